@@ -0,0 +1,375 @@
+"""
+Firefighting backtester: replays historical index (and, where recorded, option) prices
+through the Dashboard's firefighting rules (firefight_rules.py) one weekly cycle at a time.
+
+A cycle sells an ATM straddle at `entry_time` on its entry date and holds it to the
+weekly expiry. Whenever spot leaves avg short strike +/- buffer, the rule the panel
+recommends is applied: shift the base to a new ATM straddle when the cycle is in profit,
+otherwise average with a straddle at S2 (optionally adding the reference and extension
+legs shown in "All Firefighting Options"). Everything left open settles at intrinsic.
+
+Prices come from a ReplayTape source (tick-log directory or candle CSV, see
+market_data.py). Option premiums are read from the tape when a scrip-master snapshot maps
+the strike to a recorded token, and are otherwise modelled with Black-Scholes at `iv`.
+
+Cycles are independent, so they run across a process pool:
+
+    python backtest.py candles.csv --instrument NIFTY --start 2025-01-01 --end 2025-12-31 \\
+        --buffer 150 --workers 8 --out results/
+
+writes trades.csv, equity.csv and cycles.csv and prints a summary.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time as dt_time, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from firefight_rules import INDEX_MAP, STRIKE_ROUNDING, firefight_signal, leg_pnl, round_strike, short_avg_strike
+from pricing import bs_price
+
+IST = ZoneInfo("Asia/Kolkata")
+MARKET_CLOSE = dt_time(15, 30)
+NS_PER_YEAR = 365.0 * 86400 * 10**9
+
+
+class BacktestParams:
+    def __init__(self, instrument="NIFTY", buffer=100, lots=1, iv=0.14, rate=0.0, rounding="nearest",
+                 add_reference=False, add_extension=False, cooldown_minutes=0, max_adjustments=20,
+                 entry_weekday=4, expiry_weekday=3, entry_time=dt_time(9, 20)):
+        if rounding not in STRIKE_ROUNDING:
+            raise ValueError(f"rounding must be one of {STRIKE_ROUNDING}")
+        self.instrument = instrument
+        self.buffer = buffer                    # Same meaning as the panel's "Firefighting Buffer (pts)"
+        self.lots = lots                        # Lots per leg
+        self.iv = iv                            # Annualized vol for modelled premiums
+        self.rate = rate
+        self.rounding = rounding                # How S2 / reference / extension strikes snap to listed ones
+        self.add_reference = add_reference      # Also sell the reference leg on every breach
+        self.add_extension = add_extension      # Also sell the extension leg on every breach
+        self.cooldown_minutes = cooldown_minutes  # Minimum gap between adjustments
+        self.max_adjustments = max_adjustments  # Per cycle
+        self.entry_weekday = entry_weekday      # Monday=0 ... (default Friday, the day after expiry)
+        self.expiry_weekday = expiry_weekday    # Default Thursday
+        self.entry_time = entry_time
+
+    @property
+    def step(self):
+        return INDEX_MAP[self.instrument]["step"]
+
+    @property
+    def lot_size(self):
+        return INDEX_MAP[self.instrument]["lot_size"]
+
+    def as_dict(self):
+        return {k: (v.isoformat() if isinstance(v, dt_time) else v) for k, v in vars(self).items()}
+
+
+def expiry_for(entry_day, expiry_weekday=3):
+    """The first expiry weekday on or after entry_day (holidays are not shifted)."""
+    return entry_day + timedelta(days=(expiry_weekday - entry_day.weekday()) % 7)
+
+
+def weekly_entry_dates(start, end, entry_weekday=4):
+    day = start + timedelta(days=(entry_weekday - start.weekday()) % 7)
+    dates = []
+    while day <= end:
+        dates.append(day)
+        day += timedelta(days=7)
+    return dates
+
+
+def ist_ns(day, at):
+    return int(datetime.combine(day, at, tzinfo=IST).timestamp()) * 10**9
+
+
+class PathContext:
+    """One cycle's spot path plus a per-(strike, type) premium cache over every point of it.
+
+    `options` maps (strike, "CE"/"PE") -> (ts_ns, prices) recorded for this expiry; missing
+    strikes (and points before a strike's first recorded price) are modelled. Premium
+    arrays depend only on the path, so parameter sweeps reuse them across grid points.
+    """
+
+    def __init__(self, ts_ns, spot, expiry_ns, iv=0.14, rate=0.0, options=None):
+        self.ts_ns = np.asarray(ts_ns, dtype=np.int64)
+        self.spot = np.asarray(spot, dtype=np.float64)
+        self.expiry_ns = expiry_ns
+        self.iv = iv
+        self.rate = rate
+        self.options = options or {}
+        self.tau = np.maximum(expiry_ns - self.ts_ns, 0) / NS_PER_YEAR
+        self._premiums = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.ts_ns)
+
+    def premium(self, strike, opt_type):
+        key = (float(strike), opt_type)
+        cached = self._premiums.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        prices = bs_price(self.spot, key[0], self.tau, self.iv, opt_type == "CE", self.rate)
+        recorded = self.options.get(key)
+        if recorded is not None:
+            ts, px = recorded
+            i = np.searchsorted(ts, self.ts_ns, side="right") - 1
+            prices = np.where(i >= 0, px[np.maximum(i, 0)], prices)
+        self._premiums[key] = prices
+        return prices
+
+    def settle(self, strike, opt_type):
+        """Intrinsic value at expiry, from the last spot of the path."""
+        last = self.spot[-1]
+        return max(last - strike, 0.0) if opt_type == "CE" else max(strike - last, 0.0)
+
+
+def _open(legs, trades, ctx, params, i, action, opt_type, strike, tag, side="short"):
+    price = float(ctx.premium(strike, opt_type)[i])
+    legs.append({"side": side, "type": opt_type, "strike": strike, "lots": params.lots, "entry_premium": price,
+                 "status": "active", "strategy": tag, "opened": i, "closed": None, "exit_price": None})
+    trades.append({"ts_ns": int(ctx.ts_ns[i]), "action": action, "side": side, "type": opt_type, "strike": strike,
+                   "price": price, "lots": params.lots, "tag": tag, "spot": float(ctx.spot[i]), "pnl": 0.0})
+
+
+def _close(leg, trades, ctx, params, i, action, price=None):
+    price = float(ctx.premium(leg["strike"], leg["type"])[i]) if price is None else price
+    leg.update(status="closed", closed=i, exit_price=price)
+    pnl = leg_pnl(leg["side"], leg["entry_premium"], price, leg["lots"], params.lot_size)
+    trades.append({"ts_ns": int(ctx.ts_ns[i]), "action": action, "side": leg["side"], "type": leg["type"],
+                   "strike": leg["strike"], "price": price, "lots": leg["lots"], "tag": leg["strategy"],
+                   "spot": float(ctx.spot[i]), "pnl": pnl})
+
+
+def _group_pnl(legs, ctx, params, i):
+    total = 0.0
+    for leg in legs:
+        price = leg["exit_price"] if leg["status"] == "closed" else ctx.premium(leg["strike"], leg["type"])[i]
+        total += leg_pnl(leg["side"], leg["entry_premium"], price, leg["lots"], params.lot_size)
+    return total
+
+
+def _next_breach(ctx, start, trigger_down, trigger_up):
+    """First index >= start where spot leaves [trigger_down, trigger_up] (None if it never does)."""
+    spot = ctx.spot[start:]
+    hit = np.flatnonzero((spot > trigger_up) | (spot < trigger_down))
+    return start + int(hit[0]) if len(hit) else None
+
+
+def _equity_curve(legs, ctx, params):
+    """Cycle MTM at every point of the path: open legs at their premium, closed ones at exit (from the close on)."""
+    equity = np.zeros(len(ctx))
+    for leg in legs:
+        start, end = leg["opened"], leg["closed"] if leg["closed"] is not None else len(ctx) - 1
+        sign = 1.0 if leg["side"] == "short" else -1.0
+        qty = leg["lots"] * params.lot_size
+        equity[start:end] += sign * (leg["entry_premium"] - ctx.premium(leg["strike"], leg["type"])[start:end]) * qty
+        equity[end:] += leg_pnl(leg["side"], leg["entry_premium"], leg["exit_price"], leg["lots"], params.lot_size)
+    return equity
+
+
+def run_cycle(params, ctx):
+    """Runs one entry-to-expiry cycle over `ctx`. Returns (trades, equity array, summary)."""
+    legs, trades = [], []
+    step = params.step
+    atm = round_strike(ctx.spot[0], step)
+    _open(legs, trades, ctx, params, 0, "entry", "CE", atm, "base_straddle")
+    _open(legs, trades, ctx, params, 0, "entry", "PE", atm, "base_straddle")
+    cooldown_ns = int(params.cooldown_minutes * 60 * 10**9)
+    counts = {"shift": 0, "average": 0}
+    i = 1
+    while i < len(ctx) and sum(counts.values()) < params.max_adjustments:
+        avg_strike = short_avg_strike(legs)
+        i = _next_breach(ctx, i, avg_strike - params.buffer, avg_strike + params.buffer)
+        if i is None:
+            break
+        spot = float(ctx.spot[i])
+        signal = firefight_signal(avg_strike, spot, params.buffer, step, _group_pnl(legs, ctx, params, i), params.rounding)
+        if signal["recommended"] == "shift":
+            for leg in legs:
+                if leg["status"] == "active":
+                    _close(leg, trades, ctx, params, i, "shift_close")
+            _open(legs, trades, ctx, params, i, "shift", "CE", signal["atm_strike"], "base_straddle")
+            _open(legs, trades, ctx, params, i, "shift", "PE", signal["atm_strike"], "base_straddle")
+        else:
+            s2 = round_strike(signal["s2_strike"], step, params.rounding, spot)
+            _open(legs, trades, ctx, params, i, "average", "CE", s2, "ff_average")
+            _open(legs, trades, ctx, params, i, "average", "PE", s2, "ff_average")
+        counts[signal["recommended"]] += 1
+        if params.add_reference:
+            strike, opt_type = signal["reference"]
+            _open(legs, trades, ctx, params, i, "reference", opt_type, strike, "ff_reference")
+        if params.add_extension:
+            strike, opt_type = signal["extension"]
+            _open(legs, trades, ctx, params, i, "extension", opt_type, strike, "ff_extension")
+        # Resume after the cooldown (at least the next point)
+        i = max(i + 1, int(np.searchsorted(ctx.ts_ns, ctx.ts_ns[i] + cooldown_ns)))
+
+    last = len(ctx) - 1
+    for leg in legs:
+        if leg["status"] == "active":
+            _close(leg, trades, ctx, params, last, "expiry", ctx.settle(leg["strike"], leg["type"]))
+    equity = _equity_curve(legs, ctx, params)
+    peak = np.maximum.accumulate(np.maximum(equity, 0.0))
+    summary = {"pnl": float(equity[-1]), "max_drawdown": float((peak - equity).max()),
+               "shifts": counts["shift"], "averages": counts["average"],
+               "adjustments": counts["shift"] + counts["average"], "legs": len(legs)}
+    return trades, equity, summary
+
+
+# --- Loading paths ---
+
+def load_option_map(path, instrument):
+    """{(expiry date, strike, type): token} from a saved Angel scrip master (JSON list)."""
+    with open(path) as f:
+        rows = json.load(f)
+    tokens = {}
+    for row in rows:
+        if row.get("name") != instrument or row.get("instrumenttype") != "OPTIDX":
+            continue
+        symbol = row.get("symbol", "")
+        opt_type = symbol[-2:] if symbol[-2:] in ("CE", "PE") else None
+        if opt_type is None:
+            continue
+        expiry = datetime.strptime(row["expiry"], "%d%b%Y").date()
+        tokens[(expiry, float(row["strike"]) / 100.0, opt_type)] = str(row["token"])
+    return tokens
+
+
+def _window(series, start_ns, end_ns):
+    ts, px = series
+    lo, hi = np.searchsorted(ts, start_ns), np.searchsorted(ts, end_ns, side="right")
+    return ts[lo:hi], px[lo:hi]
+
+
+def cycle_inputs(tape, params, entry_day, option_map=None):
+    """(entry day, expiry ns, spot ts, spot px, recorded options) for one cycle, or None without data."""
+    expiry_day = expiry_for(entry_day, params.expiry_weekday)
+    start_ns = ist_ns(entry_day, params.entry_time)
+    expiry_ns = ist_ns(expiry_day, MARKET_CLOSE)
+    spot_series = tape.series.get(INDEX_MAP[params.instrument]["token"])
+    if spot_series is None:
+        raise ValueError(f"No {params.instrument} spot prices (token {INDEX_MAP[params.instrument]['token']}) in the source")
+    ts, px = _window(spot_series, start_ns, expiry_ns)
+    # Only enter on the entry day itself (a missing day skips the cycle)
+    if len(ts) < 2 or datetime.fromtimestamp(ts[0] / 1e9, IST).date() != entry_day:
+        return None
+    options = {}
+    for (expiry, strike, opt_type), token in (option_map or {}).items():
+        if expiry == expiry_day and token in tape.series:
+            recorded = _window(tape.series[token], ts[0] - 86400 * 10**9, expiry_ns)
+            if len(recorded[0]):
+                options[(strike, opt_type)] = recorded
+    return entry_day, expiry_ns, ts, px, options
+
+
+def backtest_cycle(params, inputs):
+    """Process-pool task: one cycle -> (trade rows, equity (ts, values), summary)."""
+    entry_day, expiry_ns, ts, px, options = inputs
+    ctx = PathContext(ts, px, expiry_ns, params.iv, params.rate, options)
+    trades, equity, summary = run_cycle(params, ctx)
+    summary.update(entry=entry_day.isoformat(), expiry=expiry_for(entry_day, params.expiry_weekday).isoformat(),
+                   entry_spot=float(px[0]), exit_spot=float(px[-1]), recorded_strikes=len(options))
+    for trade in trades:
+        trade["cycle"] = entry_day.isoformat()
+    return trades, (ts, equity), summary
+
+
+def run_backtest(tape, params, start, end, workers=None, option_map=None):
+    """All weekly cycles between start and end. Returns (trades, equity, cycles) DataFrames.
+
+    equity holds every replayed point of every cycle with the cycle MTM and the
+    cumulative equity (previous cycles' results + current MTM).
+    """
+    import pandas as pd
+    inputs = [c for c in (cycle_inputs(tape, params, day, option_map)
+                          for day in weekly_entry_dates(start, end, params.entry_weekday)) if c is not None]
+    if workers == 1 or len(inputs) < 2:
+        results = [backtest_cycle(params, c) for c in inputs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(backtest_cycle, [params] * len(inputs), inputs, chunksize=max(1, len(inputs) // 32)))
+
+    trade_rows, curves, summaries = [], [], []
+    carried = 0.0
+    for trades, (ts, equity), summary in results:
+        trade_rows.extend(trades)
+        curves.append(pd.DataFrame({"ts_ns": ts, "cycle": summary["entry"], "cycle_pnl": equity, "equity": carried + equity}))
+        carried += summary["pnl"]
+        summaries.append(summary)
+
+    trades = pd.DataFrame(trade_rows, columns=["cycle", "ts_ns", "action", "side", "type", "strike", "price",
+                                               "lots", "tag", "spot", "pnl"])
+    equity = pd.concat(curves, ignore_index=True) if curves else pd.DataFrame(columns=["ts_ns", "cycle", "cycle_pnl", "equity"])
+    for frame in (trades, equity):
+        frame.insert(0, "timestamp", pd.to_datetime(frame["ts_ns"], unit="ns", utc=True).dt.tz_convert(IST))
+    cycles = pd.DataFrame(summaries)
+    return trades, equity, cycles
+
+
+def summarize(equity, cycles):
+    if cycles.empty:
+        return {"cycles": 0}
+    curve = equity["equity"].to_numpy()
+    peak = np.maximum.accumulate(np.maximum(curve, 0.0))
+    return {
+        "cycles": len(cycles), "total_pnl": float(cycles["pnl"].sum()),
+        "win_rate": float((cycles["pnl"] > 0).mean()), "avg_cycle_pnl": float(cycles["pnl"].mean()),
+        "worst_cycle": float(cycles["pnl"].min()), "max_drawdown": float((peak - curve).max()),
+        "adjustments": int(cycles["adjustments"].sum()), "shifts": int(cycles["shifts"].sum()),
+        "averages": int(cycles["averages"].sum()),
+    }
+
+
+def main(argv=None):
+    from market_data import ReplayTape
+    parser = argparse.ArgumentParser(description="Replay historical prices through the firefighting rules, weekly cycle by cycle")
+    parser.add_argument("source", help="Tick-log directory or candle CSV (see market_data.py)")
+    parser.add_argument("--instrument", default="NIFTY", choices=sorted(INDEX_MAP))
+    parser.add_argument("--start", type=date.fromisoformat, required=True)
+    parser.add_argument("--end", type=date.fromisoformat, required=True)
+    parser.add_argument("--buffer", type=float, default=100)
+    parser.add_argument("--lots", type=int, default=1)
+    parser.add_argument("--iv", type=float, default=0.14, help="Annualized vol for premiums not in the source")
+    parser.add_argument("--rounding", default="nearest", choices=STRIKE_ROUNDING)
+    parser.add_argument("--reference", action="store_true", help="Also sell the reference leg on each breach")
+    parser.add_argument("--extension", action="store_true", help="Also sell the extension leg on each breach")
+    parser.add_argument("--cooldown", type=float, default=0, help="Minutes between adjustments")
+    parser.add_argument("--entry-weekday", type=int, default=4, help="Monday=0 (default Friday)")
+    parser.add_argument("--expiry-weekday", type=int, default=3, help="Monday=0 (default Thursday)")
+    parser.add_argument("--scrip-master", help="Saved scrip master JSON mapping strikes to recorded option tokens")
+    parser.add_argument("--workers", type=int, default=None, help="Processes (default: all cores, 1 = in-process)")
+    parser.add_argument("--out", help="Directory for trades.csv, equity.csv and cycles.csv")
+    args = parser.parse_args(argv)
+
+    params = BacktestParams(args.instrument, args.buffer, args.lots, args.iv, rounding=args.rounding,
+                            add_reference=args.reference, add_extension=args.extension, cooldown_minutes=args.cooldown,
+                            entry_weekday=args.entry_weekday, expiry_weekday=args.expiry_weekday)
+    started = time.perf_counter()
+    tape = ReplayTape.load(args.source, args.start, args.end + timedelta(days=7))  # Last cycles run to expiry
+    option_map = load_option_map(args.scrip_master, args.instrument) if args.scrip_master else None
+    trades, equity, cycles = run_backtest(tape, params, args.start, args.end, args.workers, option_map)
+    elapsed = time.perf_counter() - started
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        trades.to_csv(os.path.join(args.out, "trades.csv"), index=False)
+        equity.to_csv(os.path.join(args.out, "equity.csv"), index=False)
+        cycles.to_csv(os.path.join(args.out, "cycles.csv"), index=False)
+    summary = summarize(equity, cycles)
+    print(f"{args.instrument} {args.start} .. {args.end}: {summary['cycles']} cycles, {len(trades)} trades in {elapsed:.1f}s")
+    for key, value in summary.items():
+        if key != "cycles":
+            print(f"  {key}: {value:,.2f}" if isinstance(value, float) else f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+In-memory OHLC bars (1-minute and 5-minute by default) built from the LTPs the app
+already fetches, for every token it polls.
+
+Each (token, interval) keeps a fixed-size ring of bars in NumPy arrays. An update only
+touches the current bar, or starts the next one, so it is O(1) and memory stays bounded
+however long the app runs. Bars are aligned to the epoch; IST is UTC+5:30, so 1- and
+5-minute bars line up with the 09:15 market open. A price older than the current bar is
+counted in `late` and dropped.
+
+    bars = BarAggregator()
+    bars.ingest(market_data["data"]["fetched"])     # getMarketData items
+    bars.frame("26000", 300)                        # DataFrame of 5-minute bars for charting
+"""
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_INTERVALS = (60, 300)
+DEFAULT_CAPACITY = 1024  # Bars kept per (token, interval): ~2.7 sessions of 1-minute bars
+
+
+class BarSeries:
+    """Ring buffer of OHLC bars for one token at one interval."""
+
+    def __init__(self, interval_s, capacity=DEFAULT_CAPACITY):
+        self.interval_ns = int(interval_s * 1e9)
+        self.capacity = capacity
+        self.start_ns = np.zeros(capacity, dtype=np.int64)
+        self.open = np.zeros(capacity)
+        self.high = np.zeros(capacity)
+        self.low = np.zeros(capacity)
+        self.close = np.zeros(capacity)
+        self.ticks = np.zeros(capacity, dtype=np.int32)
+        self.head = -1  # Slot of the current (newest) bar
+        self.size = 0
+        self.late = 0
+
+    def update(self, ts_ns, price):
+        bucket = ts_ns - ts_ns % self.interval_ns
+        head = self.head
+        if self.size and bucket == self.start_ns[head]:
+            if price > self.high[head]:
+                self.high[head] = price
+            if price < self.low[head]:
+                self.low[head] = price
+            self.close[head] = price
+            self.ticks[head] += 1
+        elif not self.size or bucket > self.start_ns[head]:
+            head = self.head = (head + 1) % self.capacity
+            self.start_ns[head] = bucket
+            self.open[head] = self.high[head] = self.low[head] = self.close[head] = price
+            self.ticks[head] = 1
+            if self.size < self.capacity:
+                self.size += 1
+        else:
+            self.late += 1
+
+    def arrays(self, last=None):
+        """Column arrays of the newest `last` (default all) bars, oldest first."""
+        n = self.size if last is None else min(last, self.size)
+        slots = (self.head - n + 1 + np.arange(n)) % self.capacity
+        return {"start_ns": self.start_ns[slots], "open": self.open[slots], "high": self.high[slots],
+                "low": self.low[slots], "close": self.close[slots], "ticks": self.ticks[slots]}
+
+
+class BarAggregator:
+    """BarSeries per (token, interval), fed from getMarketData results. Thread-safe."""
+
+    def __init__(self, intervals=DEFAULT_INTERVALS, capacity=DEFAULT_CAPACITY):
+        self.intervals = tuple(intervals)
+        self.capacity = capacity
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def update(self, token, ts_ns, price):
+        token = str(token)
+        with self._lock:
+            series = self._series.get(token)
+            if series is None:
+                series = self._series[token] = {i: BarSeries(i, self.capacity) for i in self.intervals}
+            for bars in series.values():
+                bars.update(ts_ns, price)
+
+    def ingest(self, fetched, ts_ns=None):
+        """Adds every getMarketData item with an LTP, stamped ts_ns (default: now)."""
+        ts_ns = time.time_ns() if ts_ns is None else int(ts_ns)
+        for item in fetched or []:
+            ltp = item.get("ltp")
+            if ltp is not None and item.get("symbolToken") is not None:
+                self.update(item["symbolToken"], ts_ns, float(ltp))
+
+    def tokens(self):
+        with self._lock:
+            return sorted(self._series)
+
+    def latest(self):
+        """{token: (last price, bar start ns)} from the newest bar of every token: a shared LTP cache."""
+        interval = self.intervals[0]
+        with self._lock:
+            return {token: (float(s[interval].close[s[interval].head]), int(s[interval].start_ns[s[interval].head]))
+                    for token, s in self._series.items()}
+
+    def series(self, token, interval):
+        """Column arrays (oldest first) of a token's bars, or None if it was never updated."""
+        with self._lock:
+            series = self._series.get(str(token))
+            return None if series is None else series[interval].arrays()
+
+    def frame(self, token, interval, last=None):
+        """pandas DataFrame (time, open, high, low, close, ticks) of a token's bars, oldest first."""
+        import pandas as pd
+        with self._lock:
+            series = self._series.get(str(token))
+            data = series[interval].arrays(last) if series is not None else None
+        if data is None:
+            return pd.DataFrame(columns=["time", "open", "high", "low", "close", "ticks"])
+        df = pd.DataFrame(data)
+        df.insert(0, "time", pd.to_datetime(df.pop("start_ns"), unit="ns", utc=True).dt.tz_convert("Asia/Kolkata"))
+        return df
@@ -0,0 +1,211 @@
+"""
+Broker (Angel One SmartAPI) call metrics and a local diagnostics endpoint.
+
+`instrument(api)` wraps the SmartConnect methods we use so every call records its
+latency into a per-endpoint histogram, its outcome (ok / broker error code /
+exception type) and, for market data, how many tokens it asked for. The numbers
+are process-wide; with STRATEGY_METRICS_PORT=8599 set for op_final.py they can be
+read while the app runs:
+
+    curl http://127.0.0.1:8599/metrics        # Prometheus-style text
+    curl http://127.0.0.1:8599/metrics.json   # same data as JSON
+
+Note that `generateSession` calls `getProfile` internally, so a login shows up under
+both endpoints.
+"""
+import functools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds (ms); the last bucket is +Inf
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+INSTRUMENTED_METHODS = ("generateSession", "generateToken", "getProfile", "getMarketData")
+
+
+def _market_data_tokens(args, kwargs):
+    """Number of tokens in a getMarketData(mode, exchangeTokens) request."""
+    exchange_tokens = kwargs.get("exchangeTokens", args[1] if len(args) > 1 else None) or {}
+    return sum(len(tokens) for tokens in exchange_tokens.values())
+
+
+TOKEN_COUNTERS = {"getMarketData": _market_data_tokens}
+
+
+def response_status(response):
+    """'ok', 'error:<code>' for a broker-level failure, or 'empty' when nothing came back."""
+    if not isinstance(response, dict):
+        return "ok" if response is not None else "empty"
+    if response.get("status"):
+        return "ok"
+    return f"error:{response.get('errorcode') or response.get('message') or 'unknown'}"
+
+
+class _Endpoint:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = 0.0
+        self.statuses = {}
+        self.requests_with_tokens = 0
+        self.tokens_total = 0
+        self.tokens_max = 0
+        self.tokens_last = 0
+        self.retries = 0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum_ms": self.sum_ms,
+            "mean_ms": self.sum_ms / self.count if self.count else 0.0,
+            "max_ms": self.max_ms,
+            "last_ms": self.last_ms,
+            "buckets_ms": dict(zip([str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"], self.buckets)),
+            "statuses": dict(self.statuses),
+            "errors": sum(n for status, n in self.statuses.items() if status != "ok"),
+            "retries": self.retries,
+            "tokens_total": self.tokens_total,
+            "tokens_max": self.tokens_max,
+            "tokens_last": self.tokens_last,
+            "tokens_mean": self.tokens_total / self.requests_with_tokens if self.requests_with_tokens else 0.0,
+        }
+
+
+class BrokerMetrics:
+    """Thread-safe per-endpoint latency histograms, status counts and token counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.started_at = time.time()
+
+    def _endpoint(self, name):
+        endpoint = self._endpoints.get(name)
+        if endpoint is None:
+            endpoint = self._endpoints[name] = _Endpoint()
+        return endpoint
+
+    def record(self, name, elapsed_ms, status, tokens=None):
+        with self._lock:
+            endpoint = self._endpoint(name)
+            index = len(LATENCY_BUCKETS_MS)
+            for i, bound in enumerate(LATENCY_BUCKETS_MS):
+                if elapsed_ms <= bound:
+                    index = i
+                    break
+            endpoint.buckets[index] += 1
+            endpoint.count += 1
+            endpoint.sum_ms += elapsed_ms
+            endpoint.max_ms = max(endpoint.max_ms, elapsed_ms)
+            endpoint.last_ms = elapsed_ms
+            endpoint.statuses[status] = endpoint.statuses.get(status, 0) + 1
+            if tokens is not None:
+                endpoint.requests_with_tokens += 1
+                endpoint.tokens_total += tokens
+                endpoint.tokens_max = max(endpoint.tokens_max, tokens)
+                endpoint.tokens_last = tokens
+
+    def record_retry(self, name):
+        with self._lock:
+            self._endpoint(name).retries += 1
+
+    def wrap(self, name, func, token_counter=None):
+        """Returns `func` timed and counted under `name`. Exceptions are recorded and re-raised."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tokens = token_counter(args, kwargs) if token_counter else None
+            started = time.perf_counter()
+            try:
+                response = func(*args, **kwargs)
+            except Exception as e:
+                self.record(name, (time.perf_counter() - started) * 1000, f"exception:{type(e).__name__}", tokens)
+                raise
+            self.record(name, (time.perf_counter() - started) * 1000, response_status(response), tokens)
+            return response
+        wrapper.broker_metrics_wrapped = True
+        return wrapper
+
+    def instrument(self, api, methods=INSTRUMENTED_METHODS):
+        """Wraps the given methods on one SmartConnect instance (idempotent). Returns `api`."""
+        for name in methods:
+            method = getattr(api, name, None)
+            if method is None or getattr(method, "broker_metrics_wrapped", False):
+                continue
+            setattr(api, name, self.wrap(name, method, TOKEN_COUNTERS.get(name)))
+        return api
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {name: endpoint.to_dict() for name, endpoint in sorted(self._endpoints.items())}
+        return {"started_at": self.started_at, "uptime_s": time.time() - self.started_at, "endpoints": endpoints}
+
+    def to_text(self):
+        """Prometheus text exposition of `snapshot()`."""
+        snap = self.snapshot()
+        lines = [
+            "# HELP broker_request_latency_ms Broker API call latency in milliseconds.",
+            "# TYPE broker_request_latency_ms histogram",
+        ]
+        for name, e in snap["endpoints"].items():
+            cumulative = 0
+            for bound, n in e["buckets_ms"].items():
+                cumulative += n
+                lines.append(f'broker_request_latency_ms_bucket{{endpoint="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'broker_request_latency_ms_sum{{endpoint="{name}"}} {e["sum_ms"]:.3f}')
+            lines.append(f'broker_request_latency_ms_count{{endpoint="{name}"}} {e["count"]}')
+        lines += ["# HELP broker_requests_total Broker API calls by outcome.", "# TYPE broker_requests_total counter"]
+        for name, e in snap["endpoints"].items():
+            for status, n in sorted(e["statuses"].items()):
+                lines.append(f'broker_requests_total{{endpoint="{name}",status="{status}"}} {n}')
+        lines += ["# HELP broker_retries_total Broker API retries.", "# TYPE broker_retries_total counter"]
+        for name, e in snap["endpoints"].items():
+            lines.append(f'broker_retries_total{{endpoint="{name}"}} {e["retries"]}')
+        lines += ["# HELP broker_request_tokens_total Instrument tokens requested.", "# TYPE broker_request_tokens_total counter"]
+        for name, e in snap["endpoints"].items():
+            if e["tokens_total"]:
+                lines.append(f'broker_request_tokens_total{{endpoint="{name}"}} {e["tokens_total"]}')
+        lines += ["# HELP broker_request_tokens_max Most instrument tokens in one request.",
+                  "# TYPE broker_request_tokens_max gauge"]
+        for name, e in snap["endpoints"].items():
+            if e["tokens_total"]:
+                lines.append(f'broker_request_tokens_max{{endpoint="{name}"}} {e["tokens_max"]}')
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path in ("/", "/metrics"):
+            body, content_type = self.metrics.to_text(), "text/plain; version=0.0.4"
+        elif path == "/metrics.json":
+            body, content_type = json.dumps(self.metrics.snapshot(), indent=2), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the app log
+
+
+def start_metrics_server(metrics, host="127.0.0.1", port=8599):
+    """Serves /metrics and /metrics.json on a daemon thread. Returns the server (port 0 = any free port)."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"metrics": metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="broker-metrics-http", daemon=True).start()
+    return server
+
+
+# Shared by every session of this server process
+BROKER_METRICS = BrokerMetrics()
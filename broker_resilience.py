@@ -0,0 +1,170 @@
+"""
+Retry with backoff and a circuit breaker for broker calls.
+
+`harden(api, breaker)` wraps SmartConnect's read methods (outside BROKER_METRICS.instrument,
+so every attempt is still measured) so transient failures are retried with bounded
+exponential backoff and full jitter:
+
+  - exceptions other than the broker's own "you asked for something wrong" ones
+    (timeouts, connection resets, non-JSON rate-limit pages, ...)
+  - responses carrying a rate-limit / "try again later" error
+
+A `CircuitBreaker` counts calls that still failed after their retries. After
+`failure_threshold` of them in a row it opens: calls fail fast with CircuitOpenError
+for `reset_timeout` seconds, then one trial call is let through (half-open). A success
+closes it again, a failure reopens it.
+"""
+import functools
+import random
+import threading
+import time
+
+RETRIED_METHODS = ("getProfile", "getMarketData", "generateToken", "getCandleData")
+# Broker-side errors that mean "the request itself is wrong / not allowed": retrying won't help
+PERMANENT_EXCEPTIONS = ("TokenException", "InputException", "PermissionException", "OrderException", "UserException")
+# Angel One error codes / messages that mean "try again later"
+TRANSIENT_ERROR_CODES = ("AB1004",)  # "Something Went Wrong, Please Try After Sometime"
+TRANSIENT_MESSAGES = ("access rate", "rate limit", "too many requests", "try after", "try again")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the broker while the breaker is open."""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name}: broker calls paused after repeated failures (retrying in {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+def is_transient_error(error):
+    return type(error).__name__ not in PERMANENT_EXCEPTIONS
+
+
+def is_transient_response(response):
+    if not isinstance(response, dict) or response.get("status"):
+        return False
+    message = str(response.get("message") or "").lower()
+    return response.get("errorcode") in TRANSIENT_ERROR_CODES or any(m in message for m in TRANSIENT_MESSAGES)
+
+
+class RetryPolicy:
+    """Up to `max_attempts` tries; before retry n (0-based) sleeps uniform(0, min(max_delay, base_delay * 2**n))."""
+
+    def __init__(self, max_attempts=3, base_delay=0.25, max_delay=2.0, sleep=time.sleep, rng=random.random):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.rng = rng
+
+    def delay(self, attempt):
+        return self.rng() * min(self.max_delay, self.base_delay * 2 ** attempt)
+
+
+class CircuitBreaker:
+    """closed -> (failure_threshold failures in a row) -> open -> (reset_timeout) -> half-open -> closed/open."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self.trips = 0
+        self.last_error = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if self.clock() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def retry_in(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (self.clock() - self._opened_at))
+
+    def before_call(self, name):
+        """Raises CircuitOpenError unless a call may go out now (half-open lets exactly one through)."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            retry_in = max(0.0, self.reset_timeout - (self.clock() - self._opened_at))
+        raise CircuitOpenError(name, retry_in)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self._failures += 1
+            self.last_error = error
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_in_flight:
+                    self.trips += 1
+                self._opened_at = self.clock()
+                self._trial_in_flight = False
+
+    def snapshot(self):
+        with self._lock:
+            state = self._state()
+            retry_in = 0.0 if self._opened_at is None else max(0.0, self.reset_timeout - (self.clock() - self._opened_at))
+            return {"state": state, "consecutive_failures": self._failures, "trips": self.trips,
+                    "retry_in_s": retry_in, "last_error": self.last_error}
+
+
+def resilient(name, func, breaker, policy, on_retry=None):
+    """`func` behind `breaker`, retrying transient failures per `policy`. `on_retry(name)` is called before each retry."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        breaker.before_call(name)
+        for attempt in range(policy.max_attempts):
+            last_attempt = attempt + 1 >= policy.max_attempts
+            try:
+                response = func(*args, **kwargs)
+            except Exception as e:
+                if not is_transient_error(e):
+                    breaker.record_success()  # The broker answered; the request was the problem
+                    raise
+                if last_attempt:
+                    breaker.record_failure(f"{type(e).__name__}: {e}")
+                    raise
+            else:
+                if not is_transient_response(response):
+                    breaker.record_success()
+                    return response
+                if last_attempt:
+                    breaker.record_failure(str(response.get("message") or response.get("errorcode")))
+                    return response
+            if on_retry:
+                on_retry(name)
+            policy.sleep(policy.delay(attempt))
+    wrapper.broker_resilience_wrapped = True
+    return wrapper
+
+
+def harden(api, breaker, policy=None, methods=RETRIED_METHODS, on_retry=None):
+    """Wraps the given methods on one SmartConnect instance (idempotent). Returns `api`."""
+    policy = policy or RetryPolicy()
+    for name in methods:
+        method = getattr(api, name, None)
+        if method is None or getattr(method, "broker_resilience_wrapped", False):
+            continue
+        setattr(api, name, resilient(name, method, breaker, policy, on_retry))
+    return api
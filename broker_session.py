@@ -0,0 +1,265 @@
+"""
+Angel One session reuse and pooled HTTP connections.
+
+`TokenCache` keeps the JWT / refresh / feed tokens of the last login in an owner-only
+file outside the repo, together with the JWT's expiry, so a process restart can skip
+the TOTP login. `BrokerSession` owns one SmartConnect client: it restores cached tokens
+or logs in, and renews the JWT with `generateToken` shortly before it expires.
+
+Every broker request, and the instrument master download, goes through one pooled
+`requests.Session` (keep-alive), instead of SmartConnect's per-call `requests.request`.
+
+requests, pyotp and SmartApi are imported on first use, so importing this module is cheap.
+"""
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+import warnings
+from datetime import datetime, timedelta
+from urllib.parse import urljoin
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "option_selling", "angel_session.json")
+REFRESH_MARGIN_SECONDS = 15 * 60  # Renew the JWT this long before it expires
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+# pooled_request mirrors SmartConnect._request of this SDK release (pinned in requirements.txt)
+POOLED_SDK_VERSION = "1.5.5"
+# SmartConnect internals pooled_request relies on
+POOLED_SDK_ATTRS = ("_request", "_routes", "requestHeaders", "root", "access_token", "disable_ssl", "timeout",
+                    "proxies", "session_expiry_hook")
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def http_session():
+    """The process-wide pooled requests.Session (created on first use)."""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)  # Local mock/test servers
+            _http_session = session
+        return _http_session
+
+
+def jwt_expiry(token):
+    """The `exp` claim (epoch seconds) of a JWT, 'Bearer ' prefix allowed, or None if it has none."""
+    if not token:
+        return None
+    token = token.split(" ", 1)[-1]
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def default_expiry(now=None):
+    """Fallback expiry for tokens without an `exp` claim: Angel One sessions end at midnight."""
+    now = datetime.fromtimestamp(now or time.time())
+    return (datetime.combine(now.date() + timedelta(days=1), datetime.min.time())).timestamp()
+
+
+def _key_hash(api_key):
+    return hashlib.sha256(str(api_key).encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """Owner-only (0600) JSON file holding one client's tokens and their expiry."""
+
+    def __init__(self, path=DEFAULT_CACHE_FILE):
+        self.path = path
+
+    def load(self, client_id, api_key):
+        """The cached tokens for this client/API key if they have not expired, else None."""
+        try:
+            with open(self.path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("client_id") != client_id or entry.get("api_key_hash") != _key_hash(api_key):
+            return None
+        if not entry.get("jwt_token") or float(entry.get("expires_at") or 0) <= time.time():
+            return None
+        return entry
+
+    def save(self, client_id, api_key, jwt_token, refresh_token, feed_token, expires_at):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        entry = {
+            "client_id": client_id, "api_key_hash": _key_hash(api_key),
+            "jwt_token": jwt_token, "refresh_token": refresh_token, "feed_token": feed_token,
+            "expires_at": expires_at, "saved_at": time.time(),
+        }
+        tmp = f"{self.path}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.chmod(tmp, 0o600)  # In case the file already existed with looser permissions
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def pooled_request(api, route, method, parameters=None):
+    """SmartConnect._request, sent through `api.reqsession` instead of a new connection per call."""
+    from SmartApi import smartExceptions as ex
+
+    params = parameters.copy() if parameters else {}
+    url = urljoin(api.root, api._routes[route].format(**params))
+    headers = api.requestHeaders()
+    if api.access_token:
+        headers["Authorization"] = "Bearer {}".format(api.access_token)
+
+    r = api.reqsession.request(method, url,
+                               data=json.dumps(params) if method in ["POST", "PUT"] else None,
+                               params=json.dumps(params) if method in ["GET", "DELETE"] else None,
+                               headers=headers, verify=not api.disable_ssl, allow_redirects=True,
+                               timeout=api.timeout, proxies=api.proxies)
+
+    if "json" in headers["Content-type"]:
+        try:
+            data = json.loads(r.content.decode("utf8"))
+        except ValueError:
+            raise ex.DataException(f"Couldn't parse the JSON response received from the server: {r.content}")
+        if data.get("error_type"):
+            if api.session_expiry_hook and r.status_code == 403 and data["error_type"] == "TokenException":
+                api.session_expiry_hook()
+            exp = getattr(ex, data["error_type"], ex.GeneralException)
+            raise exp(data["message"], code=r.status_code)
+        return data
+    if "csv" in headers["Content-type"]:
+        return r.content
+    raise ex.DataException(f"Unknown Content-type ({headers['Content-type']}) with response: ({r.content})")
+
+
+def use_pooled_session(api, session=None):
+    """Routes every request of one SmartConnect instance through the pooled session. Returns `api`.
+
+    If the SDK no longer has the internals pooled_request copies, `api` keeps its own _request.
+    """
+    missing = [name for name in POOLED_SDK_ATTRS if not hasattr(api, name)]
+    if not missing and not (isinstance(api._routes, dict) and callable(api.requestHeaders)):
+        missing = ["_routes (dict)", "requestHeaders()"]
+    if missing:
+        warnings.warn(f"SmartConnect does not match the SDK pooled_request was written for "
+                      f"(smartapi-python {POOLED_SDK_VERSION}): missing {', '.join(missing)}. "
+                      f"Falling back to the SDK's own requests (no connection pooling).", RuntimeWarning)
+        return api
+    api.reqsession = session or http_session()
+    api._request = lambda route, method, parameters=None: pooled_request(api, route, method, parameters)
+    return api
+
+
+class BrokerSession:
+    """One SmartConnect client plus its tokens: restored from the cache, or a fresh TOTP login."""
+
+    def __init__(self, api_key, client_id, pin, totp_secret, cache=None, root=None, wrap=None):
+        self.api_key = api_key
+        self.client_id = client_id
+        self.pin = pin
+        self.totp_secret = totp_secret
+        self.cache = cache
+        self.root = root
+        self.wrap = wrap  # e.g. BROKER_METRICS.instrument
+        self.jwt_token = None
+        self.refresh_token = None
+        self.feed_token = None
+        self.expires_at = None
+        self.restored = False
+        self._lock = threading.Lock()
+        self.api = self._create_client()
+
+    def _create_client(self):
+        from SmartApi import SmartConnect
+        api = use_pooled_session(SmartConnect(self.api_key, root=self.root))
+        api.setSessionExpiryHook(self.invalidate)
+        return self.wrap(api) if self.wrap else api
+
+    def _set_tokens(self, jwt_token, refresh_token, feed_token):
+        jwt_token = jwt_token.split(" ", 1)[-1]  # The client adds "Bearer " itself
+        self.jwt_token, self.refresh_token, self.feed_token = jwt_token, refresh_token, feed_token
+        self.expires_at = jwt_expiry(jwt_token) or default_expiry()
+        self.api.setAccessToken(jwt_token)
+        self.api.setRefreshToken(refresh_token)
+        self.api.setFeedToken(feed_token)
+        if self.cache is not None:
+            try:
+                self.cache.save(self.client_id, self.api_key, jwt_token, refresh_token, feed_token, self.expires_at)
+            except OSError as e:
+                print(f"Could not cache the broker session: {e}")
+
+    def _session_data(self):
+        """Same shape as generateSession's response data (JWT with its 'Bearer ' prefix)."""
+        return {"jwtToken": f"Bearer {self.jwt_token}", "refreshToken": self.refresh_token, "feedToken": self.feed_token}
+
+    def restore(self):
+        """Reuses cached tokens (renewing them if they are about to expire). generateSession-style response or None."""
+        entry = self.cache.load(self.client_id, self.api_key) if self.cache is not None else None
+        if entry is None:
+            return None
+        self.jwt_token, self.refresh_token, self.feed_token = entry["jwt_token"], entry["refresh_token"], entry["feed_token"]
+        self.expires_at = float(entry["expires_at"])
+        self.api.setAccessToken(self.jwt_token)
+        self.api.setRefreshToken(self.refresh_token)
+        self.api.setFeedToken(self.feed_token)
+        self.api.setUserId(self.client_id)
+        if not self.ensure_fresh():
+            return None
+        self.restored = True
+        return {"status": True, "message": "SUCCESS (cached session)", "data": self._session_data()}
+
+    def login(self):
+        """Fresh TOTP login. Returns the generateSession response (profile plus tokens)."""
+        import pyotp  # Handles the 6-digit TOTP
+        session_data = self.api.generateSession(self.client_id, self.pin, pyotp.TOTP(self.totp_secret).now())
+        if session_data.get("status") and session_data.get("data"):
+            data = session_data["data"]
+            self._set_tokens(data["jwtToken"], data["refreshToken"], data["feedToken"])
+            self.restored = False
+        return session_data
+
+    def seconds_left(self):
+        return (self.expires_at or 0) - time.time()
+
+    def ensure_fresh(self, margin=REFRESH_MARGIN_SECONDS):
+        """Renews the JWT via generateToken when it expires within `margin`. False if the session is gone."""
+        with self._lock:
+            if self.jwt_token and self.seconds_left() > margin:
+                return True
+            if not self.refresh_token:
+                return False
+            try:
+                response = self.api.generateToken(self.refresh_token)
+            except Exception as e:
+                print(f"Token refresh failed: {e}")
+                response = None
+            if not (response and response.get("status") and response.get("data")):
+                if self.seconds_left() > 0:
+                    return True  # Still valid for now; try again on the next check
+                self.invalidate()
+                return False
+            data = response["data"]
+            self._set_tokens(data["jwtToken"], data.get("refreshToken") or self.refresh_token, data["feedToken"])
+            return True
+
+    def invalidate(self):
+        """Forgets the tokens (e.g. the broker rejected them), so the next login is a fresh one."""
+        self.jwt_token = None
+        self.expires_at = None
+        if self.cache is not None:
+            self.cache.clear()
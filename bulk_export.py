@@ -0,0 +1,260 @@
+"""
+Bulk analytics export: every leg of every strategy group plus the structured trade
+history, written as columnar files partitioned by month and instrument.
+
+Layout (hive-style, readable by pyarrow/pandas/duckdb/polars as one dataset):
+
+    <out>/legs/month=2025-11/instrument=NIFTY/part-00000.parquet
+    <out>/history/month=2025-11/part-00000.parquet
+
+Groups are streamed one at a time and rows are flushed per partition once a buffer
+fills, so memory stays bounded however many years of trades there are.
+
+    python bulk_export.py strategy_data.json exports/ --format parquet
+    python bulk_export.py strategy_data.db exports/ --format csv
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+from datetime import date, datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet is optional; CSV always works
+    pa = None
+    pq = None
+
+from sqlite_store import SQLiteStore, leg_realised_pnl
+from trade_history import parse_legacy_entry
+
+FORMATS = ("parquet", "csv")
+UNKNOWN_MONTH = "unknown"
+
+LEG_COLUMNS = [
+    ("group_id", "string"), ("group_name", "string"), ("group_status", "string"),
+    ("leg_id", "string"), ("position", "int64"), ("entry_ts", "timestamp"),
+    ("side", "string"), ("type", "string"), ("strike", "float64"), ("expiry", "date"),
+    ("lots", "float64"), ("lot_size", "float64"), ("entry_premium", "float64"),
+    ("exit_price", "float64"), ("current_ltp", "float64"), ("status", "string"),
+    ("tag", "string"), ("symbol", "string"), ("token", "string"), ("exchange", "string"),
+    ("realised_pnl", "float64"),
+]
+HISTORY_COLUMNS = [
+    ("id", "string"), ("ts", "timestamp"), ("group_id", "string"), ("group_name", "string"),
+    ("action", "string"), ("side", "string"), ("type", "string"), ("strike", "float64"),
+    ("price", "float64"), ("tag", "string"), ("leg_id", "string"), ("message", "string"),
+]
+
+
+def _arrow_schema(columns):
+    types = {
+        "string": pa.string(),
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "date": pa.date32(),
+        "timestamp": pa.timestamp("s", tz="Asia/Kolkata"),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def _coerce(value, kind):
+    """Normalizes one cell to the column type (None when it can't be converted)."""
+    if value is None or value == "":
+        return None
+    try:
+        if kind == "string":
+            return str(value)
+        if kind == "int64":
+            return int(value)
+        if kind == "float64":
+            return float(value)
+        if kind == "date":
+            if isinstance(value, datetime):
+                return value.date()
+            if isinstance(value, date):
+                return value
+            return date.fromisoformat(str(value)[:10])
+        if kind == "timestamp":
+            return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+class PartitionedWriter:
+    """Buffers rows per partition and flushes them to numbered part files."""
+
+    def __init__(self, root, columns, fmt, max_buffer_rows=50_000):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt!r} (expected one of {FORMATS})")
+        if fmt == "parquet" and pa is None:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow), or use --format csv")
+        self.root = root
+        self.columns = columns
+        self.fmt = fmt
+        self.max_buffer_rows = max_buffer_rows
+        self.schema = _arrow_schema(columns) if fmt == "parquet" else None
+        self._buffers = {}
+        self._part_numbers = {}
+        self.rows_written = 0
+        self.files_written = 0
+
+    def add(self, partition, row):
+        """`partition` is a tuple of (key, value) pairs, e.g. (("month", "2025-11"), ("instrument", "NIFTY"))."""
+        buffer = self._buffers.setdefault(partition, [])
+        buffer.append([_coerce(row.get(name), kind) for name, kind in self.columns])
+        if len(buffer) >= self.max_buffer_rows:
+            self._flush(partition)
+
+    def close(self):
+        for partition in list(self._buffers):
+            self._flush(partition)
+        return {"rows": self.rows_written, "files": self.files_written}
+
+    def _flush(self, partition):
+        rows = self._buffers.pop(partition, None)
+        if not rows:
+            return
+        directory = os.path.join(self.root, *(f"{key}={value}" for key, value in partition))
+        os.makedirs(directory, exist_ok=True)
+        part = self._part_numbers.get(partition, 0)
+        self._part_numbers[partition] = part + 1
+        path = os.path.join(directory, f"part-{part:05d}.{self.fmt}")
+
+        if self.fmt == "parquet":
+            table = pa.Table.from_arrays(
+                [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(self.schema)],
+                schema=self.schema,
+            )
+            pq.write_table(table, path, compression="zstd")
+        else:
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow([name for name, _ in self.columns])
+                writer.writerows([["" if v is None else v.isoformat() if hasattr(v, "isoformat") else v
+                                   for v in row] for row in rows])
+        self.rows_written += len(rows)
+        self.files_written += 1
+
+
+def _month_of(value):
+    """YYYY-MM of an ISO date/timestamp string or date, or None."""
+    if not value:
+        return None
+    text = value.isoformat() if hasattr(value, "isoformat") else str(value)
+    return text[:7] if len(text) >= 7 and text[4] == "-" else None
+
+
+def _record_time_index(history_records):
+    """leg id -> first ADD_LEG timestamp, group id -> earliest timestamp (only records with a real date)."""
+    leg_ts, group_ts = {}, {}
+    for record in history_records:
+        ts = record.get("ts") if isinstance(record, dict) else None
+        if not ts:
+            continue
+        lid = record.get("leg_id")
+        if lid and record.get("action") == "ADD_LEG" and (lid not in leg_ts or ts < leg_ts[lid]):
+            leg_ts[lid] = ts
+        gid = record.get("group_id")
+        if gid and (gid not in group_ts or ts < group_ts[gid]):
+            group_ts[gid] = ts
+    return leg_ts, group_ts
+
+
+def leg_rows(group, leg_ts, group_ts, default_lot_sizes=None):
+    """Flattened leg rows of one group, each with its (month, instrument) partition."""
+    instrument = group.get("instrument") or "UNKNOWN"
+    default_lot_size = (default_lot_sizes or {}).get(instrument)
+    for position, leg in enumerate(group.get("legs", [])):
+        entry_ts = leg_ts.get(leg.get("id"))
+        # Month of the trade: when the leg was added, else when the group started, else its expiry
+        month = _month_of(entry_ts) or _month_of(group_ts.get(group.get("id"))) or _month_of(leg.get("expiry")) or UNKNOWN_MONTH
+        lot_size = leg.get("lot_size", default_lot_size)
+        realised = None
+        if leg.get("status") == "closed":
+            realised = leg_realised_pnl(leg.get("side"), leg.get("entry_premium"), leg.get("exit_price"),
+                                        leg.get("lots", 1), lot_size)
+        row = {
+            "group_id": group.get("id"), "group_name": group.get("name"), "group_status": group.get("status"),
+            "leg_id": leg.get("id"), "position": position, "entry_ts": entry_ts,
+            "side": leg.get("side"), "type": leg.get("type"), "strike": leg.get("strike"),
+            "expiry": leg.get("expiry"), "lots": leg.get("lots", 1), "lot_size": lot_size,
+            "entry_premium": leg.get("entry_premium"), "exit_price": leg.get("exit_price"),
+            "current_ltp": leg.get("current_ltp"), "status": leg.get("status"), "tag": leg.get("strategy"),
+            "symbol": leg.get("symbol"), "token": leg.get("token"), "exchange": leg.get("exchange"),
+            "realised_pnl": realised,
+        }
+        yield (("month", month), ("instrument", instrument)), row
+
+
+def export_dataset(groups, history_records, out_dir, fmt="parquet", default_lot_sizes=None, max_buffer_rows=50_000,
+                   time_index=None):
+    """Writes the legs and history datasets under `out_dir`, replacing any previous dump.
+
+    `groups` may be any iterable of full group dicts (a generator keeps memory flat).
+    `history_records` is an iterable of history records (legacy strings are parsed, their month is unknown),
+    streamed straight into the writer. `time_index` is the (leg_ts, group_ts) pair of _record_time_index;
+    without it the records are read twice, so a one-shot iterator needs it (SQLiteStore.history_time_index).
+    Returns {"legs": {...}, "history": {...}} with row and file counts.
+    """
+    if time_index is None:
+        if iter(history_records) is history_records:
+            raise ValueError("A one-shot history iterator can't be read twice: pass time_index "
+                             "(e.g. SQLiteStore.history_time_index())")
+        time_index = _record_time_index(history_records)
+    leg_ts, group_ts = time_index
+
+    os.makedirs(out_dir, exist_ok=True)
+    stats = {}
+    for name in ("legs", "history"):
+        staging = os.path.join(out_dir, f".{name}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        if name == "legs":
+            writer = PartitionedWriter(staging, LEG_COLUMNS, fmt, max_buffer_rows)
+            for group in groups:
+                for partition, row in leg_rows(group, leg_ts, group_ts, default_lot_sizes):
+                    writer.add(partition, row)
+        else:
+            writer = PartitionedWriter(staging, HISTORY_COLUMNS, fmt, max_buffer_rows)
+            for record in history_records:
+                if isinstance(record, str):
+                    record = parse_legacy_entry(record)
+                writer.add((("month", _month_of(record.get("ts")) or UNKNOWN_MONTH),), record)
+        stats[name] = writer.close()
+        # Swap the finished dataset in, so readers never see a half-written dump
+        final = os.path.join(out_dir, name)
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(staging, final)
+    return stats
+
+
+def _iter_json_groups(path):
+    with open(path, "r") as f:
+        data = json.load(f)
+    return iter(data.get("strategy_groups", {}).values()), data.get("trade_history", [])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export all strategy legs and history to partitioned columnar files")
+    parser.add_argument("source", help="strategy_data.json or a SQLite database (.db)")
+    parser.add_argument("out_dir")
+    parser.add_argument("--format", choices=FORMATS, default="parquet" if pa is not None else "csv")
+    args = parser.parse_args(argv)
+
+    if args.source.endswith(".json"):
+        groups, history = _iter_json_groups(args.source)
+        time_index = None
+    else:
+        store = SQLiteStore(args.source)
+        groups, history, time_index = store.iter_groups(), store.iter_history(), store.history_time_index()
+    stats = export_dataset(groups, history, args.out_dir, fmt=args.format, time_index=time_index)
+    print(f"legs: {stats['legs']['rows']} rows in {stats['legs']['files']} files | "
+          f"history: {stats['history']['rows']} rows in {stats['history']['files']} files -> {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Local cache of historical candles from SmartAPI getCandleData, for the index spots in
+INDEX_MAP and any traded option tokens.
+
+Candles are kept as one columnar (Parquet) file per (token, interval, day):
+
+    <root>/NSE/26000/ONE_MINUTE/20250102.parquet
+
+Each file records whether the day was complete when it was fetched (fetched after that
+day's close). A range query only asks the broker for days that have no complete file.
+Consecutive missing days are fetched in as few getCandleData calls as the interval's
+per-request limit allows. Today's partial file is topped up from its last candle.
+Queries that are already on disk make no network calls:
+
+    store = CandleStore("candles", api)             # api: a logged-in SmartConnect
+    df = store.candles("NSE", "26000", "ONE_MINUTE", date(2025, 1, 1), date(2025, 3, 31))
+
+    python candle_store.py sync --from 2025-01-01 --to 2025-03-31     # all INDEX_MAP spots
+    python candle_store.py show NSE 26000 --from 2025-03-03 --to 2025-03-07
+"""
+import argparse
+import os
+import threading
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from zoneinfo import ZoneInfo
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+IST = ZoneInfo("Asia/Kolkata")
+MARKET_OPEN = dt_time(9, 15)
+MARKET_CLOSE = dt_time(15, 30)
+COMPLETE_AFTER = dt_time(15, 35)  # Last candles can land a few minutes after the close
+# getCandleData interval: (seconds per candle, max days per request)
+INTERVALS = {
+    "ONE_MINUTE": (60, 30), "THREE_MINUTE": (180, 60), "FIVE_MINUTE": (300, 100),
+    "TEN_MINUTE": (600, 100), "FIFTEEN_MINUTE": (900, 200), "THIRTY_MINUTE": (1800, 200),
+    "ONE_HOUR": (3600, 400), "ONE_DAY": (86400, 2000),
+}
+COLUMNS = ("ts_ns", "open", "high", "low", "close", "volume")
+MIN_REQUEST_GAP = 0.35  # getCandleData allows about 3 requests/s
+
+
+class CandleFetchError(Exception):
+    pass
+
+
+def _schema(complete):
+    fields = [("ts_ns", pa.int64())] + [(name, pa.float64()) for name in COLUMNS[1:-1]] + [("volume", pa.int64())]
+    return pa.schema(fields, metadata={b"complete": b"1" if complete else b"0"})
+
+
+def _as_day(value):
+    return value.astimezone(IST).date() if isinstance(value, datetime) else value
+
+
+def _at(day, clock):
+    return datetime.combine(day, clock, tzinfo=IST)
+
+
+def parse_candles(rows):
+    """getCandleData rows [[iso ts, o, h, l, c, v], ...] -> {day: {column: list}}."""
+    days = {}
+    for ts, o, h, l, c, v in rows or []:
+        stamp = datetime.fromisoformat(ts).astimezone(IST)
+        cols = days.setdefault(stamp.date(), {name: [] for name in COLUMNS})
+        cols["ts_ns"].append(int(stamp.timestamp()) * 10**9)
+        for name, value in zip(COLUMNS[1:], (o, h, l, c, v)):
+            cols[name].append(value)
+    return days
+
+
+class CandleStore:
+    def __init__(self, root="candles", api=None, min_request_gap=MIN_REQUEST_GAP, now=None):
+        if pa is None:
+            raise RuntimeError("The candle store needs pyarrow (pip install pyarrow)")
+        self.root = root
+        self.api = api
+        self.min_request_gap = min_request_gap
+        self.now = now or (lambda: datetime.now(IST))
+        self.requests = 0  # getCandleData calls made by this store
+        self._lock = threading.Lock()
+        self._last_request = 0.0
+
+    def path(self, exchange, token, interval, day):
+        return os.path.join(self.root, exchange, str(token), interval, f"{day:%Y%m%d}.parquet")
+
+    # --- Disk ---
+    def read_day(self, exchange, token, interval, day):
+        """(pyarrow Table, complete) for one day, or (None, False) if it was never fetched."""
+        path = self.path(exchange, token, interval, day)
+        if not os.path.exists(path):
+            return None, False
+        table = pq.read_table(path)
+        return table, (table.schema.metadata or {}).get(b"complete") == b"1"
+
+    def write_day(self, exchange, token, interval, day, columns, complete):
+        path = self.path(exchange, token, interval, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pa.table({name: columns.get(name, []) for name in COLUMNS}, schema=_schema(complete))
+        tmp = f"{path}.tmp"
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+
+    # --- What needs fetching ---
+    def _is_complete(self, day, fetched_at):
+        return fetched_at >= _at(day, COMPLETE_AFTER)
+
+    def missing(self, exchange, token, interval, start, end):
+        """[(day, resume ns or None)] of trading days in [start, end] without a complete file."""
+        today = self.now().date()
+        needed = []
+        day = _as_day(start)
+        while day <= min(_as_day(end), today):
+            if day.weekday() < 5:  # Exchange holidays are fetched once and cached as empty days
+                table, complete = self.read_day(exchange, token, interval, day)
+                if not complete:
+                    resume = int(table["ts_ns"][-1].as_py()) if table is not None and table.num_rows else None
+                    needed.append((day, resume))
+            day += timedelta(days=1)
+        return needed
+
+    def _spans(self, interval, needed):
+        """Groups consecutive needed days into request-sized spans."""
+        max_days = INTERVALS[interval][1]
+        spans = []
+        for day, resume in needed:
+            if spans and (day - spans[-1][0][0]).days < max_days and (day - spans[-1][-1][0]).days <= 3:
+                spans[-1].append((day, resume))  # <= 3: bridges weekends, not long gaps of cached days
+            else:
+                spans.append([(day, resume)])
+        return spans
+
+    # --- Network ---
+    def _request(self, exchange, token, interval, start, end):
+        with self._lock:
+            wait = self._last_request + self.min_request_gap - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_request = time.monotonic()
+            self.requests += 1
+        response = self.api.getCandleData({
+            "exchange": exchange, "symboltoken": str(token), "interval": interval,
+            "fromdate": start.strftime("%Y-%m-%d %H:%M"), "todate": end.strftime("%Y-%m-%d %H:%M"),
+        })
+        if not response or not response.get("status"):
+            message = (response or {}).get("message") or "empty response"
+            raise CandleFetchError(f"getCandleData {exchange}:{token} {interval} {start:%Y-%m-%d}..{end:%Y-%m-%d}: {message}")
+        return response.get("data") or []
+
+    def fetch_missing(self, exchange, token, interval, start, end):
+        """Fetches every missing day in [start, end]. Returns the number of getCandleData calls."""
+        if interval not in INTERVALS:
+            raise ValueError(f"Unknown interval {interval!r} (expected one of {sorted(INTERVALS)})")
+        needed = self.missing(exchange, token, interval, start, end)
+        if needed and self.api is None:
+            raise CandleFetchError("Candles are missing from the store and there is no broker session to fetch them")
+        calls = 0
+        for span in self._spans(interval, needed):
+            first_day, resume = span[0]
+            # A partial day resumes at its last candle, which may have been fetched while still forming
+            span_start = datetime.fromtimestamp(resume / 1e9, IST) if resume is not None else _at(first_day, MARKET_OPEN)
+            fetched_at = self.now()
+            span_end = min(_at(span[-1][0], MARKET_CLOSE), fetched_at)
+            if span_start > span_end:
+                continue
+            by_day = parse_candles(self._request(exchange, token, interval, span_start, span_end))
+            calls += 1
+            for day, resume in span:
+                columns = by_day.get(day, {})
+                if resume is not None:  # Top up a partial day
+                    table, _ = self.read_day(exchange, token, interval, day)
+                    old = table.to_pydict()
+                    keep = [i for i, ts in enumerate(old["ts_ns"]) if ts < (columns.get("ts_ns") or [float("inf")])[0]]
+                    columns = {name: [old[name][i] for i in keep] + columns.get(name, []) for name in COLUMNS}
+                self.write_day(exchange, token, interval, day, columns, self._is_complete(day, fetched_at))
+        return calls
+
+    # --- Queries ---
+    def candles(self, exchange, token, interval, start, end, fetch=True):
+        """pandas DataFrame (timestamp, open, high, low, close, volume) of candles in [start, end].
+
+        start/end are dates (whole days) or datetimes. With fetch=False (or no api) only
+        what is already on disk is returned.
+        """
+        import pandas as pd
+        if fetch and self.api is not None:
+            self.fetch_missing(exchange, token, interval, start, end)
+        tables = []
+        day = _as_day(start)
+        while day <= _as_day(end):
+            table, _ = self.read_day(exchange, token, interval, day)
+            if table is not None and table.num_rows:
+                tables.append(table)
+            day += timedelta(days=1)
+        if not tables:
+            return pd.DataFrame(columns=["timestamp"] + list(COLUMNS[1:]))
+        df = pa.concat_tables(tables).to_pandas()
+        lo = start if isinstance(start, datetime) else _at(start, dt_time.min)
+        hi = end if isinstance(end, datetime) else _at(end, dt_time.max)
+        df = df[(df["ts_ns"] >= int(lo.timestamp() * 1e9)) & (df["ts_ns"] <= int(hi.timestamp() * 1e9))]
+        df.insert(0, "timestamp", pd.to_datetime(df["ts_ns"], unit="ns", utc=True).dt.tz_convert(IST))
+        return df.drop(columns="ts_ns").reset_index(drop=True)
+
+    def tokens(self):
+        """[(exchange, token, interval)] present on disk."""
+        found = []
+        for exchange in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            for token in sorted(os.listdir(os.path.join(self.root, exchange))):
+                for interval in sorted(os.listdir(os.path.join(self.root, exchange, token))):
+                    found.append((exchange, token, interval))
+        return found
+
+    def days(self, exchange, token, interval):
+        """Sorted days with a file on disk."""
+        folder = os.path.join(self.root, exchange, str(token), interval)
+        names = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+        return [datetime.strptime(name[:8], "%Y%m%d").date() for name in names if name.endswith(".parquet")]
+
+    def frame(self, start, end, interval="ONE_MINUTE", tokens=None):
+        """Cached candles of every (or the given) token with a token column, as ReplayTape.from_candles takes."""
+        import pandas as pd
+        parts = []
+        for exchange, token, cached_interval in self.tokens():
+            if cached_interval == interval and (tokens is None or token in tokens):
+                df = self.candles(exchange, token, interval, start, end, fetch=False)
+                if len(df):
+                    parts.append(df.assign(token=token))
+        return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["timestamp", "token"] + list(COLUMNS[1:]))
+
+
+def traded_option_tokens(strategy_groups):
+    """{(exchange, token)} of every leg in the strategy groups (expired contracts included)."""
+    return {(leg.get("exchange") or "NFO", str(leg["token"]))
+            for group in strategy_groups.values() for leg in group.get("legs", []) if leg.get("token")}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Historical candle cache (getCandleData)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sync = sub.add_parser("sync", help="Fetch missing candles for the INDEX_MAP spots (and traded options)")
+    sync.add_argument("--from", dest="start", type=date.fromisoformat, required=True)
+    sync.add_argument("--to", dest="end", type=date.fromisoformat, default=date.today())
+    sync.add_argument("--interval", default="ONE_MINUTE", choices=sorted(INTERVALS))
+    sync.add_argument("--groups", help="strategy_data.json: also cache the candles of every traded leg")
+    sync.add_argument("--secrets", default=".streamlit/secrets.toml")
+    show = sub.add_parser("show", help="Print cached candles (no network)")
+    show.add_argument("exchange")
+    show.add_argument("token")
+    show.add_argument("--from", dest="start", type=date.fromisoformat, required=True)
+    show.add_argument("--to", dest="end", type=date.fromisoformat, required=True)
+    show.add_argument("--interval", default="ONE_MINUTE", choices=sorted(INTERVALS))
+    parser.add_argument("--root", default=os.environ.get("STRATEGY_CANDLE_DIR", "candles"))
+    args = parser.parse_args(argv)
+
+    if args.command == "show":
+        print(CandleStore(args.root).candles(args.exchange, args.token, args.interval, args.start, args.end).to_string(index=False))
+        return
+
+    import json
+    import tomllib
+    from broker_session import BrokerSession
+    from firefight_rules import INDEX_MAP
+    with open(args.secrets, "rb") as f:
+        creds = tomllib.load(f)["angelone"]  # Same credentials the app reads from st.secrets
+    broker = BrokerSession(creds["api_key"], creds["client_id"], creds["pin"], creds["totp_secret"],
+                           root=os.environ.get("STRATEGY_BROKER_ROOT"))
+    response = broker.login()
+    if not response.get("status"):
+        raise SystemExit(f"Login failed: {response.get('message')}")
+    store = CandleStore(args.root, broker.api)
+    targets = {(details["exchange"], details["token"]) for details in INDEX_MAP.values()}
+    if args.groups:
+        with open(args.groups) as f:
+            targets |= traded_option_tokens(json.load(f).get("strategy_groups", {}))
+    for exchange, token in sorted(targets):
+        try:
+            calls = store.fetch_missing(exchange, token, args.interval, args.start, args.end)
+            print(f"{exchange}:{token} {args.interval}: {calls} getCandleData call(s)")
+        except CandleFetchError as e:
+            print(f"{exchange}:{token}: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+The Dashboard's firefighting rules as plain functions (no Streamlit), so the live
+"Adjustment Signal & Firefighting" panel and the backtester apply exactly the same
+logic:
+
+  - group P&L, Greeks and avg strike come from process_group_legs / calculate_group_stats
+  - the safe range is avg short strike +/- buffer (ff_reference hedges excluded)
+  - outside it: shift the base to an ATM straddle when the group is in profit,
+    otherwise average with a straddle at S2 = 2*T - S1
+  - the alternatives shown alongside: a reference trade at avg -/+ buffer on the
+    other side, and a range extension at avg +/- 2*buffer on the breached side
+"""
+# --- Static map for index tokens (NFO for options, NSE for spot index) ---
+INDEX_MAP = {
+    "NIFTY": {"token": "26000", "exchange": "NSE", "symbol": "NIFTY 50", "lot_size": 25, "step": 50},
+    "BANKNIFTY": {"token": "26009", "exchange": "NSE", "symbol": "NIFTY BANK", "lot_size": 15, "step": 100},
+    "FINNIFTY": {"token": "26037", "exchange": "NSE", "symbol": "NIFTY FIN SERVICE", "lot_size": 25, "step": 50},
+}
+
+# How computed strikes snap to listed ones (the Dashboard uses "nearest")
+STRIKE_ROUNDING = ("nearest", "toward_spot", "away_from_spot")
+
+
+def round_strike(price, step, mode="nearest", spot=None):
+    """Snaps `price` to a multiple of `step`. toward/away_from_spot need `spot`."""
+    if mode == "nearest" or spot is None:
+        return round(price / step) * step
+    lower = (price // step) * step
+    upper = lower if lower == price else lower + step
+    toward = upper if spot > price else lower
+    if mode == "toward_spot":
+        return toward
+    if mode == "away_from_spot":
+        return lower if toward == upper else upper
+    raise ValueError(f"Unknown strike rounding {mode!r} (expected one of {STRIKE_ROUNDING})")
+
+
+def s2_from_s1_and_spot(s1, spot, step):
+    """Calculates the PR Sundar 'Averaging' strike (S2 = 2*T - S1)."""
+    target_spot = round(spot / step) * step
+    return (2 * target_spot - s1)
+
+
+def averages_into_base(leg):
+    """True for the legs the avg short strike is taken over: active shorts, except 'ff_reference' hedges."""
+    return leg.get('side') == 'short' and leg.get('strategy', '') != 'ff_reference' and leg.get('status') == 'active'
+
+
+def short_avg_strike(legs):
+    """Lots-weighted strike of the averages_into_base legs (0 if none)."""
+    total_lots = 0
+    weighted = 0
+    for leg in legs:
+        if averages_into_base(leg):
+            total_lots += leg.get('lots', 1)
+            weighted += leg.get('strike', 0) * leg.get('lots', 1)
+    return weighted / total_lots if total_lots else 0
+
+
+def leg_pnl(side, entry, price, lots, lot_size):
+    """P&L of one leg at `price` (LTP for active legs, exit price for closed ones)."""
+    if side == 'short':
+        return (entry - price) * lots * lot_size
+    return (price - entry) * lots * lot_size
+
+
+def process_group_legs(group):
+    """Legs with numeric fields coerced and their P&L (LTP for active legs, exit price for closed)."""
+    import pandas as pd
+    processed_legs = []
+    if group and group['legs']:
+        for leg in group['legs']:
+            new_leg = leg.copy()
+            
+            if 'lot_size' not in new_leg or pd.isna(new_leg['lot_size']):
+                new_leg['lot_size'] = INDEX_MAP.get(group['instrument'], {}).get('lot_size', 25)
+            
+            entry = pd.to_numeric(new_leg.get('entry_premium', 0), errors='coerce')
+            lots = pd.to_numeric(new_leg.get('lots', 1), errors='coerce')
+            lot_size = pd.to_numeric(new_leg.get('lot_size', 1), errors='coerce')
+            
+            ltp = 0.0
+            price = 0.0
+
+            if new_leg.get('status') == 'active':
+                ltp = pd.to_numeric(new_leg.get('current_ltp', 0), errors='coerce')
+                price = ltp
+            else:
+                price = pd.to_numeric(new_leg.get('exit_price', 0), errors='coerce')
+            
+            pnl = 0.0
+            if not any(pd.isna([entry, price, lots, lot_size])):
+                if new_leg.get('side') == 'short':
+                    pnl = (entry - price) * lots * lot_size
+                elif new_leg.get('side') == 'long':
+                    pnl = (price - entry) * lots * lot_size
+            
+            new_leg['pnl'] = pnl
+            new_leg['entry_premium'] = entry
+            new_leg['lots'] = lots
+            new_leg['lot_size'] = lot_size
+            new_leg['current_ltp'] = ltp
+            new_leg['exit_price'] = price
+            
+            processed_legs.append(new_leg)
+    return processed_legs
+
+
+def calculate_group_stats(group, legs_data):
+    """
+    Calculates combined stats for a group of positions.
+    """
+    import pandas as pd
+    realised_pnl = 0
+    unrealised_pnl = 0
+    net_delta = 0
+    net_theta = 0
+    net_credit = 0
+    
+    if not group or not legs_data:
+        return {
+            'total_pnl': 0, 'realised_pnl': 0, 'unrealised_pnl': 0,
+            'net_delta': 0, 'net_theta': 0, 'net_credit': 0, 'avg_strike': 0, 'total_lots': 0
+        }
+
+    for leg in legs_data:
+        lots = leg.get('lots', 1)
+        lot_size = leg.get('lot_size', INDEX_MAP.get(group['instrument'], {}).get('lot_size', 25))
+        
+        entry_premium = pd.to_numeric(leg.get('entry_premium', 0), errors='coerce')
+        delta = pd.to_numeric(leg.get('delta', 0), errors='coerce')
+        theta = pd.to_numeric(leg.get('theta', 0), errors='coerce')
+        
+        pnl = pd.to_numeric(leg.get('pnl', 0), errors='coerce')
+        if pd.isna(pnl): pnl = 0
+        if pd.isna(entry_premium): entry_premium = 0
+        
+        # Accumulate PnL based on status
+        if leg.get('status') == 'closed':
+            realised_pnl += pnl
+        else:
+            unrealised_pnl += pnl
+
+        # Calculate Net Credit only from entry premiums
+        if leg.get('side') == 'short':
+            net_credit += entry_premium * lots * lot_size
+        elif leg.get('side') == 'long':
+            net_credit -= entry_premium * lots * lot_size
+        
+        # Calculate Greeks only for ACTIVE legs
+        if leg.get('status') == 'active':
+            if not pd.isna(delta):
+                if leg.get('side') == 'short':
+                    net_delta -= delta * lots * lot_size
+                elif leg.get('side') == 'long':
+                    net_delta += delta * lots * lot_size
+            
+            if not pd.isna(theta):
+                if leg.get('side') == 'short':
+                    net_theta += theta * lots * lot_size
+                elif leg.get('side') == 'long':
+                    net_theta -= theta * lots * lot_size
+
+    # All short legs (base, average, extension) except the 'ff_reference' hedges
+    avg_strike = short_avg_strike(legs_data)
+    total_short_lots = sum(leg.get('lots', 1) for leg in legs_data if averages_into_base(leg))
+
+    return {
+        'total_pnl': realised_pnl + unrealised_pnl,
+        'realised_pnl': realised_pnl,
+        'unrealised_pnl': unrealised_pnl,
+        'net_delta': net_delta,
+        'net_theta': net_theta,
+        'net_credit': net_credit,
+        'avg_strike': avg_strike,
+        'total_lots': total_short_lots
+    }
+
+
+def firefight_signal(avg_strike, spot, buffer, step, total_pnl, rounding="nearest"):
+    """What the firefighting panel shows for this state, or None without an active base.
+
+    zone: "up" / "down" / "safe"; recommended: "shift" / "average" (None while safe).
+    s2_strike is exactly s2_from_s1_and_spot (unrounded, as on the Dashboard);
+    reference/extension are (strike, option type) on the respective sides.
+    """
+    if not avg_strike:
+        return None
+    trigger_up = avg_strike + buffer
+    trigger_down = avg_strike - buffer
+    signal = {
+        "trigger_up": trigger_up, "trigger_down": trigger_down,
+        "atm_strike": round(spot / step) * step,
+        "s2_strike": s2_from_s1_and_spot(avg_strike, spot, step),
+        "zone": "safe", "recommended": None, "reference": None, "extension": None,
+    }
+    if spot > trigger_up:
+        signal["zone"] = "up"
+        signal["reference"] = (round_strike(avg_strike - buffer, step, rounding, spot), "PE")
+        signal["extension"] = (round_strike(avg_strike + buffer + buffer, step, rounding, spot), "CE")
+    elif spot < trigger_down:
+        signal["zone"] = "down"
+        signal["reference"] = (round_strike(avg_strike + buffer, step, rounding, spot), "CE")
+        signal["extension"] = (round_strike(avg_strike - buffer - buffer, step, rounding, spot), "PE")
+    if signal["zone"] != "safe":
+        signal["recommended"] = "shift" if total_pnl >= 0 else "average"
+    return signal
@@ -0,0 +1,204 @@
+"""
+Load driver for the broker client stack, run against mock_angel.py (or any compatible server).
+
+Each simulated session logs in through BrokerSession (pooled HTTP, metrics, retries and
+the shared circuit breaker, exactly as the app wires them), builds `--groups` strategy
+groups of `--legs` random option legs from the scrip master, and then refreshes every
+group the way refresh_all_prices does (one FULL getMarketData for spot + legs) every
+`--interval` seconds (0 = closed loop) for `--duration` seconds.
+
+    python load_driver.py --spawn-mock --latency-ms 30 --jitter-ms 20 --error-rate 0.02 \\
+        --sessions 50 --groups 3 --legs 4 --duration 30
+
+Reports throughput and end-to-end refresh latency percentiles (retries included), the
+per-attempt broker histogram, outcomes and circuit-breaker trips.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+
+from broker_metrics import BrokerMetrics
+from broker_resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, harden
+from broker_session import BrokerSession, http_session
+from mock_angel import INDICES, SCRIP_MASTER_PATH, MockConfig, serve
+from profiler import percentile
+
+
+class LoadStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies_ms = []
+        self.outcomes = {}
+        self.tokens = 0
+        self.logins = 0
+        self.login_failures = 0
+
+    def record(self, elapsed_ms, outcome, tokens=0):
+        with self._lock:
+            self.latencies_ms.append(elapsed_ms)
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            if outcome == "ok":
+                self.tokens += tokens
+
+    def summary(self, elapsed_s):
+        with self._lock:
+            ordered = sorted(self.latencies_ms)
+            outcomes = dict(self.outcomes)
+            tokens = self.tokens
+        requests = len(ordered)
+        return {
+            "duration_s": elapsed_s, "refreshes": requests, "logins": self.logins, "login_failures": self.login_failures,
+            "throughput_rps": requests / elapsed_s if elapsed_s else 0.0,
+            "tokens_per_s": tokens / elapsed_s if elapsed_s else 0.0,
+            "ok_ratio": outcomes.get("ok", 0) / requests if requests else 0.0,
+            "outcomes": outcomes,
+            "latency_ms": {
+                "mean": sum(ordered) / requests if requests else 0.0,
+                "p50": percentile(ordered, 50), "p95": percentile(ordered, 95),
+                "p99": percentile(ordered, 99), "p999": percentile(ordered, 99.9),
+                "max": ordered[-1] if ordered else 0.0,
+            },
+        }
+
+
+def option_universe(root):
+    """{index name: [option tokens]} from the server's scrip master."""
+    rows = http_session().get(root + SCRIP_MASTER_PATH, timeout=60).json()
+    universe = {}
+    for row in rows:
+        if row.get("instrumenttype") == "OPTIDX":
+            universe.setdefault(row["name"], []).append(row["token"])
+    return universe
+
+
+def build_groups(rng, universe, n_groups, n_legs):
+    """[(spot token, {exchange: [tokens]})] - the token sets refresh_all_prices would request."""
+    groups = []
+    for _ in range(n_groups):
+        spot_token, (name, *_rest) = rng.choice(sorted(INDICES.items()))
+        legs = rng.sample(universe[name], min(n_legs, len(universe[name])))
+        groups.append({"NSE": [spot_token], "NFO": legs})
+    return groups
+
+
+def run_session(index, args, universe, wrap, stats, deadline):
+    rng = random.Random(args.seed + index)
+    broker = BrokerSession(args.api_key, f"LOAD{index:04d}", "pin", args.totp_secret, root=args.root, wrap=wrap)
+    try:
+        response = broker.login()
+        ok = bool(response.get("status"))
+    except Exception:
+        ok = False
+    with stats._lock:
+        stats.logins += 1
+        stats.login_failures += 0 if ok else 1
+    if not ok:
+        return
+    groups = build_groups(rng, universe, args.groups, args.legs)
+    time.sleep(rng.uniform(0, args.interval))  # Spread the sessions out instead of firing in lockstep
+    while time.time() < deadline:
+        cycle_started = time.perf_counter()
+        for tokens in groups:
+            n_tokens = sum(len(t) for t in tokens.values())
+            started = time.perf_counter()
+            try:
+                result = broker.api.getMarketData("FULL", tokens)
+                outcome = "ok" if result.get("status") else f"error:{result.get('errorcode') or result.get('message')}"
+            except CircuitOpenError:
+                outcome = "circuit_open"
+            except Exception as e:
+                outcome = f"exception:{type(e).__name__}"
+            stats.record((time.perf_counter() - started) * 1000, outcome, n_tokens)
+            if outcome == "circuit_open":
+                time.sleep(0.1)  # The app would simply skip this refresh cycle
+        if args.interval:
+            time.sleep(max(0.0, args.interval - (time.perf_counter() - cycle_started)))
+
+
+def run(args):
+    server = None
+    if args.spawn_mock:
+        config = MockConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit, seed=args.seed)
+        server, _ = serve(config, port=0, background=True)
+        args.root = f"http://127.0.0.1:{server.server_address[1]}"
+
+    metrics = BrokerMetrics()
+    breaker = CircuitBreaker(failure_threshold=args.breaker_threshold, reset_timeout=args.breaker_reset)
+    if args.no_resilience:
+        wrap = metrics.instrument
+    else:
+        policy = RetryPolicy(max_attempts=args.max_attempts)
+        wrap = lambda api: harden(metrics.instrument(api), breaker, policy, on_retry=metrics.record_retry)
+
+    universe = option_universe(args.root)
+    stats = LoadStats()
+    started = time.time()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=run_session, args=(i, args, universe, wrap, stats, deadline), daemon=True)
+               for i in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    if server is not None:
+        server.shutdown()
+
+    report = stats.summary(elapsed)
+    report["broker"] = metrics.snapshot()["endpoints"]
+    report["circuit_breaker"] = breaker.snapshot()
+    return report
+
+
+def format_report(report, args):
+    lat = report["latency_ms"]
+    market = report["broker"].get("getMarketData", {})
+    lines = [
+        f"{args.sessions} sessions x {args.groups} groups x {args.legs} legs against {args.root} "
+        f"for {report['duration_s']:.1f}s (interval {args.interval}s)",
+        f"logins: {report['logins']} ({report['login_failures']} failed)",
+        f"refreshes: {report['refreshes']}  throughput: {report['throughput_rps']:.1f} req/s  "
+        f"{report['tokens_per_s']:.0f} tokens/s  ok: {report['ok_ratio']:.2%}",
+        f"refresh latency (ms, retries included): mean {lat['mean']:.1f}  p50 {lat['p50']:.1f}  p95 {lat['p95']:.1f}  "
+        f"p99 {lat['p99']:.1f}  p99.9 {lat['p999']:.1f}  max {lat['max']:.1f}",
+        f"outcomes: {', '.join(f'{k}: {v}' for k, v in sorted(report['outcomes'].items()))}",
+    ]
+    if market:
+        lines.append(f"getMarketData attempts: {market['count']} (retries {market['retries']}, mean {market['mean_ms']:.1f} ms, "
+                     f"max {market['max_ms']:.1f} ms) statuses: {market['statuses']}")
+    cb = report["circuit_breaker"]
+    lines.append(f"circuit breaker: {cb['state']}, tripped {cb['trips']}x")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated sessions refreshing strategy groups against a (mock) broker")
+    parser.add_argument("--root", default="http://127.0.0.1:8700", help="Broker API root (ignored with --spawn-mock)")
+    parser.add_argument("--spawn-mock", action="store_true", help="Start an in-process mock_angel server")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0)
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--groups", type=int, default=2, help="Strategy groups per session")
+    parser.add_argument("--legs", type=int, default=4, help="Legs per group")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between refresh cycles (0 = closed loop)")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--api-key", default="load-test", help="Shared by all sessions, like one account's tabs")
+    parser.add_argument("--totp-secret", default="JBSWY3DPEHPK3PXP")
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--breaker-threshold", type=int, default=5)
+    parser.add_argument("--breaker-reset", type=float, default=30.0)
+    parser.add_argument("--no-resilience", action="store_true", help="Measure the raw client: no retries, no breaker")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print(json.dumps(report, indent=2) if args.json else format_report(report, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Local SPAN-style margin estimate for a set of index option legs on one underlying.
+
+Like exchange SPAN, the legs are repriced under 16 scenarios: spot moves of 0, ±1/3, ±2/3
+and ±1 price scan range, each with vol up and vol down, plus two extreme moves of ±2 scan
+ranges of which only 35% counts. The worst scenario loss is the scanning risk, floored at
+a short-option minimum. Exposure margin on the notional of the short options is added on
+top. All legs x scenarios are priced in one broadcast bs_price call, and results are cached
+per (leg set, spot, days, vol), so asking again for the same group or proposal is a lookup:
+
+    margin = MarginEstimator()
+    margin.estimate(legs, spot=25000)["total"]
+    margin.incremental(current_legs, proposed_legs, spot=25000)
+
+Legs are dicts as stored in a group (side, type, strike, lots, lot_size; closed legs are
+ignored), plus an optional `expiry` date (default: DEFAULT_DAYS away). Calendar-spread and
+inter-commodity charges are not modelled: this is for sizing decisions, not the broker's number.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+
+import numpy as np
+
+from pricing import DAYS_PER_YEAR, bs_price
+
+PRICE_SCAN = 0.06          # Price scan range, fraction of spot (NSE index options: ~6%)
+VOL_SCAN = 0.04            # Vol scan range, absolute (4 vol points)
+EXTREME_MOVE = 2.0         # Extreme scenarios move this many price scan ranges...
+EXTREME_WEIGHT = 0.35      # ...and count for this fraction of the loss
+SHORT_OPTION_MINIMUM = 0.01  # Floor on scanning risk: fraction of spot x quantity per short option
+EXPOSURE_MARGIN = 0.02     # Fraction of the notional (spot x quantity) of short options
+DEFAULT_VOL = 0.14
+DEFAULT_DAYS = 7
+MIN_DAYS = 1               # Expiry-day legs are still priced with a day left (SPAN charges them fully)
+SPOT_STEP = 10             # Spot is rounded to this for the cache key (and the estimate)
+CACHE_SIZE = 512
+
+# (spot move in scan ranges, vol direction, weight): the 16 standard SPAN scenarios
+SCENARIOS = [(move, vol, 1.0) for move in (0.0, 1 / 3, -1 / 3, 2 / 3, -2 / 3, 1.0, -1.0) for vol in (1, -1)] \
+    + [(EXTREME_MOVE, 0, EXTREME_WEIGHT), (-EXTREME_MOVE, 0, EXTREME_WEIGHT)]
+_MOVES, _VOLS, _WEIGHTS = (np.array(column, dtype=np.float64) for column in zip(*SCENARIOS))
+
+
+def _leg_key(leg, today):
+    expiry = leg.get('expiry')
+    if isinstance(expiry, datetime):
+        expiry = expiry.date()
+    days = (expiry - today).days if isinstance(expiry, date) else DEFAULT_DAYS
+    qty = float(leg.get('lots', 1) or 0) * float(leg.get('lot_size', 1) or 0)
+    return (leg.get('side'), leg.get('type'), float(leg.get('strike', 0)), qty, max(days, MIN_DAYS))
+
+
+def leg_set_key(legs, today=None):
+    """Order-independent key of the active legs: sorted (side, type, strike, qty, days) tuples."""
+    today = today or date.today()
+    return tuple(sorted(_leg_key(leg, today) for leg in legs if leg.get('status', 'active') != 'closed'))
+
+
+def scenario_margin(key, spot, vol=DEFAULT_VOL, rate=0.0):
+    """Margin breakdown for a leg_set_key at `spot` (uncached)."""
+    if not key:
+        return {"scan_risk": 0.0, "short_minimum": 0.0, "span": 0.0, "exposure": 0.0, "total": 0.0,
+                "worst_scenario": None}
+    side, opt_type, strike, qty, days = zip(*key)
+    strike = np.array(strike)
+    is_call = np.array(opt_type) == "CE"
+    t = np.array(days, dtype=np.float64) / DAYS_PER_YEAR
+    signed_qty = np.where(np.array(side) == "short", -1.0, 1.0) * np.array(qty)
+    short_qty = float(np.where(signed_qty < 0, -signed_qty, 0.0).sum())
+
+    base = bs_price(spot, strike, t, vol, is_call, rate)
+    shocked = bs_price(spot * (1.0 + _MOVES[:, None] * PRICE_SCAN), strike, t,
+                       np.maximum(vol + _VOLS[:, None] * VOL_SCAN, 0.01), is_call, rate)  # scenarios x legs
+    loss = -((shocked - base) * signed_qty).sum(axis=1) * _WEIGHTS
+    worst = int(np.argmax(loss))
+    scan_risk = max(float(loss[worst]), 0.0)
+    short_minimum = SHORT_OPTION_MINIMUM * spot * short_qty
+    span = max(scan_risk, short_minimum)
+    exposure = EXPOSURE_MARGIN * spot * short_qty
+    return {"scan_risk": scan_risk, "short_minimum": short_minimum, "span": span, "exposure": exposure,
+            "total": span + exposure, "worst_scenario": SCENARIOS[worst] if scan_risk > 0 else None}
+
+
+class MarginEstimator:
+    """scenario_margin with an LRU cache per (leg set, spot bucket, vol, rate). Thread-safe."""
+
+    def __init__(self, vol=DEFAULT_VOL, rate=0.0, spot_step=SPOT_STEP, cache_size=CACHE_SIZE):
+        self.vol = vol
+        self.rate = rate
+        self.spot_step = spot_step
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def estimate(self, legs, spot, vol=None, today=None):
+        """Margin breakdown (scan_risk, short_minimum, span, exposure, total, worst_scenario) for the legs."""
+        vol = self.vol if vol is None else vol
+        spot = round(float(spot) / self.spot_step) * self.spot_step
+        key = (leg_set_key(legs, today), spot, round(vol, 4), self.rate)
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+        result = scenario_margin(key[0], spot, vol, self.rate) if spot > 0 else scenario_margin((), 0)
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def incremental(self, current_legs, proposed_legs, spot, vol=None, today=None):
+        """Total margin of proposed_legs minus that of current_legs (negative = margin released)."""
+        return (self.estimate(proposed_legs, spot, vol, today)["total"]
+                - self.estimate(current_legs, spot, vol, today)["total"])
@@ -0,0 +1,188 @@
+"""
+Market-data providers: where refresh_all_prices / refresh_all_index_prices get LTPs.
+
+A provider is anything with SmartConnect's `getMarketData(mode, exchangeTokens)`
+returning the same response shape ({"status", "message", "data": {"fetched",
+"unfetched"}}), so the live SmartConnect client is itself a provider and the
+refresh code does not care which one it talks to.
+
+`ReplayProvider` plays back a `ReplayTape` loaded from
+
+  - the tick recorder's daily ring logs (a directory of ticks-YYYYMMDD.bin),
+  - the historical candle cache (a candle_store.py directory), or
+  - a CSV of candles: timestamp, token, open, high, low, close[, volume]. Each candle
+    is replayed as open -> high/low -> close within its interval.
+
+on a virtual clock running at `speed` x real time (1 = real time, 60 = a minute per
+second), or, for fully deterministic runs, advanced by `step_seconds` on every call
+regardless of the wall clock:
+
+    tape = ReplayTape.load("ticks/")
+    provider = ReplayProvider(tape, speed=10)
+    provider.getMarketData("FULL", {"NSE": ["26000"]})
+"""
+import os
+import time
+from datetime import datetime, time as dt_time
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+MARKET_DATA_MODES = ("FULL", "LTP", "OHLC")
+IST = ZoneInfo("Asia/Kolkata")
+MARKET_OPEN = dt_time(9, 15)
+
+
+def session_open_ns(ts_ns):
+    """09:15 IST on the trading day of ts_ns, in ns since the epoch."""
+    day = datetime.fromtimestamp(ts_ns / 1e9, IST).date()
+    return int(datetime.combine(day, MARKET_OPEN, tzinfo=IST).timestamp()) * 10**9
+
+
+class ReplayTape:
+    """Per-token price series (ns timestamps, sorted) to replay."""
+
+    def __init__(self, series):
+        self.series = {str(token): (np.asarray(ts, dtype=np.int64), np.asarray(px, dtype=np.float64))
+                       for token, (ts, px) in series.items() if len(ts)}
+        if not self.series:
+            raise ValueError("Replay source has no prices")
+        self.start_ns = min(int(ts[0]) for ts, _ in self.series.values())
+        self.end_ns = max(int(ts[-1]) for ts, _ in self.series.values())
+
+    @classmethod
+    def load(cls, source, start=None, end=None):
+        """A tick-log directory, a candle store directory (candle_store.py) or a candle CSV file."""
+        if os.path.isdir(source):
+            if not any(name.startswith("ticks-") for name in os.listdir(source)):
+                return cls.from_candle_store(source, start, end)
+            return cls.from_ticks(source, start, end)
+        return cls.from_candles_csv(source)
+
+    @classmethod
+    def from_ticks(cls, directory, start=None, end=None):
+        from tick_recorder import read_ticks
+        ticks = read_ticks(directory, start, end)
+        order = np.argsort(ticks["token"], kind="stable")  # Stable: keeps time order within each token
+        ticks = ticks[order]
+        tokens, first = np.unique(ticks["token"], return_index=True)
+        bounds = list(first) + [len(ticks)]
+        return cls({str(token): (ticks["ts_ns"][bounds[i]:bounds[i + 1]], ticks["ltp"][bounds[i]:bounds[i + 1]])
+                    for i, token in enumerate(tokens)})
+
+    @classmethod
+    def from_candles(cls, df, interval_s=None):
+        """Candles DataFrame (timestamp, token, open, high, low, close) -> 4 prices per bar.
+
+        interval_s is the candle length; by default the median gap between a token's bars.
+        """
+        import pandas as pd
+        series = {}
+        df = df.copy()
+        df["timestamp"] = pd.to_datetime(df["timestamp"])
+        if df["timestamp"].dt.tz is None:
+            df["timestamp"] = df["timestamp"].dt.tz_localize("Asia/Kolkata")
+        for token, bars in df.sort_values("timestamp").groupby(df["token"].astype(str), sort=False):
+            ts = bars["timestamp"].dt.as_unit("ns").astype("int64").to_numpy()
+            # Interval of each bar = gap to the next one, capped at the candle length so the
+            # last bar of a day is not spread over the overnight gap
+            gaps = np.diff(ts)
+            if interval_s is not None:
+                bar_ns = int(interval_s * 10**9)
+            else:
+                bar_ns = int(np.median(gaps)) if len(gaps) else 60 * 10**9
+            interval = np.minimum(np.append(gaps, bar_ns), bar_ns)
+            o, h, l, c = (bars[col].to_numpy(dtype=np.float64) for col in ("open", "high", "low", "close"))
+            up = c >= o  # Rising bar: assume it dipped first (O -> L -> H -> C), falling bar the other way
+            second, third = np.where(up, l, h), np.where(up, h, l)
+            offsets = (interval[:, None] * np.array([0, 1, 2, 3]) // 4).astype(np.int64)
+            series[token] = ((ts[:, None] + offsets).ravel(), np.column_stack([o, second, third, c]).ravel())
+        return cls(series)
+
+    @classmethod
+    def from_candle_store(cls, root, start=None, end=None, interval="ONE_MINUTE"):
+        """Every token cached in a CandleStore at `interval` (disk only, no broker calls)."""
+        from candle_store import INTERVALS, CandleStore
+        store = CandleStore(root)
+        if start is None or end is None:
+            days = [d for exchange, token, cached in store.tokens() if cached == interval
+                    for d in store.days(exchange, token, interval)]
+            if not days:
+                raise ValueError(f"No {interval} candles in {root}")
+            start, end = start or min(days), end or max(days)
+        return cls.from_candles(store.frame(start, end, interval), interval_s=INTERVALS[interval][0])
+
+    @classmethod
+    def from_candles_csv(cls, path):
+        import pandas as pd
+        return cls.from_candles(pd.read_csv(path))
+
+    def price_at(self, token, ts_ns):
+        """Last price of `token` at or before ts_ns (None before its first price or if unknown)."""
+        series = self.series.get(str(token))
+        if series is None:
+            return None
+        ts, px = series
+        i = int(np.searchsorted(ts, ts_ns, side="right")) - 1
+        return float(px[i]) if i >= 0 else None
+
+    def session_stats(self, token, ts_ns):
+        """open/high/low of `token` from 09:15 of ts_ns's trading day up to ts_ns.
+
+        Before the open (or with no price yet today) the last known price stands for all three.
+        """
+        ts, px = self.series[str(token)]
+        i = int(np.searchsorted(ts, ts_ns, side="right"))
+        if i == 0:
+            return None
+        lo = min(int(np.searchsorted(ts, session_open_ns(ts_ns), side="left")), i - 1)
+        seen = px[lo:i]
+        return {"open": float(seen[0]), "high": float(seen.max()), "low": float(seen.min())}
+
+
+class ReplayProvider:
+    """Serves a ReplayTape on a virtual clock (see module docstring)."""
+
+    name = "replay"
+
+    def __init__(self, tape, speed=1.0, start=None, step_seconds=None, clock=time.monotonic):
+        self.tape = tape
+        self.speed = speed
+        self.step_ns = int(step_seconds * 1e9) if step_seconds else None
+        self.clock = clock
+        self.start_ns = tape.start_ns if start is None else int(start.timestamp() * 1e9) if isinstance(start, datetime) else int(start)
+        self._wall_start = clock()
+        self._calls = 0
+
+    def now_ns(self):
+        """Current replay time."""
+        if self.step_ns is not None:
+            return self.start_ns + self._calls * self.step_ns
+        return self.start_ns + int((self.clock() - self._wall_start) * self.speed * 1e9)
+
+    def now(self):
+        return datetime.fromtimestamp(self.now_ns() / 1e9)
+
+    @property
+    def finished(self):
+        return self.now_ns() > self.tape.end_ns
+
+    def getMarketData(self, mode, exchangeTokens):
+        if mode not in MARKET_DATA_MODES:
+            return {"status": False, "message": f"Invalid mode {mode}", "errorcode": "AB4000", "data": None}
+        now_ns = self.now_ns()
+        self._calls += 1
+        fetched, unfetched = [], []
+        for exchange, tokens in (exchangeTokens or {}).items():
+            for token in tokens:
+                ltp = self.tape.price_at(token, now_ns)
+                if ltp is None:
+                    unfetched.append({"exchange": exchange, "symbolToken": str(token),
+                                      "message": "No replay data", "errorCode": "AB4903"})
+                    continue
+                item = {"exchange": exchange, "symbolToken": str(token), "ltp": ltp}
+                if mode in ("FULL", "OHLC"):
+                    stats = self.tape.session_stats(token, now_ns)
+                    item.update(open=stats["open"], high=stats["high"], low=stats["low"], close=ltp)
+                fetched.append(item)
+        return {"status": True, "message": "SUCCESS", "errorcode": "", "data": {"fetched": fetched, "unfetched": unfetched}}
@@ -0,0 +1,429 @@
+"""
+Local stand-in for the Angel One SmartAPI endpoints this app uses, for CI, load and
+latency testing (never point load tests at the real broker).
+
+    login (generateSession), generateTokens, getProfile, market quote (FULL/LTP/OHLC),
+    historical candles (getCandleData) and the OpenAPIScripMaster.json download
+
+Prices are synthetic: each index follows a seeded random walk in (wall-clock) time, and
+options are Black-Scholes priced off it with a small smile, with a 5-level depth around
+the LTP. Historical candles come from a separate walk that is deterministic per (token,
+day), so repeated fetches of the same range return identical candles. Latency (mean + jitter), error injection (broker errors, HTTP 500s, rate-limit
+rejections) and a per-API-key rate limit are configurable.
+
+    python mock_angel.py --port 8700 --latency-ms 40 --jitter-ms 20 --error-rate 0.02 --rate-limit 10
+
+Then run the app against it:
+
+    STRATEGY_BROKER_ROOT=http://127.0.0.1:8700 \\
+    STRATEGY_SCRIP_MASTER=http://127.0.0.1:8700/OpenAPI_File/files/OpenAPIScripMaster.json \\
+    streamlit run op_final.py
+"""
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from candle_store import INTERVALS, IST, MARKET_CLOSE, MARKET_OPEN
+from pricing import bs_price
+
+SCRIP_MASTER_PATH = "/OpenAPI_File/files/OpenAPIScripMaster.json"
+HISTORY_EPOCH = date(2020, 1, 1)  # Historical walks start here
+ROUTES = {
+    "/rest/auth/angelbroking/user/v1/loginByPassword": "login",
+    "/rest/auth/angelbroking/jwt/v1/generateTokens": "generate_tokens",
+    "/rest/secure/angelbroking/user/v1/getProfile": "profile",
+    "/rest/secure/angelbroking/market/v1/quote": "quote",
+    "/rest/secure/angelbroking/historical/v1/getCandleData": "candles",
+    SCRIP_MASTER_PATH: "scrip_master",
+}
+# token: (name, exchange symbol, starting spot, strike step, lot size)
+INDICES = {
+    "26000": ("NIFTY", "NIFTY 50", 25000.0, 50, 25),
+    "26009": ("BANKNIFTY", "NIFTY BANK", 56000.0, 100, 15),
+    "26037": ("FINNIFTY", "NIFTY FIN SERVICE", 26000.0, 50, 25),
+}
+
+
+class MockConfig:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, rate_limit=0.0, token_ttl=8 * 3600,
+                 seed=7, annual_vol=0.15, strikes_each_side=40, expiries=4, totp_secret=None):
+        self.latency_ms = latency_ms      # Mean added latency per request
+        self.jitter_ms = jitter_ms        # Uniform +/- jitter around it
+        self.error_rate = error_rate      # Fraction of secure calls that fail (mix of the failure kinds below)
+        self.rate_limit = rate_limit      # Requests/s per API key before rate-limit rejections (0 = unlimited)
+        self.token_ttl = token_ttl        # JWT lifetime (s)
+        self.seed = seed
+        self.annual_vol = annual_vol
+        self.strikes_each_side = strikes_each_side
+        self.expiries = expiries
+        self.totp_secret = totp_secret    # When set, logins must present a valid TOTP
+
+
+def make_jwt(subject, ttl):
+    """Unsigned JWT-shaped token whose payload carries `exp` (what broker_session reads)."""
+    def part(obj):
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).decode().rstrip("=")
+    now = int(time.time())
+    return f"{part({'alg': 'none', 'typ': 'JWT'})}.{part({'sub': subject, 'iat': now, 'exp': now + ttl, 'jti': uuid.uuid4().hex})}.mock"
+
+
+def weekly_expiries(n, today=None):
+    """The next `n` Thursdays (today included)."""
+    today = today or date.today()
+    first = today + timedelta(days=(3 - today.weekday()) % 7)
+    return [first + timedelta(weeks=i) for i in range(n)]
+
+
+class SyntheticMarket:
+    """Index random walks plus Black-Scholes option prices on top of them."""
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng(config.seed)
+        self._spots = {token: spot for token, (_, _, spot, _, _) in INDICES.items()}
+        self._opens = dict(self._spots)
+        self._highs = dict(self._spots)
+        self._lows = dict(self._spots)
+        self._last_step = time.time()
+        self.instruments = self._build_instruments()
+        self._by_token = {row["token"]: row for row in self.instruments}
+        self._anchors = {}  # index token -> daily opening spots since HISTORY_EPOCH
+
+    def _build_instruments(self):
+        rows = [{"token": token, "symbol": symbol, "name": name, "expiry": "", "strike": "-1.000000",
+                 "lotsize": "1", "instrumenttype": "AMXIDX", "exch_seg": "NSE", "tick_size": "5.000000"}
+                for token, (name, symbol, _, _, _) in INDICES.items()]
+        next_token = 100000
+        for _, (name, _, spot, step, lot_size) in INDICES.items():
+            atm = round(spot / step) * step
+            for expiry in weekly_expiries(self.config.expiries):
+                for k in range(-self.config.strikes_each_side, self.config.strikes_each_side + 1):
+                    strike = atm + k * step
+                    for opt_type in ("CE", "PE"):
+                        next_token += 1
+                        rows.append({
+                            "token": str(next_token),
+                            "symbol": f"{name}{expiry:%d%b%y}{strike:.0f}{opt_type}".upper(),
+                            "name": name, "expiry": f"{expiry:%d%b%Y}".upper(),
+                            "strike": f"{strike * 100:.6f}", "lotsize": str(lot_size),
+                            "instrumenttype": "OPTIDX", "exch_seg": "NFO", "tick_size": "5.000000",
+                        })
+        return rows
+
+    def _advance(self):
+        """Moves every index by the random-walk steps (one per elapsed second) since the last call."""
+        now = time.time()
+        steps = int(now - self._last_step)
+        if steps <= 0:
+            return
+        self._last_step += steps
+        sigma = self.config.annual_vol / np.sqrt(252 * 375 * 60)  # Per trading second
+        for token in self._spots:
+            path = self._spots[token] * np.exp(np.cumsum(self._rng.normal(0.0, sigma, size=min(steps, 3600))))
+            self._spots[token] = float(path[-1])
+            self._highs[token] = max(self._highs[token], float(path.max()))
+            self._lows[token] = min(self._lows[token], float(path.min()))
+
+    def quote(self, token):
+        """(ltp, open, high, low) for an index or option token, or None if unknown."""
+        with self._lock:
+            self._advance()
+            if token in self._spots:
+                return self._spots[token], self._opens[token], self._highs[token], self._lows[token]
+            row = self._by_token.get(token)
+            if row is None:
+                return None
+            index_token = next(t for t, (name, *_rest) in INDICES.items() if name == row["name"])
+            spot, spot_open = self._spots[index_token], self._opens[index_token]
+        strike = float(row["strike"]) / 100
+        expiry = datetime.strptime(row["expiry"], "%d%b%Y").replace(hour=15, minute=30)
+        years = max((expiry - datetime.now()).total_seconds(), 0) / (365 * 86400)
+        vol = self.config.annual_vol * (1 + 0.8 * (np.log(strike / spot)) ** 2 * 100)  # Mild smile
+        is_call = row["symbol"].endswith("CE")
+        ltp = round(float(bs_price(spot, strike, years, vol, is_call)) / 0.05) * 0.05
+        opened = round(float(bs_price(spot_open, strike, years, vol, is_call)) / 0.05) * 0.05
+        return ltp, opened, max(ltp, opened), min(ltp, opened)
+
+    # --- History (getCandleData) ---
+    def _day_open(self, index_token, day):
+        """Deterministic opening spot of `day`: a daily walk that reaches the starting spot today."""
+        days = (day - HISTORY_EPOCH).days
+        with self._lock:
+            anchors = self._anchors.get(index_token)
+            if anchors is None or len(anchors) <= days:
+                today = (date.today() - HISTORY_EPOCH).days
+                rng = np.random.default_rng([self.config.seed, int(index_token)])
+                walk = np.cumsum(rng.normal(0.0, self.config.annual_vol / np.sqrt(252), size=max(days, today) + 366))
+                anchors = INDICES[index_token][2] * np.exp(walk - walk[today])
+                self._anchors[index_token] = anchors
+        return float(anchors[days])
+
+    def history(self, token, interval, start, end):
+        """[[iso ts, o, h, l, c, v]] candles of `token` between two IST datetimes (None if unknown)."""
+        row = self._by_token.get(token)
+        if row is None:
+            return None
+        index_token = token if token in INDICES else next(t for t, (name, *_rest) in INDICES.items() if name == row["name"])
+        seconds = INTERVALS[interval][0]
+        sigma = self.config.annual_vol / np.sqrt(252 * 375 * 60)
+        candles = []
+        day = start.date()
+        while day <= end.date():
+            if day.weekday() < 5 and day >= HISTORY_EPOCH:
+                rng = np.random.default_rng([self.config.seed, int(index_token), day.toordinal()])
+                opened = datetime.combine(day, MARKET_OPEN, tzinfo=start.tzinfo)
+                seconds_open = int((datetime.combine(day, MARKET_CLOSE) - datetime.combine(day, MARKET_OPEN)).total_seconds())
+                path = self._day_open(index_token, day) * np.exp(np.cumsum(rng.normal(0.0, sigma, size=seconds_open + 1)))
+                stamps = [opened] if seconds >= 86400 else [opened + timedelta(seconds=k) for k in range(0, seconds_open, seconds)]
+                width = seconds_open if seconds >= 86400 else seconds
+                prices = path
+                if token not in INDICES:
+                    strike = float(row["strike"]) / 100
+                    expiry = datetime.strptime(row["expiry"], "%d%b%Y").replace(hour=15, minute=30, tzinfo=start.tzinfo)
+                    secs = np.arange(len(path))
+                    years = np.maximum((expiry - opened).total_seconds() - secs, 0) / (365 * 86400)
+                    prices = bs_price(path, strike, years, self.config.annual_vol, row["symbol"].endswith("CE"))
+                for k, stamp in enumerate(stamps):
+                    if not start <= stamp <= end:
+                        continue
+                    bar = prices[k * width:(k + 1) * width + 1]
+                    volume = 0 if token in INDICES else int(rng.integers(0, 5000)) * int(row["lotsize"])
+                    candles.append([stamp.isoformat(), round(float(bar[0]), 2), round(float(bar.max()), 2),
+                                    round(float(bar.min()), 2), round(float(bar[-1]), 2), volume])
+            day += timedelta(days=1)
+        return candles
+
+
+class MockAngelServer:
+    """The request handling behind the HTTP server (kept separate so it can be driven directly)."""
+
+    def __init__(self, config=None):
+        self.config = config or MockConfig()
+        self.market = SyntheticMarket(self.config)
+        self._lock = threading.Lock()
+        self._tokens = {}   # jwt -> (client code, expiry)
+        self._refresh = {}  # refresh token -> client code
+        self._buckets = {}  # client -> (allowance, last time)
+        self._rng = random.Random(self.config.seed)
+        self.requests = 0
+
+    # --- Failure / latency injection ---
+    def delay(self):
+        c = self.config
+        if c.latency_ms or c.jitter_ms:
+            with self._lock:
+                jitter = self._rng.uniform(-c.jitter_ms, c.jitter_ms)
+            time.sleep(max(0.0, c.latency_ms + jitter) / 1000)
+
+    def rate_limited(self, client):
+        if not self.config.rate_limit:
+            return False
+        with self._lock:
+            allowance, last = self._buckets.get(client, (self.config.rate_limit, time.monotonic()))
+            now = time.monotonic()
+            allowance = min(self.config.rate_limit, allowance + (now - last) * self.config.rate_limit)
+            limited = allowance < 1
+            self._buckets[client] = (allowance if limited else allowance - 1, now)
+        return limited
+
+    def injected_error(self):
+        """None, or (http status, body) of a random failure."""
+        with self._lock:
+            if self._rng.random() >= self.config.error_rate:
+                return None
+            kind = self._rng.choice(("broker", "http500", "ratelimit"))
+        if kind == "broker":
+            return 200, {"status": False, "message": "Something Went Wrong, Please Try After Sometime",
+                         "errorcode": "AB1004", "data": None}
+        if kind == "http500":
+            return 500, "Internal Server Error"
+        return 403, "Access denied because of exceeding access rate"
+
+    def authorized(self, headers):
+        token = (headers.get("Authorization") or "").split(" ", 1)[-1]
+        with self._lock:
+            entry = self._tokens.get(token)
+        return entry is not None and entry[1] > time.time()
+
+    # --- Endpoints (return (status, body)) ---
+    def _issue(self, client):
+        jwt = make_jwt(client, self.config.token_ttl)
+        refresh = uuid.uuid4().hex
+        with self._lock:
+            self._tokens[jwt] = (client, time.time() + self.config.token_ttl)
+            self._refresh[refresh] = client
+        return {"jwtToken": jwt, "refreshToken": refresh, "feedToken": uuid.uuid4().hex}
+
+    def login(self, params, headers):
+        client = params.get("clientcode")
+        if self.config.totp_secret:
+            import pyotp
+            if not pyotp.TOTP(self.config.totp_secret).verify(str(params.get("totp")), valid_window=1):
+                return 200, {"status": False, "message": "Invalid totp", "errorcode": "AB1050", "data": None}
+        if not client or not params.get("password"):
+            return 200, {"status": False, "message": "Invalid clientcode or password", "errorcode": "AB1007", "data": None}
+        return 200, {"status": True, "message": "SUCCESS", "errorcode": "", "data": self._issue(client)}
+
+    def generate_tokens(self, params, headers):
+        with self._lock:
+            client = self._refresh.get(params.get("refreshToken"))
+        if client is None or not self.authorized(headers):
+            return 200, {"status": False, "message": "Invalid refresh token", "errorcode": "AB8050", "data": None}
+        return 200, {"status": True, "message": "SUCCESS", "errorcode": "", "data": self._issue(client)}
+
+    def profile(self, params, headers):
+        token = (headers.get("Authorization") or "").split(" ", 1)[-1]
+        with self._lock:
+            client = self._tokens.get(token, ("",))[0]
+        return 200, {"status": True, "message": "SUCCESS", "errorcode": "", "data": {
+            "clientcode": client, "name": f"Mock {client}", "email": "", "mobileno": "",
+            "exchanges": ["NSE", "NFO"], "products": ["MARGIN", "MIS", "NRML"], "lastlogintime": "", "brokerid": "B2C"}}
+
+    def quote(self, params, headers):
+        mode = params.get("mode")
+        if mode not in ("FULL", "LTP", "OHLC"):
+            return 200, {"status": False, "message": "Invalid mode", "errorcode": "AB4000", "data": None}
+        fetched, unfetched = [], []
+        for exchange, tokens in (params.get("exchangeTokens") or {}).items():
+            for token in tokens:
+                quote = self.market.quote(str(token))
+                if quote is None:
+                    unfetched.append({"exchange": exchange, "symbolToken": str(token), "message": "Invalid token",
+                                      "errorCode": "AB4903"})
+                    continue
+                ltp, opened, high, low = quote
+                row = self.market._by_token.get(str(token), {})
+                item = {"exchange": exchange, "tradingSymbol": row.get("symbol", ""), "symbolToken": str(token),
+                        "ltp": round(ltp, 2)}
+                if mode in ("FULL", "OHLC"):
+                    item.update(open=round(opened, 2), high=round(high, 2), low=round(low, 2), close=round(opened, 2))
+                if mode == "FULL":
+                    tick = 0.05
+                    item.update(
+                        lastTradeQty=50, exchFeedTime=datetime.now().strftime("%d-%b-%Y %H:%M:%S"),
+                        tradeVolume=int(self.requests * 75),
+                        depth={"buy": [{"price": round(max(ltp - tick * (i + 1), 0.05), 2), "quantity": 75 * (i + 1), "orders": i + 1} for i in range(5)],
+                               "sell": [{"price": round(ltp + tick * (i + 1), 2), "quantity": 75 * (i + 1), "orders": i + 1} for i in range(5)]})
+                fetched.append(item)
+        return 200, {"status": True, "message": "SUCCESS", "errorcode": "", "data": {"fetched": fetched, "unfetched": unfetched}}
+
+    def candles(self, params, headers):
+        interval = params.get("interval")
+        try:
+            start = datetime.strptime(params.get("fromdate", ""), "%Y-%m-%d %H:%M").replace(tzinfo=IST)
+            end = datetime.strptime(params.get("todate", ""), "%Y-%m-%d %H:%M").replace(tzinfo=IST)
+        except ValueError:
+            return 200, {"status": False, "message": "Invalid date format", "errorcode": "AB4000", "data": None}
+        if interval not in INTERVALS:
+            return 200, {"status": False, "message": "Invalid interval", "errorcode": "AB4000", "data": None}
+        if (end - start).days > INTERVALS[interval][1]:
+            return 200, {"status": False, "message": "Date range exceeds the limit for this interval",
+                         "errorcode": "AB4000", "data": None}
+        data = self.market.history(str(params.get("symboltoken")), interval, start, min(end, datetime.now(IST)))
+        if data is None:
+            return 200, {"status": False, "message": "Invalid token", "errorcode": "AB4903", "data": None}
+        return 200, {"status": True, "message": "SUCCESS", "errorcode": "", "data": data}
+
+    def scrip_master(self, params, headers):
+        return 200, self.market.instruments
+
+    def handle(self, path, params, headers, client):
+        """Routes one request. Returns (http status, JSON-able body or plain-text string)."""
+        with self._lock:
+            self.requests += 1
+        self.delay()
+        endpoint = ROUTES.get(path)
+        if endpoint is None:
+            return 404, {"status": False, "message": "Not found", "errorcode": "AB404", "data": None}
+        if endpoint not in ("login", "scrip_master"):
+            if self.rate_limited(client):
+                return 403, "Access denied because of exceeding access rate"
+            error = self.injected_error()
+            if error is not None:
+                return error
+            if endpoint != "generate_tokens" and not self.authorized(headers):
+                return 403, {"status": False, "message": "Invalid Token", "errorcode": "AG8001", "data": None}
+        return getattr(self, endpoint)(params, headers)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+    server_impl = None
+
+    def _params(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if not raw and "?" in self.path:
+            from urllib.parse import unquote
+            raw = unquote(self.path.split("?", 1)[1]).encode()
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return {}
+
+    def _serve(self):
+        path = self.path.split("?", 1)[0]
+        status, body = self.server_impl.handle(path, self._params(), self.headers,
+                                               self.headers.get("X-PrivateKey") or self.client_address[0])
+        if isinstance(body, str):
+            data, content_type = body.encode(), "text/plain"
+        else:
+            data, content_type = json.dumps(body).encode(), "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = _serve
+    do_POST = _serve
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(config=None, host="127.0.0.1", port=8700, background=False):
+    """Starts the mock. Returns (http server, MockAngelServer); port 0 picks a free port."""
+    impl = MockAngelServer(config)
+    handler = type("MockAngelHandler", (_Handler,), {"server_impl": impl})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, name="mock-angel", daemon=True).start()
+    return server, impl
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local mock of the Angel One SmartAPI endpoints used by the dashboard")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of secure calls that fail")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Requests/s per API key (0 = unlimited)")
+    parser.add_argument("--token-ttl", type=int, default=8 * 3600, help="JWT lifetime in seconds")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--totp-secret", help="Require valid TOTPs for this secret")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit, args.token_ttl,
+                        args.seed, totp_secret=args.totp_secret)
+    server, _ = serve(config, args.host, args.port)
+    print(f"Mock Angel One API on http://{args.host}:{server.server_address[1]} (scrip master at {SCRIP_MASTER_PATH})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Intraday MTM time series per strategy group.
+
+Every price refresh records the group's total / realised / unrealised P&L and net
+Greeks. The newest samples stay raw in a fixed-size ring per group. Every sample is
+also folded into a per-minute bucket (min / max / last of each field), and finished
+buckets are appended to one small binary file per group per day:
+
+    mtm/20251104/<group id>.bin
+
+So the whole day's path (buckets) plus the latest detail (raw samples) is always at
+hand, and it survives a restart:
+
+    history = MtmHistory("mtm")
+    history.record(group_id, stats)          # stats as returned by calculate_group_stats
+    history.day_frame(group_id)              # DataFrame for charting
+"""
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+IST = ZoneInfo("Asia/Kolkata")
+FIELDS = ("total_pnl", "realised_pnl", "unrealised_pnl", "net_delta", "net_theta")
+SAMPLE_DTYPE = np.dtype([("ts_ns", "<i8")] + [(f, "<f8") for f in FIELDS])
+BUCKET_DTYPE = np.dtype([("ts_ns", "<i8"), ("samples", "<i4")]
+                        + [(f"{f}_{agg}", "<f8") for f in FIELDS for agg in ("min", "max", "last")])
+DEFAULT_CAPACITY = 2048   # Raw samples kept per group (~8.5h at the 15s auto-refresh)
+DEFAULT_BUCKET_SECONDS = 60
+MAX_BUCKETS = 1440        # A full day of 1-minute buckets
+
+
+def _day_of(ts_ns):
+    return datetime.fromtimestamp(ts_ns / 1e9, IST).date()
+
+
+def _last_per_bucket(rows):
+    """Drops all but the last row of each minute: a bucket reopened after a flush is written again, in full."""
+    if len(rows) < 2:
+        return rows
+    return rows[np.append(rows["ts_ns"][1:] != rows["ts_ns"][:-1], True)]
+
+
+class _GroupSeries:
+    def __init__(self, capacity):
+        self.samples = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self.head = -1
+        self.size = 0
+        self.buckets = deque(maxlen=MAX_BUCKETS)  # Finished buckets (BUCKET_DTYPE rows) of the current day
+        self.bucket = None                         # The bucket being filled
+        self.day = None
+
+    def raw(self):
+        n = self.size
+        slots = (self.head - n + 1 + np.arange(n)) % len(self.samples)
+        return self.samples[slots]
+
+
+class MtmHistory:
+    """Per-group MTM ring buffers plus on-disk per-minute buckets. Thread-safe."""
+
+    def __init__(self, directory=None, capacity=DEFAULT_CAPACITY, bucket_seconds=DEFAULT_BUCKET_SECONDS):
+        self.directory = directory or None  # None = memory only (e.g. replay sessions)
+        self.capacity = capacity
+        self.bucket_ns = int(bucket_seconds * 1e9)
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def path(self, group_id, day):
+        return os.path.join(self.directory, f"{day:%Y%m%d}", f"{group_id}.bin")
+
+    def _series(self, group_id, day):
+        series = self._groups.get(group_id)
+        if series is None:
+            series = self._groups[group_id] = _GroupSeries(self.capacity)
+        if series.day != day:
+            if series.bucket is not None:
+                self._close_bucket(group_id, series)  # The previous day's closing minute
+            series.day = day
+            series.buckets.clear()
+            series.bucket = None
+            if self.directory:  # Pick up the buckets written earlier today (e.g. before a restart)
+                path = self.path(group_id, day)
+                if os.path.exists(path):
+                    series.buckets.extend(_last_per_bucket(np.fromfile(path, dtype=BUCKET_DTYPE)))
+        return series
+
+    def _close_bucket(self, group_id, series):
+        bucket = series.bucket
+        series.buckets.append(bucket)
+        series.bucket = None
+        if self.directory:
+            path = self.path(group_id, _day_of(int(bucket["ts_ns"])))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as f:
+                f.write(bucket.tobytes())
+
+    def record(self, group_id, stats, ts_ns=None):
+        """Adds one sample of `stats` (a dict with FIELDS) for the group."""
+        ts_ns = time.time_ns() if ts_ns is None else int(ts_ns)
+        values = [float(stats.get(f, 0) or 0) for f in FIELDS]
+        start = ts_ns - ts_ns % self.bucket_ns
+        with self._lock:
+            series = self._series(group_id, _day_of(ts_ns))
+            series.head = (series.head + 1) % self.capacity
+            series.samples[series.head] = (ts_ns, *values)
+            series.size = min(series.size + 1, self.capacity)
+
+            if series.bucket is not None and start > series.bucket["ts_ns"]:
+                self._close_bucket(group_id, series)
+            bucket = series.bucket
+            if bucket is None and series.buckets and series.buckets[-1]["ts_ns"] == start:
+                # Flushed earlier in this minute (e.g. just before a restart): keep filling it
+                bucket = series.bucket = np.array(series.buckets.pop(), dtype=BUCKET_DTYPE)
+            if bucket is None:
+                bucket = series.bucket = np.zeros((), dtype=BUCKET_DTYPE)
+                bucket["ts_ns"] = start
+                for f, v in zip(FIELDS, values):
+                    bucket[f"{f}_min"] = bucket[f"{f}_max"] = v
+            for f, v in zip(FIELDS, values):
+                bucket[f"{f}_min"] = min(bucket[f"{f}_min"], v)
+                bucket[f"{f}_max"] = max(bucket[f"{f}_max"], v)
+                bucket[f"{f}_last"] = v
+            bucket["samples"] += 1
+
+    def flush(self):
+        """Writes every partly filled bucket (e.g. at shutdown); later samples in its minute reopen it."""
+        with self._lock:
+            for group_id, series in self._groups.items():
+                if series.bucket is not None:
+                    self._close_bucket(group_id, series)
+
+    def samples(self, group_id):
+        """Raw samples (SAMPLE_DTYPE, oldest first) still in the ring."""
+        with self._lock:
+            series = self._groups.get(group_id)
+            return series.raw() if series is not None else np.empty(0, dtype=SAMPLE_DTYPE)
+
+    def day_frame(self, group_id, field="total_pnl"):
+        """pandas DataFrame (time, value, low, high) of today's path for `field`.
+
+        Buckets older than the oldest raw sample give last/min/max per minute; the raw
+        samples after them give full detail (low = high = value).
+        """
+        import pandas as pd
+        with self._lock:
+            series = self._groups.get(group_id)
+            if series is None:
+                return pd.DataFrame(columns=["time", "value", "low", "high"])
+            raw = series.raw()
+            buckets = np.array(list(series.buckets) + ([series.bucket] if series.bucket is not None else []),
+                               dtype=BUCKET_DTYPE)
+        if series.day is not None:
+            raw = raw[raw["ts_ns"] >= int(datetime.combine(series.day, datetime.min.time(), tzinfo=IST).timestamp() * 1e9)]
+        first_raw = raw["ts_ns"][0] if len(raw) else np.iinfo(np.int64).max
+        older = buckets[buckets["ts_ns"] + self.bucket_ns <= first_raw]
+        ts = np.concatenate([older["ts_ns"], raw["ts_ns"]])
+        df = pd.DataFrame({
+            "time": pd.to_datetime(ts, unit="ns", utc=True).tz_convert(IST),
+            "value": np.concatenate([older[f"{field}_last"], raw[field]]),
+            "low": np.concatenate([older[f"{field}_min"], raw[field]]),
+            "high": np.concatenate([older[f"{field}_max"], raw[field]]),
+        })
+        return df
+
+    def read_day(self, group_id, day):
+        """Buckets written to disk for a past (or the current) day."""
+        path = self.path(group_id, day) if self.directory else None
+        if path is None or not os.path.exists(path):
+            return np.empty(0, dtype=BUCKET_DTYPE)
+        return _last_per_bucket(np.fromfile(path, dtype=BUCKET_DTYPE))
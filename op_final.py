@@ -1,1285 +1,2255 @@
-import streamlit as st
-import pandas as pd
-import pyotp  # Handles the 6-digit TOTP
-import requests # To download the instrument file
-from SmartApi import SmartConnect
-from datetime import date, timedelta
-import uuid # To create unique IDs for legs and groups
-import io # For Excel export
-import openpyxl # For Excel export
-import time # For Auto-Refresh
-import json # <-- ADDED
-import os   # <-- ADDED
-
-# --- App Config ---
-st.set_page_config(
-    page_title="Pro Options Dashboard",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
-# --- Data Persistence Functions ---
-# MOVED THIS ENTIRE BLOCK UP
-DATA_FILE = "strategy_data.json"
-
-def save_data():
-    """Saves strategy groups and trade history to a JSON file."""
-    data_to_save = {
-        "strategy_groups": st.session_state.strategy_groups,
-        "trade_history": st.session_state.trade_history
-    }
-    try:
-        # We need to handle non-serializable types like datetime.date
-        def default_converter(o):
-            if isinstance(o, (date, pd.Timestamp)): # Handle date and pandas timestamp
-                return o.isoformat()
-        
-        with open(DATA_FILE, "w") as f:
-            json.dump(data_to_save, f, indent=4, default=default_converter)
-    except Exception as e:
-        print(f"Error saving data: {e}") # You can see this in your terminal
-        # st.toast(f"Error saving data: {e}", icon="🚨") # Optional: show error in UI
-
-def load_data():
-    """Loads data from JSON file into session_state on startup."""
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, "r") as f:
-                data = json.load(f)
-                
-                # Load strategy groups
-                loaded_groups = data.get("strategy_groups", {})
-                
-                # --- FIX for JSON date strings ---
-                # We must convert date strings back to date objects
-                for group_id, group in loaded_groups.items():
-                    for leg in group.get('legs', []):
-                        if 'expiry' in leg and isinstance(leg['expiry'], str):
-                            try:
-                                # Try parsing as date first
-                                leg['expiry'] = date.fromisoformat(leg['expiry'])
-                            except (ValueError, TypeError):
-                                try:
-                                    # Try parsing as full timestamp (from older pandas versions)
-                                    leg['expiry'] = pd.to_datetime(leg['expiry']).date()
-                                except:
-                                    pass # Keep it as string if all conversion fails
-                
-                st.session_state.strategy_groups = loaded_groups
-                st.session_state.trade_history = data.get("trade_history", [])
-                
-                # Set active_group_id to the first active group, if any
-                if not st.session_state.active_group_id:
-                    active_groups = [gid for gid, g in loaded_groups.items() if g.get('status', 'active') == 'active']
-                    if active_groups:
-                        st.session_state.active_group_id = active_groups[0]
-                        
-        except Exception as e:
-            print(f"Error loading data: {e}")
-            # If file is corrupt, initialize fresh
-            st.session_state.strategy_groups = {}
-            st.session_state.trade_history = []
-    else:
-        # File doesn't exist, start fresh
-        st.session_state.strategy_groups = {}
-        st.session_state.trade_history = []
-# --- END of Data Persistence Functions ---
-
-
-# --- Session State Initialization ---
-if "api_object" not in st.session_state:
-    st.session_state.api_object = None
-if "access_token" not in st.session_state:
-    st.session_state.access_token = None
-if "user_profile" not in st.session_state:
-    st.session_state.user_profile = None
-if "instrument_list" not in st.session_state:
-    st.session_state.instrument_list = None
-if "feed_token" not in st.session_state:
-    st.session_state.feed_token = None
-# --- REPLACED old "strategy_groups" and "trade_history" init ---
-if "active_group_id" not in st.session_state:
-    st.session_state.active_group_id = None
-if "current_spot_price" not in st.session_state:
-    st.session_state.current_spot_price = 0.0
-if "current_chain" not in st.session_state:
-    st.session_state.current_chain = pd.DataFrame()
-if "atm_strike" not in st.session_state:
-    st.session_state.atm_strike = 0.0
-if "all_index_prices" not in st.session_state:
-    st.session_state.all_index_prices = {
-        "NIFTY": 0.0,
-        "BANKNIFTY": 0.0,
-        "FINNIFTY": 0.0
-    }
-# --- Load Data on First Run ---
-if "data_loaded" not in st.session_state:
-    # This function is defined below
-    load_data() 
-    st.session_state.data_loaded = True # Flag to prevent re-loading
-
-if "auto_refresh" not in st.session_state:
-    st.session_state.auto_refresh = False
-
-
-# --- Static map for index tokens (NFO for options, NSE for spot index) ---
-INDEX_MAP = {
-    "NIFTY": {"token": "26000", "exchange": "NSE", "symbol": "NIFTY 50", "lot_size": 25, "step": 50},
-    "BANKNIFTY": {"token": "26009", "exchange": "NSE", "symbol": "NIFTY BANK", "lot_size": 15, "step": 100},
-    "FINNIFTY": {"token": "26037", "exchange": "NSE", "symbol": "NIFTY FIN SERVICE", "lot_size": 25, "step": 50},
-}
-
-# --- Data Persistence Functions ---
-# THIS BLOCK WAS MOVED UP
-# DATA_FILE = "strategy_data.json"
-# ...
-# ... (all the way down to)
-# ...
-# --- END of Data Persistence Functions ---
-
-
-# --- Angel One Credentials (Loaded Securely) ---
-try:
-    API_KEY = st.secrets["angelone"]["api_key"]
-    CLIENT_ID = st.secrets["angelone"]["client_id"]
-    PIN = st.secrets["angelone"]["pin"]
-    TOTP_SECRET = st.secrets["angelone"]["totp_secret"]
-except KeyError:
-    st.error("ERROR: Angel One credentials not found in st.secrets. Please check your .streamlit/secrets.toml file.")
-    st.stop()
-
-# --- Helper Functions (App Logic) ---
-
-@st.cache_data(ttl=3600) # Cache the instrument list for 1 hour
-def fetch_instrument_list():
-    """
-    Downloads the master list of all tradable instruments from Angel One.
-    """
-    st.write("Downloading master instrument list...")
-    url = "https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json"
-    try:
-        response = requests.get(url)
-        response.raise_for_status() # Raise error for bad response
-        instrument_data = response.json()
-        df = pd.DataFrame(instrument_data)
-        
-        # Clean up the dataframe for easier use
-        df['expiry'] = pd.to_datetime(df['expiry']).dt.date
-        df['strike'] = pd.to_numeric(df['strike'], errors='coerce') 
-        df['strike'] = df['strike'] / 100.0 
-        # Set lotsize based on name
-        df['lotsize'] = df['name'].map({k: v['lot_size'] for k, v in INDEX_MAP.items()})
-
-        
-        return df
-    except Exception as e:
-        st.error(f"Failed to download instrument list: {e}")
-        return None
-
-def refresh_all_index_prices():
-    """
-    Fetches LTP for all spot indices defined in INDEX_MAP.
-    """
-    st.write("Refreshing all index prices for monitor...")
-    try:
-        if st.session_state.api_object is None:
-            st.warning("Please log in first.")
-            return
-
-        tokens_by_exchange = {}
-        for key, details in INDEX_MAP.items():
-            exchange = details["exchange"]
-            token = details["token"]
-            if exchange not in tokens_by_exchange:
-                tokens_by_exchange[exchange] = []
-            tokens_by_exchange[exchange].append(token)
-        
-        # Make API Call
-        market_data = st.session_state.api_object.getMarketData("FULL", tokens_by_exchange)
-
-        if market_data['status'] and market_data['data']:
-            fetched_data = market_data['data'].get('fetched', [])
-            
-            new_prices = st.session_state.all_index_prices.copy()
-            
-            for item in fetched_data:
-                token = item.get('symbolToken')
-                ltp = item.get('ltp')
-                if ltp is None:
-                    continue
-                
-                # Find which index this token belongs to
-                for index_name, details in INDEX_MAP.items():
-                    if details['token'] == token:
-                        new_prices[index_name] = ltp
-                        break
-            
-            st.session_state.all_index_prices = new_prices
-        else:
-            st.warning(f"Could not fetch index data: {market_data.get('message', 'Unknown error')}")
-
-    except Exception as e:
-        st.error(f"Error refreshing index prices: {e}")
-
-
-def login_to_angel():
-    """
-    Handles the complete Angel One login process using credentials and TOTP.
-    """
-    try:
-        st.session_state.api_object = SmartConnect(API_KEY)
-        
-        totp = pyotp.TOTP(TOTP_SECRET).now()
-        
-        data = {
-            "clientcode": CLIENT_ID,
-            "password": PIN,
-            "totp": totp
-        }
-        
-        session_data = st.session_state.api_object.generateSession(
-            data["clientcode"], 
-            data["password"], 
-            data["totp"]
-        )
-        
-        if session_data['status'] and session_data['data']:
-            st.session_state.access_token = session_data['data']['jwtToken']
-            st.session_state.feed_token = session_data['data']['feedToken']
-            st.session_state.user_profile = st.session_state.api_object.getProfile(session_data['data']['refreshToken'])
-            st.session_state.instrument_list = fetch_instrument_list()
-            
-            # --- Load data on login ---
-            # This ensures that if the user logs in *after* app start,
-            # their data is still loaded. The 'data_loaded' flag prevents
-            # this from overwriting memory if already logged in.
-            if "data_loaded" not in st.session_state:
-                load_data()
-                st.session_state.data_loaded = True
-
-            st.success("Login Successful!")
-            refresh_all_index_prices()
-            st.rerun() # --- FIX: Force a rerun on successful login ---
-        else:
-            st.error(f"Login Failed: {session_data['message']}")
-
-    except Exception as e:
-        st.error(f"An error occurred during login: {e}")
-
-def refresh_all_prices(group_id):
-    """
-    Fetches LTP for all legs AND the active spot price in a SINGLE API call for a specific group.
-    """
-    if group_id not in st.session_state.strategy_groups:
-        st.error("Strategy group not found for refresh.")
-        return
-        
-    group = st.session_state.strategy_groups[group_id]
-    st.write(f"Refreshing prices for {group['name']}...")
-    try:
-        instrument_name = group['instrument']
-        if instrument_name not in INDEX_MAP:
-            st.error(f"Invalid instrument: {instrument_name}")
-            return
-
-        spot_details = INDEX_MAP[instrument_name]
-        
-        tokens_by_exchange = {}
-
-        spot_exchange = spot_details["exchange"]
-        spot_token = spot_details["token"]
-        if spot_exchange not in tokens_by_exchange:
-            tokens_by_exchange[spot_exchange] = []
-        tokens_by_exchange[spot_exchange].append(spot_token)
-
-        active_legs_exist = False
-        for leg in group['legs']:
-            if leg['status'] == 'active': # Only fetch for active legs
-                active_legs_exist = True
-                exchange = leg['exchange']
-                token = leg['token']
-                if exchange not in tokens_by_exchange:
-                    tokens_by_exchange[exchange] = []
-                if token not in tokens_by_exchange[exchange]:
-                    tokens_by_exchange[exchange].append(token)
-        
-        if not active_legs_exist:
-             st.warning("No active legs to refresh for this strategy.")
-             pass
-
-        market_data = st.session_state.api_object.getMarketData("FULL", tokens_by_exchange)
-
-        if market_data['status'] and market_data['data']:
-            fetched_data = market_data['data'].get('fetched', [])
-            
-            for item in fetched_data:
-                token = item.get('symbolToken')
-                ltp = item.get('ltp')
-
-                if ltp is None:
-                    continue
-
-                if token == spot_details['token']:
-                    st.session_state.current_spot_price = ltp
-                    step = spot_details["step"]
-                    st.session_state.atm_strike = round(ltp / step) * step
-                
-                for leg in group['legs']:
-                    if leg['status'] == 'active' and leg['token'] == token:
-                        leg['current_ltp'] = ltp
-                        break
-            st.success(f"Prices updated for {group['name']}!")
-            refresh_all_index_prices()
-        else:
-            st.warning(f"Could not fetch market data: {market_data.get('message', 'Unknown error')}")
-            
-    except Exception as e:
-        st.error(f"Error refreshing prices: {e}")
-
-
-def s2_from_s1_and_spot(s1, spot, step):
-    """Calculates the PR Sundar 'Averaging' strike (S2 = 2*T - S1)."""
-    target_spot = round(spot / step) * step
-    return (2 * target_spot - s1)
-
-def calculate_group_stats(group, legs_data):
-    """
-    Calculates combined stats for a group of positions.
-    """
-    realised_pnl = 0
-    unrealised_pnl = 0
-    net_delta = 0
-    net_theta = 0
-    net_credit = 0
-    total_short_lots = 0
-    weighted_strike_sum = 0
-    
-    if not group or not legs_data:
-        return {
-            'total_pnl': 0, 'realised_pnl': 0, 'unrealised_pnl': 0,
-            'net_delta': 0, 'net_theta': 0, 'net_credit': 0, 'avg_strike': 0, 'total_lots': 0
-        }
-
-    for leg in legs_data:
-        lots = leg.get('lots', 1)
-        lot_size = leg.get('lot_size', INDEX_MAP.get(group['instrument'], {}).get('lot_size', 25))
-        
-        entry_premium = pd.to_numeric(leg.get('entry_premium', 0), errors='coerce')
-        delta = pd.to_numeric(leg.get('delta', 0), errors='coerce')
-        theta = pd.to_numeric(leg.get('theta', 0), errors='coerce')
-        
-        pnl = pd.to_numeric(leg.get('pnl', 0), errors='coerce')
-        if pd.isna(pnl): pnl = 0
-        if pd.isna(entry_premium): entry_premium = 0
-        
-        # Accumulate PnL based on status
-        if leg.get('status') == 'closed':
-            realised_pnl += pnl
-        else:
-            unrealised_pnl += pnl
-
-        # Calculate Net Credit only from entry premiums
-        if leg.get('side') == 'short':
-            net_credit += entry_premium * lots * lot_size
-        elif leg.get('side') == 'long':
-            net_credit -= entry_premium * lots * lot_size
-        
-        # Calculate Greeks only for ACTIVE legs
-        if leg.get('status') == 'active':
-            if not pd.isna(delta):
-                if leg.get('side') == 'short':
-                    net_delta -= delta * lots * lot_size
-                elif leg.get('side') == 'long':
-                    net_delta += delta * lots * lot_size
-            
-            if not pd.isna(theta):
-                if leg.get('side') == 'short':
-                    net_theta += theta * lots * lot_size
-                elif leg.get('side') == 'long':
-                    net_theta -= theta * lots * lot_size
-            
-            # --- THIS IS THE FIX ---
-            # We now include all short legs (base, average, extension)
-            # EXCLUDING only the 'ff_reference' trades, which are hedges.
-            strategy_tag = leg.get('strategy', '')
-            if leg.get('side') == 'short' and strategy_tag != 'ff_reference' and leg.get('status') == 'active':
-                total_short_lots += lots
-                weighted_strike_sum += leg.get('strike', 0) * lots
-
-    
-    avg_strike = 0
-    if total_short_lots > 0:
-        avg_strike = weighted_strike_sum / total_short_lots
-
-    return {
-        'total_pnl': realised_pnl + unrealised_pnl,
-        'realised_pnl': realised_pnl,
-        'unrealised_pnl': unrealised_pnl,
-        'net_delta': net_delta,
-        'net_theta': net_theta,
-        'net_credit': net_credit,
-        'avg_strike': avg_strike,
-        'total_lots': total_short_lots
-    }
-
-def add_leg_to_group(group_id, side, opt_type, strike, symbol, token, exchange, lot_size, strategy_tag="base_trade"):
-    """Adds a new option leg."""
-    if group_id not in st.session_state.strategy_groups:
-        st.error("Strategy group not found.")
-        return
-    group = st.session_state.strategy_groups[group_id]
-    
-    new_leg = {
-        "id": str(uuid.uuid4()),
-        "side": side,
-        "type": opt_type,
-        "strike": strike,
-        "lots": 1,
-        "entry_premium": 0.0,
-        "current_ltp": 0.0,
-        "exit_price": 0.0, 
-        "status": "active", 
-        "delta": 0.5 if opt_type == 'CE' else -0.5, 
-        "theta": 5.0,
-        "strategy": strategy_tag, 
-        "symbol": symbol,
-        "token": token,
-        "exchange": exchange,
-        "lot_size": lot_size
-    }
-    
-    group['legs'].append(new_leg)
-    st.session_state.trade_history.insert(0, f"[{pd.Timestamp.now(tz='Asia/Kolkata').strftime('%H:%M:%S')}] ADD LEG ({group['name']}): {side.upper()} {opt_type} @ {strike} (Tag: {strategy_tag})")    
-    st.toast(f"Added {side} {opt_type} @ {strike}. Refresh prices when ready.")
-    save_data() # <-- ADDED
-
-
-def find_strike_row(chain_df, strike):
-    """Finds the full row of data for a specific strike in the option chain."""
-    if chain_df.empty:
-        return None
-    row = chain_df[chain_df['strike'] == strike]
-    if not row.empty:
-        return row.iloc[0]
-    else:
-        st.warning(f"Strike {strike} not found in the current option chain.")
-        return None
-
-# --- Leg Action Handlers ---
-def update_leg_details(group_id, leg_id, new_lots, new_entry, new_tag):
-    """Updates a single leg's details."""
-    if group_id not in st.session_state.strategy_groups:
-        return
-    group = st.session_state.strategy_groups[group_id]
-    
-    log_msgs = []
-    found = False
-    for leg in group['legs']:
-        if leg['id'] == leg_id:
-            found = True
-            if leg['status'] != 'active':
-                st.warning("Cannot update a closed leg.")
-                return
-
-            try:
-                new_lots = int(new_lots)
-                new_entry = float(new_entry)
-            except ValueError:
-                st.error("Lots must be an integer, Entry must be a number.")
-                return
-
-            if leg['lots'] != new_lots:
-                log_msgs.append(f"LOTS from {leg['lots']} to {new_lots}")
-                leg['lots'] = new_lots
-            if leg['entry_premium'] != new_entry:
-                log_msgs.append(f"ENTRY from {leg['entry_premium']:.2f} to {new_entry:.2f}")
-                leg['entry_premium'] = new_entry
-            if leg['strategy'] != new_tag:
-                log_msgs.append(f"TAG to '{new_tag}'")
-                leg['strategy'] = new_tag
-            
-            if log_msgs:
-                st.session_state.trade_history.insert(0, f"[{pd.Timestamp.now(tz='Asia/Kolkata').strftime('%H:%M:%S')}] UPDATE LEG ({group['name']} | {leg['strike']} {leg['type']}): {', '.join(log_msgs)}")
-                st.toast(f"Updated {leg['strike']} {leg['type']}")
-                save_data() # <-- ADDED
-            break
-    
-    if not found:
-        st.error("Leg not found for update.")
-
-
-def exit_leg(group_id, leg_id):
-    """Marks a single leg as 'closed'."""
-    if group_id not in st.session_state.strategy_groups:
-        return
-    group = st.session_state.strategy_groups[group_id]
-    
-    leg_to_close = None
-    for leg in group['legs']:
-        if leg['id'] == leg_id:
-            leg_to_close = leg
-            break
-    
-    if leg_to_close:
-        if leg_to_close['status'] == 'closed':
-            st.warning("Leg is already closed.")
-            return
-            
-        leg_to_close['status'] = 'closed'
-        leg_to_close['exit_price'] = leg_to_close['current_ltp'] # Lock in the exit price
-        st.session_state.trade_history.insert(0, f"[{pd.Timestamp.now(tz='Asia/Kolkata').strftime('%H:%M:%S')}] EXIT LEG ({group['name']}): {leg_to_close['side'].upper()} {leg_to_close['type']} @ {leg_to_close['strike']} at {leg_to_close['exit_price']:.2f}")
-        st.toast(f"Exited {leg_to_close['strike']} {leg_to_close['type']}")
-        save_data() # <-- ADDED
-
-
-def add_weekly_hedge(group_id, instrument, weekly_expiry, strike, opt_type):
-    """Finds and adds a weekly hedge leg."""
-    if group_id not in st.session_state.strategy_groups or st.session_state.instrument_list is None:
-        return
-    group = st.session_state.strategy_groups[group_id]
-    instrument_df = st.session_state.instrument_list
-
-    try:
-        hedge_row = instrument_df[
-            (instrument_df['name'] == instrument) &
-            (instrument_df['expiry'] == weekly_expiry) &
-            (instrument_df['strike'] == strike) &
-            (instrument_df['symbol'].str.endswith(opt_type))
-        ].iloc[0]
-        
-        add_leg_to_group(
-            group_id, 
-            "long", 
-            opt_type, 
-            strike, 
-            hedge_row['symbol'], 
-            hedge_row['token'], 
-            hedge_row['exch_seg'], 
-            hedge_row['lotsize'], 
-            "weekly_hedge"
-        )
-        st.success(f"Added {strike} {opt_type} (Weekly Hedge)!")
-        # save_data() is already called inside add_leg_to_group
-    except Exception as e:
-        st.error(f"Could not find weekly hedge for {strike} {opt_type} on {weekly_expiry}. {e}")
-
-
-# --- Firefighting action functions ---
-def firefight_average(group_id, strike):
-    chain_df = st.session_state.current_chain
-    group = st.session_state.strategy_groups[group_id]
-    s2_row = find_strike_row(chain_df, strike)
-    if s2_row is not None:
-        add_leg_to_group(group_id, "short", "CE", strike, s2_row.symbol_CE, s2_row.token_CE, s2_row.exch_seg_CE, s2_row.lotsize_CE, "ff_average")
-        add_leg_to_group(group_id, "short", "PE", strike, s2_row.symbol_PE, s2_row.token_PE, s2_row.exch_seg_PE, s2_row.lotsize_PE, "ff_average")
-    st.session_state.trade_history.insert(0, f"[{pd.Timestamp.now(tz='Asia/Kolkata').strftime('%H:%M:%S')}] FIREFIGHT (AVG) ({group['name']}): Added Straddle @ {strike}")
-    st.success(f"Firefighting Straddle @ {strike} added.")
-    save_data() # <-- ADDED
-
-def firefight_add_reference_trade(group_id, strike, opt_type):
-    chain_df = st.session_state.current_chain
-    group = st.session_state.strategy_groups[group_id]
-    ext_row = find_strike_row(chain_df, strike)
-    if ext_row is not None:
-        if opt_type == "PE":
-            add_leg_to_group(group_id, "short", "PE", strike, ext_row.symbol_PE, ext_row.token_PE, ext_row.exch_seg_PE, ext_row.lotsize_PE, "ff_reference")
-        elif opt_type == "CE":
-            add_leg_to_group(group_id, "short", "CE", strike, ext_row.symbol_CE, ext_row.token_CE, ext_row.exch_seg_CE, ext_row.lotsize_CE, "ff_reference")
-    st.session_state.trade_history.insert(0, f"[{pd.Timestamp.now(tz='Asia/Kolkata').strftime('%H:%M:%S')}] FIREFIGHT (REF) ({group['name']}): Added {opt_type} @ {strike}")
-    st.success(f"Firefighting Reference {opt_type} @ {strike} added.")
-    save_data() # <-- ADDED
-
-def firefight_shift_base(group_id, atm_strike):
-    chain_df = st.session_state.current_chain
-    group = st.session_state.strategy_groups.get(group_id)
-    if not group:
-        st.error("Group not found for shifting.")
-        return
-
-    for leg in group['legs']:
-        if leg['status'] == 'active':
-            leg['status'] = 'closed'
-            leg['exit_price'] = leg['current_ltp']
-
-    atm_row = find_strike_row(chain_df, atm_strike)
-    if atm_row is not None:
-        add_leg_to_group(group_id, "short", "CE", atm_strike, atm_row.symbol_CE, atm_row.token_CE, atm_row.exch_seg_CE, atm_row.lotsize_CE, "base_straddle")
-        add_leg_to_group(group_id, "short", "PE", atm_strike, atm_row.symbol_PE, atm_row.token_PE, atm_row.exch_seg_PE, atm_row.lotsize_PE, "base_straddle")
-    st.session_state.trade_history.insert(0, f"[{pd.Timestamp.now(tz='Asia/Kolkata').strftime('%H:%M:%S')}] FIREFIGHT (SHIFT) ({group['name']}): Closed active legs. Added new Straddle @ {atm_strike}")
-    st.success(f"Base Shifted to new ATM @ {atm_strike}.")
-    save_data() # <-- ADDED
-
-def firefight_true_extension(group_id, strike, opt_type):
-    chain_df = st.session_state.current_chain
-    group = st.session_state.strategy_groups[group_id]
-    ext_row = find_strike_row(chain_df, strike)
-    if ext_row is not None:
-        if opt_type == "PE":
-            add_leg_to_group(group_id, "short", "PE", strike, ext_row.symbol_PE, ext_row.token_PE, ext_row.exch_seg_PE, ext_row.lotsize_PE, "ff_extension")
-        elif opt_type == "CE":
-            add_leg_to_group(group_id, "short", "CE", strike, ext_row.symbol_CE, ext_row.token_CE, ext_row.exch_seg_CE, ext_row.lotsize_CE, "ff_extension")
-    st.session_state.trade_history.insert(0, f"[{pd.Timestamp.now(tz='Asia/Kolkata').strftime('%H:%M:%S')}] FIREFIGHT (EXT) ({group['name']}): Added {opt_type} @ {strike}")
-    st.success(f"Firefighting Extension {opt_type} @ {strike} added.")
-    save_data() # <-- ADDED
-
-def close_all_positions(group_id):
-    if group_id not in st.session_state.strategy_groups:
-        st.error("Strategy group not found.")
-        return
-    group = st.session_state.strategy_groups[group_id]
-    group_name = group['name']
-    
-    for leg in group['legs']:
-        if leg['status'] == 'active':
-            leg['status'] = 'closed'
-            leg['exit_price'] = leg['current_ltp']
-    
-    group['status'] = 'closed'
-    st.session_state.active_group_id = None
-    
-    st.session_state.trade_history.insert(0, f"[{pd.Timestamp.now(tz='Asia/Kolkata').strftime('%H:%M:%S')}] ACTION: Close All Positions executed for {group_name}. Strategy moved to 'Closed'.")
-    st.success(f"All positions for {group_name} have been closed.")
-    save_data() # <-- ADDED
-
-
-# --- Multi-strategy UI Handlers ---
-def create_new_strategy(name, instrument):
-    if not name:
-        st.error("Please enter a strategy name.")
-        return False 
-    group_id = str(uuid.uuid4())
-    new_group = {
-        "id": group_id,
-        "name": name,
-        "instrument": instrument,
-        "legs": [],
-        "buffer": 100, # Default buffer
-        "status": "active" 
-    }
-    st.session_state.strategy_groups[group_id] = new_group
-    st.session_state.active_group_id = group_id
-    
-    st.session_state.trade_history.insert(0, f"[{pd.Timestamp.now(tz='Asia/Kolkata').strftime('%H:%M:%S')}] ACTION: Created new strategy '{name}'.")
-    save_data() # <-- ADDED
-    return True 
-
-@st.dialog("Create New Strategy")
-def new_strategy_dialog():
-    with st.form("new_strategy_form"):
-        strategy_name = st.text_input("Strategy Name", placeholder="e.g., Nifty Straddle")
-        instrument = st.selectbox("Instrument", ["NIFTY", "BANKNIFTY", "FINNIFTY"])
-        
-        submitted = st.form_submit_button("Create")
-        if submitted:
-            success = create_new_strategy(strategy_name, instrument)
-            if success:
-                st.rerun() 
-
-def set_active_group(group_id):
-    st.session_state.active_group_id = group_id
-    if group_id in st.session_state.strategy_groups:
-        group = st.session_state.strategy_groups[group_id]
-        if group.get('status') == 'active':
-            st.session_state['refresh_on_select'] = group_id
-
-
-def delete_group(group_id):
-    if group_id in st.session_state.strategy_groups:
-        group_name = st.session_state.strategy_groups[group_id]['name']
-        
-        del st.session_state.strategy_groups[group_id]
-        
-        st.session_state.trade_history.insert(0, f"[{pd.Timestamp.now(tz='Asia/Kolkata').strftime('%H:%M:%S')}] ACTION: Deleted strategy '{group_name}'.")
-        if st.session_state.active_group_id == group_id:
-            st.session_state.active_group_id = None
-        save_data() # <-- ADDED
-
-# --- NEW Function to clear history ---
-def clear_trade_history():
-    st.session_state.trade_history = []
-    save_data()
-
-# --- Excel Export Function ---
-def create_excel_export():
-    closed_strategies = {gid: g for gid, g in st.session_state.strategy_groups.items() if g.get('status') == 'closed'}
-    
-    if not closed_strategies:
-        st.warning("No closed strategies to export.")
-        return None
-
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        for group_id, group in closed_strategies.items():
-            sheet_name = "".join(c for c in group['name'] if c.isalnum() or c in (' ', '_')).rstrip()[:31]
-            if not sheet_name:
-                sheet_name = f"Strategy_{group_id[:8]}"
-
-            leg_data = []
-            for leg in group['legs']:
-                entry = leg.get('entry_premium', 0)
-                exit_p = leg.get('exit_price', 0) if leg.get('status') == 'closed' else leg.get('current_ltp', 0)
-                lots = leg.get('lots', 1)
-                lot_size = leg.get('lot_size', INDEX_MAP.get(group['instrument'], {}).get('lot_size', 25))
-                pnl = 0
-                if leg.get('side') == 'short':
-                    pnl = (entry - exit_p) * lots * lot_size
-                elif leg.get('side') == 'long':
-                    pnl = (exit_p - entry) * lots * lot_size
-                
-                leg_data.append({
-                    "Status": leg.get('status', 'N/A'),
-                    "Tag": leg.get('strategy', 'N/A'),
-                    "Side": leg.get('side', 'N/A'),
-                    "Type": leg.get('type', 'N/A'),
-                    "Strike": leg.get('strike', 0),
-                    "Lots": lots,
-                    "Entry": entry,
-                    "Exit": exit_p if leg.get('status') == 'closed' else "N/A (Active)",
-                    "PnL": pnl,
-                    "Symbol": leg.get('symbol', 'N/A')
-                })
-            
-            df = pd.DataFrame(leg_data)
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
-    
-    output.seek(0)
-    return output
-
-
-# --- Main App UI ---
-st.title("🔥 Professional Firefighting Dashboard")
-
-# --- Check for post-selection refresh ---
-if 'refresh_on_select' in st.session_state and st.session_state['refresh_on_select']:
-    group_id_to_refresh = st.session_state['refresh_on_select']
-    if group_id_to_refresh in st.session_state.strategy_groups:
-        refresh_all_prices(group_id_to_refresh)
-    st.session_state['refresh_on_select'] = None # Clear the flag
-
-
-if st.session_state.access_token:
-    # --- LOGGED IN STATE ---
-    
-    with st.sidebar:
-        try:
-            user_name = st.session_state.user_profile['data']['name']
-            st.success(f"Welcome, {user_name}!")
-        except (TypeError, KeyError):
-            st.success("Welcome, User!")
-        
-        st.markdown("---")
-        st.header("📈 Index Monitor")
-        idx_c1, idx_c2 = st.columns([2,1])
-        with idx_c1:
-            st.metric("NIFTY", f"{st.session_state.all_index_prices['NIFTY']:,.2f}")
-            st.metric("BANKNIFTY", f"{st.session_state.all_index_prices['BANKNIFTY']:,.2f}")
-            st.metric("FINNIFTY", f"{st.session_state.all_index_prices['FINNIFTY']:,.2f}")
-        with idx_c2:
-            st.button("Refresh", key="refresh_indices", on_click=refresh_all_index_prices, use_container_width=True)
-        
-        st.markdown("---")
-        
-        st.header("📋 Strategy Portfolios")
-        
-        if st.button("Create New Strategy", type="primary", use_container_width=True):
-            new_strategy_dialog()
-            
-        active_strategies = {gid: g for gid, g in st.session_state.strategy_groups.items() if g.get('status', 'active') == 'active'}
-        closed_strategies = {gid: g for gid, g in st.session_state.strategy_groups.items() if g.get('status') == 'closed'}
-
-        st.subheader("Active Strategies")
-        if not active_strategies:
-            st.info("No active strategies.")
-        else:
-            for group_id, group in active_strategies.items():
-                is_active = (st.session_state.active_group_id == group_id)
-                label = f"**{group['name']}** ({len([l for l in group['legs'] if l['status'] == 'active'])} legs)"
-                if is_active:
-                    st.button(f"Viewing: {group['name']}", key=f"view_{group_id}", disabled=True, use_container_width=True)
-                else:
-                    st.button(f"View: {group['name']}", key=f"select_{group_id}", on_click=set_active_group, args=(group_id,), use_container_width=True)
-                        
-        st.subheader("Closed Strategies")
-        if not closed_strategies:
-            st.info("No closed strategies.")
-        else:
-            excel_data = create_excel_export()
-            if excel_data:
-                st.download_button(
-                    label="📥 Download All Closed (.xlsx)",
-                    data=excel_data,
-                    file_name=f"closed_strategies_{date.today().strftime('%Y-%m-%d')}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True
-                )
-            for group_id, group in closed_strategies.items():
-                with st.container(border=True):
-                    st.markdown(f"**{group['name']}**")
-                    st.caption(f"{group['instrument']} | {len(group['legs'])} total legs")
-                    st.button("Delete", key=f"del_{group_id}", on_click=delete_group, args=(group_id,), use_container_width=True)
-
-    # --- Main Page Display ---
-    
-    tab_dash, tab_chain, tab_history = st.tabs([
-        "📈 Dashboard", 
-        "⛓️ Option Chain", 
-        "📓 Trade History"
-    ])
-
-    if st.session_state.active_group_id is None:
-        msg = "Please create or select a strategy from the sidebar to begin."
-        tab_dash.info(msg)
-        tab_chain.info(msg)
-    
-    elif st.session_state.active_group_id not in st.session_state.strategy_groups:
-         st.session_state.active_group_id = None
-         st.rerun() 
-         
-    else:
-        active_group_id = st.session_state.active_group_id
-        active_group = st.session_state.strategy_groups[active_group_id]
-        
-        # --- PNL Processing Loop (BUG FIX HERE) ---
-        processed_legs = []
-        if active_group and active_group['legs']:
-            for leg in active_group['legs']:
-                new_leg = leg.copy()
-                
-                if 'lot_size' not in new_leg or pd.isna(new_leg['lot_size']):
-                    new_leg['lot_size'] = INDEX_MAP.get(active_group['instrument'], {}).get('lot_size', 25)
-                
-                entry = pd.to_numeric(new_leg.get('entry_premium', 0), errors='coerce')
-                lots = pd.to_numeric(new_leg.get('lots', 1), errors='coerce')
-                lot_size = pd.to_numeric(new_leg.get('lot_size', 1), errors='coerce')
-                
-                ltp = 0.0
-                price = 0.0
-
-                if new_leg.get('status') == 'active':
-                    ltp = pd.to_numeric(new_leg.get('current_ltp', 0), errors='coerce')
-                    price = ltp
-                else:
-                    price = pd.to_numeric(new_leg.get('exit_price', 0), errors='coerce')
-                
-                pnl = 0.0
-                if not any(pd.isna([entry, price, lots, lot_size])):
-                    if new_leg.get('side') == 'short':
-                        pnl = (entry - price) * lots * lot_size
-                    elif new_leg.get('side') == 'long':
-                        pnl = (price - entry) * lots * lot_size
-                
-                new_leg['pnl'] = pnl
-                new_leg['entry_premium'] = entry
-                new_leg['lots'] = lots
-                new_leg['lot_size'] = lot_size
-                new_leg['current_ltp'] = ltp
-                new_leg['exit_price'] = price
-                
-                processed_legs.append(new_leg)
-        
-        spot = st.session_state.current_spot_price
-        atm_strike = st.session_state.atm_strike
-        
-        stats = calculate_group_stats(active_group, processed_legs)
-
-        # --- TAB 1: Dashboard & Firefighting ---
-        with tab_dash:
-            st.header(f"📈 Live Dashboard: {active_group['name']}")
-            st.caption(f"Instrument: {active_group['instrument']}")
-            
-            st.markdown("---")
-            st.header("Live Metrics")
-            m1, m2, m3, m4, m5 = st.columns(5)
-            pnl_color = "normal" if stats['total_pnl'] >= 0 else "inverse"
-            m1.metric("Total MTM P&L", f"₹{stats['total_pnl']:,.0f}", delta_color=pnl_color)
-            m2.metric("Unrealised P&L", f"₹{stats['unrealised_pnl']:,.0f}")
-            m3.metric("Realised P&L", f"₹{stats['realised_pnl']:,.0f}")
-            m4.metric("Net Delta", f"{stats['net_delta']:,.0f}")
-            m5.metric("Net Theta", f"₹{stats['net_theta']:,.0f}")
-            
-            b1, b2, b3 = st.columns(3) 
-            b1.button("Refresh All Prices", type="primary", use_container_width=True,
-                      on_click=refresh_all_prices, args=(active_group_id,),
-                      disabled=(active_group.get('status') == 'closed')
-            )
-            b2.button(f"⚠️ Close All Positions ({active_group['name']})", use_container_width=True,
-                      on_click=close_all_positions, args=(active_group_id,),
-                      help="This will mark all active legs as 'closed' and move the strategy to the 'Closed' list.",
-                      disabled=(active_group.get('status') == 'closed')
-            )
-            with b3:
-                st.session_state.auto_refresh = st.checkbox("Auto-Refresh Prices (15s)", value=st.session_state.auto_refresh, key="auto_refresh_toggle")
-
-            
-            st.markdown("---")
-
-            st.header("Positions")
-            st.info("Use the 'Actions' expander on any leg to update or exit it. Closed legs are greyed out.")
-
-            if not processed_legs:
-                st.info("No positions added yet. Add legs manually from the 'Option Chain' tab.")
-            else:
-                for leg in processed_legs:
-                    is_closed = (leg.get('status') == 'closed')
-                    style = "opacity: 0.5;" if is_closed else "" 
-                    
-                    with st.container():
-                        st.markdown(f'<div style="{style}">', unsafe_allow_html=True)
-                        with st.container(border=True):
-                            col1, col2, col3 = st.columns([4, 2, 2])
-                            
-                            with col1:
-                                side_text = "BUY" if leg.get('side') == 'long' else "SELL"
-                                side_color = "green" if leg.get('side') == 'long' else "red"
-                                price_text = f"@{leg.get('entry_premium', 0.0):.2f}"
-                                if is_closed:
-                                    price_text += f" → {leg.get('exit_price', 0.0):.2f}"
-
-                                st.markdown(f"**<span style='color:{side_color};'>{side_text}</span> {leg.get('lots', 0)}x** {price_text}", unsafe_allow_html=True)
-                                st.markdown(f"#### {leg.get('strike', 'N/A')} {leg.get('type', 'N/A')}")
-                                st.caption(f"Tag: {leg.get('strategy', 'N/A')}")
-                            with col2:
-                                ltp_val = leg.get('current_ltp', 0.0) if not is_closed else leg.get('exit_price', 0.0)
-                                st.metric(label="LTP" if not is_closed else "Exit Price", value=f"{ltp_val:.2f}")
-                            with col3:
-                                pnl_val = leg.get('pnl', 0.0)
-                                pnl_color = "normal" if pnl_val >= 0 else "inverse"
-                                label = "PnL" if not is_closed else "Realised PnL"
-                                st.metric(label=label, value=f"₹{pnl_val:,.0f}", delta_color=pnl_color)
-
-                            if not is_closed:
-                                with st.expander("Actions"):
-                                    form_key = f"form_{leg['id']}"
-                                    with st.form(key=form_key):
-                                        c1, c2, c3 = st.columns(3)
-                                        with c1:
-                                            new_lots = st.number_input("Lots", value=int(leg['lots']), min_value=1, step=1, key=f"lots_{leg['id']}")
-                                        with c2:
-                                            new_entry = st.number_input("Entry", value=float(leg['entry_premium']), format="%.2f", step=0.05, key=f"entry_{leg['id']}")
-                                        with c3:
-                                            new_tag = st.text_input("Tag", value=leg['strategy'], key=f"tag_{leg['id']}")
-                                        
-                                        s1, s2 = st.columns(2)
-                                        with s1:
-                                            st.form_submit_button(
-                                                "Update Leg", 
-                                                use_container_width=True,
-                                                on_click=update_leg_details,
-                                                args=(active_group_id, leg['id'], new_lots, new_entry, new_tag)
-                                            )
-                                        with s2:
-                                            st.form_submit_button(
-                                                "Exit Leg", 
-                                                use_container_width=True, 
-                                                type="primary",
-                                                on_click=exit_leg,
-                                                args=(active_group_id, leg['id'])
-                                            )
-                        st.markdown('</div>', unsafe_allow_html=True)
-
-
-            st.markdown("---")
-            
-            st.header("🔥 Adjustment Signal & Firefighting")
-            
-            if active_group.get('status') == 'closed':
-                st.info("This strategy is closed. Firefighting is disabled.")
-            else:
-                active_group['buffer'] = st.number_input(
-                    "Firefighting Buffer (pts)", 
-                    value=active_group.get('buffer', 100),
-                    step=10,
-                    key=f"buffer_{active_group_id}"
-                )
-
-                avg_strike = stats['avg_strike']
-                buffer = active_group['buffer']
-                step = INDEX_MAP[active_group['instrument']]["step"]
-                total_pnl = stats['total_pnl'] 
-
-                if avg_strike == 0:
-                    st.info("Add an active base leg (straddle/strangle) to enable firefighting signals.")
-                else:
-                    trigger_up = avg_strike + buffer
-                    trigger_down = avg_strike - buffer
-                    
-                    st.metric(
-                        label=f"Avg. Short Strike: {avg_strike:,.0f} | Buffer: {buffer} pts",
-                        value=f"Live Spot: {spot:,.2f}",
-                        delta=f"Safe Range: {trigger_down:,.0f} - {trigger_up:,.0f}"
-                    )
-                    st.markdown("---")
-
-                    if spot > trigger_up:
-                        st.error(f"**ADJUST!** Spot ({spot:,.2f}) > Upper Trigger ({trigger_up:,.0f}). Firefight UP!")
-                        st.subheader("Recommended Action")
-                        if total_pnl >= 0:
-                            st.info("Position is in profit. Shifting is recommended.")
-                            st.button(f"Shift Base to ATM @ {atm_strike}", on_click=firefight_shift_base, args=(active_group_id, atm_strike), use_container_width=True, type="primary")
-                        else:
-                            st.warning("Position is in loss. Averaging is recommended.")
-                            s2_strike = s2_from_s1_and_spot(avg_strike, spot, step)
-                            st.button(f"Averaging (S2): Sell Straddle @ {s2_strike}", on_click=firefight_average, args=(active_group_id, s2_strike), use_container_width=True, type="primary")
-                        
-                        st.markdown("---")
-                        st.subheader("All Firefighting Options")
-                        s2_strike = s2_from_s1_and_spot(avg_strike, spot, step)
-                        ref_strike_down = round((avg_strike - buffer) / step) * step
-                        ext_strike_up = round((avg_strike + buffer + buffer) / step) * step
-                        c1, c2, c3 = st.columns([1, 2, 1]); c1.markdown("**Technique**"); c2.markdown("**Action**"); c3.markdown("**Execute**")
-                        c1, c2, c3 = st.columns([1, 2, 1]); c1.write("Averaging (S2)"); c2.write(f"Sell Straddle @ {s2_strike}"); c3.button("Execute", key="ff_avg_table_up", on_click=firefight_average, args=(active_group_id, s2_strike), use_container_width=True)
-                        c1, c2, c3 = st.columns([1, 2, 1]); c1.write("Adjust (Reference)"); c2.write(f"Sell PE @ {ref_strike_down:.0f}"); c3.button("Execute", key="ff_ref_table_up", on_click=firefight_add_reference_trade, args=(active_group_id, ref_strike_down, "PE"), use_container_width=True)
-                        c1, c2, c3 = st.columns([1, 2, 1]); c1.write("Extend Range"); c2.write(f"Sell CE @ {ext_strike_up:.0f}"); c3.button("Execute", key="ff_ext_table_up", on_click=firefight_true_extension, args=(active_group_id, ext_strike_up, "CE"), use_container_width=True)
-
-                    elif spot < trigger_down:
-                        st.error(f"**ADJUST!** Spot ({spot:,.2f}) < Lower Trigger ({trigger_down:,.0f}). Firefight DOWN!")
-                        st.subheader("Recommended Action")
-                        if total_pnl >= 0:
-                            st.info("Position is in profit. Shifting is recommended.")
-                            st.button(f"Shift Base to ATM @ {atm_strike}", on_click=firefight_shift_base, args=(active_group_id, atm_strike), use_container_width=True, type="primary")
-                        else:
-                            st.warning("Position is in loss. Averaging is recommended.")
-                            s2_strike = s2_from_s1_and_spot(avg_strike, spot, step)
-                            st.button(f"Averaging (S2): Sell Straddle @ {s2_strike}", on_click=firefight_average, args=(active_group_id, s2_strike), use_container_width=True, type="primary")
-                        
-                        st.markdown("---")
-                        st.subheader("All Firefighting Options")
-                        s2_strike = s2_from_s1_and_spot(avg_strike, spot, step)
-                        ref_strike_up = round((avg_strike + buffer) / step) * step
-                        ext_strike_down = round((avg_strike - buffer - buffer) / step) * step
-                        c1, c2, c3 = st.columns([1, 2, 1]); c1.markdown("**Technique**"); c2.markdown("**Action**"); c3.markdown("**Execute**")
-                        c1, c2, c3 = st.columns([1, 2, 1]); c1.write("Averaging (S2)"); c2.write(f"Sell Straddle @ {s2_strike}"); c3.button("Execute", key="ff_avg_table_down", on_click=firefight_average, args=(active_group_id, s2_strike), use_container_width=True)
-                        c1, c2, c3 = st.columns([1, 2, 1]); c1.write("Adjust (Reference)"); c2.write(f"Sell CE @ {ref_strike_up:.0f}"); c3.button("Execute", key="ff_ref_table_down", on_click=firefight_add_reference_trade, args=(active_group_id, ref_strike_up, "CE"), use_container_width=True)
-                        c1, c2, c3 = st.columns([1, 2, 1]); c1.write("Extend Range"); c2.write(f"Sell PE @ {ext_strike_down:.0f}"); c3.button("Execute", key="ff_ext_table_down", on_click=firefight_true_extension, args=(active_group_id, ext_strike_down, "PE"), use_container_width=True)
-                    
-                    else:
-                        st.success(f"IN SAFE ZONE: Spot ({spot:,.2f}) is within range ({trigger_down:,.0f} - {trigger_up:,.0f}). Monitoring...")
-                
-                st.markdown("---")
-                
-                # --- Rebuilt Weekly Protection Tool ---
-                st.header("🛡️ Add Weekly Protection (PR Sundar Method)")
-                
-                instrument_df = st.session_state.instrument_list
-                today = date.today()
-                
-                active_instrument = active_group['instrument']
-                all_expiries = []
-                if instrument_df is not None:
-                    all_expiries = instrument_df[
-                        (instrument_df['name'] == active_instrument) & 
-                        (instrument_df['instrumenttype'] == 'OPTIDX') &
-                        (instrument_df['expiry'] >= today)
-                    ]['expiry'].unique()
-                
-                weekly_expiries = [exp for exp in all_expiries if (exp > today) and (exp <= today + timedelta(days=10))]
-                
-                if not weekly_expiries:
-                    st.warning(f"No near-term weekly expiries found for {active_instrument}.")
-                else:
-                    selected_weekly_expiry = st.selectbox("Select Weekly Expiry", options=sorted(weekly_expiries))
-                    
-                    base_short_legs = [l for l in processed_legs if l['side'] == 'short' and l['strategy'].startswith('base_') and l['status'] == 'active']
-                    total_premium_points = 0
-                    call_strike = None
-                    put_strike = None
-                    
-                    if base_short_legs:
-                        total_premium_points = sum(l['entry_premium'] for l in base_short_legs)
-                        
-                        ce_legs = [l['strike'] for l in base_short_legs if l['type'] == 'CE']
-                        pe_legs = [l['strike'] for l in base_short_legs if l['type'] == 'PE']
-                        
-                        if ce_legs: call_strike = max(ce_legs)
-                        if pe_legs: put_strike = min(pe_legs)
-                        
-                        if call_strike and not put_strike: put_strike = call_strike
-                        if put_strike and not call_strike: call_strike = put_strike
-
-                    if call_strike is None or put_strike is None:
-                        st.warning("Add active 'base_straddle' or 'base_strangle' legs and **update their 'Entry' price** to calculate break-evens.")
-                    else:
-                        step = INDEX_MAP[active_instrument]["step"]
-                        
-                        put_be_strike = put_strike - total_premium_points
-                        call_be_strike = call_strike + total_premium_points
-                        
-                        put_hedge_strike = round(put_be_strike / step) * step
-                        call_hedge_strike = round(call_be_strike / step) * step
-                        
-                        st.info(f"Total Active Premium: **{total_premium_points:,.2f} pts**\n\n"
-                                f"Call Break-Even: {call_strike:,.0f} + {total_premium_points:,.2f} = **{call_be_strike:,.2f}**\n\n"
-                                f"Put Break-Even: {put_strike:,.0f} - {total_premium_points:,.2f} = **{put_be_strike:,.2f}**")
-                        
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.button(f"Buy {put_hedge_strike} PE (Weekly)", 
-                                      on_click=add_weekly_hedge, 
-                                      args=(active_group_id, active_instrument, selected_weekly_expiry, put_hedge_strike, "PE"),
-                                      use_container_width=True
-                            )
-                        with col2:
-                            st.button(f"Buy {call_hedge_strike} CE (Weekly)", 
-                                      on_click=add_weekly_hedge, 
-                                      args=(active_group_id, active_instrument, selected_weekly_expiry, call_hedge_strike, "CE"),
-                                      use_container_width=True
-                            )
-        
-        # --- TAB 2: Option Chain (Manual Builder) ---
-        with tab_chain:
-            st.header("Market Selector")
-            instrument_df = st.session_state.instrument_list
-            today = date.today()
-            
-            sc1, sc2 = st.columns(2)
-            with sc1:
-                selected_instrument_for_chain = st.selectbox(
-                    "Select Instrument (for Chain)", 
-                    ["NIFTY", "BANKNIFTY", "FINNIFTY"],
-                    key="selected_instrument_chain",
-                )
-            
-            instrument_options = pd.DataFrame()
-            if instrument_df is not None:
-                instrument_options = instrument_df[
-                    (instrument_df['name'] == selected_instrument_for_chain) & 
-                    (instrument_df['instrumenttype'] == 'OPTIDX') &
-                    (instrument_df['expiry'] >= today)
-                ]
-            
-            if instrument_options.empty:
-                st.warning(f"No active options found for {selected_instrument_for_chain}.")
-            else:
-                with sc2:
-                    unique_expiries = sorted(instrument_options['expiry'].unique())
-                    selected_expiry_for_chain = st.selectbox(
-                        "Select Expiry Date",
-                        options=unique_expiries,
-                        key="selected_expiry_chain"
-                    )
-                
-                chain_df = instrument_options[
-                    instrument_options['expiry'] == selected_expiry_for_chain
-                ].copy() 
-                
-                chain_df['lotsize'] = chain_df['name'].map({k: v['lot_size'] for k, v in INDEX_MAP.items()})
-
-                calls_df = chain_df[chain_df['symbol'].str.endswith('CE')][['strike', 'symbol', 'token', 'exch_seg', 'lotsize']]
-                puts_df = chain_df[chain_df['symbol'].str.endswith('PE')][['strike', 'symbol', 'token', 'exch_seg', 'lotsize']]
-                
-                full_chain = pd.merge(
-                    calls_df, 
-                    puts_df, 
-                    on='strike', 
-                    suffixes=('_CE', '_PE')
-                ).sort_values(by='strike').reset_index(drop=True)
-                
-                full_chain['lotsize_CE'] = full_chain['lotsize_CE'].fillna(full_chain['lotsize_PE'])
-                full_chain['lotsize_PE'] = full_chain['lotsize_PE'].fillna(full_chain['lotsize_CE'])
-                
-                st.session_state.current_chain = full_chain
-            
-            st.markdown("---")
-
-            if active_group.get('status') == 'closed':
-                st.warning(f"This strategy '{active_group['name']}' is closed. You cannot add new legs. Please create a new strategy.")
-            
-            if active_group['instrument'] != selected_instrument_for_chain:
-                st.warning(f"This chain is for {selected_instrument_for_chain}, but your active strategy '{active_group['name']}' is for {active_group['instrument']}. New legs will be added to '{active_group['name']}'.", icon="ℹ️")
-            
-            st.header(f"Manual Leg Builder: {selected_instrument_for_chain} ({selected_expiry_for_chain})")
-
-            chain_spot_price = st.session_state.all_index_prices.get(selected_instrument_for_chain, 0.0)
-            chain_atm_strike = 0.0
-            
-            if chain_spot_price > 0:
-                step = INDEX_MAP[selected_instrument_for_chain]["step"]
-                chain_atm_strike = round(chain_spot_price / step) * step
-                st.info(f"**Live Spot ({selected_instrument_for_chain}):** {chain_spot_price:,.2f} | **Nearest ATM Strike:** {chain_atm_strike:,.0f}")
-            else:
-                st.info("Fetching spot price... (Click 'Refresh' in sidebar if needed)")
-                if st.button("Fetch Spot Price"):
-                    refresh_all_index_prices()
-
-            
-            st.markdown("---")
-            filtered_chain_df = st.session_state.current_chain
-            
-            if not filtered_chain_df.empty:
-                f1, f2 = st.columns([1, 3])
-                with f1:
-                    show_atm_only = st.checkbox(f"Show Near ATM (±{10 * INDEX_MAP[selected_instrument_for_chain]['step']} pts)", value=True)
-                with f2:
-                    all_strikes = filtered_chain_df['strike'].tolist()
-                    min_strike, max_strike = all_strikes[0], all_strikes[-1]
-                    if len(all_strikes) > 1:
-                        strike_range = st.select_slider("Filter Strike Range", options=all_strikes, value=(min_strike, max_strike))
-                    else:
-                        strike_range = (min_strike, max_strike)
-                
-                filtered_chain_df = filtered_chain_df[
-                    (filtered_chain_df['strike'] >= strike_range[0]) & 
-                    (filtered_chain_df['strike'] <= strike_range[1])
-                ]
-                
-                if show_atm_only and chain_atm_strike > 0:
-                    atm_range = 10 * INDEX_MAP[selected_instrument_for_chain]["step"]
-                    filtered_chain_df = filtered_chain_df[
-                        (filtered_chain_df['strike'] >= chain_atm_strike - atm_range) & 
-                        (filtered_chain_df['strike'] <= chain_atm_strike + atm_range) 
-                    ]
-            st.markdown("---")
-            
-            chain_container = st.container(height=600)
-            
-            with chain_container:
-                c1, c2, c3, c4, c5, c6, c7 = st.columns([1, 1, 2, 1, 2, 1, 1])
-                c1.markdown("**Sell CALL**"); c2.markdown("**Buy CALL**"); c3.markdown("**CALL Symbol**"); c4.markdown("**Strike**"); c5.markdown("**PUT Symbol**"); c6.markdown("**Buy PUT**"); c7.markdown("**Sell PUT**")
-                
-                is_disabled = (active_group.get('status') == 'closed') # Disable buttons if strategy is closed
-
-                for row in filtered_chain_df.itertuples():
-                    is_atm = (row.strike == chain_atm_strike)
-                    c1, c2, c3, c4, c5, c6, c7 = st.columns([1, 1, 2, 1, 2, 1, 1])
-                    
-                    if is_atm: c4.success(f"**{row.strike}**")
-                    else: c4.write(row.strike)
-
-                    c1.button("S", key=f"sell_ce_{row.strike}", help=f"Sell {row.symbol_CE}", on_click=add_leg_to_group, args=(active_group_id, "short", "CE", row.strike, row.symbol_CE, row.token_CE, row.exch_seg_CE, row.lotsize_CE), disabled=is_disabled)
-                    c2.button("B", key=f"buy_ce_{row.strike}", help=f"Buy {row.symbol_CE}", on_click=add_leg_to_group, args=(active_group_id, "long", "CE", row.strike, row.symbol_CE, row.token_CE, row.exch_seg_CE, row.lotsize_CE), disabled=is_disabled)
-                    c3.write(row.symbol_CE)
-                    c5.write(row.symbol_PE)
-                    c6.button("B", key=f"buy_pe_{row.strike}", help=f"Buy {row.symbol_PE}", on_click=add_leg_to_group, args=(active_group_id, "long", "PE", row.strike, row.symbol_PE, row.token_PE, row.exch_seg_PE, row.lotsize_PE), disabled=is_disabled)
-                    c7.button("S", key=f"sell_pe_{row.strike}", help=f"Sell {row.symbol_PE}", on_click=add_leg_to_group, args=(active_group_id, "short", "PE", row.strike, row.symbol_PE, row.token_PE, row.exch_seg_PE, row.lotsize_PE), disabled=is_disabled)
-
-        # --- TAB 3: Trade History ---
-        with tab_history:
-            st.header("📓 Trade History Log")
-            st.info("This shows the most recent actions at the top.")
-            
-            # --- MODIFIED Button ---
-            if st.button("Clear History", on_click=clear_trade_history):
-                pass # Logic is now in the callback function
-            
-            if not st.session_state.trade_history:
-                st.warning("No trade actions have been recorded yet.")
-            else:
-                log_container = st.container(height=500)
-                log_text = "\n\n".join([f"- {entry}" for entry in st.session_state.trade_history])
-                log_container.markdown(log_text)
-
-else:
-    # --- LOGGED OUT STATE ---
-    st.warning("Please log in to connect to Angel One and start the app.")
-    if st.button("Login to Angel One"):
-        with st.spinner("Logging in, please wait..."):
-            login_to_angel()
-
-# --- NEW: Auto-Refresh Logic ---
-if st.session_state.get("auto_refresh", False) and st.session_state.get("active_group_id") is not None:
-    if st.session_state.get('active_group_id') in st.session_state.get('strategy_groups', {}):
-        active_group = st.session_state.strategy_groups[st.session_state.active_group_id]
-        if active_group.get('status') == 'active':
-            time.sleep(15)
-            refresh_all_prices(st.session_state.active_group_id)
-            st.rerun()
\ No newline at end of file
+import time # For Auto-Refresh
+app_run_started = time.perf_counter() # Full-app render time (see record_render_time) and startup timeline
+import streamlit as st
+import pandas as pd
+from datetime import date, datetime, timedelta
+import uuid # To create unique IDs for legs and groups
+import io # For Excel export
+import hashlib # Content hash for the cached Excel export
+from concurrent.futures import ThreadPoolExecutor # Concurrent login steps
+from profiler import PROFILER, Timeline # Hot-path timers (see the Diagnostics tab)
+from broker_metrics import BROKER_METRICS, start_metrics_server
+from broker_resilience import CircuitBreaker, CircuitOpenError, harden
+import json # <-- ADDED
+import os   # <-- ADDED
+import copy
+import atexit # Flushes the MTM minute still being filled at shutdown
+from sqlite_store import SQLiteStore, leg_realised_pnl, migrate_json
+from shared_state import JsonBackend, SQLiteBackend, SharedState, group_fingerprint, index_groups
+import trade_history as history
+from firefight_rules import INDEX_MAP, calculate_group_stats, firefight_signal, process_group_legs # Shared with backtest.py
+# Imported lazily where they are used, to keep cold start fast:
+#   pyotp, SmartApi (login_to_angel), requests (fetch_instrument_list),
+#   bulk_export / pyarrow (run_bulk_export), openpyxl (create_excel_export),
+#   tick_recorder, bar_aggregator, mtm_history and margin (their cache_resource getters),
+#   portfolio (render_portfolio)
+app_imports_done = time.perf_counter()
+
+# --- App Config ---
+st.set_page_config(
+    page_title="Pro Options Dashboard",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
+# --- Static map for index tokens: INDEX_MAP now lives in firefight_rules.py (shared with backtest.py) ---
+
+# --- Data Persistence Functions ---
+# MOVED THIS ENTIRE BLOCK UP
+DATA_FILE = "strategy_data.json"
+# Storage backend: "json" (default, single file) or "sqlite" (see sqlite_store.py)
+STORAGE_BACKEND = os.environ.get("STRATEGY_STORAGE_BACKEND", "json").lower()
+SQLITE_DB_FILE = os.environ.get("STRATEGY_SQLITE_DB", "strategy_data.db")
+# Lazy mode: closed strategies start as summaries and are only fully loaded when opened/exported
+LAZY_LOAD_CLOSED = os.environ.get("STRATEGY_LAZY_LOAD_CLOSED", "1") != "0"
+# Trade history records kept in memory (older ones roll off; SQLite keeps them archived)
+TRADE_HISTORY_LIMIT = 5000
+# Saves issued within this window (e.g. the 3 saves of one firefight click) become a single write
+PERSIST_DEBOUNCE_SECONDS = 0.25
+# Where the analytics dump (every leg + history, partitioned by month/instrument) is written
+BULK_EXPORT_DIR = os.environ.get("STRATEGY_EXPORT_DIR", "exports")
+# Hidden Diagnostics tab (profiler percentiles): set STRATEGY_DIAGNOSTICS=1 or open the app with ?diagnostics=1
+DIAGNOSTICS_ENABLED = os.environ.get("STRATEGY_DIAGNOSTICS", "0") == "1"
+# Local broker-metrics endpoint (http://127.0.0.1:<port>/metrics and /metrics.json), off unless a port is set
+BROKER_METRICS_PORT = int(os.environ.get("STRATEGY_METRICS_PORT", "0"))
+# Broker session tokens are cached here (owner-only file) so a restart skips the TOTP login; "" disables it
+TOKEN_CACHE_FILE = os.environ.get("STRATEGY_TOKEN_CACHE",
+                                  os.path.join(os.path.expanduser("~"), ".cache", "option_selling", "angel_session.json"))
+# STRATEGY_AUTO_RESUME=1 logs every new visitor in from that cache without the Login click; only for a private server
+SESSION_AUTO_RESUME = os.environ.get("STRATEGY_AUTO_RESUME", "0") == "1"
+# Tick recording, off by default: set STRATEGY_TICK_DIR (e.g. "ticks") to append every fetched LTP to a daily
+# memory-mapped ring log there (see tick_recorder.py). Each day's file has room for STRATEGY_TICK_CAPACITY ticks
+# at 64 bytes each (sparse, so only what is written takes disk space); the oldest are overwritten past that.
+TICK_LOG_DIR = os.environ.get("STRATEGY_TICK_DIR", "")
+TICK_LOG_CAPACITY = int(os.environ.get("STRATEGY_TICK_CAPACITY", "0")) # Ticks per day; 0 = tick_recorder's default
+# Offline replay (see market_data.py): a tick-log directory or candle CSV enables a no-broker session.
+# Replay runs at STRATEGY_REPLAY_SPEED x real time, or advances STRATEGY_REPLAY_STEP seconds per refresh (deterministic).
+REPLAY_SOURCE = os.environ.get("STRATEGY_REPLAY_SOURCE", "")
+REPLAY_SPEED = float(os.environ.get("STRATEGY_REPLAY_SPEED", "1"))
+REPLAY_STEP_SECONDS = float(os.environ.get("STRATEGY_REPLAY_STEP", "0")) or None
+REPLAY_START = os.environ.get("STRATEGY_REPLAY_START", "") # ISO datetime; default = start of the recording
+# Per-group intraday MTM path: raw samples in memory, per-minute min/max/last buckets here; "" = memory only
+MTM_HISTORY_DIR = os.environ.get("STRATEGY_MTM_DIR", "mtm")
+# Annualized vol used by the local SPAN-style margin estimate of groups and firefight actions (see margin.py)
+MARGIN_VOL = float(os.environ.get("STRATEGY_MARGIN_IV", "0.14"))
+# Broker API root; point it (and STRATEGY_SCRIP_MASTER) at mock_angel.py for local load/latency testing
+BROKER_ROOT = os.environ.get("STRATEGY_BROKER_ROOT") or None # None = SmartConnect's default (Angel One)
+# Scrip master: Angel One's URL, or a local copy of the same JSON (needed for the option chain offline)
+SCRIP_MASTER_SOURCE = os.environ.get("STRATEGY_SCRIP_MASTER",
+                                     "https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json")
+
+@st.cache_resource
+def get_metrics_server(port):
+    """Starts the broker-metrics HTTP endpoint once per server process."""
+    try:
+        return start_metrics_server(BROKER_METRICS, port=port)
+    except OSError as e: # e.g. another app process already owns the port
+        print(f"Broker metrics endpoint not started on port {port}: {e}")
+        return None
+
+if BROKER_METRICS_PORT:
+    get_metrics_server(BROKER_METRICS_PORT)
+
+@st.cache_resource
+def get_broker_breaker():
+    """One circuit breaker per server process: every tab polls the same account (and rate limit)."""
+    return CircuitBreaker(failure_threshold=5, reset_timeout=30.0)
+
+def harden_broker_client(api):
+    """Metrics on every attempt, then retry/backoff and the shared circuit breaker around them."""
+    return harden(BROKER_METRICS.instrument(api), get_broker_breaker(), on_retry=BROKER_METRICS.record_retry)
+
+@st.cache_resource
+def get_tick_recorder():
+    """One tick log writer per server process (None when disabled)."""
+    if not TICK_LOG_DIR:
+        return None
+    from tick_recorder import TickRecorder, DEFAULT_CAPACITY
+    return TickRecorder(TICK_LOG_DIR, capacity=TICK_LOG_CAPACITY or DEFAULT_CAPACITY)
+
+def record_ticks(recorder, fetched):
+    """Appends getMarketData items to the tick log. Never lets a disk problem break a price refresh."""
+    if recorder is None:
+        return
+    try:
+        recorder.record(fetched)
+    except Exception as e:
+        print(f"Tick recorder error: {e}")
+
+@st.cache_resource
+def get_replay_tape(source):
+    """The replay source, loaded once per server process and shared by every replay session."""
+    from market_data import ReplayTape
+    return ReplayTape.load(source)
+
+@st.cache_resource
+def get_bar_aggregator():
+    """Live 1m/5m OHLC bars of every polled token, shared by all sessions of this server process."""
+    from bar_aggregator import BarAggregator
+    return BarAggregator()
+
+def bars_for(provider):
+    """Replay sessions build their own bars on the replay clock; live prices go to the shared ones."""
+    if provider is st.session_state.api_object:
+        return get_bar_aggregator()
+    if "replay_bars" not in st.session_state:
+        from bar_aggregator import BarAggregator
+        st.session_state.replay_bars = BarAggregator()
+    return st.session_state.replay_bars
+
+@st.cache_resource
+def get_mtm_history():
+    """Intraday MTM samples of every group, shared by all sessions of this server process."""
+    from mtm_history import MtmHistory
+    mtm = MtmHistory(MTM_HISTORY_DIR)
+    atexit.register(mtm.flush) # Otherwise the open minute is lost on restart
+    return mtm
+
+def mtm_history_for(provider):
+    """Replayed P&L paths stay in the replay session (and off disk), like replayed bars."""
+    if provider is st.session_state.api_object:
+        return get_mtm_history()
+    if "replay_mtm" not in st.session_state:
+        from mtm_history import MtmHistory
+        st.session_state.replay_mtm = MtmHistory()
+    return st.session_state.replay_mtm
+
+def market_time_ns(provider):
+    """The time prices fetched from `provider` right now belong to (the replay clock when replaying)."""
+    return provider.now_ns() if hasattr(provider, "now_ns") else time.time_ns()
+
+def market_data_provider():
+    """Where prices come from: this session's replay provider when offline, else the broker client."""
+    return st.session_state.get("market_data") or st.session_state.api_object
+
+def tick_recorder_for(provider):
+    """Only live prices are recorded (replaying the tick log into itself would duplicate it)."""
+    return get_tick_recorder() if provider is st.session_state.api_object else None
+
+@st.cache_resource
+def get_sqlite_store(db_path):
+    """One shared SQLite connection per server process (imports DATA_FILE on first use)."""
+    store = SQLiteStore(db_path)
+    if store.is_empty() and os.path.exists(DATA_FILE):
+        n_groups, n_history = migrate_json(DATA_FILE, store)
+        print(f"Migrated {n_groups} groups and {n_history} history entries from {DATA_FILE} to {db_path}")
+    return store
+
+def restore_leg_dates(groups):
+    """Converts leg expiry strings (as stored on disk) back to date objects."""
+    for group_id, group in groups.items():
+        for leg in group.get('legs', []):
+            if 'expiry' in leg and isinstance(leg['expiry'], str):
+                try:
+                    # Try parsing as date first
+                    leg['expiry'] = date.fromisoformat(leg['expiry'])
+                except (ValueError, TypeError):
+                    try:
+                        # Try parsing as full timestamp (from older pandas versions)
+                        leg['expiry'] = pd.to_datetime(leg['expiry']).date()
+                    except:
+                        pass # Keep it as string if all conversion fails
+
+def json_default_converter(o):
+    """json.dump fallback for non-serializable types like datetime.date"""
+    if isinstance(o, (date, pd.Timestamp)): # Handle date and pandas timestamp
+        return o.isoformat()
+
+@st.cache_resource
+def get_shared_state(backend, path):
+    """Canonical groups/history shared by all sessions of this server, with its write-behind worker."""
+    if backend == "sqlite":
+        storage = SQLiteBackend(get_sqlite_store(path), load_kwargs={
+            "lazy_closed": LAZY_LOAD_CLOSED,
+            "default_lot_sizes": {k: v['lot_size'] for k, v in INDEX_MAP.items()},
+            "history_limit": TRADE_HISTORY_LIMIT,
+        })
+    else:
+        storage = JsonBackend(path, dump_default=json_default_converter)
+    return SharedState(storage, history_limit=TRADE_HISTORY_LIMIT, debounce=PERSIST_DEBOUNCE_SECONDS)
+
+def get_active_shared_state():
+    return get_shared_state(STORAGE_BACKEND, SQLITE_DB_FILE if STORAGE_BACKEND == "sqlite" else DATA_FILE)
+
+@PROFILER.timed()
+def save_data():
+    """Commits this session's changes to the shared state (merged with other sessions, written in the background)."""
+    try:
+        trade_log = st.session_state.trade_history
+        version, clean = get_active_shared_state().commit(
+            st.session_state.data_version,
+            st.session_state.data_base_index,
+            st.session_state.strategy_groups,
+            trade_log.records_since(st.session_state.data_history_head)
+        )
+        st.session_state.data_history_head = trade_log.newest_id()
+        if clean:
+            # Nobody else committed in between, so our view *is* the new version
+            st.session_state.data_version = version
+            st.session_state.data_base_index = index_groups(st.session_state.strategy_groups)
+        # Otherwise keep the old base; the next rerun re-syncs and picks up the merged result
+    except Exception as e:
+        print(f"Error saving data: {e}") # You can see this in your terminal
+        # st.toast(f"Error saving data: {e}", icon="🚨") # Optional: show error in UI
+
+# --- Lazy loading of closed strategies ---
+def is_group_summary(group):
+    """True for a closed strategy that has not been fully loaded yet."""
+    return "lazy_summary" in group
+
+def summarize_group(group):
+    """Lightweight stand-in for a closed group: header fields, leg count and realised P&L only."""
+    default_lot_size = INDEX_MAP.get(group.get('instrument'), {}).get('lot_size', 25)
+    realised_pnl = 0.0
+    for leg in group.get('legs', []):
+        if leg.get('status') == 'closed':
+            realised_pnl += leg_realised_pnl(leg.get('side'), leg.get('entry_premium', 0), leg.get('exit_price', 0),
+                                             leg.get('lots', 1), leg.get('lot_size', default_lot_size))
+    summary = {k: v for k, v in group.items() if k != 'legs'}
+    summary['lazy_summary'] = {"leg_count": len(group.get('legs', [])), "realised_pnl": realised_pnl}
+    return summary
+
+def group_leg_count(group):
+    if is_group_summary(group):
+        return group['lazy_summary']['leg_count']
+    return len(group['legs'])
+
+def ensure_group_loaded(group_id):
+    """Replaces a closed-strategy summary with the full group (legs, dates). Returns the group."""
+    group = st.session_state.strategy_groups.get(group_id)
+    if group is None or not is_group_summary(group):
+        return group
+
+    shared_group = get_active_shared_state().get_group(group_id)
+    if shared_group is not None and not is_group_summary(shared_group):
+        full = copy.deepcopy(shared_group)
+    elif STORAGE_BACKEND == "sqlite":
+        full = get_sqlite_store(SQLITE_DB_FILE).load_groups(group_ids=[group_id]).get(group_id)
+    else:
+        full = None
+    if full is None:
+        st.error(f"Could not load strategy '{group.get('name', group_id)}'.")
+        return group
+
+    restore_leg_dates({group_id: full})
+    st.session_state.strategy_groups[group_id] = full
+    # Loading is not an edit: record it in the base so the next save doesn't rewrite it
+    st.session_state.data_base_index[group_id] = group_fingerprint(full)
+    return full
+
+def ensure_groups_loaded(group_ids):
+    for group_id in group_ids:
+        ensure_group_loaded(group_id)
+
+def load_data():
+    """Loads (or re-syncs) session_state from the shared state."""
+    old_groups = st.session_state.get('strategy_groups', {})
+    try:
+        shared = get_active_shared_state()
+        shared.poll(force=True)
+        version, shared_groups, shared_history, shared_index = shared.snapshot()
+    except Exception as e:
+        print(f"Error loading data: {e}")
+        # If file is corrupt, initialize fresh
+        st.session_state.strategy_groups = {}
+        st.session_state.trade_history = history.TradeHistory(max_records=TRADE_HISTORY_LIMIT)
+        st.session_state.data_version = None
+        st.session_state.data_base_index = {}
+        st.session_state.data_history_head = None
+        return
+
+    loaded_groups = {}
+    for group_id, group in shared_groups.items():
+        if is_group_summary(group):
+            loaded_groups[group_id] = group # Read-only summary (SQLite lazy mode)
+        elif LAZY_LOAD_CLOSED and group.get('status') == 'closed' and not (
+                group_id in old_groups and not is_group_summary(old_groups[group_id])):
+            loaded_groups[group_id] = summarize_group(group)
+        else:
+            # The session gets its own copy; the shared dicts are never mutated
+            loaded_groups[group_id] = copy.deepcopy(group)
+
+    # --- FIX for JSON date strings ---
+    # We must convert date strings back to date objects
+    restore_leg_dates({gid: g for gid, g in loaded_groups.items() if not is_group_summary(g)})
+
+    # Live prices are per session and never saved; carry them over when re-syncing
+    for group_id, group in loaded_groups.items():
+        old_group = old_groups.get(group_id)
+        if old_group is None or is_group_summary(group) or is_group_summary(old_group):
+            continue
+        old_ltps = {leg['id']: leg.get('current_ltp') for leg in old_group.get('legs', [])}
+        for leg in group['legs']:
+            if leg.get('status') == 'active' and old_ltps.get(leg['id']) is not None:
+                leg['current_ltp'] = old_ltps[leg['id']]
+
+    st.session_state.strategy_groups = loaded_groups
+    st.session_state.trade_history = history.TradeHistory(reversed(shared_history), max_records=TRADE_HISTORY_LIMIT)
+    st.session_state.data_version = version
+    # Summaries are in the base too (with whatever fingerprint the shared copy has), so deleting one is seen as a change
+    st.session_state.data_base_index = {gid: shared_index.get(gid) for gid in loaded_groups}
+    st.session_state.data_history_head = st.session_state.trade_history.newest_id()
+    
+    # Set active_group_id to the first active group, if any
+    if st.session_state.get('active_group_id') not in loaded_groups:
+        st.session_state.active_group_id = None
+    if not st.session_state.active_group_id:
+        active_groups = [gid for gid, g in loaded_groups.items() if g.get('status', 'active') == 'active']
+        if active_groups:
+            st.session_state.active_group_id = active_groups[0]
+
+def sync_shared_state():
+    """Re-syncs this session only when another session or process changed the data."""
+    try:
+        shared = get_active_shared_state()
+        if shared.poll() != st.session_state.get('data_version'):
+            load_data()
+    except Exception as e:
+        print(f"Error syncing data: {e}")
+# --- END of Data Persistence Functions ---
+
+
+# --- Session State Initialization ---
+if "api_object" not in st.session_state:
+    st.session_state.api_object = None
+if "access_token" not in st.session_state:
+    st.session_state.access_token = None
+if "user_profile" not in st.session_state:
+    st.session_state.user_profile = None
+if "instrument_list" not in st.session_state:
+    st.session_state.instrument_list = None
+if "feed_token" not in st.session_state:
+    st.session_state.feed_token = None
+# --- REPLACED old "strategy_groups" and "trade_history" init ---
+if "active_group_id" not in st.session_state:
+    st.session_state.active_group_id = None
+if "current_spot_price" not in st.session_state:
+    st.session_state.current_spot_price = 0.0
+if "price_times" not in st.session_state:
+    st.session_state.price_times = {} # Token -> time.time() of its last fetched LTP (staleness display)
+if "current_chain" not in st.session_state:
+    st.session_state.current_chain = pd.DataFrame()
+if "atm_strike" not in st.session_state:
+    st.session_state.atm_strike = 0.0
+if "all_index_prices" not in st.session_state:
+    st.session_state.all_index_prices = {
+        "NIFTY": 0.0,
+        "BANKNIFTY": 0.0,
+        "FINNIFTY": 0.0
+    }
+# --- Startup Timeline (cold start -> login -> first usable dashboard) ---
+if "startup_timeline" not in st.session_state:
+    st.session_state.startup_timeline = Timeline(app_run_started)
+    st.session_state.startup_timeline.add("imports", app_run_started, app_imports_done)
+
+# --- Load Data on First Run ---
+if "data_loaded" not in st.session_state:
+    # This function is defined below
+    with st.session_state.startup_timeline.step("load_data"):
+        load_data() 
+    st.session_state.data_loaded = True # Flag to prevent re-loading
+else:
+    sync_shared_state() # Cheap version check; reloads only if another tab/process saved
+
+if "auto_refresh" not in st.session_state:
+    st.session_state.auto_refresh = False
+if "render_timings" not in st.session_state:
+    st.session_state.render_timings = {} # Section -> full/partial run counts and times
+if "fragment_runs" not in st.session_state:
+    st.session_state.fragment_runs = {} # Fragment key -> app run it last rendered in
+st.session_state.app_run_count = st.session_state.get("app_run_count", 0) + 1
+
+
+# --- Static map for index tokens ---
+# MOVED UP (needed by load_data for closed-strategy summaries)
+
+# --- Data Persistence Functions ---
+# THIS BLOCK WAS MOVED UP
+# DATA_FILE = "strategy_data.json"
+# ...
+# ... (all the way down to)
+# ...
+# --- END of Data Persistence Functions ---
+
+
+# --- Angel One Credentials (Loaded Securely) ---
+try:
+    API_KEY = st.secrets["angelone"]["api_key"]
+    CLIENT_ID = st.secrets["angelone"]["client_id"]
+    PIN = st.secrets["angelone"]["pin"]
+    TOTP_SECRET = st.secrets["angelone"]["totp_secret"]
+except KeyError:
+    st.error("ERROR: Angel One credentials not found in st.secrets. Please check your .streamlit/secrets.toml file.")
+    st.stop()
+
+# --- Helper Functions (App Logic) ---
+
+@PROFILER.timed("fetch_instrument_list") # Outside the cache, so cache hits are timed too
+@st.cache_data(ttl=3600) # Cache the instrument list for 1 hour
+def fetch_instrument_list():
+    """
+    Downloads the master list of all tradable instruments from Angel One.
+    """
+    from broker_session import http_session # Pooled keep-alive session, shared with the broker client
+    st.write("Downloading master instrument list...")
+    url = SCRIP_MASTER_SOURCE
+    try:
+        if os.path.exists(url): # Local copy (offline / replay sessions)
+            with open(url, "r") as f:
+                instrument_data = json.load(f)
+        else:
+            response = http_session().get(url, timeout=60)
+            response.raise_for_status() # Raise error for bad response
+            instrument_data = response.json()
+        df = pd.DataFrame(instrument_data)
+        
+        # Clean up the dataframe for easier use
+        df['expiry'] = pd.to_datetime(df['expiry']).dt.date
+        df['strike'] = pd.to_numeric(df['strike'], errors='coerce') 
+        df['strike'] = df['strike'] / 100.0 
+        # Set lotsize based on name
+        df['lotsize'] = df['name'].map({k: v['lot_size'] for k, v in INDEX_MAP.items()})
+
+        
+        return df
+    except Exception as e:
+        st.error(f"Failed to download instrument list: {e}")
+        return None
+
+def fetch_index_prices(api, recorder=None, bars=None):
+    """
+    Fetches LTP for all spot indices defined in INDEX_MAP. No st.* calls, so it can run
+    off the script thread (see login_to_angel). Returns ({index: ltp}, error message or None).
+    """
+    tokens_by_exchange = {}
+    for key, details in INDEX_MAP.items():
+        exchange = details["exchange"]
+        token = details["token"]
+        if exchange not in tokens_by_exchange:
+            tokens_by_exchange[exchange] = []
+        tokens_by_exchange[exchange].append(token)
+    
+    # Make API Call
+    fetched_ns = market_time_ns(api)
+    market_data = api.getMarketData("FULL", tokens_by_exchange)
+
+    if not (market_data['status'] and market_data['data']):
+        return {}, market_data.get('message', 'Unknown error')
+    record_ticks(recorder, market_data['data'].get('fetched', []))
+    if bars is not None:
+        bars.ingest(market_data['data'].get('fetched', []), fetched_ns)
+
+    prices = {}
+    for item in market_data['data'].get('fetched', []):
+        token = item.get('symbolToken')
+        ltp = item.get('ltp')
+        if ltp is None:
+            continue
+        
+        # Find which index this token belongs to
+        for index_name, details in INDEX_MAP.items():
+            if details['token'] == token:
+                prices[index_name] = ltp
+                break
+    return prices, None
+
+def apply_index_prices(prices, error):
+    """Stores the result of fetch_index_prices in the session."""
+    if error:
+        st.warning(f"Could not fetch index data: {error}")
+        return
+    new_prices = st.session_state.all_index_prices.copy()
+    new_prices.update(prices)
+    st.session_state.all_index_prices = new_prices
+    now = time.time()
+    for index_name in prices:
+        st.session_state.price_times[INDEX_MAP[index_name]['token']] = now
+
+@PROFILER.timed()
+def refresh_all_index_prices():
+    """
+    Fetches LTP for all spot indices defined in INDEX_MAP.
+    """
+    st.write("Refreshing all index prices for monitor...")
+    try:
+        provider = market_data_provider()
+        if provider is None:
+            st.warning("Please log in first.")
+            return
+        apply_index_prices(*fetch_index_prices(provider, tick_recorder_for(provider), bars_for(provider)))
+
+    except CircuitOpenError as e:
+        st.info(f"Index prices not refreshed: {e}")
+    except Exception as e:
+        st.error(f"Error refreshing index prices: {e}")
+
+
+def timed_step(timeline, label, func, *args):
+    """Runs func(*args) as one step of the startup timeline (safe on a worker thread)."""
+    with timeline.step(label):
+        return func(*args)
+
+def fetch_profile(api, refresh_token):
+    """getProfile, or None when it fails (e.g. a cached token the broker no longer accepts)."""
+    try:
+        profile = api.getProfile(refresh_token)
+    except Exception as e:
+        print(f"getProfile failed: {e}")
+        return None
+    return profile if profile and profile.get('status') and profile.get('data') else None
+
+def login_to_angel():
+    """
+    Handles the complete Angel One login process using credentials and TOTP.
+    A still-valid cached session (see broker_session) skips the TOTP login entirely.
+    After that, the independent steps run concurrently: profile and index prices on
+    worker threads (pure broker calls), the instrument master download and load_data
+    on the script thread (they use st.* and the cache).
+    """
+    timeline = st.session_state.startup_timeline
+    timeline.mark("login clicked")
+    try:
+        with timeline.step("login: import SmartApi"):
+            from broker_session import BrokerSession, TokenCache
+            broker = BrokerSession(API_KEY, CLIENT_ID, PIN, TOTP_SECRET,
+                                   cache=TokenCache(TOKEN_CACHE_FILE) if TOKEN_CACHE_FILE else None, root=BROKER_ROOT,
+                                   wrap=harden_broker_client) # Metrics, retries, circuit breaker
+        api = broker.api
+        st.session_state.api_object = api
+        st.session_state.broker_session = broker
+        
+        with timeline.step("login: restore cached session"):
+            session_data = broker.restore()
+        if session_data is None:
+            with timeline.step("login: generateSession"):
+                session_data = broker.login()
+        
+        if session_data['status'] and session_data['data']:
+            # generateSession already fetched the profile (it calls getProfile itself and
+            # returns that response), so only ask again if it came back without a name
+            # (always the case for a restored session)
+            profile = {**session_data, "data": {k: v for k, v in session_data['data'].items()
+                                                if k not in ("jwtToken", "refreshToken", "feedToken")}}
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix="login") as pool:
+                profile_future = None
+                if not profile['data'].get('name'):
+                    profile_future = pool.submit(timed_step, timeline, "login: getProfile",
+                                                 fetch_profile, api, broker.refresh_token)
+                index_future = pool.submit(timed_step, timeline, "login: index prices", fetch_index_prices, api, get_tick_recorder(), get_bar_aggregator())
+
+                with timeline.step("login: instrument master"):
+                    st.session_state.instrument_list = fetch_instrument_list()
+                
+                # --- Load data on login ---
+                # This ensures that if the user logs in *after* app start,
+                # their data is still loaded. The 'data_loaded' flag prevents
+                # this from overwriting memory if already logged in.
+                if "data_loaded" not in st.session_state:
+                    with timeline.step("login: load_data"):
+                        load_data()
+                    st.session_state.data_loaded = True
+
+                if profile_future:
+                    profile = profile_future.result()
+                try:
+                    index_result = index_future.result()
+                except Exception as e:
+                    index_result = None
+                    index_error = e
+
+            if profile is None and broker.restored:
+                # The cached token was revoked (e.g. a login elsewhere): fall back to TOTP
+                broker.invalidate()
+                with timeline.step("login: generateSession"):
+                    session_data = broker.login()
+                if not (session_data['status'] and session_data['data']):
+                    st.error(f"Login Failed: {session_data['message']}")
+                    return
+                profile = {**session_data, "data": {k: v for k, v in session_data['data'].items()
+                                                    if k not in ("jwtToken", "refreshToken", "feedToken")}}
+                index_result = fetch_index_prices(api, get_tick_recorder(), get_bar_aggregator())
+            if profile is None:
+                st.error("Login Failed: could not fetch the user profile.")
+                return
+
+            st.session_state.access_token = f"Bearer {broker.jwt_token}"
+            st.session_state.feed_token = broker.feed_token
+            st.session_state.user_profile = profile
+            if index_result is not None:
+                apply_index_prices(*index_result)
+            else:
+                st.error(f"Error refreshing index prices: {index_error}")
+
+            timeline.mark("login done")
+            st.success("Login Successful!" + (" (reused cached session)" if broker.restored else ""))
+            st.rerun() # --- FIX: Force a rerun on successful login ---
+        else:
+            st.error(f"Login Failed: {session_data['message']}")
+
+    except Exception as e:
+        st.error(f"An error occurred during login: {e}")
+
+def start_replay_session():
+    """Offline session: prices come from the replay source, no broker login or network needed."""
+    from market_data import ReplayProvider
+    try:
+        tape = get_replay_tape(REPLAY_SOURCE)
+    except Exception as e:
+        st.error(f"Could not load replay source {REPLAY_SOURCE}: {e}")
+        return
+    start = datetime.fromisoformat(REPLAY_START) if REPLAY_START else None
+    st.session_state.market_data = ReplayProvider(tape, speed=REPLAY_SPEED, start=start, step_seconds=REPLAY_STEP_SECONDS)
+    st.session_state.access_token = "replay"
+    st.session_state.user_profile = {'data': {'name': 'Offline Replay'}}
+    st.session_state.instrument_list = fetch_instrument_list()
+    if "data_loaded" not in st.session_state:
+        load_data()
+        st.session_state.data_loaded = True
+    st.session_state.pop("replay_bars", None) # A new replay starts with empty bars and P&L paths
+    st.session_state.pop("replay_mtm", None)
+    apply_index_prices(*fetch_index_prices(st.session_state.market_data, bars=bars_for(st.session_state.market_data)))
+    st.rerun()
+
+def ensure_broker_session():
+    """Renews the broker JWT shortly before it expires. Logs the session out if it can't be renewed."""
+    broker = st.session_state.get("broker_session")
+    if broker is None or not st.session_state.access_token:
+        return True
+    if not broker.ensure_fresh():
+        st.session_state.access_token = None
+        st.session_state.feed_token = None
+        st.warning("Your Angel One session expired. Please log in again.")
+        return False
+    st.session_state.access_token = f"Bearer {broker.jwt_token}"
+    st.session_state.feed_token = broker.feed_token
+    return True
+
+@PROFILER.timed()
+def refresh_all_prices(group_id):
+    """
+    Fetches LTP for all legs AND the active spot price in a SINGLE API call for a specific group.
+    """
+    if group_id not in st.session_state.strategy_groups:
+        st.error("Strategy group not found for refresh.")
+        return
+        
+    group = st.session_state.strategy_groups[group_id]
+    st.write(f"Refreshing prices for {group['name']}...")
+    try:
+        instrument_name = group['instrument']
+        if instrument_name not in INDEX_MAP:
+            st.error(f"Invalid instrument: {instrument_name}")
+            return
+
+        spot_details = INDEX_MAP[instrument_name]
+        
+        tokens_by_exchange = {}
+
+        spot_exchange = spot_details["exchange"]
+        spot_token = spot_details["token"]
+        if spot_exchange not in tokens_by_exchange:
+            tokens_by_exchange[spot_exchange] = []
+        tokens_by_exchange[spot_exchange].append(spot_token)
+
+        active_legs_exist = False
+        for leg in group['legs']:
+            if leg['status'] == 'active': # Only fetch for active legs
+                active_legs_exist = True
+                exchange = leg['exchange']
+                token = leg['token']
+                if exchange not in tokens_by_exchange:
+                    tokens_by_exchange[exchange] = []
+                if token not in tokens_by_exchange[exchange]:
+                    tokens_by_exchange[exchange].append(token)
+        
+        if not active_legs_exist:
+             st.warning("No active legs to refresh for this strategy.")
+             pass
+
+        provider = market_data_provider()
+        fetched_ns = market_time_ns(provider)
+        market_data = provider.getMarketData("FULL", tokens_by_exchange)
+
+        if market_data['status'] and market_data['data']:
+            fetched_data = market_data['data'].get('fetched', [])
+            fetched_at = time.time()
+            record_ticks(tick_recorder_for(provider), fetched_data) # Spot + leg prices behind any decision taken now
+            bars_for(provider).ingest(fetched_data, fetched_ns) # Intraday bars for the charts
+            
+            for item in fetched_data:
+                token = item.get('symbolToken')
+                ltp = item.get('ltp')
+
+                if ltp is None:
+                    continue
+                st.session_state.price_times[token] = fetched_at
+
+                if token == spot_details['token']:
+                    st.session_state.current_spot_price = ltp
+                    step = spot_details["step"]
+                    st.session_state.atm_strike = round(ltp / step) * step
+                
+                for leg in group['legs']:
+                    if leg['status'] == 'active' and leg['token'] == token:
+                        leg['current_ltp'] = ltp
+                        break
+            record_group_mtm(mtm_history_for(provider), group_id, group, fetched_ns)
+            st.success(f"Prices updated for {group['name']}!")
+            refresh_all_index_prices()
+        else:
+            st.warning(f"Could not fetch market data: {market_data.get('message', 'Unknown error')}")
+            
+    except CircuitOpenError as e:
+        st.info(f"Showing last known prices. {e}")
+    except Exception as e:
+        st.error(f"Error refreshing prices: {e}")
+
+# getMarketData accepts at most this many tokens per request
+MARKET_DATA_BATCH = 50
+
+def token_batches(tokens_by_exchange, size=MARKET_DATA_BATCH):
+    """Splits {exchange: [tokens]} into request-sized {exchange: [tokens]} batches."""
+    flat = [(exchange, token) for exchange, tokens in tokens_by_exchange.items() for token in tokens]
+    batches = []
+    for i in range(0, len(flat), size):
+        batch = {}
+        for exchange, token in flat[i:i + size]:
+            batch.setdefault(exchange, []).append(token)
+        batches.append(batch)
+    return batches
+
+@PROFILER.timed()
+def refresh_portfolio_prices():
+    """
+    Fetches the spots and the active legs of EVERY active group in one batched getMarketData
+    (one call per 50 tokens), instead of a refresh_all_prices per group.
+    """
+    provider = market_data_provider()
+    if provider is None:
+        st.warning("Please log in first.")
+        return
+    tokens_by_exchange = {}
+    for details in INDEX_MAP.values():
+        tokens_by_exchange.setdefault(details['exchange'], []).append(details['token'])
+    active_groups = {gid: g for gid, g in st.session_state.strategy_groups.items()
+                     if g.get('status') != 'closed' and not is_group_summary(g)}
+    for group in active_groups.values():
+        for leg in group['legs']:
+            if leg['status'] == 'active' and str(leg['token']) not in tokens_by_exchange.setdefault(leg['exchange'], []):
+                tokens_by_exchange[leg['exchange']].append(str(leg['token']))
+
+    ltps = {}
+    fetched_ns = market_time_ns(provider)
+    batches = token_batches(tokens_by_exchange)
+    failure = None # A failed batch stops the refresh, but prices from earlier batches are still applied
+    for batch in batches:
+        fetched_ns = market_time_ns(provider)
+        try:
+            market_data = provider.getMarketData("FULL", batch)
+        except CircuitOpenError as e:
+            failure = f"Showing last known prices. {e}"
+            break
+        if not (market_data['status'] and market_data['data']):
+            failure = f"Could not fetch market data: {market_data.get('message', 'Unknown error')}"
+            break
+        fetched_data = market_data['data'].get('fetched', [])
+        record_ticks(tick_recorder_for(provider), fetched_data)
+        bars_for(provider).ingest(fetched_data, fetched_ns)
+        ltps.update({item['symbolToken']: item['ltp'] for item in fetched_data if item.get('ltp') is not None})
+    if not ltps:
+        st.warning(failure or "No prices returned.")
+        return
+
+    now = time.time()
+    for token in ltps:
+        st.session_state.price_times[token] = now
+    apply_index_prices({name: ltps[d['token']] for name, d in INDEX_MAP.items() if d['token'] in ltps}, None)
+    active_group = st.session_state.strategy_groups.get(st.session_state.active_group_id)
+    if active_group is not None:
+        spot_details = INDEX_MAP[active_group['instrument']]
+        if spot_details['token'] in ltps:
+            st.session_state.current_spot_price = ltps[spot_details['token']]
+            st.session_state.atm_strike = round(ltps[spot_details['token']] / spot_details['step']) * spot_details['step']
+    mtm = mtm_history_for(provider)
+    for group_id, group in active_groups.items():
+        for leg in group['legs']:
+            if leg['status'] == 'active' and str(leg['token']) in ltps:
+                leg['current_ltp'] = ltps[str(leg['token'])]
+        record_group_mtm(mtm, group_id, group, fetched_ns)
+    if failure:
+        st.warning(f"{failure} Applied the {len(ltps)} prices fetched before it.")
+    else:
+        st.success(f"Prices updated for {len(active_groups)} groups in {len(batches)} call(s).")
+
+def record_group_mtm(mtm, group_id, group, ts_ns):
+    """Samples the group's P&L and Greeks into its intraday path. Never breaks a price refresh."""
+    try:
+        mtm.record(group_id, calculate_group_stats(group, process_group_legs(group)), ts_ns)
+    except Exception as e:
+        print(f"MTM history error: {e}")
+
+# LTPs older than this are flagged as stale (two missed auto-refresh cycles)
+STALE_AFTER_SECONDS = 30
+
+def price_age(token, now=None):
+    """Seconds since `token`'s LTP was last fetched, or None if it never was (this session)."""
+    fetched_at = st.session_state.price_times.get(str(token))
+    if fetched_at is None:
+        return None
+    return (now or time.time()) - fetched_at
+
+def format_price_age(token):
+    """'as of 10:15:02 (12s ago)', with a warning sign once it is stale."""
+    age = price_age(token)
+    if age is None:
+        return "not fetched yet"
+    fetched_at = time.strftime('%H:%M:%S', time.localtime(st.session_state.price_times[str(token)]))
+    ago = f"{age:.0f}s" if age < 120 else f"{age / 60:.0f}m"
+    return f"{'⚠️ stale, ' if age > STALE_AFTER_SECONDS else ''}as of {fetched_at} ({ago} ago)"
+
+def broker_pause_notice():
+    """Caption text while the circuit breaker is holding broker calls back, else None."""
+    breaker = get_broker_breaker().snapshot()
+    if breaker['state'] == 'closed':
+        return None
+    return (f"⏸️ Broker polling paused after {breaker['consecutive_failures']} failed calls "
+            f"({breaker['last_error']}); retrying in {breaker['retry_in_s']:.0f}s. Prices shown may be stale.")
+
+
+@PROFILER.timed()
+def log_trade(action, message, group=None, leg=None, group_id=None, group_name=None, **leg_fields):
+    """Appends a structured record to the trade history (O(1), oldest records roll off)."""
+    if group is not None:
+        group_id, group_name = group.get('id'), group.get('name')
+    if leg is not None:
+        leg_fields = {"side": leg.get('side'), "type": leg.get('type'), "strike": leg.get('strike'),
+                      "price": leg.get('entry_premium'), "tag": leg.get('strategy'), "leg_id": leg.get('id'),
+                      **leg_fields}
+    st.session_state.trade_history.add(action, message, group_id=group_id, group_name=group_name, **leg_fields)
+
+def add_leg_to_group(group_id, side, opt_type, strike, symbol, token, exchange, lot_size, strategy_tag="base_trade"):
+    """Adds a new option leg."""
+    if group_id not in st.session_state.strategy_groups:
+        st.error("Strategy group not found.")
+        return
+    group = st.session_state.strategy_groups[group_id]
+    
+    new_leg = {
+        "id": str(uuid.uuid4()),
+        "side": side,
+        "type": opt_type,
+        "strike": strike,
+        "lots": 1,
+        "entry_premium": 0.0,
+        "current_ltp": 0.0,
+        "exit_price": 0.0, 
+        "status": "active", 
+        "delta": 0.5 if opt_type == 'CE' else -0.5, 
+        "theta": 5.0,
+        "strategy": strategy_tag, 
+        "symbol": symbol,
+        "token": token,
+        "exchange": exchange,
+        "lot_size": lot_size
+    }
+    
+    group['legs'].append(new_leg)
+    log_trade(history.ADD_LEG, f"ADD LEG ({group['name']}): {side.upper()} {opt_type} @ {strike} (Tag: {strategy_tag})",
+              group=group, leg=new_leg)
+    st.toast(f"Added {side} {opt_type} @ {strike}. Refresh prices when ready.")
+    save_data() # <-- ADDED
+
+
+def find_strike_row(chain_df, strike):
+    """Finds the full row of data for a specific strike in the option chain."""
+    if chain_df.empty:
+        return None
+    row = chain_df[chain_df['strike'] == strike]
+    if not row.empty:
+        return row.iloc[0]
+    else:
+        st.warning(f"Strike {strike} not found in the current option chain.")
+        return None
+
+# --- Leg Action Handlers ---
+def update_leg_details(group_id, leg_id, new_lots, new_entry, new_tag):
+    """Updates a single leg's details."""
+    if group_id not in st.session_state.strategy_groups:
+        return
+    group = st.session_state.strategy_groups[group_id]
+    
+    log_msgs = []
+    found = False
+    for leg in group['legs']:
+        if leg['id'] == leg_id:
+            found = True
+            if leg['status'] != 'active':
+                st.warning("Cannot update a closed leg.")
+                return
+
+            try:
+                new_lots = int(new_lots)
+                new_entry = float(new_entry)
+            except ValueError:
+                st.error("Lots must be an integer, Entry must be a number.")
+                return
+
+            if leg['lots'] != new_lots:
+                log_msgs.append(f"LOTS from {leg['lots']} to {new_lots}")
+                leg['lots'] = new_lots
+            if leg['entry_premium'] != new_entry:
+                log_msgs.append(f"ENTRY from {leg['entry_premium']:.2f} to {new_entry:.2f}")
+                leg['entry_premium'] = new_entry
+            if leg['strategy'] != new_tag:
+                log_msgs.append(f"TAG to '{new_tag}'")
+                leg['strategy'] = new_tag
+            
+            if log_msgs:
+                log_trade(history.UPDATE_LEG, f"UPDATE LEG ({group['name']} | {leg['strike']} {leg['type']}): {', '.join(log_msgs)}",
+                          group=group, leg=leg)
+                st.toast(f"Updated {leg['strike']} {leg['type']}")
+                save_data() # <-- ADDED
+            break
+    
+    if not found:
+        st.error("Leg not found for update.")
+
+
+def exit_leg(group_id, leg_id):
+    """Marks a single leg as 'closed'."""
+    if group_id not in st.session_state.strategy_groups:
+        return
+    group = st.session_state.strategy_groups[group_id]
+    
+    leg_to_close = None
+    for leg in group['legs']:
+        if leg['id'] == leg_id:
+            leg_to_close = leg
+            break
+    
+    if leg_to_close:
+        if leg_to_close['status'] == 'closed':
+            st.warning("Leg is already closed.")
+            return
+            
+        leg_to_close['status'] = 'closed'
+        leg_to_close['exit_price'] = leg_to_close['current_ltp'] # Lock in the exit price
+        log_trade(history.EXIT_LEG, f"EXIT LEG ({group['name']}): {leg_to_close['side'].upper()} {leg_to_close['type']} @ {leg_to_close['strike']} at {leg_to_close['exit_price']:.2f}",
+                  group=group, leg=leg_to_close, price=leg_to_close['exit_price'])
+        st.toast(f"Exited {leg_to_close['strike']} {leg_to_close['type']}")
+        save_data() # <-- ADDED
+
+
+def add_weekly_hedge(group_id, instrument, weekly_expiry, strike, opt_type):
+    """Finds and adds a weekly hedge leg."""
+    if group_id not in st.session_state.strategy_groups or st.session_state.instrument_list is None:
+        return
+    group = st.session_state.strategy_groups[group_id]
+    instrument_df = st.session_state.instrument_list
+
+    try:
+        hedge_row = instrument_df[
+            (instrument_df['name'] == instrument) &
+            (instrument_df['expiry'] == weekly_expiry) &
+            (instrument_df['strike'] == strike) &
+            (instrument_df['symbol'].str.endswith(opt_type))
+        ].iloc[0]
+        
+        add_leg_to_group(
+            group_id, 
+            "long", 
+            opt_type, 
+            strike, 
+            hedge_row['symbol'], 
+            hedge_row['token'], 
+            hedge_row['exch_seg'], 
+            hedge_row['lotsize'], 
+            "weekly_hedge"
+        )
+        st.success(f"Added {strike} {opt_type} (Weekly Hedge)!")
+        # save_data() is already called inside add_leg_to_group
+    except Exception as e:
+        st.error(f"Could not find weekly hedge for {strike} {opt_type} on {weekly_expiry}. {e}")
+
+
+# --- Firefighting action functions ---
+def firefight_average(group_id, strike):
+    chain_df = st.session_state.current_chain
+    group = st.session_state.strategy_groups[group_id]
+    s2_row = find_strike_row(chain_df, strike)
+    if s2_row is not None:
+        add_leg_to_group(group_id, "short", "CE", strike, s2_row.symbol_CE, s2_row.token_CE, s2_row.exch_seg_CE, s2_row.lotsize_CE, "ff_average")
+        add_leg_to_group(group_id, "short", "PE", strike, s2_row.symbol_PE, s2_row.token_PE, s2_row.exch_seg_PE, s2_row.lotsize_PE, "ff_average")
+    log_trade(history.FF_AVERAGE, f"FIREFIGHT (AVG) ({group['name']}): Added Straddle @ {strike}", group=group, strike=strike)
+    st.success(f"Firefighting Straddle @ {strike} added.")
+    save_data() # <-- ADDED
+
+def firefight_add_reference_trade(group_id, strike, opt_type):
+    chain_df = st.session_state.current_chain
+    group = st.session_state.strategy_groups[group_id]
+    ext_row = find_strike_row(chain_df, strike)
+    if ext_row is not None:
+        if opt_type == "PE":
+            add_leg_to_group(group_id, "short", "PE", strike, ext_row.symbol_PE, ext_row.token_PE, ext_row.exch_seg_PE, ext_row.lotsize_PE, "ff_reference")
+        elif opt_type == "CE":
+            add_leg_to_group(group_id, "short", "CE", strike, ext_row.symbol_CE, ext_row.token_CE, ext_row.exch_seg_CE, ext_row.lotsize_CE, "ff_reference")
+    log_trade(history.FF_REFERENCE, f"FIREFIGHT (REF) ({group['name']}): Added {opt_type} @ {strike}", group=group, side="short", type=opt_type, strike=strike)
+    st.success(f"Firefighting Reference {opt_type} @ {strike} added.")
+    save_data() # <-- ADDED
+
+def firefight_shift_base(group_id, atm_strike):
+    chain_df = st.session_state.current_chain
+    group = st.session_state.strategy_groups.get(group_id)
+    if not group:
+        st.error("Group not found for shifting.")
+        return
+
+    for leg in group['legs']:
+        if leg['status'] == 'active':
+            leg['status'] = 'closed'
+            leg['exit_price'] = leg['current_ltp']
+
+    atm_row = find_strike_row(chain_df, atm_strike)
+    if atm_row is not None:
+        add_leg_to_group(group_id, "short", "CE", atm_strike, atm_row.symbol_CE, atm_row.token_CE, atm_row.exch_seg_CE, atm_row.lotsize_CE, "base_straddle")
+        add_leg_to_group(group_id, "short", "PE", atm_strike, atm_row.symbol_PE, atm_row.token_PE, atm_row.exch_seg_PE, atm_row.lotsize_PE, "base_straddle")
+    log_trade(history.FF_SHIFT, f"FIREFIGHT (SHIFT) ({group['name']}): Closed active legs. Added new Straddle @ {atm_strike}", group=group, strike=atm_strike)
+    st.success(f"Base Shifted to new ATM @ {atm_strike}.")
+    save_data() # <-- ADDED
+
+def firefight_true_extension(group_id, strike, opt_type):
+    chain_df = st.session_state.current_chain
+    group = st.session_state.strategy_groups[group_id]
+    ext_row = find_strike_row(chain_df, strike)
+    if ext_row is not None:
+        if opt_type == "PE":
+            add_leg_to_group(group_id, "short", "PE", strike, ext_row.symbol_PE, ext_row.token_PE, ext_row.exch_seg_PE, ext_row.lotsize_PE, "ff_extension")
+        elif opt_type == "CE":
+            add_leg_to_group(group_id, "short", "CE", strike, ext_row.symbol_CE, ext_row.token_CE, ext_row.exch_seg_CE, ext_row.lotsize_CE, "ff_extension")
+    log_trade(history.FF_EXTENSION, f"FIREFIGHT (EXT) ({group['name']}): Added {opt_type} @ {strike}", group=group, side="short", type=opt_type, strike=strike)
+    st.success(f"Firefighting Extension {opt_type} @ {strike} added.")
+    save_data() # <-- ADDED
+
+def close_all_positions(group_id):
+    if group_id not in st.session_state.strategy_groups:
+        st.error("Strategy group not found.")
+        return
+    group = st.session_state.strategy_groups[group_id]
+    group_name = group['name']
+    
+    for leg in group['legs']:
+        if leg['status'] == 'active':
+            leg['status'] = 'closed'
+            leg['exit_price'] = leg['current_ltp']
+    
+    group['status'] = 'closed'
+    st.session_state.active_group_id = None
+    
+    log_trade(history.CLOSE_ALL, f"ACTION: Close All Positions executed for {group_name}. Strategy moved to 'Closed'.", group=group)
+    st.success(f"All positions for {group_name} have been closed.")
+    save_data() # <-- ADDED
+
+
+# --- Multi-strategy UI Handlers ---
+def create_new_strategy(name, instrument):
+    if not name:
+        st.error("Please enter a strategy name.")
+        return False 
+    group_id = str(uuid.uuid4())
+    new_group = {
+        "id": group_id,
+        "name": name,
+        "instrument": instrument,
+        "legs": [],
+        "buffer": 100, # Default buffer
+        "status": "active" 
+    }
+    st.session_state.strategy_groups[group_id] = new_group
+    st.session_state.active_group_id = group_id
+    
+    log_trade(history.CREATE_STRATEGY, f"ACTION: Created new strategy '{name}'.", group=new_group)
+    save_data() # <-- ADDED
+    return True 
+
+@st.dialog("Create New Strategy")
+def new_strategy_dialog():
+    with st.form("new_strategy_form"):
+        strategy_name = st.text_input("Strategy Name", placeholder="e.g., Nifty Straddle")
+        instrument = st.selectbox("Instrument", ["NIFTY", "BANKNIFTY", "FINNIFTY"])
+        
+        submitted = st.form_submit_button("Create")
+        if submitted:
+            success = create_new_strategy(strategy_name, instrument)
+            if success:
+                st.rerun() 
+
+def set_active_group(group_id):
+    st.session_state.active_group_id = group_id
+    if group_id in st.session_state.strategy_groups:
+        group = st.session_state.strategy_groups[group_id]
+        if group.get('status') == 'active':
+            st.session_state['refresh_on_select'] = group_id
+
+
+def delete_group(group_id):
+    if group_id in st.session_state.strategy_groups:
+        group_name = st.session_state.strategy_groups[group_id]['name']
+        
+        del st.session_state.strategy_groups[group_id]
+        
+        log_trade(history.DELETE_STRATEGY, f"ACTION: Deleted strategy '{group_name}'.", group_id=group_id, group_name=group_name)
+        if st.session_state.active_group_id == group_id:
+            st.session_state.active_group_id = None
+        save_data() # <-- ADDED
+
+# --- NEW Function to clear history ---
+def clear_trade_history():
+    st.session_state.trade_history.clear()
+    st.session_state.data_history_head = None
+    get_active_shared_state().clear_history() # Clears it for every session
+
+# --- Excel Export Function ---
+EXCEL_EXPORT_COLUMNS = ["Status", "Tag", "Side", "Type", "Strike", "Lots", "Entry", "Exit", "PnL", "Symbol"]
+
+def excel_export_rows(group):
+    """Yields one row per leg (in EXCEL_EXPORT_COLUMNS order) for a group's sheet."""
+    for leg in group['legs']:
+        entry = leg.get('entry_premium', 0)
+        exit_p = leg.get('exit_price', 0) if leg.get('status') == 'closed' else leg.get('current_ltp', 0)
+        lots = leg.get('lots', 1)
+        lot_size = leg.get('lot_size', INDEX_MAP.get(group['instrument'], {}).get('lot_size', 25))
+        pnl = 0
+        if leg.get('side') == 'short':
+            pnl = (entry - exit_p) * lots * lot_size
+        elif leg.get('side') == 'long':
+            pnl = (exit_p - entry) * lots * lot_size
+
+        yield [
+            leg.get('status', 'N/A'),
+            leg.get('strategy', 'N/A'),
+            leg.get('side', 'N/A'),
+            leg.get('type', 'N/A'),
+            leg.get('strike', 0),
+            lots,
+            entry,
+            exit_p if leg.get('status') == 'closed' else "N/A (Active)",
+            pnl,
+            leg.get('symbol', 'N/A')
+        ]
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def build_closed_workbook(content_hash, _closed_strategies):
+    """Builds the .xlsx bytes. Cached on `content_hash`, so an unchanged set of closed groups is never rebuilt."""
+    from openpyxl import Workbook # Imported lazily: only needed when someone actually exports
+
+    # Write-only mode streams rows to the file, so memory stays flat however many legs there are
+    workbook = Workbook(write_only=True)
+    used_names = set()
+    for group_id, group in _closed_strategies.items():
+        sheet_name = "".join(c for c in group['name'] if c.isalnum() or c in (' ', '_')).rstrip()[:31]
+        if not sheet_name:
+            sheet_name = f"Strategy_{group_id[:8]}"
+        if sheet_name.lower() in used_names: # Two groups with the same name
+            sheet_name = f"{sheet_name[:22]}_{group_id[:8]}"
+        used_names.add(sheet_name.lower())
+
+        sheet = workbook.create_sheet(title=sheet_name)
+        sheet.append(EXCEL_EXPORT_COLUMNS)
+        for row in excel_export_rows(group):
+            sheet.append(row)
+
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+@PROFILER.timed()
+def create_excel_export():
+    closed_ids = [gid for gid, g in st.session_state.strategy_groups.items() if g.get('status') == 'closed']
+    ensure_groups_loaded(closed_ids) # Exporting needs the full legs
+    closed_strategies = {gid: st.session_state.strategy_groups[gid] for gid in closed_ids}
+    
+    if not closed_strategies:
+        st.warning("No closed strategies to export.")
+        return None
+
+    content = json.dumps(closed_strategies, sort_keys=True, default=json_default_converter)
+    content_hash = hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+    return build_closed_workbook(content_hash, closed_strategies)
+
+def prepare_excel_export():
+    """Button callback: builds (or fetches from cache) the export for the current data version."""
+    excel_data = create_excel_export()
+    if excel_data:
+        st.session_state.excel_export = {"data_version": st.session_state.data_version, "data": excel_data}
+
+def iter_export_groups(shared):
+    """Full groups one at a time for the bulk dump (summaries are loaded individually)."""
+    _, groups, _, _ = shared.snapshot()
+    for group_id, group in groups.items():
+        if is_group_summary(group):
+            group = get_sqlite_store(SQLITE_DB_FILE).load_groups(group_ids=[group_id]).get(group_id)
+            if group is None:
+                continue
+        yield group
+
+def run_bulk_export():
+    """Button callback: writes the partitioned analytics dump of everything saved so far."""
+    import bulk_export # Lazy: pulls in pyarrow, only needed for this button
+    save_data()
+    shared = get_active_shared_state()
+    shared.worker.flush()
+    fmt = "parquet" if bulk_export.pa is not None else "csv"
+    try:
+        if STORAGE_BACKEND == "sqlite":
+            store = get_sqlite_store(SQLITE_DB_FILE)
+            records = store.iter_history() # Full archive, not just the in-memory tail, streamed
+            time_index = store.history_time_index()
+        else:
+            _, _, records, _ = shared.snapshot()
+            time_index = None
+        stats = bulk_export.export_dataset(iter_export_groups(shared), records, BULK_EXPORT_DIR, fmt=fmt,
+                                           default_lot_sizes={k: v['lot_size'] for k, v in INDEX_MAP.items()},
+                                           time_index=time_index)
+        st.session_state.bulk_export_result = {"fmt": fmt, **stats}
+    except Exception as e:
+        st.session_state.bulk_export_result = {"error": str(e)}
+
+
+# --- Fragments (partial reruns) ---
+# Each UI section is a keyed st.fragment: its own widgets rerun only that section, and
+# action callbacks rerun just the sections their change shows up in (see fragment_action).
+AUTO_REFRESH_SECONDS = 15
+INDEX_FRAGMENTS = ("index_monitor", "option_chain")
+PRICE_FRAGMENTS = ("index_monitor", "live_metrics", "positions", "firefighting")
+LEG_FRAGMENTS = ("strategy_list", "live_metrics", "positions", "firefighting", "trade_history")
+
+def run_fragment(key, func, *args, run_every=None):
+    """Renders `func(*args)` as the fragment `key`, timing every run (full-app or partial)."""
+    def timed(*fargs):
+        runs = st.session_state.fragment_runs
+        partial = runs.get(key) == st.session_state.app_run_count # Already ran in this app run
+        runs[key] = st.session_state.app_run_count
+        started = time.perf_counter()
+        try:
+            return func(*fargs)
+        finally:
+            record_render_time(key, (time.perf_counter() - started) * 1000, partial)
+    return st.fragment(timed, key=key, run_every=run_every)(*args)
+
+def record_render_time(key, elapsed_ms, partial):
+    timing = st.session_state.render_timings.setdefault(key, {
+        "full_runs": 0, "full_ms": 0.0, "partial_runs": 0, "partial_ms": 0.0, "last_ms": 0.0
+    })
+    kind = "partial" if partial else "full"
+    timing[f"{kind}_runs"] += 1
+    timing[f"{kind}_ms"] += elapsed_ms
+    timing["last_ms"] = elapsed_ms
+    PROFILER.record(f"ui.{key}", elapsed_ms)
+
+def fragment_action(fragments, action, *args):
+    """Widget callback: runs `action(*args)`, then reruns only `fragments` (None = the whole app)."""
+    if fragments is None:
+        action(*args)
+        st.rerun()
+    # Messages the action shows go to a status bar at the bottom: in a fragment rerun, anything a
+    # callback writes to the main area would replace the elements at the top of the page
+    with st.bottom.container():
+        action(*args)
+    # Only fragments drawn by the last app run can be targeted (e.g. no chain without a strategy)
+    rendered = [key for key in fragments if st.session_state.fragment_runs.get(key) == st.session_state.app_run_count]
+    if rendered:
+        st.rerun(rendered)
+
+def toggle_auto_refresh():
+    st.session_state.auto_refresh = st.session_state.auto_refresh_toggle
+    st.session_state.last_auto_refresh = time.time()
+
+def live_refresh_interval():
+    """Auto-refresh period for the live fragments, or None when it is off."""
+    group = st.session_state.strategy_groups.get(st.session_state.active_group_id)
+    if st.session_state.auto_refresh and group is not None and group.get('status') == 'active':
+        return AUTO_REFRESH_SECONDS
+    return None
+
+@PROFILER.timed()
+def render_index_monitor():
+    idx_c1, idx_c2 = st.columns([2,1])
+    with idx_c1:
+        for index_name in ("NIFTY", "BANKNIFTY", "FINNIFTY"):
+            st.metric(index_name, f"{st.session_state.all_index_prices[index_name]:,.2f}")
+            st.caption(format_price_age(INDEX_MAP[index_name]['token']))
+    with idx_c2:
+        st.button("Refresh", key="refresh_indices", on_click=fragment_action, args=(INDEX_FRAGMENTS, refresh_all_index_prices), use_container_width=True)
+
+def render_strategy_list():
+    active_strategies = {gid: g for gid, g in st.session_state.strategy_groups.items() if g.get('status', 'active') == 'active'}
+    closed_strategies = {gid: g for gid, g in st.session_state.strategy_groups.items() if g.get('status') == 'closed'}
+
+    st.subheader("Active Strategies")
+    if not active_strategies:
+        st.info("No active strategies.")
+    else:
+        for group_id, group in active_strategies.items():
+            is_active = (st.session_state.active_group_id == group_id)
+            label = f"**{group['name']}** ({len([l for l in group['legs'] if l['status'] == 'active'])} legs)"
+            if is_active:
+                st.button(f"Viewing: {group['name']}", key=f"view_{group_id}", disabled=True, use_container_width=True)
+            else:
+                st.button(f"View: {group['name']}", key=f"select_{group_id}", on_click=fragment_action, args=(None, set_active_group, group_id), use_container_width=True)
+                    
+    st.subheader("Closed Strategies")
+    if not closed_strategies:
+        st.info("No closed strategies.")
+    else:
+        # Built only on request (and cached by content), not on every rerun
+        excel_export = st.session_state.get('excel_export')
+        if excel_export and excel_export['data_version'] == st.session_state.data_version:
+            st.download_button(
+                label="📥 Download All Closed (.xlsx)",
+                data=excel_export['data'],
+                file_name=f"closed_strategies_{date.today().strftime('%Y-%m-%d')}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True
+            )
+        else:
+            st.button("📦 Prepare Closed Export (.xlsx)", key="prepare_excel_export",
+                      on_click=prepare_excel_export, use_container_width=True)
+        for group_id, group in closed_strategies.items():
+            with st.container(border=True):
+                st.markdown(f"**{group['name']}**")
+                if is_group_summary(group):
+                    st.caption(f"{group['instrument']} | {group_leg_count(group)} total legs | Realised: ₹{group['lazy_summary']['realised_pnl']:,.0f}")
+                else:
+                    st.caption(f"{group['instrument']} | {group_leg_count(group)} total legs")
+                st.button("Delete", key=f"del_{group_id}", on_click=fragment_action, args=(None, delete_group, group_id), use_container_width=True)
+
+def render_timings_panel():
+    timings = st.session_state.render_timings
+    if not timings:
+        st.caption("No timings yet.")
+    else:
+        rows = []
+        for key, t in timings.items():
+            rows.append({
+                "Section": "(full app)" if key == "app" else key,
+                "Full runs": t["full_runs"],
+                "Avg full (ms)": round(t["full_ms"] / t["full_runs"], 1) if t["full_runs"] else None,
+                "Partial runs": t["partial_runs"],
+                "Avg partial (ms)": round(t["partial_ms"] / t["partial_runs"], 1) if t["partial_runs"] else None,
+                "Last (ms)": round(t["last_ms"], 1),
+            })
+        st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+    st.button("Refresh Timings", key="refresh_render_timings", use_container_width=True)
+
+def render_diagnostics():
+    """p50/p95/p99 of every profiled hot path and UI section, plus a downloadable text snapshot."""
+    st.header("🩺 Diagnostics")
+    st.caption(f"Process-wide (all sessions), last {PROFILER.window} samples per timer. "
+               "`ui.*` rows are UI sections, the rest are function timers.")
+    summary = PROFILER.summary()
+    if not summary:
+        st.info("No samples yet.")
+    else:
+        st.dataframe(pd.DataFrame([{
+            "Timer": name, "Count": t["count"], "Errors": t["errors"], "Last (ms)": t["last_ms"],
+            "Mean (ms)": t["mean_ms"], "p50 (ms)": t["p50_ms"], "p95 (ms)": t["p95_ms"],
+            "p99 (ms)": t["p99_ms"], "Max (ms)": t["max_ms"],
+        } for name, t in summary.items()]), hide_index=True, use_container_width=True,
+            column_config={c: st.column_config.NumberColumn(format="%.1f")
+                           for c in ["Last (ms)", "Mean (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Max (ms)"]})
+
+    st.subheader("Broker API")
+    server = get_metrics_server(BROKER_METRICS_PORT) if BROKER_METRICS_PORT else None
+    if server is not None:
+        st.caption(f"Live endpoint: http://127.0.0.1:{server.server_address[1]}/metrics (text) and /metrics.json")
+    elif not BROKER_METRICS_PORT:
+        st.caption("Set STRATEGY_METRICS_PORT (e.g. 8599) to serve these as /metrics and /metrics.json.")
+    broker = BROKER_METRICS.snapshot()["endpoints"]
+    if not broker:
+        st.info("No broker calls yet.")
+    else:
+        st.dataframe(pd.DataFrame([{
+            "Endpoint": name, "Calls": e["count"], "Errors": e["errors"], "Retries": e["retries"],
+            "Mean (ms)": e["mean_ms"], "Max (ms)": e["max_ms"], "Last (ms)": e["last_ms"],
+            "Tokens/req": e["tokens_mean"], "Statuses": ", ".join(f"{k}: {v}" for k, v in e["statuses"].items()),
+        } for name, e in broker.items()]), hide_index=True, use_container_width=True,
+            column_config={c: st.column_config.NumberColumn(format="%.1f")
+                           for c in ["Mean (ms)", "Max (ms)", "Last (ms)", "Tokens/req"]})
+
+    breaker = get_broker_breaker().snapshot()
+    st.caption(f"Circuit breaker: **{breaker['state']}** · {breaker['consecutive_failures']} consecutive failures · "
+               f"tripped {breaker['trips']}x" + (f" · last error: {breaker['last_error']}" if breaker['last_error'] else ""))
+
+    recorder = get_tick_recorder()
+    if recorder is not None:
+        st.caption(f"Tick log: {recorder.ticks_written:,} ticks recorded by this process to `{os.path.abspath(TICK_LOG_DIR)}` "
+                   f"(slice with `python tick_recorder.py {TICK_LOG_DIR} --from ... --to ...`)")
+    else:
+        st.caption("Tick log: off (set STRATEGY_TICK_DIR to record every fetched price for replay).")
+
+    render_startup_timeline()
+
+    timeline = st.session_state.startup_timeline
+    snapshot = (PROFILER.snapshot_text() + f"\nStartup timeline ({startup_summary(timeline)})\n" + timeline.report())
+    d1, d2, d3 = st.columns(3)
+    d1.button("Refresh", key="refresh_diagnostics", use_container_width=True)
+    d2.download_button("📄 Download Snapshot (.txt)", data=snapshot,
+                       file_name=f"profiler_{date.today().strftime('%Y-%m-%d')}_{time.strftime('%H%M%S')}.txt",
+                       mime="text/plain", use_container_width=True)
+    d3.button("Reset Timers", key="reset_diagnostics", on_click=PROFILER.reset, use_container_width=True)
+
+def startup_summary(timeline):
+    """'dashboard ready in Xs (Ys after login)' for the Diagnostics tab and console."""
+    rows = {label: (start, end) for label, start, end in timeline.rows()}
+    if "dashboard ready" not in rows:
+        return "dashboard not ready yet (not logged in)"
+    ready = rows["dashboard ready"][1]
+    text = f"dashboard ready {ready:.2f}s after session start"
+    if "login clicked" in rows:
+        text += f", {ready - rows['login clicked'][0]:.2f}s after clicking Login"
+    return text
+
+def render_startup_timeline():
+    """This session's cold start -> login -> first usable dashboard, step by step."""
+    timeline = st.session_state.startup_timeline
+    st.subheader("Startup Timeline")
+    st.caption(f"This session: {startup_summary(timeline)}. Login steps listed with overlapping times ran concurrently.")
+    rows = timeline.rows()
+    if rows:
+        st.dataframe(pd.DataFrame([{"Step": label, "Start (s)": start, "End (s)": end, "Took (s)": end - start}
+                                   for label, start, end in rows]),
+                     hide_index=True, use_container_width=True,
+                     column_config={c: st.column_config.NumberColumn(format="%.3f")
+                                    for c in ["Start (s)", "End (s)", "Took (s)"]})
+
+def render_live_dashboard(active_group_id):
+    """Dashboard tab. Auto-refresh reruns just this fragment (and the ones nested in it)."""
+    active_group = st.session_state.strategy_groups.get(active_group_id)
+    if active_group is None:
+        return
+    if live_refresh_interval() and time.time() - st.session_state.get('last_auto_refresh', 0) >= AUTO_REFRESH_SECONDS:
+        if not ensure_broker_session():
+            st.rerun() # Back to the login page
+        if get_broker_breaker().state != "open": # Don't keep hammering a failing endpoint
+            refresh_all_prices(active_group_id)
+        st.session_state.last_auto_refresh = time.time()
+
+    st.header(f"📈 Live Dashboard: {active_group['name']}")
+    st.caption(f"Instrument: {active_group['instrument']}")
+
+    st.markdown("---")
+    run_fragment("live_metrics", render_live_metrics, active_group_id)
+    st.markdown("---")
+    run_fragment("positions", render_positions, active_group_id)
+    st.markdown("---")
+    run_fragment("firefighting", render_firefighting, active_group_id)
+
+def render_live_metrics(active_group_id):
+    active_group = st.session_state.strategy_groups.get(active_group_id)
+    if active_group is None:
+        return
+    stats = calculate_group_stats(active_group, process_group_legs(active_group))
+
+    st.header("Live Metrics")
+    m1, m2, m3, m4, m5 = st.columns(5)
+    pnl_color = "normal" if stats['total_pnl'] >= 0 else "inverse"
+    m1.metric("Total MTM P&L", f"₹{stats['total_pnl']:,.0f}", delta_color=pnl_color)
+    m2.metric("Unrealised P&L", f"₹{stats['unrealised_pnl']:,.0f}")
+    m3.metric("Realised P&L", f"₹{stats['realised_pnl']:,.0f}")
+    m4.metric("Net Delta", f"{stats['net_delta']:,.0f}")
+    m5.metric("Net Theta", f"₹{stats['net_theta']:,.0f}")
+    spot_token = INDEX_MAP.get(active_group.get('instrument'), {}).get('token')
+    st.caption(f"Spot {st.session_state.current_spot_price:,.2f} {format_price_age(spot_token)}")
+    pause_notice = broker_pause_notice()
+    if pause_notice:
+        st.warning(pause_notice)
+    render_mtm_path(active_group_id)
+
+    b1, b2, b3 = st.columns(3) 
+    b1.button("Refresh All Prices", type="primary", use_container_width=True,
+              on_click=fragment_action, args=(PRICE_FRAGMENTS, refresh_all_prices, active_group_id),
+              disabled=(active_group.get('status') == 'closed')
+    )
+    b2.button(f"⚠️ Close All Positions ({active_group['name']})", use_container_width=True,
+              on_click=fragment_action, args=(None, close_all_positions, active_group_id),
+              help="This will mark all active legs as 'closed' and move the strategy to the 'Closed' list.",
+              disabled=(active_group.get('status') == 'closed')
+    )
+    with b3:
+        st.checkbox(f"Auto-Refresh Prices ({AUTO_REFRESH_SECONDS}s)", value=st.session_state.auto_refresh, key="auto_refresh_toggle",
+                    on_change=fragment_action, args=(None, toggle_auto_refresh))
+
+MTM_PATH_FIELDS = {"Total P&L": "total_pnl", "Unrealised": "unrealised_pnl", "Realised": "realised_pnl",
+                   "Net Delta": "net_delta", "Net Theta": "net_theta"}
+
+def render_mtm_path(active_group_id):
+    """Today's path of the group's P&L (or Greeks) from the samples taken at each refresh."""
+    mtm = mtm_history_for(market_data_provider())
+    with st.expander("📉 Today's P&L path", expanded=False):
+        label = st.radio("Series", options=list(MTM_PATH_FIELDS), horizontal=True, key=f"mtm_field_{active_group_id}",
+                         label_visibility="collapsed")
+        path = mtm.day_frame(active_group_id, MTM_PATH_FIELDS[label])
+        if path.empty:
+            st.caption("No samples yet: one is taken on every price refresh.")
+            return
+        import altair as alt
+        base = alt.Chart(path).encode(x=alt.X("time:T", title=None, axis=alt.Axis(format="%H:%M")))
+        band = base.mark_area(opacity=0.25).encode(y=alt.Y("low:Q", title=label), y2="high:Q")
+        line = base.mark_line().encode(y="value:Q", tooltip=["time:T", "value:Q", "low:Q", "high:Q"])
+        zero = alt.Chart(pd.DataFrame({"y": [0]})).mark_rule(color="gray", strokeDash=[4, 4]).encode(y="y:Q")
+        st.altair_chart((band + line + zero).properties(height=220), use_container_width=True)
+        st.caption(f"{len(path)} points · min {path['low'].min():,.0f} · max {path['high'].max():,.0f} · "
+                   "older than the in-memory samples: per-minute min/max/last")
+
+PORTFOLIO_FRAGMENTS = ("portfolio", "index_monitor", "live_metrics", "positions", "firefighting")
+
+def render_portfolio():
+    """Every active group's risk in one table, from the shared latest prices (no broker calls)."""
+    from portfolio import portfolio_overview
+    provider = market_data_provider()
+    latest = {token: price for token, (price, _) in bars_for(provider).latest().items()}
+    overview = portfolio_overview(st.session_state.strategy_groups, latest, st.session_state.all_index_prices)
+
+    st.header("🧭 Portfolio Risk Overview")
+    st.button("Refresh All Groups", type="primary", key="refresh_portfolio",
+              on_click=fragment_action, args=(PORTFOLIO_FRAGMENTS, refresh_portfolio_prices),
+              help=f"One batched price request for every active group (up to {MARKET_DATA_BATCH} tokens per call)")
+    if overview.empty:
+        st.info("No active strategies.")
+        return
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Total MTM P&L", f"₹{overview['total_pnl'].sum():,.0f}")
+    m2.metric("Net Delta", f"{overview['net_delta'].sum():,.0f}")
+    m3.metric("Net Theta", f"₹{overview['net_theta'].sum():,.0f}")
+    m4.metric("Need Adjustment", f"{int(overview['signal'].str.startswith('ADJUST').sum())} / {len(overview)}")
+    st.dataframe(
+        overview.drop(columns=["group_id"]).rename(columns={
+            "name": "Strategy", "instrument": "Instrument", "spot": "Spot", "active_legs": "Legs",
+            "total_pnl": "Total P&L", "realised_pnl": "Realised", "unrealised_pnl": "Unrealised",
+            "net_delta": "Net Delta", "net_theta": "Net Theta", "avg_strike": "Avg Strike", "buffer": "Buffer",
+            "trigger_down": "Lower Trigger", "trigger_up": "Upper Trigger", "distance": "To Trigger (pts)",
+            "signal": "Signal", "action": "Recommended"}),
+        hide_index=True, use_container_width=True,
+        column_config={c: st.column_config.NumberColumn(format="localized") for c in
+                       ["Spot", "Total P&L", "Realised", "Unrealised", "Net Delta", "Net Theta", "Avg Strike",
+                        "Lower Trigger", "Upper Trigger", "To Trigger (pts)"]})
+    st.caption("Closest to a trigger first. Leg prices are the latest polled LTP of each token across all sessions "
+               "(falling back to each leg's last refreshed LTP).")
+
+CLOSED_LEGS_PAGE_SIZE = 20
+
+def render_positions(active_group_id):
+    active_group = st.session_state.strategy_groups.get(active_group_id)
+    if active_group is None:
+        return
+    processed_legs = process_group_legs(active_group)
+    active_legs = [leg for leg in processed_legs if leg.get('status') != 'closed']
+    closed_legs = [leg for leg in processed_legs if leg.get('status') == 'closed']
+
+    st.header("Positions")
+    st.info("Use the 'Actions' expander on any leg to update or exit it. Closed legs are summarized below.")
+
+    if not processed_legs:
+        st.info("No positions added yet. Add legs manually from the 'Option Chain' tab.")
+    else:
+        # Active legs: one card each (page cost grows with open positions only)
+        for leg in active_legs:
+            with st.container(border=True):
+                col1, col2, col3 = st.columns([4, 2, 2])
+                
+                with col1:
+                    side_text = "BUY" if leg.get('side') == 'long' else "SELL"
+                    side_color = "green" if leg.get('side') == 'long' else "red"
+                    price_text = f"@{leg.get('entry_premium', 0.0):.2f}"
+
+                    st.markdown(f"**<span style='color:{side_color};'>{side_text}</span> {leg.get('lots', 0)}x** {price_text}", unsafe_allow_html=True)
+                    st.markdown(f"#### {leg.get('strike', 'N/A')} {leg.get('type', 'N/A')}")
+                    st.caption(f"Tag: {leg.get('strategy', 'N/A')}")
+                with col2:
+                    st.metric(label="LTP", value=f"{leg.get('current_ltp', 0.0):.2f}")
+                    st.caption(format_price_age(leg.get('token')))
+                with col3:
+                    pnl_val = leg.get('pnl', 0.0)
+                    pnl_color = "normal" if pnl_val >= 0 else "inverse"
+                    st.metric(label="PnL", value=f"₹{pnl_val:,.0f}", delta_color=pnl_color)
+
+                # The form is only built while the expander is open (opening it reruns just this fragment)
+                actions = st.expander("Actions", key=f"actions_{leg['id']}", on_change="rerun")
+                if actions.open:
+                    with actions:
+                        form_key = f"form_{leg['id']}"
+                        with st.form(key=form_key):
+                            c1, c2, c3 = st.columns(3)
+                            with c1:
+                                new_lots = st.number_input("Lots", value=int(leg['lots']), min_value=1, step=1, key=f"lots_{leg['id']}")
+                            with c2:
+                                new_entry = st.number_input("Entry", value=float(leg['entry_premium']), format="%.2f", step=0.05, key=f"entry_{leg['id']}")
+                            with c3:
+                                new_tag = st.text_input("Tag", value=leg['strategy'], key=f"tag_{leg['id']}")
+                            
+                            s1, s2 = st.columns(2)
+                            with s1:
+                                st.form_submit_button(
+                                    "Update Leg", 
+                                    use_container_width=True,
+                                    on_click=fragment_action,
+                                    args=(LEG_FRAGMENTS, update_leg_details, active_group_id, leg['id'], new_lots, new_entry, new_tag)
+                                )
+                            with s2:
+                                st.form_submit_button(
+                                    "Exit Leg", 
+                                    use_container_width=True, 
+                                    type="primary",
+                                    on_click=fragment_action,
+                                    args=(LEG_FRAGMENTS, exit_leg, active_group_id, leg['id'])
+                                )
+
+        # Closed legs: one paginated summary table instead of a card per leg
+        if closed_legs:
+            closed_pnl = sum(leg.get('pnl', 0.0) for leg in closed_legs)
+            closed_view = st.expander(f"Closed Legs ({len(closed_legs)}) | Realised: ₹{closed_pnl:,.0f}",
+                                      key=f"closed_legs_{active_group_id}", on_change="rerun")
+            if closed_view.open:
+                with closed_view:
+                    closed_pages = max(1, -(-len(closed_legs) // CLOSED_LEGS_PAGE_SIZE))
+                    page_key = f"closed_legs_page_{active_group_id}"
+                    if st.session_state.get(page_key, 1) > closed_pages:
+                        st.session_state[page_key] = closed_pages # Fewer closed legs than before
+                    closed_page = 1
+                    if closed_pages > 1:
+                        closed_page = st.number_input(f"Page (of {closed_pages})", min_value=1, max_value=closed_pages,
+                                                      value=1, step=1, key=page_key)
+                    start = (closed_page - 1) * CLOSED_LEGS_PAGE_SIZE
+                    st.dataframe(pd.DataFrame([{
+                        "Side": "BUY" if leg.get('side') == 'long' else "SELL",
+                        "Lots": leg.get('lots', 0),
+                        "Strike": leg.get('strike'),
+                        "Type": leg.get('type'),
+                        "Entry": leg.get('entry_premium', 0.0),
+                        "Exit": leg.get('exit_price', 0.0),
+                        "Realised PnL": leg.get('pnl', 0.0),
+                        "Tag": leg.get('strategy', 'N/A'),
+                    } for leg in closed_legs[start:start + CLOSED_LEGS_PAGE_SIZE]]),
+                        hide_index=True, use_container_width=True,
+                        column_config={
+                            "Entry": st.column_config.NumberColumn(format="%.2f"),
+                            "Exit": st.column_config.NumberColumn(format="%.2f"),
+                            "Realised PnL": st.column_config.NumberColumn(format="₹%.0f"),
+                        })
+
+BAR_INTERVALS = {"1m": 60, "5m": 300}
+
+def intraday_bars_chart(bars, levels=None):
+    """Altair candlesticks of a BarAggregator frame, with optional horizontal {label: price} lines."""
+    import altair as alt
+    base = alt.Chart(bars).encode(
+        x=alt.X("time:T", title=None, axis=alt.Axis(format="%H:%M")),
+        color=alt.condition("datum.open <= datum.close", alt.value("#26a69a"), alt.value("#ef5350")),
+    )
+    wicks = base.mark_rule().encode(y=alt.Y("low:Q", title=None, scale=alt.Scale(zero=False)), y2="high:Q")
+    bodies = base.mark_bar().encode(y="open:Q", y2="close:Q",
+                                    tooltip=["time:T", "open:Q", "high:Q", "low:Q", "close:Q", "ticks:Q"])
+    chart = wicks + bodies
+    if levels:
+        lines = pd.DataFrame({"level": list(levels), "price": list(levels.values())})
+        chart += alt.Chart(lines).mark_rule(strokeDash=[4, 4], color="gray").encode(y="price:Q", tooltip=["level", "price"])
+    return chart.properties(height=260)
+
+def render_intraday_bars(active_group_id, active_group, processed_legs, signal):
+    """Spot (or a leg) as 1m/5m bars from the prices already polled; no extra broker calls."""
+    bars_source = bars_for(market_data_provider())
+    spot_details = INDEX_MAP[active_group['instrument']]
+    choices = {f"{active_group['instrument']} spot": spot_details['token']}
+    for leg in processed_legs:
+        if leg.get('status') == 'active' and leg.get('token'):
+            choices[f"{leg['side'].title()} {leg['strike']:.0f} {leg['type']}"] = str(leg['token'])
+    c1, c2 = st.columns([3, 1])
+    label = c1.selectbox("Intraday bars", options=list(choices), key=f"bars_token_{active_group_id}")
+    interval = c2.radio("Interval", options=list(BAR_INTERVALS), horizontal=True, key=f"bars_interval_{active_group_id}")
+    bars = bars_source.frame(choices[label], BAR_INTERVALS[interval])
+    if bars.empty:
+        st.caption("No bars yet: they build up from each price refresh.")
+        return
+    levels = None
+    if signal is not None and choices[label] == spot_details['token']:
+        levels = {"Upper trigger": signal['trigger_up'], "Lower trigger": signal['trigger_down']}
+    st.altair_chart(intraday_bars_chart(bars, levels), use_container_width=True)
+    st.caption(f"{len(bars)} bars · last {bars['close'].iloc[-1]:,.2f} at {bars['time'].iloc[-1]:%H:%M}")
+
+@st.cache_resource
+def get_margin_estimator():
+    """One margin cache per server process: the same leg set is only repriced once per spot bucket."""
+    from margin import MarginEstimator
+    return MarginEstimator(vol=MARGIN_VOL)
+
+def margin_legs(group):
+    """Active legs of a group, with their expiry from the scrip master (margin.py assumes a week without it)."""
+    active = [leg for leg in group['legs'] if leg['status'] == 'active']
+    instrument_df = st.session_state.instrument_list
+    expiries = {}
+    if instrument_df is not None and not instrument_df.empty and active:
+        rows = instrument_df[instrument_df['token'].isin([str(leg['token']) for leg in active])]
+        expiries = dict(zip(rows['token'], rows['expiry']))
+    return [{**leg, 'expiry': leg.get('expiry') or expiries.get(str(leg['token']))} for leg in active]
+
+def proposed_leg(instrument, opt_type, strike):
+    """A 1-lot short leg at the option chain's expiry, as the firefight actions add it."""
+    return {"side": "short", "type": opt_type, "strike": strike, "lots": 1, "status": "active",
+            "lot_size": INDEX_MAP[instrument]['lot_size'], "expiry": st.session_state.get("selected_expiry_chain")}
+
+def firefight_margins(group, spot, atm_strike, signal):
+    """Estimated margin of the group now, and the incremental margin of each firefight action."""
+    estimator = get_margin_estimator()
+    instrument = group['instrument']
+    current = margin_legs(group)
+    proposals = {}
+    if signal['zone'] != 'safe': # Actions are only offered once a trigger is breached
+        proposals = {
+            "shift": [proposed_leg(instrument, "CE", atm_strike), proposed_leg(instrument, "PE", atm_strike)], # Closes all
+            "average": current + [proposed_leg(instrument, "CE", signal['s2_strike']),
+                                  proposed_leg(instrument, "PE", signal['s2_strike'])],
+            "reference": current + [proposed_leg(instrument, *reversed(signal['reference']))],
+            "extension": current + [proposed_leg(instrument, *reversed(signal['extension']))],
+        }
+    incremental = {name: estimator.incremental(current, legs, spot) for name, legs in proposals.items()}
+    return estimator.estimate(current, spot), incremental
+
+def format_margin_change(amount):
+    return f"{'+' if amount >= 0 else '−'}₹{abs(amount):,.0f}"
+
+def render_firefighting(active_group_id):
+    active_group = st.session_state.strategy_groups.get(active_group_id)
+    if active_group is None:
+        return
+    processed_legs = process_group_legs(active_group)
+    stats = calculate_group_stats(active_group, processed_legs)
+    spot = st.session_state.current_spot_price
+    atm_strike = st.session_state.atm_strike
+
+    st.header("🔥 Adjustment Signal & Firefighting")
+
+    if active_group.get('status') == 'closed':
+        st.info("This strategy is closed. Firefighting is disabled.")
+    else:
+        active_group['buffer'] = st.number_input(
+            "Firefighting Buffer (pts)", 
+            value=active_group.get('buffer', 100),
+            step=10,
+            key=f"buffer_{active_group_id}"
+        )
+
+        avg_strike = stats['avg_strike']
+        buffer = active_group['buffer']
+        step = INDEX_MAP[active_group['instrument']]["step"]
+        total_pnl = stats['total_pnl'] 
+
+        signal = firefight_signal(avg_strike, spot, buffer, step, total_pnl)
+        if signal is None:
+            st.info("Add an active base leg (straddle/strangle) to enable firefighting signals.")
+        else:
+            trigger_up = signal['trigger_up']
+            trigger_down = signal['trigger_down']
+            s2_strike = signal['s2_strike']
+            
+            st.metric(
+                label=f"Avg. Short Strike: {avg_strike:,.0f} | Buffer: {buffer} pts",
+                value=f"Live Spot: {spot:,.2f}",
+                delta=f"Safe Range: {trigger_down:,.0f} - {trigger_up:,.0f}"
+            )
+            margin_now, margin_add = firefight_margins(active_group, spot, atm_strike, signal)
+            st.caption(f"Estimated margin (SPAN + exposure, local approximation at {MARGIN_VOL:.0%} vol): "
+                       f"₹{margin_now['total']:,.0f}")
+            st.markdown("---")
+
+            if signal['zone'] == 'up':
+                st.error(f"**ADJUST!** Spot ({spot:,.2f}) > Upper Trigger ({trigger_up:,.0f}). Firefight UP!")
+                st.subheader("Recommended Action")
+                if signal['recommended'] == 'shift':
+                    st.info("Position is in profit. Shifting is recommended.")
+                    st.button(f"Shift Base to ATM @ {atm_strike}", on_click=fragment_action, args=(LEG_FRAGMENTS, firefight_shift_base, active_group_id, atm_strike), use_container_width=True, type="primary")
+                    st.caption(f"Margin change: {format_margin_change(margin_add['shift'])}")
+                else:
+                    st.warning("Position is in loss. Averaging is recommended.")
+                    st.button(f"Averaging (S2): Sell Straddle @ {s2_strike}", on_click=fragment_action, args=(LEG_FRAGMENTS, firefight_average, active_group_id, s2_strike), use_container_width=True, type="primary")
+                    st.caption(f"Margin change: {format_margin_change(margin_add['average'])}")
+                
+                st.markdown("---")
+                st.subheader("All Firefighting Options")
+                ref_strike_down, _ = signal['reference']
+                ext_strike_up, _ = signal['extension']
+                c1, c2, c3, c4 = st.columns([1, 2, 1, 1]); c1.markdown("**Technique**"); c2.markdown("**Action**"); c3.markdown("**Margin**"); c4.markdown("**Execute**")
+                c1, c2, c3, c4 = st.columns([1, 2, 1, 1]); c1.write("Averaging (S2)"); c2.write(f"Sell Straddle @ {s2_strike}"); c3.write(format_margin_change(margin_add['average'])); c4.button("Execute", key="ff_avg_table_up", on_click=fragment_action, args=(LEG_FRAGMENTS, firefight_average, active_group_id, s2_strike), use_container_width=True)
+                c1, c2, c3, c4 = st.columns([1, 2, 1, 1]); c1.write("Adjust (Reference)"); c2.write(f"Sell PE @ {ref_strike_down:.0f}"); c3.write(format_margin_change(margin_add['reference'])); c4.button("Execute", key="ff_ref_table_up", on_click=fragment_action, args=(LEG_FRAGMENTS, firefight_add_reference_trade, active_group_id, ref_strike_down, "PE"), use_container_width=True)
+                c1, c2, c3, c4 = st.columns([1, 2, 1, 1]); c1.write("Extend Range"); c2.write(f"Sell CE @ {ext_strike_up:.0f}"); c3.write(format_margin_change(margin_add['extension'])); c4.button("Execute", key="ff_ext_table_up", on_click=fragment_action, args=(LEG_FRAGMENTS, firefight_true_extension, active_group_id, ext_strike_up, "CE"), use_container_width=True)
+
+            elif signal['zone'] == 'down':
+                st.error(f"**ADJUST!** Spot ({spot:,.2f}) < Lower Trigger ({trigger_down:,.0f}). Firefight DOWN!")
+                st.subheader("Recommended Action")
+                if signal['recommended'] == 'shift':
+                    st.info("Position is in profit. Shifting is recommended.")
+                    st.button(f"Shift Base to ATM @ {atm_strike}", on_click=fragment_action, args=(LEG_FRAGMENTS, firefight_shift_base, active_group_id, atm_strike), use_container_width=True, type="primary")
+                    st.caption(f"Margin change: {format_margin_change(margin_add['shift'])}")
+                else:
+                    st.warning("Position is in loss. Averaging is recommended.")
+                    st.button(f"Averaging (S2): Sell Straddle @ {s2_strike}", on_click=fragment_action, args=(LEG_FRAGMENTS, firefight_average, active_group_id, s2_strike), use_container_width=True, type="primary")
+                    st.caption(f"Margin change: {format_margin_change(margin_add['average'])}")
+                
+                st.markdown("---")
+                st.subheader("All Firefighting Options")
+                ref_strike_up, _ = signal['reference']
+                ext_strike_down, _ = signal['extension']
+                c1, c2, c3, c4 = st.columns([1, 2, 1, 1]); c1.markdown("**Technique**"); c2.markdown("**Action**"); c3.markdown("**Margin**"); c4.markdown("**Execute**")
+                c1, c2, c3, c4 = st.columns([1, 2, 1, 1]); c1.write("Averaging (S2)"); c2.write(f"Sell Straddle @ {s2_strike}"); c3.write(format_margin_change(margin_add['average'])); c4.button("Execute", key="ff_avg_table_down", on_click=fragment_action, args=(LEG_FRAGMENTS, firefight_average, active_group_id, s2_strike), use_container_width=True)
+                c1, c2, c3, c4 = st.columns([1, 2, 1, 1]); c1.write("Adjust (Reference)"); c2.write(f"Sell CE @ {ref_strike_up:.0f}"); c3.write(format_margin_change(margin_add['reference'])); c4.button("Execute", key="ff_ref_table_down", on_click=fragment_action, args=(LEG_FRAGMENTS, firefight_add_reference_trade, active_group_id, ref_strike_up, "CE"), use_container_width=True)
+                c1, c2, c3, c4 = st.columns([1, 2, 1, 1]); c1.write("Extend Range"); c2.write(f"Sell PE @ {ext_strike_down:.0f}"); c3.write(format_margin_change(margin_add['extension'])); c4.button("Execute", key="ff_ext_table_down", on_click=fragment_action, args=(LEG_FRAGMENTS, firefight_true_extension, active_group_id, ext_strike_down, "PE"), use_container_width=True)
+            
+            else:
+                st.success(f"IN SAFE ZONE: Spot ({spot:,.2f}) is within range ({trigger_down:,.0f} - {trigger_up:,.0f}). Monitoring...")
+
+        render_intraday_bars(active_group_id, active_group, processed_legs, signal)
+        
+        st.markdown("---")
+        
+        # --- Rebuilt Weekly Protection Tool ---
+        st.header("🛡️ Add Weekly Protection (PR Sundar Method)")
+        
+        instrument_df = st.session_state.instrument_list
+        today = date.today()
+        
+        active_instrument = active_group['instrument']
+        all_expiries = []
+        if instrument_df is not None:
+            all_expiries = instrument_df[
+                (instrument_df['name'] == active_instrument) & 
+                (instrument_df['instrumenttype'] == 'OPTIDX') &
+                (instrument_df['expiry'] >= today)
+            ]['expiry'].unique()
+        
+        weekly_expiries = [exp for exp in all_expiries if (exp > today) and (exp <= today + timedelta(days=10))]
+        
+        if not weekly_expiries:
+            st.warning(f"No near-term weekly expiries found for {active_instrument}.")
+        else:
+            selected_weekly_expiry = st.selectbox("Select Weekly Expiry", options=sorted(weekly_expiries))
+            
+            base_short_legs = [l for l in processed_legs if l['side'] == 'short' and l['strategy'].startswith('base_') and l['status'] == 'active']
+            total_premium_points = 0
+            call_strike = None
+            put_strike = None
+            
+            if base_short_legs:
+                total_premium_points = sum(l['entry_premium'] for l in base_short_legs)
+                
+                ce_legs = [l['strike'] for l in base_short_legs if l['type'] == 'CE']
+                pe_legs = [l['strike'] for l in base_short_legs if l['type'] == 'PE']
+                
+                if ce_legs: call_strike = max(ce_legs)
+                if pe_legs: put_strike = min(pe_legs)
+                
+                if call_strike and not put_strike: put_strike = call_strike
+                if put_strike and not call_strike: call_strike = put_strike
+
+            if call_strike is None or put_strike is None:
+                st.warning("Add active 'base_straddle' or 'base_strangle' legs and **update their 'Entry' price** to calculate break-evens.")
+            else:
+                step = INDEX_MAP[active_instrument]["step"]
+                
+                put_be_strike = put_strike - total_premium_points
+                call_be_strike = call_strike + total_premium_points
+                
+                put_hedge_strike = round(put_be_strike / step) * step
+                call_hedge_strike = round(call_be_strike / step) * step
+                
+                st.info(f"Total Active Premium: **{total_premium_points:,.2f} pts**\n\n"
+                        f"Call Break-Even: {call_strike:,.0f} + {total_premium_points:,.2f} = **{call_be_strike:,.2f}**\n\n"
+                        f"Put Break-Even: {put_strike:,.0f} - {total_premium_points:,.2f} = **{put_be_strike:,.2f}**")
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.button(f"Buy {put_hedge_strike} PE (Weekly)", 
+                              on_click=fragment_action, 
+                              args=(LEG_FRAGMENTS, add_weekly_hedge, active_group_id, active_instrument, selected_weekly_expiry, put_hedge_strike, "PE"),
+                              use_container_width=True
+                    )
+                with col2:
+                    st.button(f"Buy {call_hedge_strike} CE (Weekly)", 
+                              on_click=fragment_action, 
+                              args=(LEG_FRAGMENTS, add_weekly_hedge, active_group_id, active_instrument, selected_weekly_expiry, call_hedge_strike, "CE"),
+                              use_container_width=True
+                    )
+
+def render_option_chain(active_group_id):
+    active_group = st.session_state.strategy_groups.get(active_group_id)
+    if active_group is None:
+        return
+
+    st.header("Market Selector")
+    instrument_df = st.session_state.instrument_list
+    today = date.today()
+
+    sc1, sc2 = st.columns(2)
+    with sc1:
+        selected_instrument_for_chain = st.selectbox(
+            "Select Instrument (for Chain)", 
+            ["NIFTY", "BANKNIFTY", "FINNIFTY"],
+            key="selected_instrument_chain",
+        )
+
+    instrument_options = pd.DataFrame()
+    if instrument_df is not None:
+        instrument_options = instrument_df[
+            (instrument_df['name'] == selected_instrument_for_chain) & 
+            (instrument_df['instrumenttype'] == 'OPTIDX') &
+            (instrument_df['expiry'] >= today)
+        ]
+
+    if instrument_options.empty:
+        st.warning(f"No active options found for {selected_instrument_for_chain}.")
+    else:
+        with sc2:
+            unique_expiries = sorted(instrument_options['expiry'].unique())
+            selected_expiry_for_chain = st.selectbox(
+                "Select Expiry Date",
+                options=unique_expiries,
+                key="selected_expiry_chain"
+            )
+        
+        with PROFILER.timer("chain_merge"):
+            chain_df = instrument_options[
+                instrument_options['expiry'] == selected_expiry_for_chain
+            ].copy() 
+        
+            chain_df['lotsize'] = chain_df['name'].map({k: v['lot_size'] for k, v in INDEX_MAP.items()})
+
+            calls_df = chain_df[chain_df['symbol'].str.endswith('CE')][['strike', 'symbol', 'token', 'exch_seg', 'lotsize']]
+            puts_df = chain_df[chain_df['symbol'].str.endswith('PE')][['strike', 'symbol', 'token', 'exch_seg', 'lotsize']]
+        
+            full_chain = pd.merge(
+                calls_df, 
+                puts_df, 
+                on='strike', 
+                suffixes=('_CE', '_PE')
+            ).sort_values(by='strike').reset_index(drop=True)
+        
+            full_chain['lotsize_CE'] = full_chain['lotsize_CE'].fillna(full_chain['lotsize_PE'])
+            full_chain['lotsize_PE'] = full_chain['lotsize_PE'].fillna(full_chain['lotsize_CE'])
+        
+        st.session_state.current_chain = full_chain
+
+    st.markdown("---")
+
+    if active_group.get('status') == 'closed':
+        st.warning(f"This strategy '{active_group['name']}' is closed. You cannot add new legs. Please create a new strategy.")
+
+    if active_group['instrument'] != selected_instrument_for_chain:
+        st.warning(f"This chain is for {selected_instrument_for_chain}, but your active strategy '{active_group['name']}' is for {active_group['instrument']}. New legs will be added to '{active_group['name']}'.", icon="ℹ️")
+
+    st.header(f"Manual Leg Builder: {selected_instrument_for_chain} ({selected_expiry_for_chain})")
+
+    chain_spot_price = st.session_state.all_index_prices.get(selected_instrument_for_chain, 0.0)
+    chain_atm_strike = 0.0
+
+    if chain_spot_price > 0:
+        step = INDEX_MAP[selected_instrument_for_chain]["step"]
+        chain_atm_strike = round(chain_spot_price / step) * step
+        st.info(f"**Live Spot ({selected_instrument_for_chain}):** {chain_spot_price:,.2f} | **Nearest ATM Strike:** {chain_atm_strike:,.0f}")
+    else:
+        st.info("Fetching spot price... (Click 'Refresh' in sidebar if needed)")
+        st.button("Fetch Spot Price", on_click=fragment_action, args=(INDEX_FRAGMENTS, refresh_all_index_prices))
+
+
+    st.markdown("---")
+    filtered_chain_df = st.session_state.current_chain
+
+    if not filtered_chain_df.empty:
+        f1, f2 = st.columns([1, 3])
+        with f1:
+            show_atm_only = st.checkbox(f"Show Near ATM (±{10 * INDEX_MAP[selected_instrument_for_chain]['step']} pts)", value=True)
+        with f2:
+            all_strikes = filtered_chain_df['strike'].tolist()
+            min_strike, max_strike = all_strikes[0], all_strikes[-1]
+            if len(all_strikes) > 1:
+                strike_range = st.select_slider("Filter Strike Range", options=all_strikes, value=(min_strike, max_strike))
+            else:
+                strike_range = (min_strike, max_strike)
+        
+        filtered_chain_df = filtered_chain_df[
+            (filtered_chain_df['strike'] >= strike_range[0]) & 
+            (filtered_chain_df['strike'] <= strike_range[1])
+        ]
+        
+        if show_atm_only and chain_atm_strike > 0:
+            atm_range = 10 * INDEX_MAP[selected_instrument_for_chain]["step"]
+            filtered_chain_df = filtered_chain_df[
+                (filtered_chain_df['strike'] >= chain_atm_strike - atm_range) & 
+                (filtered_chain_df['strike'] <= chain_atm_strike + atm_range) 
+            ]
+    st.markdown("---")
+
+    # One grid widget for the whole chain: the browser only draws the rows in view, so
+    # render time no longer grows with the number of strikes (it used to be 4 buttons per strike)
+    is_disabled = (active_group.get('status') == 'closed') # Disable buttons if strategy is closed
+    chain_view = filtered_chain_df.reset_index(drop=True)
+    chain_display = chain_view.reindex(columns=['symbol_CE', 'strike', 'symbol_PE']).rename(
+        columns={'symbol_CE': "CALL Symbol", 'strike': "Strike", 'symbol_PE': "PUT Symbol"}
+    )
+    atm_rows = set(chain_display.index[chain_display['Strike'] == chain_atm_strike]) if chain_atm_strike > 0 else set()
+    chain_styled = chain_display.style.apply(
+        lambda r: ['background-color: rgba(33, 195, 84, 0.2)' if r.name in atm_rows else ''] * len(r), axis=1
+    ) if atm_rows else chain_display
+
+    chain_event = st.dataframe(
+        chain_styled,
+        key="chain_grid",
+        on_select="rerun",
+        selection_mode="single-row",
+        hide_index=True,
+        use_container_width=True,
+        height=600,
+        column_config={"Strike": st.column_config.NumberColumn("Strike", format="%.0f")},
+    )
+
+    selected_rows = chain_event.selection.rows if chain_event else []
+    selected_row = None
+    if selected_rows and selected_rows[0] < len(chain_view): # The selection can outlive a filter change
+        selected_row = chain_view.iloc[selected_rows[0]]
+
+    if selected_row is None:
+        st.caption("Select a strike in the chain to trade it.")
+    else:
+        st.markdown(f"**Selected Strike:** {selected_row['strike']:,.0f}" + (" (ATM)" if selected_row['strike'] == chain_atm_strike else ""))
+    a1, a2, a3, a4 = st.columns(4)
+    for col, side, opt_type, label in [
+        (a1, "short", "CE", "Sell CALL"), (a2, "long", "CE", "Buy CALL"),
+        (a3, "long", "PE", "Buy PUT"), (a4, "short", "PE", "Sell PUT"),
+    ]:
+        if selected_row is None:
+            col.button(label, key=f"chain_{side}_{opt_type}", disabled=True, use_container_width=True)
+        else:
+            col.button(label, key=f"chain_{side}_{opt_type}",
+                       help=f"{label.split()[0]} {selected_row[f'symbol_{opt_type}']}",
+                       on_click=fragment_action,
+                       args=(LEG_FRAGMENTS, add_leg_to_group, active_group_id, side, opt_type, selected_row['strike'], selected_row[f'symbol_{opt_type}'],
+                             selected_row[f'token_{opt_type}'], selected_row[f'exch_seg_{opt_type}'], selected_row[f'lotsize_{opt_type}']),
+                       disabled=is_disabled, use_container_width=True)
+
+def render_trade_history():
+    st.header("📓 Trade History Log")
+    st.info("This shows the most recent actions at the top.")
+
+    # --- MODIFIED Button ---
+    if st.button("Clear History", on_click=clear_trade_history):
+        pass # Logic is now in the callback function
+
+    trade_log = st.session_state.trade_history
+    if not trade_log:
+        st.warning("No trade actions have been recorded yet.")
+    else:
+        # Filters use the per-group / per-action indexes, so nothing here scans the full log
+        h1, h2, h3 = st.columns([2, 2, 1])
+        with h1:
+            history_group = st.selectbox(
+                "Strategy",
+                options=[None] + trade_log.group_ids(),
+                format_func=lambda gid: "All strategies" if gid is None else trade_log.group_name(gid),
+                key="history_group_filter"
+            )
+        with h2:
+            history_action = st.selectbox(
+                "Action",
+                options=[None] + trade_log.action_types(),
+                format_func=lambda a: "All actions" if a is None else history.ACTION_LABELS.get(a, a),
+                key="history_action_filter"
+            )
+        with h3:
+            history_page_size = st.selectbox("Per page", [25, 50, 100], index=1, key="history_page_size")
+
+        history_total = trade_log.count(group_id=history_group, action=history_action)
+        history_pages = max(1, -(-history_total // history_page_size))
+        if st.session_state.get("history_page", 1) > history_pages:
+            st.session_state.history_page = history_pages # Filter shrank the result
+        history_page = st.number_input(f"Page (of {history_pages}, {history_total} entries)",
+                                       min_value=1, max_value=history_pages, value=1, step=1, key="history_page")
+
+        page_records = trade_log.page(history_page - 1, history_page_size, group_id=history_group, action=history_action)
+        log_container = st.container(height=500)
+        if not page_records:
+            log_container.info("No entries match these filters.")
+        else:
+            log_text = "\n\n".join([f"- {history.format_record(record)}" for record in page_records])
+            log_container.markdown(log_text)
+
+
+# --- Main App UI ---
+st.title("🔥 Professional Firefighting Dashboard")
+
+# --- Check for post-selection refresh ---
+if 'refresh_on_select' in st.session_state and st.session_state['refresh_on_select']:
+    group_id_to_refresh = st.session_state['refresh_on_select']
+    if group_id_to_refresh in st.session_state.strategy_groups:
+        refresh_all_prices(group_id_to_refresh)
+    st.session_state['refresh_on_select'] = None # Clear the flag
+
+
+ensure_broker_session() # Proactive JWT renewal (no-op until it is close to expiry)
+
+if st.session_state.access_token:
+    # --- LOGGED IN STATE ---
+    
+    with st.sidebar:
+        try:
+            user_name = st.session_state.user_profile['data']['name']
+            st.success(f"Welcome, {user_name}!")
+        except (TypeError, KeyError):
+            st.success("Welcome, User!")
+        replay = st.session_state.get("market_data")
+        if replay is not None:
+            st.info(f"⏪ Replay time {replay.now():%Y-%m-%d %H:%M:%S}" + (" (finished)" if replay.finished else ""))
+        
+        st.markdown("---")
+        st.header("📈 Index Monitor")
+        run_fragment("index_monitor", render_index_monitor, run_every=live_refresh_interval()) # Mirrors prices fetched by auto-refresh
+        
+        st.markdown("---")
+        
+        st.header("📋 Strategy Portfolios")
+        
+        if st.button("Create New Strategy", type="primary", use_container_width=True):
+            new_strategy_dialog()
+            
+        run_fragment("strategy_list", render_strategy_list)
+        st.markdown("---")
+        with st.expander("💾 Storage"):
+            persist_stats = get_active_shared_state().stats()
+            st.caption(f"Backend: {STORAGE_BACKEND} | Pending: {'yes' if persist_stats['pending'] else 'no'}")
+            st.caption(f"Writes: {persist_stats['writes']} ({persist_stats['coalesced']} saves coalesced) | "
+                       f"Written: {persist_stats['bytes_written'] / 1024:,.1f} KB")
+            st.caption(f"Flush latency: {persist_stats['last_flush_latency_ms']:,.0f} ms (max {persist_stats['max_flush_latency_ms']:,.0f} ms) | "
+                       f"Write: {persist_stats['last_write_ms']:,.1f} ms")
+            st.caption(f"Data version: {persist_stats['version']} | Merged commits: {persist_stats['merged_commits']} | "
+                       f"External reloads: {persist_stats['external_reloads']}")
+            if persist_stats['errors']:
+                st.error(f"{persist_stats['errors']} failed writes. Last error: {persist_stats['last_error']}")
+            st.button("🗃️ Write Analytics Dump", key="run_bulk_export", on_click=run_bulk_export, use_container_width=True)
+            bulk_result = st.session_state.get('bulk_export_result')
+            if bulk_result and 'error' in bulk_result:
+                st.error(f"Analytics dump failed: {bulk_result['error']}")
+            elif bulk_result:
+                st.caption(f"{bulk_result['fmt'].upper()} in {BULK_EXPORT_DIR}/ | Legs: {bulk_result['legs']['rows']} rows "
+                           f"({bulk_result['legs']['files']} files) | History: {bulk_result['history']['rows']} rows")
+        with st.expander("⏱️ Render Timings"):
+            st.fragment(render_timings_panel, key="render_timings")()
+
+    # --- Main Page Display ---
+    
+    show_diagnostics = DIAGNOSTICS_ENABLED or st.query_params.get("diagnostics") == "1"
+    tab_dash, tab_portfolio, tab_chain, tab_history, *tab_diagnostics = st.tabs([
+        "📈 Dashboard", 
+        "🧭 Portfolio",
+        "⛓️ Option Chain", 
+        "📓 Trade History"
+    ] + (["🩺 Diagnostics"] if show_diagnostics else []))
+
+    with tab_portfolio:
+        run_fragment("portfolio", render_portfolio, run_every=live_refresh_interval()) # Mirrors prices fetched anywhere
+
+    if st.session_state.active_group_id is None:
+        msg = "Please create or select a strategy from the sidebar to begin."
+        tab_dash.info(msg)
+        tab_chain.info(msg)
+    
+    elif st.session_state.active_group_id not in st.session_state.strategy_groups:
+         st.session_state.active_group_id = None
+         st.rerun() 
+         
+    else:
+        active_group_id = st.session_state.active_group_id
+        ensure_group_loaded(active_group_id) # Full legs, even if it started as a summary
+
+        # --- TAB 1: Dashboard & Firefighting ---
+        with tab_dash:
+            run_fragment("live_dashboard", render_live_dashboard, active_group_id, run_every=live_refresh_interval())
+
+        # --- TAB 2: Option Chain (Manual Builder) ---
+        with tab_chain:
+            run_fragment("option_chain", render_option_chain, active_group_id)
+
+        # --- TAB 3: Trade History ---
+        with tab_history:
+            run_fragment("trade_history", render_trade_history)
+
+    if tab_diagnostics:
+        with tab_diagnostics[0]:
+            st.fragment(render_diagnostics, key="diagnostics")()
+
+else:
+    # --- LOGGED OUT STATE ---
+    st.warning("Please log in to connect to Angel One and start the app.")
+    resume = False
+    if SESSION_AUTO_RESUME and TOKEN_CACHE_FILE and not st.session_state.get("session_resume_tried"):
+        # A cached, unexpired session from before a restart: reconnect without asking
+        st.session_state.session_resume_tried = True
+        from broker_session import TokenCache
+        resume = TokenCache(TOKEN_CACHE_FILE).load(CLIENT_ID, API_KEY) is not None
+    if st.button("Login to Angel One") or resume:
+        with st.spinner("Logging in, please wait..."):
+            login_to_angel()
+    if REPLAY_SOURCE:
+        st.caption(f"Replay source: `{REPLAY_SOURCE}` "
+                   + (f"({REPLAY_STEP_SECONDS:g}s per refresh)" if REPLAY_STEP_SECONDS else f"({REPLAY_SPEED:g}x real time)"))
+        if st.button("▶️ Start Offline Replay Session"):
+            with st.spinner("Loading replay data..."):
+                start_replay_session()
+
+# --- Auto-Refresh ---
+# Handled by the live fragments' run_every (see live_refresh_interval): only the dashboard
+# reruns every AUTO_REFRESH_SECONDS, instead of sleeping and then rerunning the whole app.
+record_render_time("app", (time.perf_counter() - app_run_started) * 1000, False)
+
+# --- Startup Timeline milestones ---
+timeline = st.session_state.startup_timeline
+if not timeline.has("first render"):
+    timeline.add("first render", app_run_started)
+if st.session_state.access_token and not timeline.has("dashboard ready"):
+    timeline.add("dashboard ready", app_run_started) # First full run after login
+    print(f"Startup timeline ({startup_summary(timeline)}):\n{timeline.report()}", end="")
\ No newline at end of file
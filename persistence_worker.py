@@ -0,0 +1,152 @@
+"""
+Write-behind persistence for the dashboard state.
+
+`save_data()` used to rewrite the whole file synchronously on every action, and a
+single firefight click calls it three times. The worker below coalesces those
+notifications: the newest snapshot wins, and it is written once the state has
+been quiet for `debounce` seconds, on a background thread.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+def atomic_write_json(path, payload, **dump_kwargs):
+    """Writes `payload` as JSON via temp file + rename, so a crash never leaves a truncated file.
+
+    Returns the number of bytes written.
+    """
+    data = json.dumps(payload, **dump_kwargs).encode("utf-8")
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return len(data)
+
+
+class PersistenceWorker:
+    """Debounced background writer. `write_fn(payload)` must return the bytes written."""
+
+    def __init__(self, write_fn, debounce=0.25, name="persistence-worker"):
+        self.write_fn = write_fn
+        self.debounce = debounce
+        self._cond = threading.Condition()
+        self._pending = None
+        self._has_pending = False
+        self._first_dirty_at = None
+        self._last_dirty_at = None
+        self._writing = False
+        self._stopped = False
+        self._stats = {
+            "notifications": 0,
+            "writes": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "bytes_written": 0,
+            "last_write_ms": 0.0,
+            "max_write_ms": 0.0,
+            "last_flush_latency_ms": 0.0,
+            "max_flush_latency_ms": 0.0,
+            "last_error": None,
+        }
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def notify(self, payload):
+        """Queues `payload` (an already detached snapshot) to be written. Never blocks on I/O."""
+        now = time.monotonic()
+        with self._cond:
+            self._stats["notifications"] += 1
+            if self._has_pending:
+                self._stats["coalesced"] += 1
+            else:
+                self._first_dirty_at = now
+            self._pending = payload
+            self._has_pending = True
+            self._last_dirty_at = now
+            self._cond.notify_all()
+
+    def flush(self, timeout=5.0):
+        """Blocks until everything queued so far is on disk. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # Skip the debounce wait for whatever is pending right now
+            self._last_dirty_at = float("-inf") if self._has_pending else self._last_dirty_at
+            self._cond.notify_all()
+            while self._has_pending or self._writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = self._has_pending
+        return stats
+
+    def stop(self):
+        self.flush()
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._has_pending:
+                        wait = self._last_dirty_at + self.debounce - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                if self._stopped and not self._has_pending:
+                    return
+                payload = self._pending
+                first_dirty_at = self._first_dirty_at
+                self._pending = None
+                self._has_pending = False
+                self._writing = True
+
+            started = time.monotonic()
+            error = None
+            written = 0
+            try:
+                written = self.write_fn(payload) or 0
+            except Exception as e:  # Keep the worker alive; the next notify retries with fresh state
+                error = e
+                print(f"Error saving data: {e}")
+            finished = time.monotonic()
+
+            with self._cond:
+                self._writing = False
+                if error is not None:
+                    self._stats["errors"] += 1
+                    self._stats["last_error"] = str(error)
+                else:
+                    write_ms = (finished - started) * 1000
+                    flush_ms = (finished - first_dirty_at) * 1000
+                    self._stats["writes"] += 1
+                    self._stats["bytes_written"] += written
+                    self._stats["last_write_ms"] = write_ms
+                    self._stats["max_write_ms"] = max(self._stats["max_write_ms"], write_ms)
+                    self._stats["last_flush_latency_ms"] = flush_ms
+                    self._stats["max_flush_latency_ms"] = max(self._stats["max_flush_latency_ms"], flush_ms)
+                self._cond.notify_all()
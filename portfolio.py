@@ -0,0 +1,105 @@
+"""
+Portfolio-wide risk overview: P&L, net Greeks, distance to the firefighting triggers and
+the signal state of every active strategy group, in one pass over all their legs.
+
+The legs of all groups are flattened into NumPy arrays once and every per-group figure
+is a weighted bincount over them. The numbers follow calculate_group_stats and the
+firefighting panel, but the prices come from a shared cache (the latest polled LTP per
+token) instead of a refresh per group:
+
+    overview = portfolio_overview(groups, latest_prices, index_prices)
+"""
+import numpy as np
+
+from firefight_rules import INDEX_MAP, averages_into_base
+
+COLUMNS = ["group_id", "name", "instrument", "spot", "active_legs", "total_pnl", "realised_pnl", "unrealised_pnl",
+           "net_delta", "net_theta", "avg_strike", "buffer", "trigger_down", "trigger_up", "distance", "signal", "action"]
+
+
+def _num(value, default=0.0):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return default if np.isnan(value) else value
+
+
+def portfolio_overview(groups, prices=None, index_prices=None):
+    """pandas DataFrame with one row per active group (COLUMNS), closest to a trigger first.
+
+    prices: {token: ltp} used for active legs (falls back to the leg's current_ltp).
+    index_prices: {instrument: spot} (falls back to prices[INDEX_MAP token]).
+    distance: points from spot to the nearer trigger (negative once breached).
+    """
+    import pandas as pd
+    prices = prices or {}
+    index_prices = index_prices or {}
+    active_groups = [(gid, g) for gid, g in groups.items()
+                     if g.get('status') != 'closed' and isinstance(g.get('legs'), list)]
+    if not active_groups:
+        return pd.DataFrame(columns=COLUMNS)
+
+    gi, sign, qty, lots, entry, price, active, delta, theta, strike, averaged = ([] for _ in range(11))
+    for index, (_, group) in enumerate(active_groups):
+        default_lot_size = INDEX_MAP.get(group.get('instrument'), {}).get('lot_size', 25)
+        for leg in group['legs']:
+            is_active = leg.get('status') == 'active'
+            side = leg.get('side')
+            leg_lots = _num(leg.get('lots', 1))
+            gi.append(index)
+            sign.append(1.0 if side == 'short' else -1.0 if side == 'long' else 0.0)
+            lots.append(leg_lots)
+            qty.append(leg_lots * _num(leg.get('lot_size', default_lot_size), default_lot_size))
+            entry.append(_num(leg.get('entry_premium')))
+            if is_active:
+                price.append(_num(prices.get(str(leg.get('token'))), _num(leg.get('current_ltp'))))
+            else:
+                price.append(_num(leg.get('exit_price')))
+            active.append(is_active)
+            delta.append(_num(leg.get('delta')))
+            theta.append(_num(leg.get('theta')))
+            strike.append(_num(leg.get('strike')))
+            averaged.append(averages_into_base(leg))
+
+    n = len(active_groups)
+    gi = np.asarray(gi, dtype=np.int64)
+    sign, qty, lots, entry, price, delta, theta, strike = (
+        np.asarray(a, dtype=np.float64) for a in (sign, qty, lots, entry, price, delta, theta, strike))
+    active = np.asarray(active, dtype=bool)
+    averaged = np.asarray(averaged, dtype=bool)
+
+    def per_group(weights):
+        return np.bincount(gi, weights=weights, minlength=n) if len(gi) else np.zeros(n)
+
+    pnl = sign * (entry - price) * qty
+    realised = per_group(np.where(active, 0.0, pnl))
+    unrealised = per_group(np.where(active, pnl, 0.0))
+    total = realised + unrealised
+    net_delta = per_group(np.where(active, -sign * delta * qty, 0.0))
+    net_theta = per_group(np.where(active, sign * theta * qty, 0.0))
+    short_lots = per_group(np.where(averaged, lots, 0.0))
+    avg_strike = np.divide(per_group(np.where(averaged, strike * lots, 0.0)), short_lots,
+                           out=np.zeros(n), where=short_lots > 0)
+    active_legs = per_group(active.astype(np.float64)).astype(int)
+
+    instruments = [g.get('instrument') for _, g in active_groups]
+    spot = np.array([_num(index_prices.get(i), _num(prices.get(INDEX_MAP.get(i, {}).get('token')))) for i in instruments])
+    buffer = np.array([_num(g.get('buffer', 100), 100.0) for _, g in active_groups])
+    has_base = avg_strike > 0
+    trigger_up = np.where(has_base, avg_strike + buffer, np.nan)
+    trigger_down = np.where(has_base, avg_strike - buffer, np.nan)
+    distance = np.where(has_base & (spot > 0), np.minimum(trigger_up - spot, spot - trigger_down), np.nan)
+    zone = np.where(~has_base, "NO BASE", np.where(spot <= 0, "NO PRICE", np.where(
+        spot > trigger_up, "ADJUST UP", np.where(spot < trigger_down, "ADJUST DOWN", "SAFE"))))
+    breached = np.char.startswith(zone, "ADJUST")
+    action = np.where(breached, np.where(total >= 0, "Shift", "Average"), "")
+
+    table = pd.DataFrame({
+        "group_id": [gid for gid, _ in active_groups], "name": [g.get('name', '') for _, g in active_groups],
+        "instrument": instruments, "spot": spot, "active_legs": active_legs, "total_pnl": total,
+        "realised_pnl": realised, "unrealised_pnl": unrealised, "net_delta": net_delta, "net_theta": net_theta,
+        "avg_strike": np.where(has_base, avg_strike, np.nan), "buffer": buffer, "trigger_down": trigger_down,
+        "trigger_up": trigger_up, "distance": distance, "signal": zone, "action": action,
+    }, columns=COLUMNS)
+    return table.sort_values("distance", na_position="last", ignore_index=True)
@@ -0,0 +1,166 @@
+"""
+Hot-path profiler for the dashboard.
+
+Named timers (broker calls, P&L stats, saves, exports, UI sections) record their
+durations into bounded per-name windows; `summary()` turns each window into
+count / mean / p50 / p95 / p99 / max. One process-wide `PROFILER` is shared by all
+sessions, so the numbers describe the server, not a single tab.
+
+    @PROFILER.timed("refresh_all_prices")
+    def refresh_all_prices(...): ...
+
+    with PROFILER.timer("ui.chain_merge"):
+        ...
+"""
+import contextlib
+import functools
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+DEFAULT_WINDOW = 1000
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile (q in 0..100) of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class Profiler:
+    """Thread-safe named timers. Keeps the last `window` samples (ms) per name."""
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._counts = {}
+        self._errors = {}
+        self.started_at = datetime.now()
+
+    def record(self, name, elapsed_ms, error=False):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(elapsed_ms)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            if error:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000, error)
+
+    def timed(self, name=None):
+        """Decorator form of `timer` (defaults to the function name)."""
+        def decorator(func):
+            label = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(label):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """{name: {count, errors, last_ms, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}} over each window."""
+        with self._lock:
+            windows = {name: list(samples) for name, samples in self._samples.items()}
+            counts = dict(self._counts)
+            errors = dict(self._errors)
+        summary = {}
+        for name in sorted(windows):
+            samples = windows[name]
+            ordered = sorted(samples)
+            summary[name] = {
+                "count": counts.get(name, 0),
+                "errors": errors.get(name, 0),
+                "last_ms": samples[-1],
+                "mean_ms": sum(samples) / len(samples),
+                "p50_ms": percentile(ordered, 50),
+                "p95_ms": percentile(ordered, 95),
+                "p99_ms": percentile(ordered, 99),
+                "max_ms": ordered[-1],
+            }
+        return summary
+
+    def snapshot_text(self):
+        """Plain-text table of `summary()`, for pasting into an issue or saving alongside logs."""
+        lines = [
+            f"Profiler snapshot {datetime.now().isoformat(timespec='seconds')} "
+            f"(since {self.started_at.isoformat(timespec='seconds')}, window {self.window} samples)",
+            f"{'timer':<32}{'count':>8}{'errors':>8}{'last':>10}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}",
+        ]
+        for name, s in self.summary().items():
+            lines.append(
+                f"{name:<32}{s['count']:>8}{s['errors']:>8}{s['last_ms']:>10.1f}{s['mean_ms']:>10.1f}"
+                f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}"
+            )
+        lines.append("(all times in ms)")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._errors.clear()
+            self.started_at = datetime.now()
+
+
+class Timeline:
+    """Named steps of one startup sequence (e.g. cold start -> login -> first dashboard), relative to `t0`."""
+
+    def __init__(self, t0=None):
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self._lock = threading.Lock()
+        self.steps = []  # (label, start offset s, end offset s)
+
+    def add(self, label, started, ended=None):
+        """Records a step from perf_counter values (`ended` defaults to now)."""
+        ended = time.perf_counter() if ended is None else ended
+        with self._lock:
+            self.steps.append((label, started - self.t0, ended - self.t0))
+
+    def mark(self, label):
+        """A zero-length milestone at the current time."""
+        now = time.perf_counter()
+        self.add(label, now, now)
+
+    def has(self, label):
+        with self._lock:
+            return any(step[0] == label for step in self.steps)
+
+    @contextlib.contextmanager
+    def step(self, label):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(label, started)
+
+    def rows(self):
+        with self._lock:
+            return sorted(self.steps, key=lambda s: (s[1], s[2]))
+
+    def report(self):
+        lines = [f"{'step':<40}{'start (s)':>12}{'end (s)':>10}{'took (s)':>10}"]
+        for label, start, end in self.rows():
+            lines.append(f"{label:<40}{start:>12.3f}{end:>10.3f}{end - start:>10.3f}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared by every session of this server process
+PROFILER = Profiler()
@@ -0,0 +1,359 @@
+"""
+Shared, concurrency-safe strategy state for all sessions of one server.
+
+Every browser tab used to hold its own copy of `strategy_groups` and overwrite the
+data file with it, so the last writer silently won. Now there is one canonical copy
+per process (`SharedState`). A session commits the *changes* it made relative to the
+version it last synced (a three-way merge per group and per leg), and a version
+counter tells other sessions when to re-sync, so nobody re-reads the file on every
+rerun.
+
+Writes to disk go through the debounced `PersistenceWorker` and are guarded by a file
+lock plus a stamp check: if another process wrote in the meantime, its changes are
+merged in before we write.
+"""
+import contextlib
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+
+from persistence_worker import PersistenceWorker, atomic_write_json
+from trade_history import TradeHistory, parse_legacy_entry
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Market data that every session refreshes on its own; never treated as a user edit
+VOLATILE_LEG_FIELDS = ("current_ltp",)
+
+
+def _default(o):
+    if hasattr(o, "isoformat"):
+        return o.isoformat()
+    return None
+
+
+def _hash(obj):
+    text = json.dumps(obj, default=_default, sort_keys=True)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def group_fingerprint(group):
+    """(header hash, {leg id: leg hash}) for a full group, None for a lazy summary."""
+    if "lazy_summary" in group:
+        return None
+    header = {k: v for k, v in group.items() if k != "legs"}
+    legs = {}
+    for leg in group.get("legs", []):
+        legs[leg["id"]] = _hash({k: v for k, v in leg.items() if k not in VOLATILE_LEG_FIELDS})
+    return _hash(header), legs
+
+
+def index_groups(groups):
+    return {gid: group_fingerprint(group) for gid, group in groups.items()}
+
+
+def _merge_group(base_fp, ours, our_fp, theirs):
+    """Both sides changed one group: take each side's changed header/legs, ours winning a tie."""
+    base_header, base_legs = base_fp
+    our_header, our_leg_fps = our_fp
+    header_source = ours if our_header != base_header else theirs
+    merged = {k: copy.deepcopy(v) for k, v in header_source.items() if k != "legs"}
+
+    our_legs = {leg["id"]: leg for leg in ours.get("legs", [])}
+    their_ids = set()
+    legs = []
+    for leg in theirs.get("legs", []):
+        lid = leg["id"]
+        their_ids.add(lid)
+        if lid in our_legs:
+            changed_by_us = our_leg_fps[lid] != base_legs.get(lid)
+            legs.append(copy.deepcopy(our_legs[lid]) if changed_by_us else leg)
+        elif lid not in base_legs:
+            legs.append(leg)  # Added by them
+        # else: we removed it
+    for lid, leg in our_legs.items():
+        if lid not in their_ids and lid not in base_legs:
+            legs.append(copy.deepcopy(leg))  # Added by us
+    merged["legs"] = legs
+    return merged
+
+
+def merge_groups(base_index, ours, theirs):
+    """Applies the changes `ours` made relative to `base_index` on top of `theirs`.
+
+    Returns (merged groups, ids of groups whose content came from `ours`). Groups taken
+    from `ours` are deep-copied, so the caller may keep mutating its own dicts.
+    """
+    merged = dict(theirs)
+    taken = set()
+    for gid, group in ours.items():
+        our_fp = group_fingerprint(group)
+        if our_fp is None:
+            continue  # Lazy summary: never loaded, so never changed
+        base_fp = base_index.get(gid)
+        if our_fp == base_fp:
+            continue
+        their_group = theirs.get(gid)
+        their_fp = group_fingerprint(their_group) if their_group is not None else None
+        if their_group is None or base_fp is None or their_fp is None or their_fp == base_fp:
+            # New group, or only we touched it
+            merged[gid] = copy.deepcopy(group)
+        else:
+            merged[gid] = _merge_group(base_fp, group, our_fp, their_group)
+        taken.add(gid)
+    for gid in base_index:
+        if gid not in ours:
+            merged.pop(gid, None)  # We deleted it
+            taken.add(gid)
+    return merged, taken
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive inter-process lock on `path` (a dedicated lock file)."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class JsonBackend:
+    """The single strategy_data.json file. The stamp is (mtime, size).
+
+    The file keeps the full trade history. Entries older than the bounded in-memory view are
+    carried over from the last read/write and written after it, like the SQLite archive.
+    """
+
+    def __init__(self, path, dump_default=None):
+        self.path = path
+        self.dump_default = dump_default or _default
+        self._history = []  # Full newest-first history as last read or written
+
+    def lock(self):
+        return file_lock(self.path + ".lock")
+
+    def stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def read(self):
+        if not os.path.exists(self.path):
+            self._history = []
+            return {}, []
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        groups = data.get("strategy_groups", {})
+        # Legacy strings become records here, so each keeps one id from now on
+        names = {g.get("name"): gid for gid, g in groups.items()}
+        self._history = [parse_legacy_entry(entry, names) if isinstance(entry, str) else entry
+                         for entry in data.get("trade_history", [])]
+        return groups, self._history
+
+    def write(self, groups, history, clear_history=False):
+        older = []
+        if not clear_history:
+            # The in-memory view only ever drops its oldest entries, so whatever it lacks is older
+            kept = {entry.get("id") for entry in history}
+            older = [entry for entry in self._history if entry.get("id") not in kept]
+        full_history = history + older
+        payload = {"strategy_groups": groups, "trade_history": full_history}
+        written = atomic_write_json(self.path, payload, indent=4, default=self.dump_default)
+        self._history = full_history
+        return written
+
+
+class SQLiteBackend:
+    """A `SQLiteStore`. The stamp is SQLite's data_version, which moves when another connection commits."""
+
+    def __init__(self, store, load_kwargs=None):
+        self.store = store
+        self.load_kwargs = load_kwargs or {}
+
+    def lock(self):
+        # Held across stamp check, merge and save, so another process can't commit in between
+        return file_lock(self.store.path + ".lock")
+
+    def stamp(self):
+        return self.store.data_version()
+
+    def read(self):
+        return self.store.load(**self.load_kwargs)
+
+    def write(self, groups, history, clear_history=False):
+        return self.store.save(groups, history, clear_history=clear_history)
+
+
+class SharedState:
+    """Canonical strategy groups and trade history for every session of this process."""
+
+    def __init__(self, backend, history_limit, debounce=0.25, poll_interval=1.0):
+        self.backend = backend
+        self.history_limit = history_limit
+        self.poll_interval = poll_interval
+        self._lock = threading.RLock()
+        self.version = 0
+        self.groups = {}
+        self.history = TradeHistory(max_records=history_limit)
+        self._overflow = []               # Records evicted from `history` before reaching the backend
+        self._index = {}
+        self._disk_stamp = None
+        self._disk_index = {}
+        self._disk_history_ids = set()
+        self._last_poll = 0.0
+        self.external_reloads = 0
+        self.merged_commits = 0
+        self._history_clears = 0          # clear_history() calls so far...
+        self._history_clears_written = 0  # ...and how many of them reached the backend
+        with self.backend.lock():
+            self._read_disk_locked()
+        self.worker = PersistenceWorker(self._write, debounce=debounce)
+
+    # --- Reading (sessions) ---
+    def snapshot(self):
+        """(version, groups, history records newest-first, fingerprint index). Treat all as read-only."""
+        with self._lock:
+            return self.version, dict(self.groups), self.history.to_list(), dict(self._index)
+
+    def get_group(self, group_id):
+        with self._lock:
+            return self.groups.get(group_id)
+
+    def poll(self, force=False):
+        """Picks up writes made by other processes. Cheap: one stat (or PRAGMA) per poll_interval."""
+        now = time.monotonic()
+        if not force and now - self._last_poll < self.poll_interval:
+            return self.version
+        self._last_poll = now
+        if self.backend.stamp() == self._disk_stamp:
+            return self.version
+        with self.backend.lock():
+            with self._lock:
+                if self.backend.stamp() != self._disk_stamp:
+                    self._merge_external_locked()
+                    self.external_reloads += 1
+        return self.version
+
+    # --- Writing (sessions) ---
+    def commit(self, base_version, base_index, groups, new_records):
+        """Merges one session's changes into the canonical state and queues a write.
+
+        Returns (new version, clean). `clean` is False when other sessions committed since
+        `base_version`, i.e. the caller's view is stale and it should re-sync.
+        """
+        with self._lock:
+            clean = base_version == self.version
+            merged, taken = merge_groups(base_index, groups, self.groups)
+            for record in new_records:
+                if record.get("id") not in self.history:
+                    self._append_history_locked(self.history, record)
+            if not taken and not new_records:
+                return self.version, clean
+            if not clean:
+                self.merged_commits += 1
+            self.groups = merged
+            for gid in taken:
+                if gid in merged:
+                    self._index[gid] = group_fingerprint(merged[gid])
+                else:
+                    self._index.pop(gid, None)
+            self.version += 1
+            self._queue_write_locked()
+            return self.version, clean
+
+    def clear_history(self):
+        with self._lock:
+            self.history.clear()
+            self._overflow = []
+            self._history_clears += 1  # The backend archive is only emptied on an explicit clear
+            self.version += 1
+            self._queue_write_locked()
+            return self.version
+
+    def _append_history_locked(self, history, record):
+        evicted = history.append(record)
+        if evicted is not None and evicted.get("id") not in self._disk_history_ids:
+            self._overflow.append(evicted)  # Still has to be written, or it is lost from the archive
+
+    def _history_to_write_locked(self):
+        return self.history.to_list() + self._overflow[::-1]
+
+    def _queue_write_locked(self):
+        # Canonical group dicts are replaced, never mutated, so a shallow copy is a stable snapshot
+        self.worker.notify({"groups": dict(self.groups), "history": self._history_to_write_locked(),
+                            "history_clears": self._history_clears})
+
+    # --- Disk ---
+    def _read_disk_locked(self):
+        groups, history = self.backend.read()
+        self._disk_stamp = self.backend.stamp()
+        self.groups = groups
+        self._index = index_groups(groups)
+        self._disk_index = dict(self._index)
+        self.history = TradeHistory.from_list(history, max_records=self.history_limit,
+                                              group_ids_by_name={g.get("name"): gid for gid, g in groups.items()})
+        self._disk_history_ids = {r.get("id") for r in self.history.to_list()}
+        self.version += 1
+
+    def _merge_external_locked(self):
+        """Another process wrote: rebase our not-yet-written changes onto what is on disk."""
+        their_groups, their_history = self.backend.read()
+        self._disk_stamp = self.backend.stamp()
+        merged, _ = merge_groups(self._disk_index, self.groups, their_groups)
+        ours_pending = [r for r in reversed(self.history.to_list()) if r.get("id") not in self._disk_history_ids]
+        history = TradeHistory.from_list(their_history, max_records=self.history_limit,
+                                         group_ids_by_name={g.get("name"): gid for gid, g in merged.items()})
+        self._disk_history_ids = {r.get("id") for r in history.to_list()}
+        for record in ours_pending:
+            self._append_history_locked(history, record)
+        self.groups = merged
+        self._index = index_groups(merged)
+        self._disk_index = index_groups(their_groups)
+        self.history = history
+        self.version += 1
+
+    def _write(self, snapshot):
+        """PersistenceWorker callback: compare-and-swap write under the file lock."""
+        with self.backend.lock():
+            with self._lock:
+                if self.backend.stamp() != self._disk_stamp:
+                    self._merge_external_locked()
+                    self.external_reloads += 1
+                    snapshot = {"groups": dict(self.groups), "history": self._history_to_write_locked(),
+                                "history_clears": snapshot.get("history_clears", 0)}
+            clears = snapshot.get("history_clears", 0)
+            written = self.backend.write(snapshot["groups"], snapshot["history"],
+                                         clear_history=clears > self._history_clears_written)
+            with self._lock:
+                self._history_clears_written = max(self._history_clears_written, clears)
+                self._disk_stamp = self.backend.stamp()
+                self._disk_index = index_groups(snapshot["groups"])
+                self._disk_history_ids = {r.get("id") for r in snapshot["history"]}
+                self._overflow = [r for r in self._overflow if r.get("id") not in self._disk_history_ids]
+        return written
+
+    def stats(self):
+        stats = self.worker.stats()
+        with self._lock:
+            stats.update(version=self.version, external_reloads=self.external_reloads,
+                         merged_commits=self.merged_commits)
+        return stats
@@ -0,0 +1,461 @@
+"""
+SQLite storage backend for strategy groups, legs and trade history.
+
+Drop-in alternative to the single JSON file used by op_final.py. The database
+runs in WAL mode so readers never block the writer, and `save()` only touches
+the rows that actually changed since the last load/save.
+
+One-shot migration of an existing JSON file:
+
+    python sqlite_store.py migrate strategy_data.json strategy_data.db
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import date, datetime
+
+from trade_history import parse_legacy_entry
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS groups (
+    id          TEXT PRIMARY KEY,
+    name        TEXT NOT NULL,
+    instrument  TEXT,
+    status      TEXT NOT NULL DEFAULT 'active',
+    created_on  TEXT NOT NULL,
+    updated_on  TEXT NOT NULL,
+    row_hash    TEXT NOT NULL,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_groups_status ON groups(status);
+CREATE INDEX IF NOT EXISTS idx_groups_instrument ON groups(instrument);
+CREATE INDEX IF NOT EXISTS idx_groups_updated_on ON groups(updated_on);
+
+CREATE TABLE IF NOT EXISTS legs (
+    id          TEXT PRIMARY KEY,
+    group_id    TEXT NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
+    position    INTEGER NOT NULL,
+    status      TEXT,
+    token       TEXT,
+    strike      REAL,
+    expiry      TEXT,
+    row_hash    TEXT NOT NULL,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_legs_group ON legs(group_id, position);
+CREATE INDEX IF NOT EXISTS idx_legs_status ON legs(status);
+CREATE INDEX IF NOT EXISTS idx_legs_expiry ON legs(expiry);
+
+CREATE TABLE IF NOT EXISTS history (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_date  TEXT NOT NULL,
+    group_id    TEXT,
+    action      TEXT,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_date ON history(event_date);
+CREATE INDEX IF NOT EXISTS idx_history_group ON history(group_id);
+CREATE INDEX IF NOT EXISTS idx_history_action ON history(action);
+CREATE INDEX IF NOT EXISTS idx_history_record_id ON history(json_extract(data, '$.id'));
+"""
+
+
+def _json_default(o):
+    """json.dumps fallback for date-like values (same rule as save_data)."""
+    if isinstance(o, (date, datetime)) or hasattr(o, "isoformat"):
+        return o.isoformat()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def leg_realised_pnl(side, entry, exit_price, lots, lot_size):
+    """P&L locked in by a closed leg (same formula as the dashboard's PnL loop)."""
+    try:
+        points = float(entry or 0) - float(exit_price or 0)
+        qty = float(lots if lots is not None else 1) * float(lot_size or 0)
+    except (TypeError, ValueError):
+        return 0.0
+    if side == "short":
+        return points * qty
+    if side == "long":
+        return -points * qty
+    return 0.0
+
+
+def _dumps(obj):
+    return json.dumps(obj, default=_json_default, sort_keys=True)
+
+
+def _history_key(entry):
+    """Identity of a history entry: the record id, or the text of a legacy string entry."""
+    if isinstance(entry, dict) and entry.get("id"):
+        return entry["id"]
+    return _dumps(entry)
+
+
+def _hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class SQLiteStore:
+    """Row-level persistence of the `strategy_groups` / `trade_history` state."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        # Hashes of what is currently on disk, used to skip unchanged rows
+        self._group_hashes = {}
+        self._leg_hashes = {}
+        self._history_synced = False  # True once _history_head reflects the table
+        self._history_head = None
+        self._legacy_checked = False  # Legacy string history rows are upgraded once per connection
+
+    # --- Reading ---
+    def data_version(self):
+        """Changes whenever another connection (e.g. another server process) commits."""
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM groups LIMIT 1").fetchone() is None
+
+    def load(self, lazy_closed=False, default_lot_sizes=None, history_limit=None):
+        """Returns (strategy_groups, trade_history) as plain dicts/lists.
+
+        With `lazy_closed`, closed groups come back as summaries (see `load_closed_summaries`)
+        and their legs are not read at all. `history_limit` caps how many of the newest history
+        entries are returned; older ones stay archived in the table.
+        """
+        with self._lock:
+            self._group_hashes = {}
+            self._leg_hashes = {}
+            groups = self._read_groups("status != 'closed'" if lazy_closed else None, ())
+            if lazy_closed:
+                groups.update(self.load_closed_summaries(default_lot_sizes))
+            if not self._legacy_checked:
+                self._upgrade_legacy_history({g.get("name"): gid for gid, g in groups.items()})
+
+            history = [json.loads(data) for (data,) in self._conn.execute(
+                "SELECT data FROM history ORDER BY seq DESC LIMIT ?", (-1 if history_limit is None else history_limit,)
+            )]
+            self._history_synced = True
+            self._history_head = _history_key(history[0]) if history else None
+            return groups, history
+
+    def load_groups(self, status=None, instrument=None, group_ids=None):
+        """Loads full groups (with legs) matching the given filters."""
+        clauses, params = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if instrument is not None:
+            clauses.append("instrument = ?")
+            params.append(instrument)
+        if group_ids is not None:
+            group_ids = list(group_ids)
+            if not group_ids:
+                return {}
+            clauses.append(f"id IN ({','.join('?' * len(group_ids))})")
+            params.extend(group_ids)
+        with self._lock:
+            return self._read_groups(" AND ".join(clauses) or None, params)
+
+    def load_closed_summaries(self, default_lot_sizes=None):
+        """Lightweight closed groups: header fields plus `lazy_summary` (leg count, realised P&L).
+
+        `default_lot_sizes` maps instrument -> lot size for legs saved without one.
+        """
+        default_lot_sizes = default_lot_sizes or {}
+        with self._lock:
+            summaries = {}
+            for gid, data in self._conn.execute("SELECT id, data FROM groups WHERE status = 'closed'"):
+                header = json.loads(data)
+                header["lazy_summary"] = {"leg_count": 0, "realised_pnl": 0.0}
+                summaries[gid] = header
+
+            # Only the handful of numeric fields needed for P&L are extracted; leg JSON is never parsed here
+            for gid, instrument, side, status, entry, exit_price, lots, lot_size in self._conn.execute(
+                """SELECT l.group_id, g.instrument, json_extract(l.data, '$.side'), l.status,
+                          json_extract(l.data, '$.entry_premium'), json_extract(l.data, '$.exit_price'),
+                          json_extract(l.data, '$.lots'), json_extract(l.data, '$.lot_size')
+                   FROM legs l JOIN groups g ON g.id = l.group_id
+                   WHERE g.status = 'closed'"""
+            ):
+                summary = summaries[gid]["lazy_summary"]
+                summary["leg_count"] += 1
+                if status == "closed":
+                    if lot_size is None:
+                        lot_size = default_lot_sizes.get(instrument, 0)
+                    summary["realised_pnl"] += leg_realised_pnl(side, entry, exit_price, lots, lot_size)
+            return summaries
+
+    def iter_groups(self):
+        """Yields full groups one at a time (bulk export), so only one group's legs are in memory."""
+        with self._lock:
+            group_ids = [gid for (gid,) in self._conn.execute("SELECT id FROM groups ORDER BY created_on, id")]
+        for gid in group_ids:
+            with self._lock:
+                row = self._conn.execute("SELECT data FROM groups WHERE id = ?", (gid,)).fetchone()
+                if row is None:
+                    continue  # Deleted meanwhile
+                group = json.loads(row[0])
+                group["legs"] = [json.loads(data) for (data,) in self._conn.execute(
+                    "SELECT data FROM legs WHERE group_id = ? ORDER BY position", (gid,)
+                )]
+            yield group
+
+    def iter_history(self, batch_size=1000):
+        """Yields every archived history entry, oldest first, reading `batch_size` rows at a time."""
+        last_seq = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT seq, data FROM history WHERE seq > ? ORDER BY seq LIMIT ?", (last_seq, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for seq, data in rows:
+                yield json.loads(data)
+            last_seq = rows[-1][0]
+
+    def history_time_index(self):
+        """(leg id -> first ADD_LEG timestamp, group id -> earliest timestamp), straight from SQL.
+
+        Same as bulk_export's pass over the history, without reading the records into Python.
+        """
+        with self._lock:
+            leg_ts = dict(self._conn.execute(
+                """SELECT json_extract(data, '$.leg_id'), MIN(json_extract(data, '$.ts')) FROM history
+                   WHERE json_extract(data, '$.action') = 'ADD_LEG' AND json_extract(data, '$.leg_id') IS NOT NULL
+                         AND json_extract(data, '$.ts') IS NOT NULL
+                   GROUP BY 1"""
+            ).fetchall())
+            group_ts = dict(self._conn.execute(
+                """SELECT json_extract(data, '$.group_id'), MIN(json_extract(data, '$.ts')) FROM history
+                   WHERE json_extract(data, '$.group_id') IS NOT NULL AND json_extract(data, '$.ts') IS NOT NULL
+                   GROUP BY 1"""
+            ).fetchall())
+        return leg_ts, group_ts
+
+    def _upgrade_legacy_history(self, group_ids_by_name):
+        """Stores old preformatted string rows as parsed records, so each keeps one stable id.
+
+        Otherwise every load would parse them into records with fresh ids, and the next save
+        could not tell them apart from new entries.
+        """
+        rows = self._conn.execute("SELECT seq, data FROM history WHERE json_type(data) = 'text'").fetchall()
+        if rows:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                for seq, data in rows:
+                    record = parse_legacy_entry(json.loads(data), group_ids_by_name)
+                    cur.execute("UPDATE history SET group_id = ?, action = ?, data = ? WHERE seq = ?",
+                                (record.get("group_id"), record.get("action"), _dumps(record), seq))
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        self._legacy_checked = True
+
+    def _read_groups(self, where, params):
+        where = f" WHERE {where}" if where else ""
+        groups = {}
+        for gid, row_hash, data in self._conn.execute(f"SELECT id, row_hash, data FROM groups{where}", params):
+            group = json.loads(data)
+            group["legs"] = []
+            groups[gid] = group
+            self._group_hashes[gid] = row_hash
+        if groups:
+            marks = ",".join("?" * len(groups))
+            for lid, gid, row_hash, data in self._conn.execute(
+                f"SELECT id, group_id, row_hash, data FROM legs WHERE group_id IN ({marks}) ORDER BY group_id, position",
+                list(groups),
+            ):
+                groups[gid]["legs"].append(json.loads(data))
+                self._leg_hashes[lid] = row_hash
+        return groups
+
+    # --- Writing ---
+    def save(self, strategy_groups, trade_history, clear_history=False, prune=True):
+        """Writes only the groups, legs and history entries that changed. Returns bytes of row data written.
+
+        History entries are only ever appended; `clear_history` empties the archived table first.
+        Groups in the table but not in `strategy_groups` are deleted, unless `prune` is False.
+        """
+        today = date.today().isoformat()
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                written = self._save_groups(cur, strategy_groups, today, prune)
+                written += self._save_history(cur, trade_history, today, clear_history)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                # Our hash cache may no longer match the disk; force a full compare next time
+                self._group_hashes, self._leg_hashes = {}, {}
+                self._history_synced, self._history_head = False, None
+                raise
+            return written
+
+    def _save_groups(self, cur, strategy_groups, today, prune=True):
+        written = 0
+        for gid, group in strategy_groups.items():
+            if "lazy_summary" in group:
+                # Not loaded by the caller, so nothing in it can have changed
+                continue
+            header = {k: v for k, v in group.items() if k != "legs"}
+            header_json = _dumps(header)
+            legs = group.get("legs", [])
+            # Leg ids are folded into the header hash so a removed leg marks the group as changed
+            header_hash = _hash(header_json + "|" + ",".join(leg["id"] for leg in legs))
+            changed = False
+            if self._group_hashes.get(gid) != header_hash:
+                cur.execute(
+                    """INSERT INTO groups (id, name, instrument, status, created_on, updated_on, row_hash, data)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(id) DO UPDATE SET
+                           name=excluded.name, instrument=excluded.instrument, status=excluded.status,
+                           updated_on=excluded.updated_on, row_hash=excluded.row_hash, data=excluded.data""",
+                    (gid, header.get("name", ""), header.get("instrument"), header.get("status", "active"),
+                     today, today, header_hash, header_json),
+                )
+                self._group_hashes[gid] = header_hash
+                written += len(header_json)
+                changed = True
+
+            leg_ids = []
+            for position, leg in enumerate(legs):
+                lid = leg["id"]
+                leg_ids.append(lid)
+                leg_json = _dumps(leg)
+                # Position is part of the hash so re-ordered legs are rewritten too
+                leg_hash = _hash(f"{position}|{leg_json}")
+                if self._leg_hashes.get(lid) == leg_hash:
+                    continue
+                expiry = leg.get("expiry")
+                cur.execute(
+                    """INSERT INTO legs (id, group_id, position, status, token, strike, expiry, row_hash, data)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(id) DO UPDATE SET
+                           group_id=excluded.group_id, position=excluded.position, status=excluded.status,
+                           token=excluded.token, strike=excluded.strike, expiry=excluded.expiry,
+                           row_hash=excluded.row_hash, data=excluded.data""",
+                    (lid, gid, position, leg.get("status"), leg.get("token"), leg.get("strike"),
+                     expiry.isoformat() if hasattr(expiry, "isoformat") else expiry, leg_hash, leg_json),
+                )
+                self._leg_hashes[lid] = leg_hash
+                written += len(leg_json)
+                changed = True
+
+            if changed:
+                # Legs removed from this group since the last save
+                marks = ",".join("?" * len(leg_ids))
+                for (lid,) in cur.execute(
+                    f"SELECT id FROM legs WHERE group_id = ? AND id NOT IN ({marks})", [gid, *leg_ids]
+                ).fetchall():
+                    cur.execute("DELETE FROM legs WHERE id = ?", (lid,))
+                    self._leg_hashes.pop(lid, None)
+
+        # Deleted groups (legs go with them via ON DELETE CASCADE)
+        if prune:
+            for (gid,) in cur.execute("SELECT id FROM groups").fetchall():
+                if gid not in strategy_groups:
+                    cur.execute("DELETE FROM groups WHERE id = ?", (gid,))
+                    self._group_hashes.pop(gid, None)
+        return written
+
+    def _save_history(self, cur, trade_history, today, clear_history=False):
+        # History is newest-first and only grows at the front (old entries may fall off the
+        # in-memory tail, but stay archived here). If the newest entry we saved last time is
+        # still in the list, only the entries in front of it are new. Otherwise (nothing saved
+        # yet, or after a rolled-back save) the new ones are those whose id is not in the table.
+        appended = None
+        if clear_history:
+            cur.execute("DELETE FROM history")
+            appended = trade_history
+        elif self._history_synced and self._history_head is not None:
+            for i, entry in enumerate(trade_history):
+                if _history_key(entry) == self._history_head:
+                    appended = trade_history[:i]
+                    break
+
+        if appended is None:
+            archived = self._archived_keys(cur, trade_history)
+            appended = [entry for entry in trade_history if _history_key(entry) not in archived]
+
+        # Insert oldest first so `seq` keeps chronological order
+        rows = []
+        for entry in reversed(appended):
+            if isinstance(entry, dict):
+                event_date = (entry.get("ts") or today)[:10]
+                rows.append((event_date, entry.get("group_id"), entry.get("action"), _dumps(entry)))
+            else:
+                rows.append((today, None, None, _dumps(entry)))
+        cur.executemany("INSERT INTO history (event_date, group_id, action, data) VALUES (?, ?, ?, ?)", rows)
+        self._history_synced = True
+        self._history_head = _history_key(trade_history[0]) if trade_history else None
+        return sum(len(row[3]) for row in rows)
+
+    @staticmethod
+    def _archived_keys(cur, entries, chunk_size=500):
+        """History keys (record ids, or the text of legacy strings) of `entries` already in the table."""
+        ids = [entry["id"] for entry in entries if isinstance(entry, dict) and entry.get("id")]
+        texts = [_dumps(entry) for entry in entries if not (isinstance(entry, dict) and entry.get("id"))]
+        archived = set()
+        for column, keys in (("json_extract(data, '$.id')", ids), ("data", texts)):
+            for i in range(0, len(keys), chunk_size):
+                chunk = keys[i:i + chunk_size]
+                archived.update(key for (key,) in cur.execute(
+                    f"SELECT {column} FROM history WHERE {column} IN ({','.join('?' * len(chunk))})", chunk
+                ))
+        return archived
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def migrate_json(json_path, store, prune=True):
+    """Imports an existing strategy_data.json into `store`. Returns (groups, history entries).
+
+    With prune=False groups already in the store but not in the file are kept (a merge).
+    """
+    with open(json_path, "r") as f:
+        data = json.load(f)
+    groups = data.get("strategy_groups", {})
+    history = data.get("trade_history", [])
+    store.save(groups, history, prune=prune)
+    return len(groups), len(history)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Strategy data SQLite tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    mig = sub.add_parser("migrate", help="Import a strategy_data.json file into a SQLite database")
+    mig.add_argument("json_path")
+    mig.add_argument("db_path")
+    mig.add_argument("--force", action="store_true", help="Import into a database that already has groups: groups in the file are "
+                          "inserted or updated, the others are kept")
+    args = parser.parse_args(argv)
+
+    store = SQLiteStore(args.db_path)
+    if not store.is_empty() and not args.force:
+        parser.error(f"{args.db_path} already contains strategy groups (use --force to merge into it)")
+    store.load()  # Prime the row hashes so --force upserts instead of duplicating
+    n_groups, n_history = migrate_json(args.json_path, store, prune=not args.force)
+    store.close()
+    print(f"Imported {n_groups} strategy groups and {n_history} history entries into {args.db_path}")
+
+
+if __name__ == "__main__":
+    main()
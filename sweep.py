@@ -0,0 +1,178 @@
+"""
+Parameter sweep for the firefighting rules: every (buffer, strike rounding) grid point is
+backtested over the same weekly cycles (see backtest.py) for each instrument, and the grid
+is ranked by total P&L, drawdown and adjustment counts.
+
+Work is split by path, not by grid point: each process task takes one cycle's spot path
+and runs the whole grid over a single PathContext, so option premium arrays computed for
+one grid point are reused by every other point that trades the same strikes.
+
+    python sweep.py candles.csv --instruments NIFTY BANKNIFTY --start 2025-01-01 --end 2025-12-31 \\
+        --buffers 50:300:25 --workers 8 --out sweep.csv
+
+Buffers default to 1..6 strike steps of each instrument.
+"""
+import argparse
+import copy
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+from backtest import BacktestParams, PathContext, cycle_inputs, load_option_map, run_cycle, weekly_entry_dates
+from firefight_rules import INDEX_MAP, STRIKE_ROUNDING
+
+RANK_BY = {
+    "pnl": ("total_pnl", False),
+    "drawdown": ("max_drawdown", True),
+    "pnl_to_dd": ("pnl_to_dd", False),
+}
+
+
+def parse_buffers(text):
+    """'50:300:25' (inclusive range) or '75,100,150'."""
+    if ":" in text:
+        lo, hi, step = (float(x) for x in text.split(":"))
+        return [float(b) for b in np.arange(lo, hi + step / 2, step)]
+    return [float(b) for b in text.split(",")]
+
+
+def default_buffers(instrument):
+    step = INDEX_MAP[instrument]["step"]
+    return [float(step * k) for k in range(1, 7)]
+
+
+def make_grid(base, buffers, roundings):
+    grid = []
+    for buffer in buffers:
+        for rounding in roundings:
+            params = copy.copy(base)
+            params.buffer = buffer
+            params.rounding = rounding
+            grid.append(params)
+    return grid
+
+
+def sweep_path(grid, inputs):
+    """Process-pool task: the whole grid over one cycle -> (per-point stats, cache hits, misses)."""
+    _entry_day, expiry_ns, ts, px, options = inputs
+    ctx = PathContext(ts, px, expiry_ns, grid[0].iv, grid[0].rate, options)
+    stats = []
+    for params in grid:
+        _trades, equity, summary = run_cycle(params, ctx)
+        stats.append((summary["pnl"], float(equity.max()), float(equity.min()), summary["max_drawdown"],
+                      summary["shifts"], summary["averages"], summary["adjustments"] >= params.max_adjustments))
+    return stats, ctx.hits, ctx.misses
+
+
+def _combine(per_cycle):
+    """Cycle results in date order -> totals, with max drawdown of the cumulative equity curve."""
+    carried = peak = 0.0
+    drawdown = 0.0
+    shifts = averages = wins = capped = 0
+    for pnl, high, low, internal_dd, n_shift, n_avg, hit_cap in per_cycle:
+        drawdown = max(drawdown, internal_dd, peak - (carried + low))
+        peak = max(peak, carried + high)
+        carried += pnl
+        shifts += n_shift
+        averages += n_avg
+        wins += pnl > 0
+        capped += hit_cap
+    cycles = len(per_cycle)
+    return {
+        "total_pnl": carried, "max_drawdown": drawdown,
+        "pnl_to_dd": carried / drawdown if drawdown else float("inf") if carried > 0 else 0.0,
+        "win_rate": wins / cycles if cycles else 0.0, "cycles": cycles,
+        "adjustments": shifts + averages, "shifts": shifts, "averages": averages,
+        "adjustments_per_cycle": (shifts + averages) / cycles if cycles else 0.0,
+        "capped_cycles": capped,  # Cycles that hit max_adjustments (results there are cut short)
+    }
+
+
+def run_sweep(tape, instruments, start, end, buffers=None, roundings=STRIKE_ROUNDING, base=None,
+              workers=None, option_maps=None, rank_by="pnl"):
+    """Ranked DataFrame (rank 1 = best within each instrument) plus premium-cache stats."""
+    import pandas as pd
+    base = base or BacktestParams()
+    rows = []
+    cache = {"hits": 0, "misses": 0}
+    tasks, owners = [], []
+    grids = {}
+    for instrument in instruments:
+        instrument_base = copy.copy(base)
+        instrument_base.instrument = instrument
+        grids[instrument] = make_grid(instrument_base, buffers or default_buffers(instrument), roundings)
+        option_map = (option_maps or {}).get(instrument)
+        for day in weekly_entry_dates(start, end, base.entry_weekday):
+            inputs = cycle_inputs(tape, instrument_base, day, option_map)
+            if inputs is not None:
+                tasks.append(inputs)
+                owners.append(instrument)
+
+    if workers == 1 or len(tasks) < 2:
+        results = [sweep_path(grids[owner], inputs) for owner, inputs in zip(owners, tasks)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(sweep_path, [grids[o] for o in owners], tasks, chunksize=max(1, len(tasks) // 64)))
+
+    per_point = {}
+    for owner, (stats, hits, misses) in zip(owners, results):
+        cache["hits"] += hits
+        cache["misses"] += misses
+        for index, point in enumerate(stats):
+            per_point.setdefault((owner, index), []).append(point)
+    for (instrument, index), per_cycle in per_point.items():
+        params = grids[instrument][index]
+        rows.append({"instrument": instrument, "buffer": params.buffer, "rounding": params.rounding, **_combine(per_cycle)})
+
+    column, ascending = RANK_BY[rank_by]
+    table = pd.DataFrame(rows)
+    if table.empty:
+        return table, cache
+    table = table.sort_values(["instrument", column, "max_drawdown"], ascending=[True, ascending, True], ignore_index=True)
+    table.insert(0, "rank", table.groupby("instrument").cumcount() + 1)
+    return table, cache
+
+
+def main(argv=None):
+    from market_data import ReplayTape
+    parser = argparse.ArgumentParser(description="Sweep firefighting buffers and strike rounding over weekly backtest cycles")
+    parser.add_argument("source", help="Tick-log directory or candle CSV (see market_data.py)")
+    parser.add_argument("--instruments", nargs="+", default=["NIFTY"], choices=sorted(INDEX_MAP))
+    parser.add_argument("--start", type=date.fromisoformat, required=True)
+    parser.add_argument("--end", type=date.fromisoformat, required=True)
+    parser.add_argument("--buffers", type=parse_buffers, help="lo:hi:step or a comma list (default: 1..6 strike steps)")
+    parser.add_argument("--roundings", nargs="+", default=list(STRIKE_ROUNDING), choices=STRIKE_ROUNDING)
+    parser.add_argument("--iv", type=float, default=0.14)
+    parser.add_argument("--reference", action="store_true", help="Also sell the reference leg on each breach")
+    parser.add_argument("--extension", action="store_true", help="Also sell the extension leg on each breach")
+    parser.add_argument("--cooldown", type=float, default=0, help="Minutes between adjustments")
+    parser.add_argument("--max-adjustments", type=int, default=20, help="Per cycle (see capped_cycles)")
+    parser.add_argument("--scrip-master", help="Saved scrip master JSON mapping strikes to recorded option tokens")
+    parser.add_argument("--rank-by", default="pnl", choices=sorted(RANK_BY))
+    parser.add_argument("--top", type=int, default=10, help="Rows printed per instrument")
+    parser.add_argument("--workers", type=int, default=None, help="Processes (default: all cores, 1 = in-process)")
+    parser.add_argument("--out", help="Write the full ranked table to this CSV")
+    args = parser.parse_args(argv)
+
+    base = BacktestParams(iv=args.iv, add_reference=args.reference, add_extension=args.extension,
+                          cooldown_minutes=args.cooldown, max_adjustments=args.max_adjustments)
+    started = time.perf_counter()
+    tape = ReplayTape.load(args.source, args.start, args.end + timedelta(days=7))  # Last cycles run to expiry
+    option_maps = {i: load_option_map(args.scrip_master, i) for i in args.instruments} if args.scrip_master else None
+    table, cache = run_sweep(tape, args.instruments, args.start, args.end, args.buffers, args.roundings, base,
+                             args.workers, option_maps, args.rank_by)
+    elapsed = time.perf_counter() - started
+
+    if args.out:
+        table.to_csv(args.out, index=False)
+    lookups = cache["hits"] + cache["misses"]
+    print(f"{len(table)} grid points in {elapsed:.1f}s; premium cache hit rate "
+          f"{cache['hits'] / lookups if lookups else 0:.1%} ({cache['misses']} premium arrays computed)")
+    if not table.empty:
+        print(table[table["rank"] <= args.top].to_string(index=False, float_format=lambda v: f"{v:,.2f}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Bar rollover, late prices and the ring of bars kept per token."""
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from bar_aggregator import BarAggregator, BarSeries
+
+IST = ZoneInfo("Asia/Kolkata")
+SECOND = 10**9
+
+
+def at(hour, minute, second=0):
+    return int(datetime(2025, 11, 20, hour, minute, second, tzinfo=IST).timestamp()) * SECOND
+
+
+def test_prices_roll_over_into_the_next_bar():
+    bars = BarSeries(60)
+    for ts, price in ((at(9, 15, 1), 100), (at(9, 15, 20), 104), (at(9, 15, 40), 98), (at(9, 15, 59), 101),
+                      (at(9, 16, 0), 102)):
+        bars.update(ts, price)
+
+    data = bars.arrays()
+    assert list(data["start_ns"]) == [at(9, 15), at(9, 16)]
+    assert [data[c][0] for c in ("open", "high", "low", "close", "ticks")] == [100, 104, 98, 101, 4]
+    assert [data[c][1] for c in ("open", "high", "low", "close", "ticks")] == [102, 102, 102, 102, 1]
+
+
+def test_five_minute_bars_line_up_with_the_open_and_skip_quiet_minutes():
+    aggregator = BarAggregator()
+    aggregator.update("26000", at(9, 15, 30), 100)
+    aggregator.update("26000", at(9, 19, 59), 101)
+    aggregator.update("26000", at(9, 27, 0), 99)        # No prices from 09:20 to 09:24
+
+    assert list(aggregator.series("26000", 300)["start_ns"]) == [at(9, 15), at(9, 25)]
+    assert len(aggregator.series("26000", 60)["start_ns"]) == 3
+    assert aggregator.latest() == {"26000": (99.0, at(9, 27))}
+
+
+def test_late_price_is_dropped_and_counted():
+    bars = BarSeries(60)
+    bars.update(at(9, 16, 10), 100)
+    bars.update(at(9, 15, 50), 90)
+
+    assert bars.late == 1
+    assert list(bars.arrays()["close"]) == [100]
+
+
+def test_ring_keeps_the_newest_bars():
+    bars = BarSeries(60, capacity=3)
+    for minute in range(5):
+        bars.update(at(9, 15 + minute), 100 + minute)
+
+    assert list(bars.arrays()["open"]) == [102, 103, 104]
+    assert list(bars.arrays(last=2)["open"]) == [103, 104]
+
+
+def test_ingest_stamps_every_item_and_skips_missing_prices():
+    aggregator = BarAggregator(intervals=(60,))
+    aggregator.ingest([{"symbolToken": "26000", "ltp": 25000.5}, {"symbolToken": "26009", "ltp": None}],
+                      ts_ns=at(9, 30, 5))
+
+    assert aggregator.tokens() == ["26000"]
+    frame = aggregator.frame("26000", 60)
+    assert frame["time"].iloc[0] == datetime(2025, 11, 20, 9, 30, tzinfo=IST)
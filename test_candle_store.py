@@ -0,0 +1,94 @@
+"""What the candle cache fetches: missing days, request spans and the partial-day top-up."""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from candle_store import IST, CandleStore
+
+pytest.importorskip("pyarrow")
+
+
+class FakeCandleApi:
+    """getCandleData with one candle per minute of every weekday session in the requested range."""
+
+    def __init__(self):
+        self.calls = []
+
+    def getCandleData(self, params):
+        start = datetime.strptime(params["fromdate"], "%Y-%m-%d %H:%M").replace(tzinfo=IST)
+        end = datetime.strptime(params["todate"], "%Y-%m-%d %H:%M").replace(tzinfo=IST)
+        self.calls.append((start, end))
+        rows = []
+        minute = start
+        while minute <= end:
+            opened = minute.replace(hour=9, minute=15)
+            if minute.weekday() < 5 and opened <= minute < minute.replace(hour=15, minute=30):
+                price = 25000 + (minute - opened).total_seconds() / 60
+                rows.append([minute.isoformat(), price, price + 1, price - 1, price, 100])
+            minute += timedelta(minutes=1)
+        return {"status": True, "data": rows}
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def store_at(tmp_path, now):
+    clock = Clock(now)
+    return CandleStore(str(tmp_path), FakeCandleApi(), min_request_gap=0, now=clock), clock
+
+
+def test_missing_skips_weekends_and_complete_days(tmp_path):
+    store, _ = store_at(tmp_path, datetime(2025, 11, 19, 20, 0, tzinfo=IST))   # Wednesday evening
+    start, end = date(2025, 11, 14), date(2025, 11, 19)
+
+    assert [day for day, _ in store.missing("NSE", "26000", "ONE_MINUTE", start, end)] == [
+        date(2025, 11, 14), date(2025, 11, 17), date(2025, 11, 18), date(2025, 11, 19)]
+    assert store.fetch_missing("NSE", "26000", "ONE_MINUTE", start, end) == 1   # Weekend bridged
+    assert store.missing("NSE", "26000", "ONE_MINUTE", start, end) == []
+    assert store.fetch_missing("NSE", "26000", "ONE_MINUTE", start, end) == 0
+    assert len(store.candles("NSE", "26000", "ONE_MINUTE", start, end)) == 4 * 375
+    assert len(store.api.calls) == 1
+
+
+def test_spans_split_on_gaps_and_request_limit(tmp_path):
+    store, _ = store_at(tmp_path, datetime(2025, 12, 31, 20, 0, tzinfo=IST))
+    weekdays = [date(2025, 11, 3) + timedelta(days=i) for i in range(45)]
+    needed = [(day, None) for day in weekdays if day.weekday() < 5]
+
+    spans = store._spans("ONE_MINUTE", needed)                   # At most 30 days per request
+    assert [(span[0][0], span[-1][0]) for span in spans] == [
+        (date(2025, 11, 3), date(2025, 12, 2)), (date(2025, 12, 3), date(2025, 12, 17))]
+
+    gappy = [(date(2025, 11, 3), None), (date(2025, 11, 4), None), (date(2025, 11, 10), None)]
+    assert [len(span) for span in store._spans("ONE_MINUTE", gappy)] == [2, 1]
+
+
+def test_partial_day_is_topped_up_from_its_last_candle(tmp_path):
+    day = date(2025, 11, 19)
+    store, clock = store_at(tmp_path, datetime(2025, 11, 19, 11, 0, tzinfo=IST))
+    store.fetch_missing("NSE", "26000", "ONE_MINUTE", day, day)
+    assert store.read_day("NSE", "26000", "ONE_MINUTE", day)[1] is False
+
+    clock.now = datetime(2025, 11, 19, 13, 0, tzinfo=IST)
+    [(_, resume)] = store.missing("NSE", "26000", "ONE_MINUTE", day, day)
+    assert resume == int(datetime(2025, 11, 19, 11, 0, tzinfo=IST).timestamp()) * 10**9
+    store.fetch_missing("NSE", "26000", "ONE_MINUTE", day, day)
+    assert store.api.calls[-1][0] == datetime(2025, 11, 19, 11, 0, tzinfo=IST)   # Re-fetches the forming candle
+
+    clock.now = datetime(2025, 11, 19, 16, 0, tzinfo=IST)
+    store.fetch_missing("NSE", "26000", "ONE_MINUTE", day, day)
+    table, complete = store.read_day("NSE", "26000", "ONE_MINUTE", day)
+    ts = table["ts_ns"].to_pylist()
+    assert complete and len(ts) == 375 and ts == sorted(set(ts))
+    assert store.missing("NSE", "26000", "ONE_MINUTE", day, day) == []
+
+
+def test_disk_only_queries_make_no_calls(tmp_path):
+    store, _ = store_at(tmp_path, datetime(2025, 11, 19, 20, 0, tzinfo=IST))
+    assert store.candles("NSE", "26000", "ONE_MINUTE", date(2025, 11, 19), date(2025, 11, 19), fetch=False).empty
+    assert store.api.calls == []
@@ -0,0 +1,72 @@
+"""The Dashboard's firefighting panel and the backtester reach the same signal from the same legs."""
+import copy
+from datetime import date, time as dt_time
+
+import numpy as np
+
+import backtest
+from backtest import BacktestParams, PathContext, ist_ns, run_cycle
+from firefight_rules import (averages_into_base, calculate_group_stats, firefight_signal, process_group_legs,
+                             short_avg_strike)
+from portfolio import portfolio_overview
+
+MINUTE = 60 * 10**9
+
+
+def leg(side, strike, lots=1, status="active", strategy="base_straddle"):
+    return {"side": side, "type": "CE", "strike": strike, "lots": lots, "status": status, "strategy": strategy}
+
+
+def test_avg_strike_skips_hedges_closed_and_long_legs():
+    legs = [leg("short", 25000, lots=2), leg("short", 25300), leg("short", 24000, strategy="ff_reference"),
+            leg("short", 26000, status="closed"), leg("long", 23000)]
+
+    assert [averages_into_base(l) for l in legs] == [True, True, False, False, False]
+    assert short_avg_strike(legs) == (2 * 25000 + 25300) / 3
+    assert short_avg_strike([leg("long", 25000)]) == 0
+
+
+def panel_signal(legs, ctx, i, params):
+    """What render_firefighting shows for the backtester's legs, priced at point i of the path."""
+    group_legs = []
+    for l in legs:
+        shown = {**l, "lot_size": params.lot_size}
+        if l["status"] == "active":
+            shown["current_ltp"] = float(ctx.premium(l["strike"], l["type"])[i])
+        group_legs.append(shown)
+    group = {"instrument": params.instrument, "buffer": params.buffer, "status": "active", "legs": group_legs}
+    stats = calculate_group_stats(group, process_group_legs(group))
+    signal = firefight_signal(stats['avg_strike'], float(ctx.spot[i]), params.buffer, params.step, stats['total_pnl'])
+    return signal, group
+
+
+def test_panel_and_backtest_agree_on_every_breach(monkeypatch):
+    day = date(2025, 11, 21)
+    ts = ist_ns(day, dt_time(9, 20)) + np.arange(300) * MINUTE
+    spot = 25000 + 300 * np.sin(np.arange(300) / 25)           # Breaches up, then down
+    ctx = PathContext(ts, spot, ist_ns(date(2025, 11, 27), dt_time(15, 30)))
+    params = BacktestParams(buffer=100, add_reference=True, add_extension=True, max_adjustments=6)
+
+    seen, signals = [], []
+    group_pnl, signal_fn = backtest._group_pnl, backtest.firefight_signal
+
+    def spy_pnl(legs, ctx, params, i):
+        seen.append((copy.deepcopy(legs), i))
+        return group_pnl(legs, ctx, params, i)
+
+    def spy_signal(*args):
+        signals.append(signal_fn(*args))
+        return signals[-1]
+
+    monkeypatch.setattr(backtest, "_group_pnl", spy_pnl)
+    monkeypatch.setattr(backtest, "firefight_signal", spy_signal)
+    run_cycle(params, ctx)
+
+    assert {s["zone"] for s in signals} == {"up", "down"}
+    for (legs, i), expected in zip(seen, signals):
+        shown, group = panel_signal(legs, ctx, i, params)
+        for key in ("zone", "recommended", "atm_strike", "s2_strike", "reference", "extension",
+                    "trigger_up", "trigger_down"):
+            assert shown[key] == expected[key], key
+        row = portfolio_overview({"g": group}, index_prices={params.instrument: float(ctx.spot[i])}).iloc[0]
+        assert row["avg_strike"] == expected["trigger_up"] - params.buffer
@@ -0,0 +1,69 @@
+"""Margin scenarios, the short-option floor and the estimate cache."""
+from datetime import date, timedelta
+
+import pytest
+
+from margin import EXPOSURE_MARGIN, MIN_DAYS, SHORT_OPTION_MINIMUM, MarginEstimator, leg_set_key, scenario_margin
+
+TODAY = date(2025, 11, 20)
+
+
+def leg(side, opt, strike, lots=1, status="active", expiry=None):
+    return {"side": side, "type": opt, "strike": strike, "lots": lots, "lot_size": 75, "status": status,
+            "expiry": expiry or TODAY + timedelta(days=7)}
+
+
+STRADDLE = [leg("short", "CE", 25000), leg("short", "PE", 25000)]
+
+
+def test_no_active_legs_need_no_margin():
+    margin = MarginEstimator()
+    assert margin.estimate([], 25000, today=TODAY)["total"] == 0
+    closed = [leg("short", "CE", 25000, status="closed")]
+    assert margin.estimate(closed, 25000, today=TODAY) == scenario_margin((), 25000)
+    assert margin.estimate(STRADDLE + closed, 25000, today=TODAY) == margin.estimate(STRADDLE, 25000, today=TODAY)
+
+
+def test_legs_key_ignores_order_and_floors_days():
+    assert leg_set_key(STRADDLE, TODAY) == leg_set_key(STRADDLE[::-1], TODAY)
+    [(side, opt, strike, qty, days)] = leg_set_key([leg("short", "CE", 25000, lots=2, expiry=TODAY)], TODAY)
+    assert (side, opt, strike, qty, days) == ("short", "CE", 25000.0, 150.0, MIN_DAYS)
+
+
+def test_worst_scenario_is_the_adverse_move():
+    margin = MarginEstimator()
+    call = margin.estimate([leg("short", "CE", 25000)], 25000, today=TODAY)
+    put = margin.estimate([leg("short", "PE", 25000)], 25000, today=TODAY)
+
+    assert call["worst_scenario"][:2] == (1.0, 1) and put["worst_scenario"][:2] == (-1.0, 1)
+    assert call["span"] == call["scan_risk"] > call["short_minimum"]
+    assert call["exposure"] == pytest.approx(EXPOSURE_MARGIN * 25000 * 75)
+    assert call["total"] == pytest.approx(call["span"] + call["exposure"])
+
+
+def test_far_short_option_pays_the_short_minimum():
+    result = MarginEstimator().estimate([leg("short", "PE", 18000)], 25000, today=TODAY)
+
+    assert result["scan_risk"] < result["short_minimum"] == pytest.approx(SHORT_OPTION_MINIMUM * 25000 * 75)
+    assert result["span"] == result["short_minimum"]
+
+
+def test_hedge_releases_margin_and_a_new_short_adds_it():
+    margin = MarginEstimator()
+    hedged = STRADDLE + [leg("long", "CE", 25400), leg("long", "PE", 24600)]
+
+    assert margin.incremental(STRADDLE, hedged, 25000, today=TODAY) < 0
+    assert margin.incremental(STRADDLE, STRADDLE + [leg("short", "CE", 25200)], 25000, today=TODAY) > 0
+
+
+def test_cache_buckets_spot_and_evicts_the_oldest():
+    margin = MarginEstimator(spot_step=10, cache_size=2)
+    first = margin.estimate(STRADDLE, 25001, today=TODAY)
+    assert margin.estimate(STRADDLE[::-1], 24998, today=TODAY) is first      # Same legs, same 10-point bucket
+    assert (margin.hits, margin.misses) == (1, 1)
+
+    margin.estimate(STRADDLE, 25100, today=TODAY)
+    margin.estimate(STRADDLE, 25200, today=TODAY)                            # Evicts the 25000 entry
+    margin.estimate(STRADDLE, 25000, today=TODAY)
+    assert (margin.hits, margin.misses) == (1, 4)
+    assert margin.estimate(STRADDLE, 25200, today=TODAY)["total"] > 0 and margin.hits == 2
@@ -0,0 +1,65 @@
+"""Candle replay offsets, the interval cap, per-day session stats and the replay clock."""
+from datetime import datetime
+
+import pandas as pd
+
+from market_data import IST, ReplayProvider, ReplayTape
+
+MINUTE = 60 * 10**9
+
+
+def ns(text):
+    return int(datetime.fromisoformat(text).replace(tzinfo=IST).timestamp()) * 10**9
+
+
+def candles(*rows):
+    return pd.DataFrame([{"timestamp": ts, "token": "26000", "open": o, "high": h, "low": l, "close": c}
+                         for ts, o, h, l, c in rows])
+
+
+def test_candle_is_replayed_open_low_high_close_within_its_minute():
+    tape = ReplayTape.from_candles(candles(("2025-11-20 09:15", 100, 110, 95, 105),    # Rising
+                                           ("2025-11-20 09:16", 105, 108, 90, 92)))    # Falling
+    ts, px = tape.series["26000"]
+    start = ns("2025-11-20 09:15")
+
+    assert list(ts[:4] - start) == [0, MINUTE // 4, MINUTE // 2, 3 * MINUTE // 4]
+    assert list(px) == [100, 95, 110, 105, 105, 108, 90, 92]
+
+
+def test_last_bar_of_the_day_is_capped_at_the_candle_length():
+    rows = [(f"2025-11-20 15:{minute}", 100, 102, 98, 101) for minute in range(25, 30)]
+    tape = ReplayTape.from_candles(candles(*rows, ("2025-11-21 09:15", 101, 103, 100, 102)))
+    ts, _ = tape.series["26000"]
+    last_bar = ts[16:20]
+
+    assert last_bar[-1] - ns("2025-11-20 15:29") == 3 * MINUTE // 4    # Not spread over the night
+
+
+def test_explicit_interval_caps_gaps_in_sparse_candles():
+    tape = ReplayTape.from_candles(candles(("2025-11-20 09:15", 100, 101, 99, 100),
+                                           ("2025-11-20 09:25", 100, 102, 98, 101)), interval_s=60)
+    ts, _ = tape.series["26000"]
+    assert ts[3] - ts[0] == 3 * MINUTE // 4
+
+
+def test_session_stats_start_at_the_days_open():
+    tape = ReplayTape({"26000": ([ns("2025-11-20 15:29"), ns("2025-11-21 09:15"), ns("2025-11-21 09:20")],
+                                 [250.0, 100.0, 120.0])})
+
+    assert tape.session_stats("26000", ns("2025-11-21 09:30")) == {"open": 100.0, "high": 120.0, "low": 100.0}
+    # Before the next day's open, the last known price stands for all three
+    assert tape.session_stats("26000", ns("2025-11-21 09:00")) == {"open": 250.0, "high": 250.0, "low": 250.0}
+    assert tape.session_stats("26000", ns("2025-11-20 09:00")) is None
+
+
+def test_replay_provider_steps_a_fixed_interval_per_call():
+    tape = ReplayTape({"26000": ([ns("2025-11-20 09:15"), ns("2025-11-20 09:16")], [100.0, 101.0])})
+    provider = ReplayProvider(tape, step_seconds=60)
+
+    first = provider.getMarketData("LTP", {"NSE": ["26000", "99999"]})["data"]
+    second = provider.getMarketData("FULL", {"NSE": ["26000"]})["data"]
+
+    assert [item["ltp"] for item in first["fetched"]] == [100.0]
+    assert [item["symbolToken"] for item in first["unfetched"]] == ["99999"]
+    assert second["fetched"][0]["ltp"] == 101.0 and second["fetched"][0]["open"] == 100.0
@@ -0,0 +1,63 @@
+"""Per-minute MTM buckets: closing, flushing at shutdown and reloading after a restart."""
+from datetime import date, datetime
+
+from mtm_history import IST, MtmHistory
+
+SECOND = 10**9
+
+
+def at(hour, minute, second=0, day=date(2025, 11, 20)):
+    return int(datetime(day.year, day.month, day.day, hour, minute, second, tzinfo=IST).timestamp()) * SECOND
+
+
+def pnl(value):
+    return {"total_pnl": value, "realised_pnl": 0, "unrealised_pnl": value, "net_delta": 0, "net_theta": 0}
+
+
+def test_bucket_is_written_when_the_minute_ends(tmp_path):
+    mtm = MtmHistory(str(tmp_path))
+    for second, value in ((5, 100), (20, 80), (50, 120)):
+        mtm.record("g1", pnl(value), at(10, 0, second))
+    assert len(mtm.read_day("g1", date(2025, 11, 20))) == 0      # Still being filled
+
+    mtm.record("g1", pnl(90), at(10, 1, 5))
+    [bucket] = mtm.read_day("g1", date(2025, 11, 20))
+    assert bucket["ts_ns"] == at(10, 0) and bucket["samples"] == 3
+    assert (bucket["total_pnl_min"], bucket["total_pnl_max"], bucket["total_pnl_last"]) == (80, 120, 120)
+
+
+def test_flush_then_restart_in_the_same_minute_continues_the_bucket(tmp_path):
+    mtm = MtmHistory(str(tmp_path))
+    mtm.record("g1", pnl(100), at(10, 0, 5))
+    mtm.record("g1", pnl(150), at(10, 1, 5))
+    mtm.flush()                                                    # Shutdown at 10:01:10
+
+    restarted = MtmHistory(str(tmp_path))
+    restarted.record("g1", pnl(50), at(10, 1, 40))
+    restarted.record("g1", pnl(70), at(10, 2, 5))
+
+    buckets = restarted.read_day("g1", date(2025, 11, 20))
+    assert list(buckets["ts_ns"]) == [at(10, 0), at(10, 1)]
+    assert buckets[1]["samples"] == 2 and buckets[1]["total_pnl_min"] == 50 and buckets[1]["total_pnl_max"] == 150
+    frame = MtmHistory(str(tmp_path))
+    frame.record("g1", pnl(60), at(10, 5, 0))
+    times = list(frame.day_frame("g1")["time"])
+    assert times == sorted(set(times))                             # No minute twice
+
+
+def test_day_change_closes_the_previous_days_bucket(tmp_path):
+    mtm = MtmHistory(str(tmp_path))
+    mtm.record("g1", pnl(100), at(15, 29, 30))
+    mtm.record("g1", pnl(200), at(9, 15, 5, day=date(2025, 11, 21)))
+
+    assert list(mtm.read_day("g1", date(2025, 11, 20))["ts_ns"]) == [at(15, 29)]
+    assert list(mtm.day_frame("g1")["value"]) == [200]
+
+
+def test_memory_only_history_keeps_raw_samples():
+    mtm = MtmHistory(capacity=2)
+    for second, value in ((1, 10), (2, 20), (3, 30)):
+        mtm.record("g1", pnl(value), at(10, 0, second))
+
+    assert list(mtm.samples("g1")["total_pnl"]) == [20, 30]
+    assert len(mtm.read_day("g1", date(2025, 11, 20))) == 0
@@ -0,0 +1,71 @@
+"""Debouncing and coalescing of the write-behind persistence worker."""
+import json
+
+from persistence_worker import PersistenceWorker, atomic_write_json
+
+
+def recorder():
+    written = []
+
+    def write(payload):
+        written.append(payload)
+        return len(payload)
+
+    return written, write
+
+
+def test_notifications_coalesce_into_newest_snapshot():
+    written, write = recorder()
+    worker = PersistenceWorker(write, debounce=60)
+
+    for payload in ("first", "second", "third"):
+        worker.notify(payload)
+    assert written == []                      # Still inside the debounce window
+    assert worker.flush()
+
+    assert written == ["third"]
+    stats = worker.stats()
+    assert (stats["notifications"], stats["coalesced"], stats["writes"]) == (3, 2, 1)
+    assert stats["bytes_written"] == len("third") and not stats["pending"]
+    worker.stop()
+
+
+def test_flush_with_nothing_pending_does_not_write():
+    written, write = recorder()
+    worker = PersistenceWorker(write, debounce=60)
+    assert worker.flush()
+    worker.notify("a")
+    worker.flush()
+    worker.flush()
+    assert written == ["a"]
+    worker.stop()
+
+
+def test_failed_write_is_counted_and_next_notify_retries():
+    written = []
+
+    def write(payload):
+        if payload == "bad":
+            raise OSError("disk full")
+        written.append(payload)
+        return 1
+
+    worker = PersistenceWorker(write, debounce=60)
+    worker.notify("bad")
+    worker.flush()
+    worker.notify("good")
+    worker.flush()
+
+    stats = worker.stats()
+    assert written == ["good"]
+    assert (stats["errors"], stats["writes"], stats["last_error"]) == (1, 1, "disk full")
+    worker.stop()
+
+
+def test_atomic_write_json_leaves_only_the_target(tmp_path):
+    path = tmp_path / "strategy_data.json"
+    size = atomic_write_json(str(path), {"strategy_groups": {}}, indent=2)
+
+    assert json.loads(path.read_text()) == {"strategy_groups": {}}
+    assert size == path.stat().st_size
+    assert [p.name for p in tmp_path.iterdir()] == ["strategy_data.json"]
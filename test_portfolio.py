@@ -0,0 +1,60 @@
+"""The portfolio overview reports what calculate_group_stats does for each group, from the same prices."""
+import pytest
+
+from firefight_rules import calculate_group_stats, process_group_legs
+from portfolio import portfolio_overview
+
+
+def leg(token, side, opt, strike, entry, lots=1, status="active", strategy="base_straddle", exit_price=None,
+        delta=0.5, theta=-8.0):
+    built = {"token": token, "side": side, "type": opt, "strike": strike, "entry_premium": entry, "lots": lots,
+             "status": status, "strategy": strategy, "delta": delta, "theta": theta}
+    if exit_price is not None:
+        built["exit_price"] = exit_price
+    return built
+
+
+GROUPS = {
+    "nifty": {"name": "Weekly", "instrument": "NIFTY", "buffer": 100, "status": "active", "legs": [
+        leg("1", "short", "CE", 25000, 120, lots=2),
+        leg("2", "short", "PE", 25000, 110, lots=2, delta=-0.45),
+        leg("3", "short", "CE", 25200, 80, exit_price=150, status="closed"),
+        leg("4", "short", "PE", 25300, 90),                              # Averaged in
+        leg("5", "long", "CE", 25600, 15, delta=0.1, theta=-2.0),        # Hedge
+        leg("6", "short", "CE", 24500, 40, strategy="ff_reference", delta=0.8),
+    ]},
+    "bank": {"name": "Bank", "instrument": "BANKNIFTY", "buffer": 300, "status": "active", "legs": [
+        {**leg("7", "short", "CE", 57000, 400), "lot_size": 35},
+        {**leg("8", "short", "PE", 57000, 380, delta=-0.5), "lot_size": 35},
+    ]},
+    "done": {"name": "Closed", "instrument": "NIFTY", "status": "closed", "legs": [leg("9", "short", "CE", 24000, 50)]},
+}
+PRICES = {"1": 135.0, "2": 95.5, "4": 70.0, "5": 22.0, "6": 60.0, "7": 350.0, "8": 420.0}
+
+
+def priced(group):
+    """The group as the Dashboard holds it after a refresh: current_ltp from PRICES on every active leg."""
+    legs = [{**l, "current_ltp": PRICES[l["token"]]} if l["status"] == "active" else l for l in group["legs"]]
+    return {**group, "legs": legs}
+
+
+def test_overview_matches_group_stats():
+    table = portfolio_overview(GROUPS, PRICES, {"NIFTY": 25080.0, "BANKNIFTY": 57100.0}).set_index("group_id")
+
+    assert sorted(table.index) == ["bank", "nifty"]
+    for gid in table.index:
+        group = priced(GROUPS[gid])
+        stats = calculate_group_stats(group, process_group_legs(group))
+        row = table.loc[gid]
+        for key in ("total_pnl", "realised_pnl", "unrealised_pnl", "net_delta", "net_theta", "avg_strike"):
+            assert row[key] == pytest.approx(stats[key]), (gid, key)
+        assert row["trigger_up"] == pytest.approx(stats["avg_strike"] + GROUPS[gid]["buffer"])
+
+
+def test_leg_ltp_is_used_when_the_cache_has_no_price():
+    group = priced(GROUPS["nifty"])
+    with_cache = portfolio_overview({"nifty": GROUPS["nifty"]}, PRICES, {"NIFTY": 25080.0})
+    from_legs = portfolio_overview({"nifty": group}, {}, {"NIFTY": 25080.0})
+
+    assert from_legs["total_pnl"].iloc[0] == pytest.approx(with_cache["total_pnl"].iloc[0])
+    assert from_legs["signal"].iloc[0] == "SAFE"
@@ -0,0 +1,123 @@
+"""Three-way merge of strategy groups, and concurrent writers sharing one SQLite database."""
+import json
+import threading
+
+from shared_state import JsonBackend, SharedState, SQLiteBackend, index_groups, merge_groups
+from sqlite_store import SQLiteStore
+from trade_history import make_record
+
+
+def leg(lid, strike, status="active"):
+    return {"id": lid, "side": "short", "type": "CE", "strike": strike, "lots": 1, "status": status}
+
+
+def group(gid, *legs, **header):
+    return {"id": gid, "name": gid, "instrument": "NIFTY", "status": "active", **header, "legs": list(legs)}
+
+
+def test_merge_groups_keeps_both_sides_changes():
+    base = {"g1": group("g1", leg("a", 25000), leg("b", 25000)), "g2": group("g2", leg("c", 25100))}
+    base_index = index_groups(base)
+    ours = {"g1": group("g1", leg("a", 25000, "closed"), leg("b", 25000), leg("d", 25200)),
+            "g2": group("g2", leg("c", 25100))}
+    theirs = {"g1": group("g1", leg("a", 25000), leg("b", 25000, "closed"), buffer=150),
+              "g2": group("g2", leg("c", 25100)), "g3": group("g3", leg("e", 24900))}
+
+    merged, taken = merge_groups(base_index, ours, theirs)
+
+    assert taken == {"g1"}
+    assert set(merged) == {"g1", "g2", "g3"}
+    legs = {l["id"]: l for l in merged["g1"]["legs"]}
+    assert legs["a"]["status"] == "closed"   # Ours
+    assert legs["b"]["status"] == "closed"   # Theirs
+    assert "d" in legs                       # Added by us
+    assert merged["g1"]["buffer"] == 150     # Header only changed by them
+
+
+def test_merge_groups_deletions():
+    base = {"g1": group("g1", leg("a", 25000), leg("b", 25000)), "g2": group("g2")}
+    ours = {"g1": group("g1", leg("a", 25000))}                       # Removed leg b and group g2
+    theirs = {"g1": group("g1", leg("a", 25000), leg("b", 25000)), "g2": group("g2")}
+
+    merged, _ = merge_groups(index_groups(base), ours, theirs)
+
+    assert set(merged) == {"g1"}
+    assert [l["id"] for l in merged["g1"]["legs"]] == ["a"]
+
+
+def shared(path):
+    return SharedState(SQLiteBackend(SQLiteStore(path)), history_limit=100, debounce=0)
+
+
+def commit_group(state, gid, *legs):
+    version, groups, _, index = state.snapshot()
+    groups[gid] = group(gid, *legs)
+    state.commit(version, index, groups, [])
+
+
+def test_processes_merge_each_others_commits(tmp_path):
+    path = str(tmp_path / "strategy.db")
+    first, second = shared(path), shared(path)
+
+    commit_group(first, "g1", leg("a", 25000))
+    first.worker.flush()
+    commit_group(second, "g2", leg("b", 25100))   # Stale: has not seen g1 yet
+    second.worker.flush()
+
+    groups, _ = SQLiteStore(path).load()
+    assert set(groups) == {"g1", "g2"}
+
+
+def test_commit_between_stamp_check_and_save_is_not_lost(tmp_path):
+    path = str(tmp_path / "strategy.db")
+    first, second = shared(path), shared(path)
+    original_write = first.backend.write
+    second_lock, second_write = second.backend.lock, second.backend.write
+    second_arrived = threading.Event()  # Second is at the file lock (or, if it took none, has written)
+    racer = []
+
+    def announced_lock():
+        second_arrived.set()
+        return second_lock()
+
+    def announced_write(*args, **kwargs):
+        written = second_write(*args, **kwargs)
+        second_arrived.set()
+        return written
+
+    def racing_write(groups, history, clear_history=False):
+        # The other process commits right after our stamp check
+        if not racer:
+            racer.append(threading.Thread(target=lambda: (commit_group(second, "g2", leg("b", 25100)),
+                                                          second.worker.flush())))
+            racer[0].start()
+            assert second_arrived.wait(5)
+        return original_write(groups, history, clear_history)
+
+    second.backend.lock, second.backend.write = announced_lock, announced_write
+    first.backend.write = racing_write
+    commit_group(first, "g1", leg("a", 25000))
+    first.worker.flush()
+    racer[0].join(5)
+
+    groups, _ = SQLiteStore(path).load()
+    assert set(groups) == {"g1", "g2"}
+
+
+def test_json_file_keeps_history_beyond_the_in_memory_limit(tmp_path):
+    path = tmp_path / "strategy_data.json"
+    path.write_text(json.dumps({"strategy_groups": {}, "trade_history": ["[09:16:00] old 2", "[09:15:00] old 1"]}))
+    state = SharedState(JsonBackend(str(path)), history_limit=2, debounce=0)
+
+    for i in range(3):
+        version, _, _, index = state.snapshot()
+        state.commit(version, index, {}, [make_record("OTHER", f"new {i}")])
+    state.worker.flush()
+
+    assert len(state.history) == 2
+    messages = [entry["message"] for entry in json.loads(path.read_text())["trade_history"]]
+    assert messages == ["new 2", "new 1", "new 0", "old 2", "old 1"]
+
+    state.clear_history()
+    state.worker.flush()
+    assert json.loads(path.read_text())["trade_history"] == []
@@ -0,0 +1,118 @@
+"""Row-level saves, deletions and history archiving of the SQLite store, and the JSON migration."""
+import json
+
+from sqlite_store import SQLiteStore, main
+from trade_history import make_record
+
+
+def leg(lid, strike, status="active"):
+    return {"id": lid, "side": "short", "type": "CE", "strike": strike, "lots": 1, "status": status}
+
+
+def group(gid, *legs, **header):
+    return {"id": gid, "name": gid, "instrument": "NIFTY", "status": "active", **header, "legs": list(legs)}
+
+
+def leg_ids(store):
+    return [lid for (lid,) in store._conn.execute("SELECT id FROM legs ORDER BY group_id, position")]
+
+
+def history_ids(store):
+    return [entry.get("id") for entry in store.iter_history()]
+
+
+def test_save_only_writes_changed_rows(tmp_path):
+    store = SQLiteStore(str(tmp_path / "strategy.db"))
+    groups = {"g1": group("g1", leg("a", 25000), leg("b", 25100)), "g2": group("g2", leg("c", 24900))}
+
+    assert store.save(groups, []) > 0
+    assert store.save(groups, []) == 0                  # Nothing changed
+
+    groups["g1"]["legs"][1]["status"] = "closed"
+    written = store.save(groups, [])
+    assert 0 < written < len(json.dumps(groups))        # Just leg b
+    loaded, _ = SQLiteStore(store.path).load()
+    assert loaded["g1"]["legs"][1]["status"] == "closed"
+
+
+def test_removed_legs_and_groups_are_deleted(tmp_path):
+    store = SQLiteStore(str(tmp_path / "strategy.db"))
+    groups = {"g1": group("g1", leg("a", 25000), leg("b", 25100)), "g2": group("g2", leg("c", 24900))}
+    store.save(groups, [])
+
+    groups["g1"]["legs"].pop(0)
+    del groups["g2"]
+    store.save(groups, [])
+
+    loaded, _ = SQLiteStore(store.path).load()
+    assert set(loaded) == {"g1"}
+    assert leg_ids(store) == ["b"]                      # c went with its group
+
+
+def test_history_is_appended_not_rewritten(tmp_path):
+    store = SQLiteStore(str(tmp_path / "strategy.db"))
+    first, second, third = (make_record("ADD_LEG", f"leg {i}", group_id="g1") for i in range(3))
+    store.save({}, [first])
+    store.save({}, [second, first])
+
+    # A fresh store has no saved head, so it looks the ids up; `first` fell off the in-memory list
+    other = SQLiteStore(store.path)
+    other.save({}, [third, second])
+
+    assert history_ids(other) == [first["id"], second["id"], third["id"]]
+
+
+def test_archived_keys_in_chunks(tmp_path):
+    store = SQLiteStore(str(tmp_path / "strategy.db"))
+    records = [make_record("ADD_LEG", f"leg {i}") for i in range(7)]
+    store.save({}, records[2:] + ["[09:20:00] legacy entry"])
+
+    cur = store._conn.cursor()
+    archived = store._archived_keys(cur, records + ["[09:20:00] legacy entry"], chunk_size=3)
+    assert archived == {r["id"] for r in records[2:]} | {json.dumps("[09:20:00] legacy entry")}
+
+
+def test_migrate_force_merges_into_existing_groups(tmp_path):
+    db_path = str(tmp_path / "strategy.db")
+    store = SQLiteStore(db_path)
+    store.save({"g1": group("g1", leg("a", 25000)), "g2": group("g2", leg("b", 25100))}, [])
+    store.close()
+    json_path = tmp_path / "strategy_data.json"
+    json_path.write_text(json.dumps({"strategy_groups": {"g1": group("g1", leg("a", 25050)),
+                                                         "g3": group("g3", leg("c", 24900))},
+                                     "trade_history": []}))
+
+    main(["migrate", str(json_path), db_path, "--force"])
+
+    loaded, _ = SQLiteStore(db_path).load()
+    assert set(loaded) == {"g1", "g2", "g3"}            # g2 is not in the file but is kept
+    assert loaded["g1"]["legs"][0]["strike"] == 25050
+
+
+def test_legacy_history_is_upgraded_once_and_kept(tmp_path):
+    store = SQLiteStore(str(tmp_path / "strategy.db"))
+    store.save({"g1": group("g1")}, ["[09:20:00] Created strategy 'g1'."])
+
+    reloaded = SQLiteStore(store.path)
+    _, history = reloaded.load(history_limit=1)
+    assert history[0]["group_id"] == "g1"
+    reloaded.save({"g1": group("g1")}, [make_record("ADD_LEG", "leg"), *history])
+    _, history = SQLiteStore(store.path).load()
+
+    assert len(history) == 2
+    assert history[1]["id"] == history_ids(store)[0]   # Kept the id it got when upgraded
+
+
+def test_history_after_rolled_back_save_and_clear(tmp_path):
+    store = SQLiteStore(str(tmp_path / "strategy.db"))
+    first, second = make_record("ADD_LEG", "a"), make_record("ADD_LEG", "b")
+    store.save({}, [first])
+    try:
+        store.save({"bad": {"id": "bad", "legs": [{"strike": 1}]}}, [second, first])  # Leg without an id
+    except KeyError:
+        pass
+    store.save({}, [second, first])
+    assert history_ids(store) == [first["id"], second["id"]]
+
+    store.save({}, [], clear_history=True)
+    assert history_ids(store) == []
@@ -0,0 +1,46 @@
+"""Every sweep grid point reports what a standalone backtest with the same parameters does."""
+from datetime import date, datetime, time as dt_time, timedelta
+
+import numpy as np
+import pytest
+
+from backtest import IST, BacktestParams, run_backtest, summarize
+from market_data import ReplayTape
+from sweep import parse_buffers, run_sweep
+
+START, END = date(2025, 11, 3), date(2025, 11, 28)
+
+
+def nifty_tape():
+    """5-minute NIFTY spot random walk over every weekday session between START and END."""
+    rng = np.random.default_rng(7)
+    ts = []
+    day = START
+    while day <= END:
+        if day.weekday() < 5:
+            opened = datetime.combine(day, dt_time(9, 15), tzinfo=IST)
+            ts += [int((opened + timedelta(minutes=5 * k)).timestamp()) * 10**9 for k in range(76)]
+        day += timedelta(days=1)
+    spot = 25000 + np.cumsum(rng.normal(0, 25, len(ts)))
+    return ReplayTape({"26000": (ts, spot)})
+
+
+def test_parse_buffers():
+    assert parse_buffers("50:100:25") == [50.0, 75.0, 100.0]
+    assert parse_buffers("75,150") == [75.0, 150.0]
+
+
+def test_sweep_matches_standalone_backtests():
+    tape = nifty_tape()
+    table, cache = run_sweep(tape, ["NIFTY"], START, END, buffers=[100, 150], workers=1)
+
+    assert len(table) == 6 and cache["hits"] > 0          # 2 buffers x 3 roundings, premiums shared
+    for row in table.itertuples():
+        params = BacktestParams(buffer=row.buffer, rounding=row.rounding)
+        _trades, equity, cycles = run_backtest(tape, params, START, END, workers=1)
+        expected = summarize(equity, cycles)
+        assert row.cycles == expected["cycles"] > 0
+        assert row.total_pnl == pytest.approx(expected["total_pnl"])
+        assert row.max_drawdown == pytest.approx(expected["max_drawdown"])
+        assert (row.adjustments, row.shifts, row.averages) == (
+            expected["adjustments"], expected["shifts"], expected["averages"])
@@ -0,0 +1,67 @@
+"""Ring wrap-around, slicing across the wrap, and the midnight split of the tick log."""
+from datetime import date, datetime
+
+import numpy as np
+
+from tick_recorder import TICK_DTYPE, TickLog, TickRecorder, day_file, read_ticks
+
+SECOND = 1_000_000_000
+
+
+def ticks(ts_ns, token=26000):
+    out = np.zeros(len(ts_ns), dtype=TICK_DTYPE)
+    out["ts_ns"] = ts_ns
+    out["token"] = token
+    out["ltp"] = np.arange(len(ts_ns), dtype=np.float64)
+    return out
+
+
+def at(hour, minute, second=0, day=date(2025, 11, 20)):
+    return int(datetime(day.year, day.month, day.day, hour, minute, second).timestamp() * SECOND)
+
+
+def test_ring_keeps_newest_records_after_wrapping(tmp_path):
+    log = TickLog(str(tmp_path / "ticks.bin"), mode="r+", capacity=5)
+    base = at(9, 15)
+    log.append(ticks([base + i * SECOND for i in range(3)]))
+    log.append(ticks([base + i * SECOND for i in range(3, 8)]))    # Slots 3, 4, then wraps to 0..2
+
+    assert log.count == 8
+    segments = log.segments()
+    assert [len(s) for s in segments] == [2, 3]
+    stored = np.concatenate(segments)["ts_ns"]
+    assert list(stored) == [base + i * SECOND for i in range(3, 8)]
+
+
+def test_slice_across_the_wrap(tmp_path):
+    log = TickLog(str(tmp_path / "ticks.bin"), mode="r+", capacity=5)
+    base = at(9, 15)
+    log.append(ticks([base + i * SECOND for i in range(8)]))
+    log.append(ticks([base + 8 * SECOND], token=26009))
+
+    window = log.slice(base + 4 * SECOND, base + 8 * SECOND)
+    assert list(window["ts_ns"]) == [base + i * SECOND for i in range(4, 8)]   # Both segments
+    assert list(log.slice(tokens=[26009])["ts_ns"]) == [base + 8 * SECOND]
+    assert len(log.slice(base + 20 * SECOND)) == 0
+
+
+def test_batch_straddling_midnight_is_split_across_days(tmp_path):
+    recorder = TickRecorder(str(tmp_path), capacity=10)
+    day, next_day = date(2025, 11, 20), date(2025, 11, 21)
+    before, after = at(23, 59, 59, day), at(0, 0, 1, next_day)
+    recorder.append(ticks([after, before]))     # Out of order on purpose
+    recorder.close()
+
+    assert list(TickLog(day_file(str(tmp_path), day)).slice()["ts_ns"]) == [before]
+    assert list(TickLog(day_file(str(tmp_path), next_day)).slice()["ts_ns"]) == [after]
+    assert list(read_ticks(str(tmp_path), day, date(2025, 11, 22))["ts_ns"]) == [before, after]
+
+
+def test_timestamps_never_go_backwards(tmp_path):
+    recorder = TickRecorder(str(tmp_path), capacity=10)
+    recorder.append(ticks([at(10, 0, 5)]))
+    recorder.append(ticks([at(10, 0, 1)]))      # Clock stepped back: clamped to the last timestamp
+    recorder.close()
+
+    stored = read_ticks(str(tmp_path))["ts_ns"]
+    assert list(stored) == [at(10, 0, 5), at(10, 0, 5)]
@@ -0,0 +1,277 @@
+"""
+Tick recorder: every LTP we fetch (spot, indices, strategy legs), appended to a
+fixed-record, memory-mapped ring log with one file per trading day.
+
+File layout (little-endian):
+
+    [64-byte header][capacity x 64-byte TICK_DTYPE records]
+
+    header: magic "TICKLOG1", version, record size, capacity, count (records ever
+    written), first/last timestamp. Record i lives at slot i % capacity, so once a day
+    holds more than `capacity` ticks the oldest are overwritten.
+
+Writes copy a NumPy structured array straight into the mapped pages (no encoding),
+and readers binary-search the timestamp column of the mapping, so slicing a time
+range never parses the file:
+
+    rec = TickRecorder("ticks")
+    rec.append(ticks_from_market_data(fetched, time.time_ns()))
+    read_ticks("ticks", start, end, tokens=[26000])  # -> structured array
+
+    python tick_recorder.py ticks/ --from "2025-11-20 09:15" --to "2025-11-20 09:30" --token 26000
+"""
+import argparse
+import glob
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+MAGIC = b"TICKLOG1"
+VERSION = 1
+HEADER_SIZE = 64
+DEFAULT_CAPACITY = 1_000_000  # Ticks per day (64 MB per daily file, allocated sparsely)
+
+TICK_DTYPE = np.dtype([
+    ("ts_ns", "<i8"),      # Fetch time, ns since the epoch
+    ("token", "<i8"),      # Angel One symbol token
+    ("ltp", "<f8"),
+    ("bid", "<f8"),        # Best bid/ask from the FULL-mode depth (NaN when absent)
+    ("ask", "<f8"),
+    ("bid_qty", "<i8"),
+    ("ask_qty", "<i8"),
+    ("volume", "<i8"),     # Day volume (tradeVolume), -1 when absent
+])
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"), ("version", "<u4"), ("record_size", "<u4"), ("capacity", "<u8"),
+    ("count", "<u8"), ("first_ts", "<i8"), ("last_ts", "<i8"), ("reserved", "S16"),
+])
+assert TICK_DTYPE.itemsize == 64 and HEADER_DTYPE.itemsize == HEADER_SIZE
+
+
+def day_file(directory, day):
+    return os.path.join(directory, f"ticks-{day:%Y%m%d}.bin")
+
+
+def _day_of(ts_ns):
+    return datetime.fromtimestamp(ts_ns / 1e9).date()
+
+
+def _to_ns(value):
+    """datetime / date / epoch seconds / ns -> ns since the epoch."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1e9)
+    if isinstance(value, date):
+        return int(datetime.combine(value, datetime.min.time()).timestamp() * 1e9)
+    if isinstance(value, (int, np.integer)) and value > 1e14:
+        return int(value)  # Already ns (kept exact: float64 would round it)
+    return int(float(value) * 1e9)
+
+
+def _best(levels, key):
+    if not levels:
+        return None
+    level = levels[0] or {}
+    return level.get(key)
+
+
+def ticks_from_market_data(fetched, ts_ns):
+    """Structured TICK_DTYPE array from getMarketData FULL 'fetched' items (one ts for the whole batch)."""
+    rows = []
+    for item in fetched or []:
+        try:
+            token = int(item.get("symbolToken"))
+            ltp = float(item.get("ltp"))
+        except (TypeError, ValueError):
+            continue
+        depth = item.get("depth") or {}
+        bid = _best(depth.get("buy"), "price")
+        ask = _best(depth.get("sell"), "price")
+        bid_qty = _best(depth.get("buy"), "quantity")
+        ask_qty = _best(depth.get("sell"), "quantity")
+        volume = item.get("tradeVolume")
+        rows.append((ts_ns, token, ltp,
+                     np.nan if bid is None else bid, np.nan if ask is None else ask,
+                     -1 if bid_qty is None else bid_qty, -1 if ask_qty is None else ask_qty,
+                     -1 if volume is None else volume))
+    return np.array(rows, dtype=TICK_DTYPE)
+
+
+class TickLog:
+    """One memory-mapped daily ring file. mode 'r' for readers, 'r+' (created if missing) for the writer."""
+
+    def __init__(self, path, mode="r", capacity=DEFAULT_CAPACITY):
+        self.path = path
+        if mode != "r" and not os.path.exists(path):
+            self._create(path, capacity)
+        self.header = np.memmap(path, dtype=HEADER_DTYPE, mode=mode, shape=(1,))
+        h = self.header[0]
+        if h["magic"] != MAGIC or h["record_size"] != TICK_DTYPE.itemsize:
+            raise ValueError(f"{path} is not a version-{VERSION} tick log")
+        self.capacity = int(h["capacity"])
+        self.records = np.memmap(path, dtype=TICK_DTYPE, mode=mode, offset=HEADER_SIZE, shape=(self.capacity,))
+
+    @staticmethod
+    def _create(path, capacity):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header[0] = (MAGIC, VERSION, TICK_DTYPE.itemsize, capacity, 0, 0, 0, b"")
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(header.tobytes())
+            f.truncate(HEADER_SIZE + capacity * TICK_DTYPE.itemsize)  # Sparse: pages appear as they're written
+        os.replace(tmp, path)
+
+    @property
+    def count(self):
+        return int(self.header[0]["count"])
+
+    def append(self, ticks):
+        """Copies `ticks` (TICK_DTYPE, time-ordered) into the ring. Single writer; see TickRecorder."""
+        n = len(ticks)
+        if n == 0:
+            return
+        if n > self.capacity:
+            ticks = ticks[-self.capacity:]
+            n = self.capacity
+        count = self.count
+        start = count % self.capacity
+        first = min(n, self.capacity - start)
+        self.records[start:start + first] = ticks[:first]
+        if first < n:
+            self.records[:n - first] = ticks[first:]  # Wrapped around
+        if count == 0:
+            self.header["first_ts"] = ticks["ts_ns"][0]
+        self.header["last_ts"] = ticks["ts_ns"][-1]
+        self.header["count"] = count + n  # Published last: readers never see half-written slots
+
+    def segments(self):
+        """The stored records as one or two time-ordered views (oldest first), without copying."""
+        count = self.count
+        if count <= self.capacity:
+            return [self.records[:count]]
+        head = count % self.capacity
+        return [self.records[head:], self.records[:head]]
+
+    def slice(self, start_ns=None, end_ns=None, tokens=None):
+        """Records with start_ns <= ts_ns < end_ns (optionally only `tokens`), as a new array."""
+        parts = []
+        for segment in self.segments():
+            ts = segment["ts_ns"]
+            lo = 0 if start_ns is None else int(np.searchsorted(ts, start_ns, side="left"))
+            hi = len(segment) if end_ns is None else int(np.searchsorted(ts, end_ns, side="left"))
+            if hi > lo:
+                parts.append(segment[lo:hi])
+        result = np.concatenate(parts) if parts else np.empty(0, dtype=TICK_DTYPE)
+        if tokens is not None:
+            result = result[np.isin(result["token"], np.asarray([int(t) for t in tokens], dtype=np.int64))]
+        return np.array(result)  # Detach from the mapping
+
+    def flush(self):
+        if self.records.mode != "r":
+            self.records.flush()
+            self.header.flush()
+
+    def close(self):
+        self.flush()
+        # Drop the mappings (np.memmap closes them once unreferenced)
+        self.records = None
+        self.header = None
+
+
+class TickRecorder:
+    """Thread-safe appender that rolls over to a new file at the start of each (local) day."""
+
+    def __init__(self, directory, capacity=DEFAULT_CAPACITY):
+        self.directory = directory
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._log = None
+        self._day = None
+        self._last_ts = 0
+        self.ticks_written = 0
+
+    def _log_for(self, day):
+        if day != self._day:
+            if self._log is not None:
+                self._log.close()
+            self._log = TickLog(day_file(self.directory, day), mode="r+", capacity=self.capacity)
+            self._day = day
+            self._last_ts = int(self._log.header[0]["last_ts"]) if self._log.count else 0
+        return self._log
+
+    def append(self, ticks):
+        """Appends a TICK_DTYPE batch. Timestamps are kept non-decreasing so readers can binary-search."""
+        if len(ticks) == 0:
+            return
+        with self._lock:
+            ticks = np.sort(ticks, order="ts_ns", kind="stable")
+            ticks["ts_ns"] = np.maximum.accumulate(np.maximum(ticks["ts_ns"], self._last_ts))
+            # A batch straddling midnight is split across the two days' files
+            days = [_day_of(ts) for ts in (int(ticks["ts_ns"][0]), int(ticks["ts_ns"][-1]))]
+            if days[0] == days[1]:
+                self._log_for(days[0]).append(ticks)
+            else:
+                midnight = _to_ns(days[1])
+                split = int(np.searchsorted(ticks["ts_ns"], midnight))
+                self._log_for(days[0]).append(ticks[:split])
+                self._log_for(days[1]).append(ticks[split:])
+            self._last_ts = int(ticks["ts_ns"][-1])
+            self.ticks_written += len(ticks)
+
+    def record(self, fetched, ts_ns=None):
+        """Convenience: records getMarketData 'fetched' items."""
+        self.append(ticks_from_market_data(fetched, time.time_ns() if ts_ns is None else ts_ns))
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+                self._day = None
+
+
+def read_ticks(directory, start=None, end=None, tokens=None):
+    """All ticks in [start, end) across the daily files of `directory` (datetimes, dates or epoch s/ns)."""
+    start_ns, end_ns = _to_ns(start), _to_ns(end)
+    if start_ns is not None and end_ns is not None:
+        first_day, last_day = _day_of(start_ns), _day_of(end_ns)
+        paths = [day_file(directory, first_day + timedelta(days=i)) for i in range((last_day - first_day).days + 1)]
+        paths = [p for p in paths if os.path.exists(p)]
+    else:
+        paths = sorted(glob.glob(os.path.join(directory, "ticks-*.bin")))
+    parts = [TickLog(path).slice(start_ns, end_ns, tokens) for path in paths]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=TICK_DTYPE)
+
+
+def ticks_to_frame(ticks):
+    """pandas DataFrame of a tick array, with a datetime column."""
+    import pandas as pd
+    df = pd.DataFrame(ticks)
+    df.insert(0, "time", pd.to_datetime(df["ts_ns"], unit="ns", utc=True).dt.tz_convert("Asia/Kolkata"))
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Slice recorded ticks by time range and token")
+    parser.add_argument("directory")
+    parser.add_argument("--from", dest="start", type=datetime.fromisoformat)
+    parser.add_argument("--to", dest="end", type=datetime.fromisoformat)
+    parser.add_argument("--token", action="append", type=int)
+    parser.add_argument("--csv", help="Write the slice to this CSV instead of printing it")
+    args = parser.parse_args(argv)
+
+    df = ticks_to_frame(read_ticks(args.directory, args.start, args.end, args.token))
+    if args.csv:
+        df.to_csv(args.csv, index=False)
+        print(f"{len(df)} ticks -> {args.csv}")
+    else:
+        print(df.to_string(index=False, max_rows=50))
+
+
+if __name__ == "__main__":
+    main()
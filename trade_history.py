@@ -0,0 +1,246 @@
+"""
+Structured, bounded trade history.
+
+Each action is a record dict (timestamp, group, action type, leg fields, message)
+kept oldest -> newest in a bounded deque, with per-group and per-action indexes
+so the History tab can count, filter and page without scanning the whole log.
+"""
+import itertools
+import re
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+IST = ZoneInfo("Asia/Kolkata")
+DEFAULT_MAX_RECORDS = 5000
+
+# Action types (the "what happened" column of every record)
+ADD_LEG = "ADD_LEG"
+UPDATE_LEG = "UPDATE_LEG"
+EXIT_LEG = "EXIT_LEG"
+FF_AVERAGE = "FF_AVERAGE"
+FF_REFERENCE = "FF_REFERENCE"
+FF_SHIFT = "FF_SHIFT"
+FF_EXTENSION = "FF_EXTENSION"
+CLOSE_ALL = "CLOSE_ALL"
+CREATE_STRATEGY = "CREATE_STRATEGY"
+DELETE_STRATEGY = "DELETE_STRATEGY"
+OTHER = "OTHER"
+
+ACTION_LABELS = {
+    ADD_LEG: "Add Leg",
+    UPDATE_LEG: "Update Leg",
+    EXIT_LEG: "Exit Leg",
+    FF_AVERAGE: "Firefight: Average",
+    FF_REFERENCE: "Firefight: Reference",
+    FF_SHIFT: "Firefight: Shift",
+    FF_EXTENSION: "Firefight: Extension",
+    CLOSE_ALL: "Close All",
+    CREATE_STRATEGY: "Create Strategy",
+    DELETE_STRATEGY: "Delete Strategy",
+    OTHER: "Other",
+}
+
+LEG_FIELDS = ("side", "type", "strike", "price", "tag", "leg_id")
+
+# Old plain-string entries: "[HH:MM:SS] <prefix> ..." -> action type
+_LEGACY_PREFIXES = [
+    ("ADD LEG", ADD_LEG),
+    ("UPDATE LEG", UPDATE_LEG),
+    ("EXIT LEG", EXIT_LEG),
+    ("FIREFIGHT (AVG)", FF_AVERAGE),
+    ("FIREFIGHT (REF)", FF_REFERENCE),
+    ("FIREFIGHT (SHIFT)", FF_SHIFT),
+    ("FIREFIGHT (EXT)", FF_EXTENSION),
+    ("ACTION: Close All", CLOSE_ALL),
+    ("ACTION: Created", CREATE_STRATEGY),
+    ("ACTION: Deleted", DELETE_STRATEGY),
+]
+_LEGACY_RE = re.compile(r"^\[(\d{2}:\d{2}:\d{2})\]\s*(.*)$", re.S)
+_LEGACY_GROUP_RES = [
+    re.compile(r"^[A-Z ]+(?:\([A-Z]+\) )?\((.+?)(?: \| [^)]*)?\):"),  # ADD LEG (name): / FIREFIGHT (AVG) (name):
+    re.compile(r"strategy '(.+)'\.$"),                                # Created/Deleted strategy 'name'.
+    re.compile(r"executed for (.+)\. Strategy moved"),                # Close All Positions executed for name.
+]
+
+
+def make_record(action, message, group_id=None, group_name=None, ts=None, **leg_fields):
+    """Builds one history record. Unknown leg fields are rejected to keep the schema tight."""
+    unknown = set(leg_fields) - set(LEG_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown history fields: {sorted(unknown)}")
+    ts = ts or datetime.now(IST)
+    record = {
+        "id": str(uuid.uuid4()),
+        "ts": ts.isoformat(timespec="seconds"),
+        "group_id": group_id,
+        "group_name": group_name,
+        "action": action,
+        "message": message,
+    }
+    for field in LEG_FIELDS:
+        record[field] = leg_fields.get(field)
+    return record
+
+
+def parse_legacy_entry(entry, group_ids_by_name=None):
+    """Converts an old preformatted string into a record (timestamp date unknown, so `ts` is None)."""
+    match = _LEGACY_RE.match(entry)
+    time_text, message = (match.group(1), match.group(2)) if match else (None, entry)
+    action = OTHER
+    for prefix, action_type in _LEGACY_PREFIXES:
+        if message.startswith(prefix):
+            action = action_type
+            break
+    group_name = None
+    for group_re in _LEGACY_GROUP_RES:
+        m = group_re.search(message)
+        if m:
+            group_name = m.group(1)
+            break
+    record = make_record(action, message, group_name=group_name,
+                         group_id=(group_ids_by_name or {}).get(group_name))
+    record["ts"] = None
+    record["time"] = time_text
+    return record
+
+
+def record_time(record):
+    """HH:MM:SS of a record (legacy records only know the time of day)."""
+    if record.get("ts"):
+        return record["ts"][11:19]
+    return record.get("time") or "--:--:--"
+
+
+def format_record(record):
+    return f"[{record_time(record)}] {record['message']}"
+
+
+class TradeHistory:
+    """Bounded, indexed trade log. Oldest records are evicted past `max_records`."""
+
+    def __init__(self, records=(), max_records=DEFAULT_MAX_RECORDS):
+        self.max_records = max_records
+        self._records = deque(maxlen=max_records)
+        self._by_group = defaultdict(deque)
+        self._by_action = defaultdict(deque)
+        self._by_id = {}
+        for record in records:
+            self.append(record)
+
+    @classmethod
+    def from_list(cls, entries, max_records=DEFAULT_MAX_RECORDS, group_ids_by_name=None):
+        """Builds the store from the persisted newest-first list (records or legacy strings)."""
+        records = []
+        for entry in reversed(entries[:max_records]):
+            if isinstance(entry, str):
+                records.append(parse_legacy_entry(entry, group_ids_by_name))
+            else:
+                records.append(entry)
+        return cls(records, max_records=max_records)
+
+    def to_list(self):
+        """Newest-first list of records, the persisted format. Records are never mutated, so no copy."""
+        return list(reversed(self._records))
+
+    def add(self, action, message, group_id=None, group_name=None, **leg_fields):
+        record = make_record(action, message, group_id=group_id, group_name=group_name, **leg_fields)
+        self.append(record)
+        return record
+
+    def append(self, record):
+        """Adds an existing record (e.g. one committed by another session) as the newest entry.
+
+        Returns the record evicted to make room, if any.
+        """
+        evicted = None
+        if len(self._records) == self.max_records:
+            evicted = self._records[0]
+            # The evicted record is the oldest overall, so it is also the oldest in its indexes
+            self._drop_from_index(self._by_group, evicted.get("group_id"))
+            self._drop_from_index(self._by_action, evicted.get("action"))
+            self._by_id.pop(evicted.get("id"), None)
+        self._records.append(record)
+        self._by_id[record.get("id")] = record
+        self._by_group[record.get("group_id")].append(record)
+        self._by_action[record.get("action")].append(record)
+        return evicted
+
+    @staticmethod
+    def _drop_from_index(index, key):
+        bucket = index.get(key)
+        if bucket:
+            bucket.popleft()
+            if not bucket:
+                del index[key]
+
+    def clear(self):
+        self._records.clear()
+        self._by_group.clear()
+        self._by_action.clear()
+        self._by_id.clear()
+
+    def records_since(self, record_id):
+        """Records newer than `record_id`, oldest first (all of them if it is None or rolled off)."""
+        newer = []
+        for record in reversed(self._records):
+            if record_id is not None and record.get("id") == record_id:
+                break
+            newer.append(record)
+        newer.reverse()
+        return newer
+
+    def newest_id(self):
+        return self._records[-1].get("id") if self._records else None
+
+    def __contains__(self, record_id):
+        return record_id in self._by_id
+
+    def __len__(self):
+        return len(self._records)
+
+    def __bool__(self):
+        return bool(self._records)
+
+    def group_ids(self):
+        return [gid for gid in self._by_group if gid is not None]
+
+    def group_name(self, group_id):
+        """Name of a group as of its latest record (works for deleted groups too)."""
+        bucket = self._by_group.get(group_id)
+        if not bucket:
+            return str(group_id)
+        return bucket[-1].get("group_name") or str(group_id)
+
+    def action_types(self):
+        return list(self._by_action)
+
+    def _source(self, group_id=None, action=None):
+        """Smallest index bucket covering the filter, plus a predicate for the other filter (if any)."""
+        if group_id is None and action is None:
+            return self._records, None
+        group_bucket = self._by_group.get(group_id, ()) if group_id is not None else None
+        action_bucket = self._by_action.get(action, ()) if action is not None else None
+        if action_bucket is None:
+            return group_bucket, None
+        if group_bucket is None:
+            return action_bucket, None
+        if len(group_bucket) <= len(action_bucket):
+            return group_bucket, lambda r: r.get("action") == action
+        return action_bucket, lambda r: r.get("group_id") == group_id
+
+    def count(self, group_id=None, action=None):
+        source, predicate = self._source(group_id, action)
+        if predicate is None:
+            return len(source)
+        return sum(1 for r in source if predicate(r))
+
+    def page(self, page=0, page_size=50, group_id=None, action=None):
+        """Newest-first records for one page of the (optionally filtered) log."""
+        source, predicate = self._source(group_id, action)
+        newest_first = reversed(source)
+        if predicate is not None:
+            newest_first = filter(predicate, newest_first)
+        start = page * page_size
+        return list(itertools.islice(newest_first, start, start + page_size))